@@ -1,16 +1,32 @@
 import math
 import os
-from datetime import datetime, timedelta
+import time
+from collections import OrderedDict
 
 import netCDF4
+import numpy
 
 import esdl
 import esdl.util
 from .cube_access import CubeDataAccess
+from .cube_codecs import DEFAULT_CANDIDATES, DEFAULT_IO_BYTES_PER_SECOND, select_codec, set_num_threads
 from .cube_config import CubeConfig, CUBE_CHANGELOG
+from .cube_manifest import CubeManifest
+from .cube_metrics import CubeMetrics, STAGES
+from .cube_overviews import write_overviews
+from .cube_pipeline import PeriodPipeline
+from .cube_plan import UpdatePlan
+from .cube_timeseries import write_time_series
+from .cube_writer import DatasetPool, SlabWriter, ZarrYearDataset, INCOMPLETE_ATTR_NAME
 # from .cube_provider import CubeSourceProvider
 from .version import version as __version__
 
+#: The default maximum number of variable files kept open by :py:meth:`Cube.update`.
+DEFAULT_MAX_OPEN_FILES = 64
+
+#: Variable descriptor attributes which are not copied as such into the target variables' attributes.
+_NON_TARGET_ATTR_NAMES = {'data_type', 'fill_value', 'scale_factor', 'add_offset', 'temporal_aggregation'}
+
 
 class Cube:
     """
@@ -22,6 +38,9 @@ class Cube:
         self._config = config
         self._closed = False
         self._data = None
+        self._manifest = None
+        self._slab_writers = None
+        self._metrics = None
 
     def __repr__(self) -> str:
         return 'Cube(%s, \'%s\')' % (self._config, self._base_dir)
@@ -106,86 +125,487 @@ class Cube:
             self._data = None
         self._closed = True
 
-    def update(self, provider: 'CubeSourceProvider'):
+    def update(self, provider: 'CubeSourceProvider', jobs: int = None, pipelined: bool = False,
+               queue_size: int = 2, resume: bool = False, memory_budget: int = None, years=None,
+               profile_stages=None, max_open_files: int = DEFAULT_MAX_OPEN_FILES, time_series: bool = True,
+               overviews: bool = True, reports: bool = False):
         """
         Updates the data cube with source data from the given image provider.
 
         :param provider: An instance of the abstract ImageProvider class
+        :param jobs: The number of worker processes used to compute the images of the target periods.
+               Only used if greater than one and if the provider's **parallel_periods** property is true.
+               Images are always written in period order by the calling process, so the result is the same as
+               for the default serial computation.
+        :param pipelined: If true, source data of the next period is read and images of the previous period are
+               written while the images of the current period are computed, see :py:class:`PeriodPipeline`.
+               Stage statistics are printed when the update has finished. Cannot be combined with *jobs*.
+        :param queue_size: The maximum number of periods waiting between two pipeline stages if *pipelined* is true.
+        :param resume: If true, skip all periods which have already been written for all variables of the provider
+               according to the cube's :py:class:`CubeManifest`. Written periods are always recorded in the
+               manifest once their year file has been closed.
+        :param memory_budget: If given, the images of each period are computed and written in tiles of the target
+               grid, such that computing a tile requires at most *memory_budget* bytes, see the provider's
+               **compute_variable_tiles()** method. Use for target or source resolutions whose whole images
+               do not fit into memory. Cannot be combined with *jobs* or *pipelined*.
+        :param years: If given, a collection of years. Only the periods of these years are updated, so that only
+               the variable files of these years are written. Used by cube-gen workers, see :py:class:`WorkQueue`.
+        :param profile_stages: If given, a collection of stage names, see :py:data:`esdl.cube_metrics.STAGES`,
+               or ``'all'``. The given stages are profiled using cProfile, see :py:class:`CubeMetrics`. The profiles
+               are written to the cube's ``reports`` directory.
+        :param max_open_files: The maximum number of variable files kept open, unbounded if ``None``. If exceeded,
+               the least recently written file is closed, see :py:class:`DatasetPool`. Files of a year are closed
+               as soon as the first period of the next year is written. Files whose periods have all been written
+               are closed first: closing a new file before that makes HDF5 write fill values for its remaining
+               periods, which must be read back when they are written after reopening the file. Use at least
+               as many open files as variables are written per year to avoid this.
+        :param time_series: Whether the time-series copies of the provider's variables are rewritten after the
+               update if the cube's configuration has *time_series_chunks*, see :py:meth:`update_time_series`.
+               Never done if *years* are given, because other years may still be updated by other workers.
+        :param overviews: Whether the overview levels of the provider's variables are rewritten after the update if
+               the cube's configuration has *overview_levels*, see :py:meth:`update_overviews`. Never done if
+               *years* are given.
+        :param reports: Whether the events and the generation report are written to the cube's ``reports``
+               directory, see below.
+
+        The timers and counters of all stages are assigned to the provider's **metrics** property. Their report is
+        printed together with the statistics of the open variable files. If *reports* is true, they are also written
+        to the cube's ``reports`` directory as JSON lines events ``<provider>-<time>-<pid>.jsonl`` and as generation
+        report ``<provider>-<time>-<pid>.json``. With *jobs* > 1 the stages performed by the
+        worker processes are not profiled.
+        """
+        if self._closed:
+            raise IOError('cube has been closed')
+        if pipelined and jobs and jobs > 1:
+            raise ValueError('pipelined updates cannot be combined with jobs > 1')
+        if memory_budget is not None:
+            if memory_budget <= 0:
+                raise ValueError('memory_budget must be a positive number of bytes')
+            if pipelined or (jobs and jobs > 1):
+                raise ValueError('tiled updates cannot be combined with pipelined or jobs > 1')
+
+        start_time = time.time()
+        provider.prepare()
+        if self._config.comp_threads:
+            set_num_threads(self._config.comp_threads)
+        self._manifest = CubeManifest(self._base_dir)
+        self._slab_writers = dict()
+        target_times = self._get_target_times(provider)
+        if years is not None:
+            target_times = [target_time for target_time in target_times if target_time[1].year in years]
+        if resume:
+            num_target_times = len(target_times)
+            target_times = self._get_incomplete_target_times(provider, target_times)
+            print('%s: resuming, skipping %d of %d period(s) found in %s' % (provider.name,
+                                                                         num_target_times - len(target_times),
+                                                                         num_target_times,
+                                                                         self._manifest.path))
+        if profile_stages == 'all':
+            profile_stages = STAGES
+        reports_dir = os.path.join(self._base_dir, 'reports')
+        if reports or profile_stages:
+            os.makedirs(reports_dir, exist_ok=True)
+        report_prefix = '%s-%s-%d' % (provider.name, time.strftime('%Y%m%dT%H%M%S', time.localtime(start_time)),
+                                      os.getpid())
+        metrics = CubeMetrics(events_file=os.path.join(reports_dir, report_prefix + '.jsonl') if reports else None,
+                              profile_dir=reports_dir if profile_stages else None,
+                              profile_stages=profile_stages,
+                              profile_prefix=report_prefix + '-')
+        provider.metrics = metrics
+        self._metrics = metrics
+        tiled = memory_budget is not None
+
+        def open_dataset(key):
+            year, var_name = key
+            return self._open_variable_dataset(provider, self._get_variable_filename(var_name, year), var_name, year,
+                                               tiled)
+
+        datasets = DatasetPool(open_dataset, self._close_dataset, max_open=max_open_files,
+                               get_eviction_cost=self._get_dataset_eviction_cost)
+        pipeline = None
+        period_images = None
+        write_images = self._write_images
+        try:
+            if tiled:
+                period_images = _compute_period_tiles(provider, target_times, memory_budget)
+                write_images = self._write_tiles
+            elif pipelined:
+                pipeline = PeriodPipeline(provider, target_times, queue_size=queue_size)
+                period_images = iter(pipeline)
+            elif jobs and jobs > 1 and provider.parallel_periods:
+                period_images = _compute_period_images_parallel(provider, target_times, jobs)
+            else:
+                period_images = _compute_period_images(provider, target_times)
+            for target_time, images in period_images:
+                # Close all open datasets of previous years (which have been processed)
+                self._close_datasets(datasets, target_time[1].year)
+                # Tiles are computed lazily, so whether a period has been written is known after writing it
+                if images and write_images(provider, datasets, target_time, images):
+                    metrics.count('periods')
+        finally:
+            if period_images is not None:
+                period_images.close()
+            self._close_datasets(datasets)
+            self._manifest = None
+            self._slab_writers = None
+            self._metrics = None
+            provider.close()
+            metrics.close()
+            if reports:
+                metrics.write_report(os.path.join(reports_dir, report_prefix + '.json'),
+                                     provider=provider.name,
+                                     version=__version__,
+                                     start_time=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_time)),
+                                     seconds=time.time() - start_time,
+                                     jobs=jobs,
+                                     pipelined=pipelined,
+                                     memory_budget=memory_budget,
+                                     open_files=datasets.stats())
+        for line in metrics.report().split('\n'):
+            print('%s: %s' % (provider.name, line))
+        print('%s: open files: %d hit(s), %d miss(es), %d eviction(s)' % (provider.name, datasets.hits,
+                                                                           datasets.misses, datasets.evictions))
+        if pipeline is not None:
+            for line in pipeline.report().split('\n'):
+                print('%s: %s' % (provider.name, line))
+        var_names = [var_name for var_name in provider.variable_descriptors
+                     if os.path.exists(os.path.join(self._base_dir, 'data', var_name))]
+        if time_series and years is None and self._config.time_series_chunks:
+            self.update_time_series(var_names)
+        if overviews and years is None and self._config.overview_levels:
+            self.update_overviews(var_names)
+
+    def update_time_series(self, var_names=None):
+        """
+        Rewrite the time-series copies of the given variables from their data, see :py:mod:`esdl.cube_timeseries`.
+        Requires *time_series_chunks* to be given in the cube's configuration.
+
+        :param var_names: The variable names, defaults to all variables of the cube.
         """
         if self._closed:
             raise IOError('cube has been closed')
+        if not self._config.time_series_chunks:
+            raise ValueError('cube configuration has no time_series_chunks')
+        if var_names is None:
+            var_names = self._get_variable_names()
+        for var_name in var_names:
+            t1 = time.time()
+            path = write_time_series(self._base_dir, self._config, var_name)
+            print('%s: time series written to %s, took %f seconds' % (var_name, path, time.time() - t1))
+
+    def update_overviews(self, var_names=None):
+        """
+        Rewrite the overview levels of the given variables from their data, see :py:mod:`esdl.cube_overviews`.
+        Requires *overview_levels* to be given in the cube's configuration.
+
+        :param var_names: The variable names, defaults to all variables of the cube.
+        """
+        if self._closed:
+            raise IOError('cube has been closed')
+        if not self._config.overview_levels:
+            raise ValueError('cube configuration has no overview_levels')
+        if var_names is None:
+            var_names = self._get_variable_names()
+        for var_name in var_names:
+            t1 = time.time()
+            paths = write_overviews(self._base_dir, self._config, var_name)
+            print('%s: %d overview level(s) written to %s, took %f seconds' % (var_name, len(paths),
+                                                                               os.path.dirname(paths[0]),
+                                                                               time.time() - t1))
+
+    def subset(self, target_dir: str, var_names=None, lon_range=None, lat_range=None, time_range=None,
+               align_chunks: bool = False, jobs: int = 1) -> 'Cube':
+        """
+        Write a regional and temporal subset of this cube as a new cube, see :py:func:`esdl.cube_subset.subset_cube`.
+
+        :param target_dir: The subset's base directory, must not exist.
+        :param var_names: The names of the variables to copy, defaults to all variables.
+        :param lon_range: The (lon_1, lon_2) range in degrees, the whole grid width if ``None``.
+        :param lat_range: The (lat_1, lat_2) range in degrees, the whole grid height if ``None``.
+        :param time_range: The (start_time, end_time) range given as datetime values, whole years are copied.
+        :param align_chunks: If true, the bounding box is extended to chunk boundaries, so that all chunks are
+               copied without recompressing them.
+        :param jobs: The number of processes copying variables.
+        :return: The subset cube.
+        """
+        if self._closed:
+            raise IOError('cube has been closed')
+        # Imported here, because esdl.cube_subset imports this module
+        from .cube_subset import subset_cube
+        subset_cube(self._base_dir, target_dir, var_names=var_names, lon_range=lon_range, lat_range=lat_range,
+                    time_range=time_range, align_chunks=align_chunks, jobs=jobs)
+        return Cube.open(target_dir)
+
+    def get_update_years(self, provider: 'CubeSourceProvider') -> list:
+        """
+        Return the sorted list of years whose periods would be updated with the given provider.
+
+        :param provider: An instance of the abstract ImageProvider class
+        """
+        provider.prepare()
+        try:
+            return sorted(set(target_time[1].year for target_time in self._get_target_times(provider)))
+        finally:
+            provider.close()
+
+    def plan(self, provider: 'CubeSourceProvider', resume: bool = False) -> UpdatePlan:
+        """
+        Estimate the costs of updating the data cube with the given provider without reading any pixel data
+        and without writing anything.
+
+        :param provider: An instance of the abstract ImageProvider class
+        :param resume: If true, plan only the periods which would not be skipped by a resumed update,
+               see :py:meth:`update`.
+        :return: An :py:class:`UpdatePlan`.
+        """
+        provider.prepare()
+        self._manifest = CubeManifest(self._base_dir)
+        try:
+            target_times = self._get_target_times(provider)
+            if resume:
+                target_times = self._get_incomplete_target_times(provider, target_times)
+            return UpdatePlan(provider, target_times, self._config)
+        finally:
+            self._manifest = None
+            provider.close()
+
+    def select_codecs(self, provider: 'CubeSourceProvider', candidates=DEFAULT_CANDIDATES, num_samples: int = 3,
+                      io_bytes_per_second: float = DEFAULT_IO_BYTES_PER_SECOND) -> OrderedDict:
+        """
+        Select the compression codec of each variable of the given provider by trying the *candidates* on the
+        images of *num_samples* periods evenly spread over the provider's target periods,
+        see :py:func:`esdl.cube_codecs.select_codec`. The selected codecs are recorded in the **var_codecs**
+        of the cube's configuration, which is stored in ``cube.config``. Variables which already have data in the
+        cube keep their codec.
 
+        :param provider: An instance of the abstract ImageProvider class
+        :param candidates: The codec specifications to try, candidates not supported by the cube's file format or
+               by the installed libraries are skipped.
+        :param num_samples: The number of sample periods.
+        :param io_bytes_per_second: The I/O throughput used to weigh compressed sizes against compression times.
+        :return: A mapping of the names of the variables whose codec has been selected to the list of results
+                 of all tried candidates.
+        """
+        if self._closed:
+            raise IOError('cube has been closed')
+        if num_samples < 1:
+            raise ValueError('num_samples must be a positive integer')
         provider.prepare()
         try:
-            target_start_time, target_end_time = provider.temporal_coverage
-        except Exception as e:
-            raise e
+            target_times = self._get_target_times(provider)
+            if len(target_times) > num_samples:
+                step = len(target_times) / num_samples
+                target_times = [target_times[int(i * step)] for i in range(num_samples)]
+            var_name_to_images = OrderedDict((var_name, []) for var_name in provider.variable_descriptors)
+            for _, period_start, period_end in target_times:
+                images = provider.compute_variable_images(period_start, period_end)
+                for var_name, image in (images or {}).items():
+                    if image is not None and var_name in var_name_to_images:
+                        var_name_to_images[var_name].append(image)
+        finally:
+            provider.close()
+
+        var_codecs = dict(self._config.var_codecs or {})
+        var_name_to_results = OrderedDict()
+        for var_name, images in var_name_to_images.items():
+            if not images or os.path.exists(os.path.join(self._base_dir, 'data', var_name)):
+                continue
+            codec, results = select_codec(images, candidates=candidates, file_format=self._config.file_format,
+                                          io_bytes_per_second=io_bytes_per_second)
+            var_codecs[var_name] = codec.spec
+            var_name_to_results[var_name] = results
+        if var_name_to_results:
+            self._config.var_codecs = var_codecs
+            self._config.store(os.path.join(self._base_dir, 'cube.config'))
+        return var_name_to_results
+
+    def _get_variable_names(self):
+        """
+        Return the sorted names of the variables in ``TARGET/data``.
+        """
+        data_dir = os.path.join(self._base_dir, 'data')
+        if not os.path.isdir(data_dir):
+            return []
+        return sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+
+    def _get_target_times(self, provider):
+        """
+        Return the list of target periods (time_index, period_start, period_end) that overlap with the
+        temporal coverage of *provider* and with the cube's configured time range.
+        """
+        target_start_time, target_end_time = provider.temporal_coverage
         if self._config.start_time and self._config.start_time > target_start_time:
             target_start_time = self._config.start_time
         if self._config.end_time and self._config.end_time < target_end_time:
             target_end_time = self._config.end_time
-        target_year_1 = target_start_time.year
-        target_year_2 = target_end_time.year
-        cube_temporal_res = self._config.temporal_res
-        num_periods_per_year = self._config.num_periods_per_year
-        datasets = dict()
-
-        for target_year in range(target_year_1, target_year_2 + 1):
-            time_min = datetime(target_year, 1, 1)
-            time_max = datetime(target_year + 1, 1, 1)
-            d_time = timedelta(days=cube_temporal_res)
-            time_1 = time_min
-            # Close all open datasets of last year (which have been processed)
-            for key in datasets:
-                if target_year - 1 == int(key[0:4]):
-                    datasets[key].close()
-            for time_index in range(num_periods_per_year):
-                time_2 = time_1 + d_time
-                if time_2 > time_max:
-                    time_2 = time_max
-                weight = esdl.util.temporal_weight(time_1, time_2, target_start_time, target_end_time)
-                if weight > 0.0:
-                    var_name_to_image = provider.compute_variable_images(time_1, time_2)
-                    if var_name_to_image:
-                        self._write_images(provider, datasets, (time_index, time_1, time_2), var_name_to_image)
-                time_1 = time_2
-        for key in datasets:
-            if datasets[key].isopen():
-                datasets[key].close()
-        provider.close()
+        if self._config.start_time and self._config.end_time:
+            time_axis = self._config.time_axis
+        else:
+            time_axis = esdl.util.CubeTimeAxis(target_start_time.year, target_end_time.year,
+                                               self._config.temporal_res, ref_time=self._config.ref_time,
+                                               calendar=self._config.calendar)
+        target_times = []
+        for index in time_axis.get_overlapping_indices(target_start_time, target_end_time):
+            _, time_index = time_axis.get_year_and_time_index(index)
+            target_times.append((time_index,) + time_axis.get_period(index))
+        return target_times
+
+    def _get_incomplete_target_times(self, provider, target_times):
+        """
+        Return the target periods of *target_times* which have not yet been written for all provider variables.
+        """
+        var_names = list(provider.variable_descriptors.keys())
+        return [target_time for target_time in target_times
+                if not all(self._manifest.is_completed(var_name, target_time[1].year, target_time[0])
+                           for var_name in var_names)]
+
+    def _close_datasets(self, datasets, before_year=None):
+        """
+        Close the open datasets of the :py:class:`DatasetPool` *datasets* whose year is less than *before_year*,
+        or all if *before_year* is None.
+        """
+        datasets.close_all(None if before_year is None else lambda key: key[0] < before_year)
+
+    def _get_dataset_eviction_cost(self, key):
+        """
+        Return the number of periods that would be filled if the dataset given by *key* was closed now.
+        """
+        year, var_name = key
+        slab_writer = self._slab_writers.get(self._get_variable_filename(var_name, year))
+        return slab_writer.num_unfilled_periods if slab_writer is not None else 0
+
+    def _close_dataset(self, key, dataset):
+        """
+        Close the *dataset* of the variable and year given by *key*. Buffered images are written before and the
+        periods written to the dataset are committed to the manifest.
+        """
+        year, var_name = key
+        filename = self._get_variable_filename(var_name, year)
+        slab_writer = self._slab_writers.pop(filename, None)
+        if dataset.isopen():
+            with self._metrics.timer('close', file=filename):
+                if slab_writer is not None:
+                    slab_writer.close()
+                if INCOMPLETE_ATTR_NAME in dataset.ncattrs():
+                    dataset.delncattr(INCOMPLETE_ATTR_NAME)
+                dataset.close()
+        self._manifest.commit(filename)
 
     def _write_images(self, provider, datasets, target_time, var_name_to_image):
+        """
+        Write the images of a period and return the number of images written.
+        """
+        num_images = 0
         for var_name in var_name_to_image:
             image = var_name_to_image[var_name]
             if image is not None:
                 self._write_image(provider, datasets, target_time, var_name, image)
+                num_images += 1
+        return num_images
+
+    def _write_tiles(self, provider, datasets, target_time, tiles):
+        """
+        Write the tiles of a period as they are computed and return the number of tiles written.
+        """
+        time_index, target_start_time, _ = target_time
+        year = target_start_time.year
+        written_files = OrderedDict()
+        num_tiles = 0
+        for var_name, (x, y, width, height), tile in tiles:
+            with datasets.use((year, var_name)) as dataset:
+                with self._metrics.timer('write', var=var_name, time_index=time_index, bytes=tile.nbytes):
+                    dataset.variables[var_name][time_index, y:y + height, x:x + width] = tile
+            written_files[var_name] = self._get_variable_filename(var_name, year)
+            num_tiles += 1
+        for var_name, filename in written_files.items():
+            self._manifest.add_pending(filename, var_name, year, time_index)
+        return num_tiles
 
     def _write_image(self, provider, datasets, target_time, var_name, image):
         time_index, target_start_time, target_end_time = target_time
-        folder_name = var_name
-        folder = os.path.join(os.path.join(self._base_dir, 'data', folder_name))
+        year = target_start_time.year
+        filename = self._get_variable_filename(var_name, year)
+        with datasets.use((year, var_name)):
+            with self._metrics.timer('write', var=var_name, time_index=time_index, bytes=image.nbytes):
+                self._slab_writers[filename].put(time_index, image)
+        self._manifest.add_pending(filename, var_name, year, time_index)
+
+    def _get_variable_filename(self, var_name, year):
+        """
+        Return the name of the dataset which holds the periods of variable *var_name* in the given *year*.
+        """
+        if self._config.file_format == 'zarr':
+            return '%04d_%s.zarr' % (year, var_name)
+        return '%04d_%s.nc' % (year, var_name)
+
+    def _open_variable_dataset(self, provider, filename, var_name, year, tiled):
+        """
+        Open or create the dataset *filename* which holds the periods of variable *var_name* in the given *year*.
+        Unless *tiled*, whole images are written and a slab writer is created for the dataset.
+        """
+        folder = os.path.join(self._base_dir, 'data', var_name)
         if not os.path.exists(folder):
             os.makedirs(folder, exist_ok=True)
-        filename = '%04d_%s.nc' % (target_start_time.year, var_name)
+        time_chunk_size = self._config.chunk_sizes[0] if self._config.chunk_sizes else 1
+        if self._config.file_format == 'zarr':
+            dataset = self._open_zarr_dataset(provider, folder, var_name, year)
+            if not tiled:
+                self._slab_writers[filename] = SlabWriter(dataset.variables[var_name], time_chunk_size, False,
+                                                          time_offset=dataset.time_offset)
+            return dataset
         file = os.path.join(folder, filename)
-        if filename in datasets:
-            dataset = datasets[filename]
+        if os.path.exists(file):
+            dataset = netCDF4.Dataset(file, 'a')
+            if tiled and INCOMPLETE_ATTR_NAME in dataset.ncattrs():
+                dataset.close()
+                raise ValueError('%s has been left incomplete by an interrupted update and cannot be written '
+                                 'in tiles, complete it by an update without memory budget first' % file)
+            _, upper_bounds, _ = self._get_year_time_bounds(year)
+            if not numpy.allclose(numpy.ma.getdata(dataset.variables['time_bnds'][:, 1]), upper_bounds):
+                print("Warning: time stamps discrepancy: time bounds of %s differ from the cube's periods" % file)
         else:
-            if os.path.exists(file):
-                dataset = netCDF4.Dataset(file, 'a')
-            else:
-                dataset = netCDF4.Dataset(file, 'w', format=self._config.file_format)
-                self._init_variable_dataset(provider, dataset, var_name, target_start_time.year)
-            datasets[filename] = dataset
+            dataset = netCDF4.Dataset(file, 'w', format=self._config.file_format)
+            if not tiled:
+                # The SlabWriter makes sure that all periods are written, so HDF5 need not fill them on creation
+                dataset.set_fill_off()
+            self._init_variable_dataset(provider, dataset, var_name, year)
+            if not tiled:
+                setattr(dataset, INCOMPLETE_ATTR_NAME, 'true')
+        if not tiled:
+            # Files still marked incomplete have been created by an interrupted update and may contain unfilled
+            # periods, so they are treated like new ones
+            self._slab_writers[filename] = SlabWriter(dataset.variables[var_name], time_chunk_size,
+                                                      INCOMPLETE_ATTR_NAME in dataset.ncattrs())
+        return dataset
 
-        t2 = self._config.date2num(target_end_time)
-        time_bnds = dataset.variables['time_bnds']
-        if time_bnds[time_index, 1] != t2:
-            print("Warning: Time stamps discrepancy: %f is is not %f" % (time_bnds[time_index, 1], t2))
-            print("target start: %s, target end %s" % (target_start_time, target_end_time))
+    def _open_zarr_dataset(self, provider, folder, var_name, year):
+        """
+        Open the Zarr group in *folder* which holds all periods of variable *var_name*, create it if it does
+        not exist yet, and return a :py:class:`ZarrYearDataset` for the given *year*.
+        """
+        import zarr
 
-        var_variable = dataset.variables[var_name]
-        var_variable[time_index, :, :] = image
+        time_axis = self._config.time_axis
+        if not time_axis.start_year <= year <= time_axis.end_year:
+            raise ValueError('year %d is outside of the cube\'s time range' % year)
+        group = zarr.open_group(folder, mode='a')
+        if var_name not in group:
+            self._init_variable_group(provider, group, var_name)
+        return ZarrYearDataset(group, var_name, time_axis.get_global_index(year, 0), time_axis.num_periods_per_year)
+
+    def _get_year_time_bounds(self, year):
+        """
+        Return the lower bounds, upper bounds and times of the periods of the given *year* as numpy arrays.
+        """
+        config = self._config
+        if config.start_time and config.end_time and \
+                config.time_axis.start_year <= year <= config.time_axis.end_year:
+            time_axis = config.time_axis
+        else:
+            time_axis = esdl.util.CubeTimeAxis(year, year, config.temporal_res, ref_time=config.ref_time,
+                                               calendar=config.calendar)
+        year_slice = time_axis.get_year_slice(year)
+        return time_axis.lower_bounds[year_slice], time_axis.upper_bounds[year_slice], time_axis.times[year_slice]
 
     def _init_variable_dataset(self, provider, dataset, variable_name, start_year):
         import time
@@ -217,15 +637,10 @@ class Cube:
         dataset.createDimension('lat', image_height)
         dataset.createDimension('lon', image_width)
 
-        temporal_res = self._config.temporal_res
-        start_date = datetime(start_year, 1, 1, 0, 0)
-        start_num = self._config.date2num(start_date)
+        lower_bounds, upper_bounds, times = self._get_year_time_bounds(start_year)
         var_time_bnds = dataset.createVariable('time_bnds', 'f8', ('time', 'bnds'), fill_value=-9999.0)
         var_time_bnds.units = self._config.time_units
         var_time_bnds.calendar = self._config.calendar
-        lower_bounds = [start_num + temporal_res * (i + 0.0) for i in range(num_periods_per_year)]
-        upper_bounds = [start_num + temporal_res * (i + 1.0) for i in range(num_periods_per_year)]
-        upper_bounds[-1] = self._config.date2num(datetime(start_year + 1, 1, 1, 0, 0))
         var_time_bnds[:, 0] = lower_bounds
         var_time_bnds[:, 1] = upper_bounds
 
@@ -236,7 +651,6 @@ class Cube:
         var_time.calendar = self._config.calendar
         var_time.bounds = 'time_bnds'
 
-        times = [start_num + temporal_res * (i + 0.5) for i in range(num_periods_per_year)]
         # times[-1] = var_time_bnds[-1,0] + (var_time_bnds[-1,1] - var_time_bnds[-1,0]) / 2.
         # Thus, we keep date of the last time range always at Julian day 364, not in the center of the period.
         # The time bounds then specify the real extent of the period.
@@ -264,18 +678,14 @@ class Cube:
         spatial_res = self._config.spatial_res
 
         lon0 = self._config.easting + image_x0 * spatial_res
-        for i in range(image_width):
-            lon = lon0 + i * spatial_res
-            var_longitude[i] = lon + 0.5 * spatial_res
-            var_longitude_bnds[i, 0] = lon
-            var_longitude_bnds[i, 1] = lon + spatial_res
+        lon = lon0 + numpy.arange(image_width) * spatial_res
+        var_longitude[:] = lon + 0.5 * spatial_res
+        var_longitude_bnds[:, :] = numpy.stack([lon, lon + spatial_res], axis=1)
 
         lat0 = self._config.northing + image_y0 * spatial_res
-        for i in range(image_height):
-            lat = lat0 - i * spatial_res
-            var_latitude[i] = lat - 0.5 * spatial_res
-            var_latitude_bnds[i, 0] = lat - spatial_res
-            var_latitude_bnds[i, 1] = lat
+        lat = lat0 - numpy.arange(image_height) * spatial_res
+        var_latitude[:] = lat - 0.5 * spatial_res
+        var_latitude_bnds[:, :] = numpy.stack([lat - spatial_res, lat], axis=1)
 
         variable_descriptors = provider.variable_descriptors
         variable_attributes = variable_descriptors[variable_name]
@@ -286,14 +696,14 @@ class Cube:
                                               ('time', 'lat', 'lon',),
                                               fill_value=variable_fill_value,
                                               chunksizes=self._config.chunk_sizes,
-                                              zlib=self._config.compression,
-                                              complevel=self._config.comp_level)
+                                              **self._config.get_codec(variable_name).get_netcdf_kwargs(
+                                                  self._config.file_format))
         var_variable.scale_factor = variable_attributes.get('scale_factor', 1.0)
         var_variable.add_offset = variable_attributes.get('add_offset', 0.0)
 
         # Set remaining NetCDF attributes
         for name in variable_attributes:
-            if name not in {'data_type', 'fill_value', 'scale_factor', 'add_offset'}:
+            if name not in _NON_TARGET_ATTR_NAMES:
                 value = variable_attributes[name]
                 try:
                     var_variable.__setattr__(name, value)
@@ -302,6 +712,158 @@ class Cube:
                     print('%s = %s failed (%s)!' % (name, value, str(ve)))
         return dataset
 
+    def _init_variable_group(self, provider, group, variable_name):
+        """
+        Initialise the Zarr *group* of a variable with the coordinate arrays for the cube's complete time range
+        and an empty variable array. Arrays are annotated with xarray's ``_ARRAY_DIMENSIONS`` attribute.
+        """
+        import time
+
+        group.attrs.update(Conventions='CF-1.6',
+                           institution='Brockmann Consult GmbH, Germany',
+                           source='ESDL data cube generation, version %s' % __version__,
+                           history=time.ctime(time.time()) + ' - ESDL data cube generation',
+                           northing='%s degrees' % self.config.northing,
+                           easting='%s degrees' % self.config.easting,
+                           spatial_res='%s degrees' % self.config.spatial_res)
+
+        image_x0, image_y0, image_width, image_height = provider.spatial_coverage
+
+        time_axis = self._config.time_axis
+        lower_bounds = time_axis.lower_bounds
+        upper_bounds = time_axis.upper_bounds
+        time_size = time_axis.size
+
+        var_time_bnds = group.create_dataset('time_bnds', data=numpy.stack([lower_bounds, upper_bounds], axis=1),
+                                             chunks=(time_size, 2), fill_value=-9999.0)
+        var_time_bnds.attrs.update(_ARRAY_DIMENSIONS=['time', 'bnds'],
+                                   units=self._config.time_units,
+                                   calendar=self._config.calendar)
+
+        # See _init_variable_dataset() why times are not centered between their bounds
+        var_time = group.create_dataset('time', data=time_axis.times, chunks=(time_size,),
+                                        fill_value=-9999.0)
+        var_time.attrs.update(_ARRAY_DIMENSIONS=['time'],
+                              long_name='time',
+                              standard_name='time',
+                              units=self._config.time_units,
+                              calendar=self._config.calendar,
+                              bounds='time_bnds')
+
+        spatial_res = self._config.spatial_res
+
+        lon0 = self._config.easting + image_x0 * spatial_res
+        lon = lon0 + numpy.arange(image_width) * spatial_res
+        var_longitude = group.create_dataset('lon', data=(lon + 0.5 * spatial_res).astype(numpy.float32))
+        var_longitude.attrs.update(_ARRAY_DIMENSIONS=['lon'],
+                                   long_name='longitude',
+                                   standard_name='longitude',
+                                   units='degrees_east',
+                                   bounds='lon_bnds')
+        var_longitude_bnds = group.create_dataset('lon_bnds',
+                                                  data=numpy.stack([lon, lon + spatial_res],
+                                                                   axis=1).astype(numpy.float32))
+        var_longitude_bnds.attrs.update(_ARRAY_DIMENSIONS=['lon', 'bnds'], units='degrees_east')
+
+        lat0 = self._config.northing + image_y0 * spatial_res
+        lat = lat0 - numpy.arange(image_height) * spatial_res
+        var_latitude = group.create_dataset('lat', data=(lat - 0.5 * spatial_res).astype(numpy.float32))
+        var_latitude.attrs.update(_ARRAY_DIMENSIONS=['lat'],
+                                  long_name='latitude',
+                                  standard_name='latitude',
+                                  units='degrees_north',
+                                  bounds='lat_bnds')
+        var_latitude_bnds = group.create_dataset('lat_bnds',
+                                                 data=numpy.stack([lat - spatial_res, lat],
+                                                                  axis=1).astype(numpy.float32))
+        var_latitude_bnds.attrs.update(_ARRAY_DIMENSIONS=['lat', 'bnds'], units='degrees_north')
+
+        variable_attributes = provider.variable_descriptors[variable_name]
+        codec_kwargs = self._config.get_codec(variable_name).get_zarr_kwargs(variable_attributes['data_type'])
+        var_variable = group.create_dataset(variable_name,
+                                            shape=(time_size, image_height, image_width),
+                                            chunks=self._config.chunk_sizes or (1, image_height, image_width),
+                                            dtype=variable_attributes['data_type'],
+                                            fill_value=variable_attributes['fill_value'],
+                                            **codec_kwargs)
+        var_variable.attrs['_ARRAY_DIMENSIONS'] = ['time', 'lat', 'lon']
+        var_variable.attrs['scale_factor'] = variable_attributes.get('scale_factor', 1.0)
+        var_variable.attrs['add_offset'] = variable_attributes.get('add_offset', 0.0)
+        for name in variable_attributes:
+            if name not in _NON_TARGET_ATTR_NAMES:
+                value = variable_attributes[name]
+                # Attributes are stored as JSON
+                var_variable.attrs[name] = value.item() if isinstance(value, numpy.generic) else value
+
     @staticmethod
     def _get_num_steps(x1, x2, dx):
         return int(math.floor((x2 - x1) / dx))
+
+
+#: The provider used by a worker process of :py:func:`_compute_period_images_parallel`.
+_WORKER_PROVIDER = None
+
+
+def _init_period_worker(provider):
+    global _WORKER_PROVIDER
+    # The metrics of the worker are passed back with each result, see _compute_period_images_parallel()
+    provider.metrics = CubeMetrics(buffer_events=True)
+    _WORKER_PROVIDER = provider
+
+
+def _compute_period_images_in_worker(target_time):
+    _, period_start, period_end = target_time
+    images = _WORKER_PROVIDER.compute_variable_images(period_start, period_end)
+    return images, _WORKER_PROVIDER.metrics.pop()
+
+
+def _compute_period_images(provider, target_times):
+    """
+    Compute the images of each target period in turn and yield (target_time, var_name_to_image) pairs.
+    """
+    for target_time in target_times:
+        _, period_start, period_end = target_time
+        yield target_time, provider.compute_variable_images(period_start, period_end)
+
+
+def _compute_period_tiles(provider, target_times, memory_budget):
+    """
+    Generate (target_time, tiles) pairs, where tiles are computed lazily by the provider's
+    **compute_variable_tiles()** method.
+    """
+    for target_time in target_times:
+        _, period_start, period_end = target_time
+        yield target_time, provider.compute_variable_tiles(period_start, period_end, memory_budget)
+
+
+def _compute_period_images_parallel(provider, target_times, jobs):
+    """
+    Same as :py:func:`_compute_period_images`, but the images are computed by *jobs* worker processes, each of which
+    receives a copy of the prepared *provider*. Results are yielded in the order of *target_times*.
+    At most ``2 * jobs`` periods are in flight, so computed images cannot pile up if writing is slower than computing.
+    The metrics recorded by the workers are merged into the provider's metrics.
+    """
+    import multiprocessing
+    from collections import deque
+
+    pool = multiprocessing.Pool(processes=jobs, initializer=_init_period_worker, initargs=(provider,))
+    try:
+        pending = deque()
+        for target_time in target_times:
+            pending.append((target_time, pool.apply_async(_compute_period_images_in_worker, (target_time,))))
+            if len(pending) >= 2 * jobs:
+                next_target_time, result = pending.popleft()
+                yield next_target_time, _get_worker_images(provider, result)
+        while pending:
+            next_target_time, result = pending.popleft()
+            yield next_target_time, _get_worker_images(provider, result)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _get_worker_images(provider, result):
+    images, metrics_dict = result.get()
+    provider.metrics.merge(metrics_dict)
+    return images
@@ -1,12 +1,13 @@
 
-import math
 import os
 from collections import OrderedDict
-from datetime import datetime, timedelta
 
 import xarray as xr
 from xarray import Dataset
 
+from .cube_overviews import get_overview_path, get_overview_shape, is_overview_current
+from .cube_timeseries import count_touched_chunks, get_time_series_path, is_time_series_current
+
 
 class _CubeVar:
     def __init__(self, index, name, dir_path):
@@ -14,6 +15,10 @@ class _CubeVar:
         self.name = name
         self.dir_path = dir_path
         self.dataset = None
+        self.time_series_dataset = None
+        self.time_series_current = None
+        self.overview_datasets = dict()
+        self.overviews_current = dict()
 
 
 #: The names in this list are not *data* variables but *coordinate* variables.
@@ -36,6 +41,7 @@ class CubeDataAccess:
             print('WARNING: missing Python package "dask", expect runtime performance issues!')
 
         self._cube_config = cube_config
+        self._cube_base_dir = cube_base_dir
 
         self._cube_var_dict = OrderedDict()
         self._cube_var_list = []
@@ -70,12 +76,7 @@ class CubeDataAccess:
         Return the shape of the data cube.
         """
         cube_config = self._cube_config
-        year_1 = cube_config.start_time.year
-        year_2 = cube_config.end_time.year
-        years = year_2 - year_1
-        if cube_config.end_time > datetime(cube_config.end_time.year, 1, 1):
-            years += 1
-        time_size = years * cube_config.num_periods_per_year
+        time_size = cube_config.time_axis.size
         return len(self._cube_var_list), time_size, cube_config.grid_height, cube_config.grid_width
 
     @property
@@ -85,7 +86,7 @@ class CubeDataAccess:
         """
         return [cube_var.name for cube_var in self._cube_var_list]
 
-    def variable(self, key=None):
+    def variable(self, key=None, level: int = 0, max_shape=None):
         """
         Get one or more cube variables as ``xarray.DataArray`` instances. Same as, e.g. ``cube.data['ozone']``.
 
@@ -94,32 +95,37 @@ class CubeDataAccess:
                 indices (type ``int``) point into this list, which is in alphabetical order w.r.t. the variable names.
                 If a sequence is provided, a sequence will be returned.
                 Passing ``None`` is equivalent to passing the ``variable_names`` list.
+        :param level: The overview level, 0 for the full resolution, see :py:mod:`esdl.cube_overviews`.
+        :param max_shape: If given, the maximum (latitude, longitude) shape of the variable(s). The finest
+                level whose shape does not exceed it is used, or the coarsest available level. Overrides *level*.
         :return: a ``xarray.DataArray`` instance or a sequence of such representing the variable(s) with the
                 dimensions (time, latitude, longitude).
         """
-        return self._variable(key if key is not None else self.variable_names, True)
+        return self._variable(key if key is not None else self.variable_names, True, level=level,
+                              max_shape=max_shape)
 
-    def _variable(self, key, method_call):
+    def _variable(self, key, method_call, level=0, max_shape=None):
         if isinstance(key, int):
             key = self._cube_var_list[key]
-            dataset = self._get_or_open_dataset(key)
+            dataset = self._get_dataset_for(key, None, self._get_level(key, None, level, max_shape))
             return dataset.variables[key.name]
         elif isinstance(key, str):
             key = self._cube_var_dict[key]
-            dataset = self._get_or_open_dataset(key)
+            dataset = self._get_dataset_for(key, None, self._get_level(key, None, level, max_shape))
             return dataset.variables[key.name]
         elif method_call or not isinstance(key, tuple):
             indices = self._get_var_indices(key)
             data_arrays = []
             for i in indices:
                 key = self._cube_var_list[i]
-                dataset = self._get_or_open_dataset(key)
+                dataset = self._get_dataset_for(key, None, self._get_level(key, None, level, max_shape))
                 data_arrays.append(dataset.variables[key.name])
             return data_arrays
         else:
             raise IndexError('key cannot be a tuple')
 
-    def dataset(self, key=None) -> xr.Dataset:
+    def dataset(self, key=None, time=None, latitude=None, longitude=None, level: int = 0,
+                max_shape=None) -> xr.Dataset:
         """
         .. _xarray.Dataset: http://xarray.pydata.org/en/stable/data-structures.html#dataset
 
@@ -130,28 +136,41 @@ class CubeDataAccess:
                 indices (type ``int``) point into this list.
                 If a sequence is provided, a sequence will be returned.
                 Passing ``None`` is equivalent to passing the ``variable_names`` list.
+        :param time: If given, a single datetime.datetime object or a 2-element iterable (time_start, time_end)
+                to which the dataset is subset, see :py:meth:`get`.
+        :param latitude: If given, a single latitude value or a 2-element iterable (latitude_start, latitude_end)
+                to which the dataset is subset.
+        :param longitude: If given, a single longitude value or a 2-element iterable (longitude_start,
+                longitude_end) to which the dataset is subset.
+        :param level: The overview level, 0 for the full resolution, see :py:mod:`esdl.cube_overviews`.
+        :param max_shape: If given, the maximum (latitude, longitude) shape of the subset. The finest level whose
+                subset does not exceed it is used, or the coarsest available level. Overrides *level*.
         :return: an `xarray.Dataset`_ instance with the dimensions (time, latitude, longitude).
         """
 
+        index_ranges = None
+        if time is not None or latitude is not None or longitude is not None:
+            index_ranges = self._get_index_ranges(time, latitude, longitude)
         if isinstance(key, int):
             key = self._cube_var_list[key]
-            return self._get_or_open_dataset(key)
+            return self._get_subset_dataset(key, index_ranges, self._get_level(key, index_ranges, level, max_shape))
         elif isinstance(key, str):
             key = self._cube_var_dict[key]
-            return self._get_or_open_dataset(key)
+            return self._get_subset_dataset(key, index_ranges, self._get_level(key, index_ranges, level, max_shape))
         else:
             indices = self._get_var_indices(key)
             data_arrays = {}
             for i in indices:
                 key = self._cube_var_list[i]
-                dataset = self._get_or_open_dataset(key)
+                dataset = self._get_subset_dataset(key, index_ranges,
+                                                   self._get_level(key, index_ranges, level, max_shape))
                 # data_arrays[key.name] = dataset.variables[key.name]
                 data_arrays = xr.merge([data_arrays, dataset])
             return xr.Dataset(data_arrays)
 
     # TODO (forman, 20160713): Remove method, add time, lat, lon to variable() and dataset()
     # TODO (forman, 20160713): Use xarray API to achieve the same result
-    def get(self, variable=None, time=None, latitude=None, longitude=None):
+    def get(self, variable=None, time=None, latitude=None, longitude=None, level: int = 0, max_shape=None):
         """
         Get the cube's data as a list of numpy-like data arrays. The returned list will 
         correspond to the **variable** argument. A one-element list will be returned
@@ -161,38 +180,13 @@ class CubeDataAccess:
         :param time: a single datetime.datetime object or a 2-element iterable (time_start, time_end)
         :param latitude: a single latitude value or a 2-element iterable (latitude_start, latitude_end)
         :param longitude: a single longitude value or a 2-element iterable (longitude_start, longitude_end)
+        :param level: the overview level, 0 for the full resolution
+        :param max_shape: the maximum (latitude, longitude) shape of the data arrays, overrides **level**
         :return: a dictionary mapping variable names --> data arrays of dimension (time, latitude, longitude)
         """
 
         var_indexes = self._get_var_indices(variable)
-        time_1, time_2 = self._get_time_range(time)
-        lat_1, lat_2 = self._get_lat_range(latitude)
-        lon_1, lon_2 = self._get_lon_range(longitude)
-
-        config = self._cube_config
-        time_index_1 = int(math.floor(((time_1 - config.ref_time) / timedelta(days=config.temporal_res))))
-        time_index_2 = int(math.floor(((time_2 - config.ref_time) / timedelta(days=config.temporal_res))))
-        grid_y1 = int(round((90.0 - lat_2) / (180 / config.grid_height))) - config.grid_y0
-        grid_y2 = int(round((90.0 - lat_1) / (180 / config.grid_height))) - config.grid_y0
-        grid_x1 = int(round((180.0 + lon_1) / (360 / config.grid_width))) - config.grid_x0
-        grid_x2 = int(round((180.0 + lon_2) / (360 / config.grid_width))) - config.grid_x0
-
-        if grid_y2 > grid_y1 and 90.0 - (grid_y2 + config.grid_y0) * (180 / config.grid_height) == lat_1:
-            grid_y2 -= 1
-        if grid_x2 > grid_x1 and -180.0 + (grid_x2 + config.grid_x0) * (360 / config.grid_width) == lon_2:
-            grid_x2 -= 1
-
-        global_grid_width = int(round(360.0 / config.spatial_res))
-        dateline_intersection = grid_x2 >= global_grid_width
-
-        if dateline_intersection:
-            grid_x11 = grid_x1
-            grid_x12 = global_grid_width - 1
-            grid_x21 = 0
-            grid_x22 = grid_x2
-            # TODO (forman, 20151102) - Handle data requests intersecting the dateline, see issue #15
-            print('dateline intersection! grid_x: %d-%d, %d-%d' % (grid_x11, grid_x12, grid_x21, grid_x22))
-            raise ValueError('illegal longitude: %s: dateline intersection not yet implemented' % longitude)
+        index_ranges = self._get_index_ranges(time, latitude, longitude)
 
         # TODO (forman, 20151102) - Fill in NaN, where a variable does not provide any data, see issue #17
         result = []
@@ -200,7 +194,11 @@ class CubeDataAccess:
         #         grid_y2 - grid_y1 + 1, \
         #         grid_x2 - grid_x1 + 1
         for var_index in var_indexes:
-            variable = self.variable(var_index)
+            cube_var = self._cube_var_list[var_index]
+            var_level = self._get_level(cube_var, index_ranges, level, max_shape)
+            variable = self._get_dataset_for(cube_var, index_ranges, var_level).variables[cube_var.name]
+            (time_index_1, time_index_2), (grid_y1, grid_y2), (grid_x1, grid_x2) = \
+                _get_level_index_ranges(index_ranges, var_level)
             # result += [numpy.full(shape, numpy.NaN, dtype=numpy.float32)]
             # print('variable.shape =', variable.shape)
             array = variable[slice(time_index_1, time_index_2 + 1) if (time_index_1 < time_index_2) else time_index_1,
@@ -215,6 +213,45 @@ class CubeDataAccess:
         """
         self._close_datasets()
 
+    def _get_index_ranges(self, time, latitude, longitude):
+        """
+        Return the inclusive (time, lat, lon) index ranges of the given *time*, *latitude* and *longitude* ranges.
+        """
+        time_1, time_2 = self._get_time_range(time)
+        lat_1, lat_2 = self._get_lat_range(latitude)
+        lon_1, lon_2 = self._get_lon_range(longitude)
+
+        config = self._cube_config
+        time_index_1 = config.time_axis.get_index(time_1, clip=True)
+        time_index_2 = config.time_axis.get_index(time_2, clip=True)
+        # The grid of regional cubes, e.g. subsets, does not span the globe, so cells are given by spatial_res
+        spatial_res = config.spatial_res
+        grid_y1 = int(round((90.0 - lat_2) / spatial_res)) - config.grid_y0
+        grid_y2 = int(round((90.0 - lat_1) / spatial_res)) - config.grid_y0
+        grid_x1 = int(round((180.0 + lon_1) / spatial_res)) - config.grid_x0
+        grid_x2 = int(round((180.0 + lon_2) / spatial_res)) - config.grid_x0
+
+        if grid_y2 > grid_y1 and 90.0 - (grid_y2 + config.grid_y0) * spatial_res == lat_1:
+            grid_y2 -= 1
+        if grid_x2 > grid_x1 and -180.0 + (grid_x2 + config.grid_x0) * spatial_res == lon_2:
+            grid_x2 -= 1
+
+        global_grid_width = int(round(360.0 / config.spatial_res))
+        dateline_intersection = grid_x2 + config.grid_x0 >= global_grid_width
+
+        if dateline_intersection:
+            grid_x11 = grid_x1
+            grid_x12 = global_grid_width - 1
+            grid_x21 = 0
+            grid_x22 = grid_x2
+            # TODO (forman, 20151102) - Handle data requests intersecting the dateline, see issue #15
+            print('dateline intersection! grid_x: %d-%d, %d-%d' % (grid_x11, grid_x12, grid_x21, grid_x22))
+            raise ValueError('illegal longitude: %s: dateline intersection not yet implemented' % longitude)
+
+        grid_y1, grid_y2 = [min(max(y, 0), config.grid_height - 1) for y in (grid_y1, grid_y2)]
+        grid_x1, grid_x2 = [min(max(x, 0), config.grid_width - 1) for x in (grid_x1, grid_x2)]
+        return (time_index_1, time_index_2), (grid_y1, grid_y2), (grid_x1, grid_x2)
+
     def _get_lon_range(self, longitude):
         if longitude is None:
             return -180, 180
@@ -302,18 +339,99 @@ class CubeDataAccess:
             self._open_dataset(cube_var)
         return cube_var.dataset
 
+    def _get_subset_dataset(self, cube_var, index_ranges, level=0):
+        dataset = self._get_dataset_for(cube_var, index_ranges, level)
+        if index_ranges is None:
+            return dataset
+        (time_1, time_2), (lat_1, lat_2), (lon_1, lon_2) = _get_level_index_ranges(index_ranges, level)
+        return dataset.isel(time=slice(time_1, time_2 + 1), lat=slice(lat_1, lat_2 + 1), lon=slice(lon_1, lon_2 + 1))
+
+    def _get_dataset_for(self, cube_var, index_ranges, level=0):
+        """
+        Return the dataset of overview *level* of *cube_var* if *level* is not 0. Otherwise return the dataset of
+        the layout of *cube_var* whose chunks are touched less by reading the given (time, lat, lon)
+        *index_ranges*, the map layout in ``TARGET/data`` if *index_ranges* is ``None``.
+        """
+        if level:
+            if level not in cube_var.overview_datasets:
+                self._open_overview_dataset(cube_var, level)
+            return cube_var.overview_datasets[level]
+        config = self._cube_config
+        if index_ranges is None or not config.time_series_chunks:
+            return self._get_or_open_dataset(cube_var)
+        if cube_var.time_series_current is None:
+            cube_var.time_series_current = is_time_series_current(self._cube_base_dir, cube_var.name,
+                                                                  config.file_format)
+        if not cube_var.time_series_current:
+            return self._get_or_open_dataset(cube_var)
+        map_chunk_sizes = config.chunk_sizes or (1, config.grid_height, config.grid_width)
+        time_block_size = None if config.file_format == 'zarr' else config.num_periods_per_year
+        num_map_chunks = count_touched_chunks(index_ranges, map_chunk_sizes, time_block_size=time_block_size)
+        num_time_series_chunks = count_touched_chunks(index_ranges, self._get_time_series_chunk_sizes())
+        if num_time_series_chunks >= num_map_chunks:
+            return self._get_or_open_dataset(cube_var)
+        if not cube_var.time_series_dataset:
+            self._open_time_series_dataset(cube_var)
+        return cube_var.time_series_dataset
+
+    def _get_level(self, cube_var, index_ranges, level, max_shape):
+        """
+        Return the overview level of *cube_var* used to read the given (time, lat, lon) *index_ranges*, all of the
+        variable if ``None``: *level* if *max_shape* is ``None``, otherwise the finest level whose
+        (lat, lon) shape does not exceed *max_shape*, or the coarsest available level.
+
+        :raise ValueError: if *level* is not an available level.
+        """
+        if max_shape is None:
+            if level and not self._is_overview_available(cube_var, level):
+                raise ValueError('overview level %d of variable %s is not available, see Cube.update_overviews'
+                                 % (level, cube_var.name))
+            return level
+        if index_ranges is None:
+            height, width = self._cube_config.grid_height, self._cube_config.grid_width
+        else:
+            _, (lat_1, lat_2), (lon_1, lon_2) = index_ranges
+            height, width = lat_2 - lat_1 + 1, lon_2 - lon_1 + 1
+        max_height, max_width = max_shape
+        level = 0
+        while True:
+            level_height, level_width = get_overview_shape(height, width, level)
+            if (level_height <= max_height and level_width <= max_width) \
+                    or not self._is_overview_available(cube_var, level + 1):
+                return level
+            level += 1
+
+    def _is_overview_available(self, cube_var, level):
+        config = self._cube_config
+        if not config.overview_levels or not 0 < level <= config.overview_levels:
+            return False
+        if level not in cube_var.overviews_current:
+            cube_var.overviews_current[level] = is_overview_current(self._cube_base_dir, cube_var.name, level,
+                                                                    config.file_format)
+        return cube_var.overviews_current[level]
+
+    def _get_time_series_chunk_sizes(self):
+        config = self._cube_config
+        lat_size, lon_size = config.time_series_chunks
+        return config.time_axis.size, lat_size, lon_size
+
     def _open_dataset(self, variable):
-        file_pattern = os.path.join(variable.dir_path, '*.nc')
-        chunk_sizes = self._cube_config.chunk_sizes
+        # Multiples of the chunk sizes for the expected access patterns are recommended by cube-chunks
+        chunk_sizes = self._cube_config.dask_chunks or self._cube_config.chunk_sizes
         dask_chunks = None
         if chunk_sizes:
             time_size, lat_size, lon_size = chunk_sizes
-            # TODO (forman): use multiples of chunk sizes in certain dimensions
-            #                until some constraint is fulfilled.
-            #                e.g. hint that allows using max. XYZ MB per variable,
-            #                only have multiples in time dimension, because users want
-            #                time-series analysis...
             dask_chunks = dict(time=time_size, lat=lat_size, lon=lon_size)
+        if self._cube_config.file_format == 'zarr':
+            # The variable directory is a Zarr group holding all years, chunks can be read without the HDF5 lock
+            kwargs = dict()
+            if dask_chunks:
+                kwargs.update(chunks=dask_chunks)
+            if os.path.exists(os.path.join(variable.dir_path, '.zmetadata')):
+                kwargs.update(consolidated=True)
+            variable.dataset = self._preprocess_dataset(xr.open_zarr(variable.dir_path, **kwargs))
+            return
+        file_pattern = os.path.join(variable.dir_path, '*.nc')
         variable.dataset = xr.open_mfdataset(file_pattern,
                                              concat_dim='time',
                                              preprocess=self._preprocess_dataset,
@@ -321,6 +439,30 @@ class CubeDataAccess:
                                              chunks=dask_chunks,
                                              data_vars='minimal')
 
+    def _open_time_series_dataset(self, variable):
+        time_size, lat_size, lon_size = self._get_time_series_chunk_sizes()
+        dask_chunks = dict(time=time_size, lat=lat_size, lon=lon_size)
+        path = get_time_series_path(self._cube_base_dir, variable.name, self._cube_config.file_format)
+        if self._cube_config.file_format == 'zarr':
+            kwargs = dict(chunks=dask_chunks)
+            if os.path.exists(os.path.join(path, '.zmetadata')):
+                kwargs.update(consolidated=True)
+            dataset = xr.open_zarr(path, **kwargs)
+        else:
+            dataset = xr.open_dataset(path, engine='h5netcdf', chunks=dask_chunks)
+        variable.time_series_dataset = self._preprocess_dataset(dataset)
+
+    def _open_overview_dataset(self, variable, level):
+        path = get_overview_path(self._cube_base_dir, variable.name, level, self._cube_config.file_format)
+        if self._cube_config.file_format == 'zarr':
+            kwargs = dict()
+            if os.path.exists(os.path.join(path, '.zmetadata')):
+                kwargs.update(consolidated=True)
+            dataset = xr.open_zarr(path, **kwargs)
+        else:
+            dataset = xr.open_dataset(path, engine='h5netcdf', chunks=dict(time=1))
+        variable.overview_datasets[level] = self._preprocess_dataset(dataset)
+
     def _preprocess_dataset(self, ds: Dataset):
         # Convert specific data variables to coordinate variables
         for var_name in EXTRA_COORDS_VAR_NAMES:
@@ -334,3 +476,22 @@ class CubeDataAccess:
             if cube_var.dataset:
                 cube_var.dataset.close()
                 cube_var.dataset = None
+            if cube_var.time_series_dataset:
+                cube_var.time_series_dataset.close()
+                cube_var.time_series_dataset = None
+            cube_var.time_series_current = None
+            for dataset in cube_var.overview_datasets.values():
+                dataset.close()
+            cube_var.overview_datasets = dict()
+            cube_var.overviews_current = dict()
+
+
+def _get_level_index_ranges(index_ranges, level):
+    """
+    Return the (time, lat, lon) index ranges of overview *level* covering the full resolution *index_ranges*.
+    """
+    if not level:
+        return index_ranges
+    factor = 2 ** level
+    time_range, (lat_1, lat_2), (lon_1, lon_2) = index_ranges
+    return time_range, (lat_1 // factor, lat_2 // factor), (lon_1 // factor, lon_2 // factor)
@@ -0,0 +1,291 @@
+"""
+Benchmark of cube generation throughput using source-free providers derived from
+:py:class:`TestCubeSourceProvider`.
+
+Usage examples::
+
+    cube-bench
+    cube-bench --spatial-res 0.25 --temporal-res 8 --years 2 --chunk-sizes 1,720,1440
+    cube-bench --compression --comp-level 1 --images constant --label before-change
+    cube-bench --codec blosc-lz4:5:shuffle --chunk-sizes 1,180,360
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from .cube import Cube
+from .cube_config import CubeConfig
+from .providers.test_provider import TestCubeSourceProvider
+from .version import version as __version__
+
+#: The default file which keeps the results of previous benchmark runs, one JSON object per line.
+DEFAULT_HISTORY_FILE = 'cube-bench-history.jsonl'
+
+#: The result values which must match for two runs to be comparable.
+SETUP_KEYS = ('grid_width', 'grid_height', 'temporal_res', 'years', 'num_vars', 'images', 'file_format',
+              'chunk_sizes', 'compression', 'comp_level', 'codec')
+
+
+class BenchCubeSourceProvider(TestCubeSourceProvider):
+    """
+    A :py:class:`TestCubeSourceProvider` that measures the time spent in :py:meth:`compute_variable_images`.
+
+    :param cube_config: Specifies the fixed layout and conventions used for the cube.
+    :param var: The variable name.
+    :param images: 'constant' for constant images as returned by :py:class:`TestCubeSourceProvider`, 'random' for
+           images of uniformly distributed random numbers, which are a lot harder to compress.
+    :param seed: The random seed used for 'random' images.
+    """
+
+    def __init__(self, cube_config: CubeConfig, var: str = 'test', images: str = 'random', seed: int = 0):
+        super(BenchCubeSourceProvider, self).__init__(cube_config, name='bench', var=var)
+        if images not in ('constant', 'random'):
+            raise ValueError("images must be one of 'constant', 'random'")
+        self._images = images
+        self._random = np.random.RandomState(seed)
+        self.num_periods = 0
+        self.compute_time = 0.0
+
+    def compute_variable_images(self, period_start, period_end):
+        t1 = time.perf_counter()
+        var_name_to_image = super(BenchCubeSourceProvider, self).compute_variable_images(period_start, period_end)
+        if self._images == 'random':
+            for var_name, image in var_name_to_image.items():
+                var_name_to_image[var_name] = self._random.random_sample(image.shape).astype(np.float32)
+        self.compute_time += time.perf_counter() - t1
+        self.num_periods += 1
+        return var_name_to_image
+
+
+class _BenchCube(Cube):
+    """
+    A cube that measures the time spent writing images, including closing the variable files.
+    """
+
+    def __init__(self, base_dir, config):
+        super(_BenchCube, self).__init__(base_dir, config)
+        self.write_time = 0.0
+
+    def _write_image(self, *args):
+        t1 = time.perf_counter()
+        super(_BenchCube, self)._write_image(*args)
+        self.write_time += time.perf_counter() - t1
+
+    def _close_dataset(self, *args):
+        t1 = time.perf_counter()
+        super(_BenchCube, self)._close_dataset(*args)
+        self.write_time += time.perf_counter() - t1
+
+
+def run_benchmark(cube_dir: str, cube_config: CubeConfig, num_vars: int = 1, images: str = 'random') -> OrderedDict:
+    """
+    Generate a cube with *num_vars* variables in *cube_dir*, which must not exist, and measure the throughput.
+
+    :return: An ordered dictionary with the benchmark setup and the measured values.
+    """
+    cube = Cube.create(cube_dir, cube_config)
+    cube.close()
+    cube = _BenchCube(cube_dir, cube_config)
+    providers = [BenchCubeSourceProvider(cube_config, var='var_%d' % (i + 1), images=images, seed=i)
+                 for i in range(num_vars)]
+    t1 = time.perf_counter()
+    for provider in providers:
+        cube.update(provider)
+    total_time = time.perf_counter() - t1
+    cube.close()
+
+    num_periods = sum(provider.num_periods for provider in providers)
+    compute_time = sum(provider.compute_time for provider in providers)
+    image_bytes = cube_config.grid_width * cube_config.grid_height * np.dtype(np.float32).itemsize
+    data_bytes = num_periods * image_bytes
+    file_bytes = _get_dir_size(os.path.join(cube_dir, 'data'))
+    mb = 1024. * 1024.
+
+    result = OrderedDict()
+    result['version'] = __version__
+    result['time'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    result['host'] = socket.gethostname()
+    result['python'] = platform.python_version()
+    result['grid_width'] = cube_config.grid_width
+    result['grid_height'] = cube_config.grid_height
+    result['temporal_res'] = cube_config.temporal_res
+    result['years'] = cube_config.end_time.year - cube_config.start_time.year
+    result['num_vars'] = num_vars
+    result['images'] = images
+    result['file_format'] = cube_config.file_format
+    result['chunk_sizes'] = list(cube_config.chunk_sizes) if cube_config.chunk_sizes else None
+    result['compression'] = bool(cube_config.compression)
+    result['comp_level'] = cube_config.comp_level if cube_config.compression else None
+    result['codec'] = cube_config.codec
+    result['num_periods'] = num_periods
+    result['total_time'] = total_time
+    result['compute_time'] = compute_time
+    result['write_time'] = cube.write_time
+    result['periods_per_second'] = num_periods / total_time if total_time > 0 else 0.0
+    result['data_mb'] = data_bytes / mb
+    result['file_mb'] = file_bytes / mb
+    result['data_mb_per_second'] = data_bytes / mb / total_time if total_time > 0 else 0.0
+    result['file_mb_per_second'] = file_bytes / mb / total_time if total_time > 0 else 0.0
+    return result
+
+
+def load_history(history_file: str) -> list:
+    """
+    Load the results of previous benchmark runs from *history_file*. Returns an empty list if it does not exist.
+    """
+    if not os.path.exists(history_file):
+        return []
+    history = []
+    with open(history_file) as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                history.append(json.loads(line, object_pairs_hook=OrderedDict))
+    return history
+
+
+def append_history(history_file: str, result: dict):
+    """
+    Append the benchmark *result* to *history_file*.
+    """
+    with open(history_file, 'a') as fp:
+        fp.write(json.dumps(result) + '\n')
+
+
+def find_baseline(history: list, result: dict):
+    """
+    Return the most recent result in *history* with the same setup as *result*, or ``None``.
+    """
+    for previous_result in reversed(history):
+        if all(previous_result.get(key) == result.get(key) for key in SETUP_KEYS):
+            return previous_result
+    return None
+
+
+def format_result(result: dict, baseline: dict = None) -> str:
+    """
+    Return a human-readable report of the benchmark *result*, compared to *baseline* if given.
+    """
+    lines = ['setup: %s' % ', '.join('%s=%s' % (key, result[key]) for key in SETUP_KEYS)]
+    for key, unit in (('num_periods', ''), ('total_time', 's'), ('compute_time', 's'), ('write_time', 's'),
+                      ('periods_per_second', '1/s'), ('data_mb', 'MiB'), ('file_mb', 'MiB'),
+                      ('data_mb_per_second', 'MiB/s'), ('file_mb_per_second', 'MiB/s')):
+        line = '%-20s %12.3f %s' % (key, result[key], unit)
+        if baseline is not None and baseline.get(key):
+            line += '  (%+.1f%% vs. %s of %s)' % (100. * (result[key] - baseline[key]) / baseline[key],
+                                                  baseline['version'], baseline['time'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def is_regression(result: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Test whether the periods per second of *result* are more than *tolerance* percent lower than of *baseline*.
+    """
+    return result['periods_per_second'] < baseline['periods_per_second'] * (1. - tolerance / 100.)
+
+
+def _get_dir_size(dir_path):
+    size = 0
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+
+    print('ESDL cube generation benchmark, version %s' % __version__)
+
+    parser = argparse.ArgumentParser(description='Measures the throughput of ESDL data cube generation.')
+    parser.add_argument('--spatial-res', metavar='DEG', type=float, default=1.0,
+                        help="spatial resolution of the global grid in degrees, defaults to 1.0")
+    parser.add_argument('--temporal-res', metavar='DAYS', type=int, default=8,
+                        help="temporal resolution in days, defaults to 8")
+    parser.add_argument('--years', metavar='N', type=int, default=1,
+                        help="number of years to generate, defaults to 1")
+    parser.add_argument('--vars', metavar='N', type=int, default=1,
+                        help="number of variables to generate, defaults to 1")
+    parser.add_argument('--images', choices=['random', 'constant'], default='random',
+                        help="image content, defaults to random")
+    parser.add_argument('--file-format', metavar='FORMAT', default='NETCDF4_CLASSIC',
+                        help="cube file format, defaults to NETCDF4_CLASSIC")
+    parser.add_argument('--chunk-sizes', metavar='T,Y,X',
+                        help="chunk sizes in time, lat and lon")
+    parser.add_argument('--compression', action='store_true',
+                        help="compress variables")
+    parser.add_argument('--comp-level', metavar='L', type=int, default=5,
+                        help="compression level 1 to 9, defaults to 5")
+    parser.add_argument('--codec', metavar='CODEC',
+                        help="compression codec, e.g. blosc-lz4:5:shuffle, overrides --compression")
+    parser.add_argument('--work-dir', metavar='DIR',
+                        help="directory in which the benchmark cube is generated, defaults to a temporary directory")
+    parser.add_argument('--history', metavar='FILE', default=DEFAULT_HISTORY_FILE,
+                        help="file with the results of previous runs, defaults to %s" % DEFAULT_HISTORY_FILE)
+    parser.add_argument('--label', metavar='LABEL',
+                        help="label stored with the result, e.g. a release or commit")
+    parser.add_argument('--tolerance', metavar='PCT', type=float, default=10.0,
+                        help="periods per second may be this many percent lower than in the last comparable run "
+                             "before a regression is reported, defaults to 10")
+    parser.add_argument('--no-history', action='store_true',
+                        help="neither compare with nor append to the history file")
+    args_obj = parser.parse_args(args)
+
+    if args_obj.years < 1 or args_obj.vars < 1:
+        parser.error('N must be a positive integer')
+    chunk_sizes = None
+    if args_obj.chunk_sizes:
+        try:
+            chunk_sizes = tuple(int(size) for size in args_obj.chunk_sizes.split(','))
+        except ValueError:
+            chunk_sizes = ()
+        if len(chunk_sizes) != 3:
+            parser.error('T,Y,X must be three integers')
+
+    grid_width = int(round(360. / args_obj.spatial_res))
+    grid_height = int(round(180. / args_obj.spatial_res))
+    try:
+        cube_config = CubeConfig(spatial_res=args_obj.spatial_res, grid_width=grid_width, grid_height=grid_height,
+                                 temporal_res=args_obj.temporal_res,
+                                 start_time=datetime(2001, 1, 1), end_time=datetime(2001 + args_obj.years, 1, 1),
+                                 file_format=args_obj.file_format, chunk_sizes=chunk_sizes,
+                                 compression=args_obj.compression, comp_level=args_obj.comp_level,
+                                 codec=args_obj.codec)
+    except ValueError as e:
+        parser.error(str(e))
+
+    work_dir = tempfile.mkdtemp(prefix='cube-bench-', dir=args_obj.work_dir)
+    try:
+        result = run_benchmark(os.path.join(work_dir, 'cube'), cube_config, num_vars=args_obj.vars,
+                               images=args_obj.images)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result['label'] = args_obj.label
+
+    baseline = None
+    if not args_obj.no_history:
+        baseline = find_baseline(load_history(args_obj.history), result)
+    print(format_result(result, baseline))
+    if not args_obj.no_history:
+        append_history(args_obj.history, result)
+    if baseline is not None and is_regression(result, baseline, args_obj.tolerance):
+        print('error: regression, periods per second are more than %s%% lower than in the run of %s' %
+              (args_obj.tolerance, baseline['time']))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
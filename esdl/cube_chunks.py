@@ -0,0 +1,449 @@
+"""
+Tuning of a cube's chunk sizes for a declared mix of read access patterns, see :py:func:`tune_chunk_sizes`.
+
+Each candidate chunk shape is benchmarked on a synthetic slice of the configured grid of at most two chunks in each
+dimension, which is written using the cube's file format and codec. The measured time per chunk read is multiplied
+by the number of chunks that a read of the full grid touches, e.g. all spatial chunks of a period for a map read or
+all time chunks of all years for a pixel time-series read.
+
+Usage examples::
+
+    cube-chunks -c cube.config --maps 0.2 --time-series 0.8
+    cube-chunks -c cube.config --boxes 1 --box-size 46,100,100 --max-chunk-mb 4 --max-latency 0.5 -o tuned.config
+"""
+
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import netCDF4
+import numpy
+
+from .cube_config import CubeConfig
+from .version import version as __version__
+
+#: The read access patterns of a :py:class:`Workload`: *maps* read all pixels of a single period,
+#: *time_series* read all periods of a single pixel and *boxes* read a (time, lat, lon) box of a given size.
+ACCESS_PATTERNS = ('maps', 'time_series', 'boxes')
+
+#: The default maximum size of an uncompressed chunk in bytes.
+DEFAULT_MAX_CHUNK_BYTES = 8 * 1024 * 1024
+
+#: The default maximum size of a dask chunk in bytes.
+DEFAULT_MAX_DASK_BYTES = 128 * 1024 * 1024
+
+_ITEM_SIZE = numpy.dtype(numpy.float32).itemsize
+
+
+class Workload:
+    """
+    A mix of read access patterns, see :py:data:`ACCESS_PATTERNS`. The fractions are normalized to sum up to one.
+
+    :param maps: The fraction of map reads.
+    :param time_series: The fraction of pixel time-series reads.
+    :param boxes: The fraction of box reads.
+    :param box_size: The (time, lat, lon) size of a box read.
+    """
+
+    def __init__(self, maps: float = 1.0, time_series: float = 0.0, boxes: float = 0.0, box_size=(46, 100, 100)):
+        fractions = (maps, time_series, boxes)
+        if any(fraction < 0 for fraction in fractions) or sum(fractions) <= 0:
+            raise ValueError('workload fractions must not be negative and must not all be zero')
+        if len(box_size) != 3 or any(size < 1 for size in box_size):
+            raise ValueError('box_size must be a sequence of three positive integers: <time>, <lat>, <lon>')
+        total = float(sum(fractions))
+        #: The mapping of access patterns to their normalized fractions
+        self.fractions = OrderedDict((pattern, fraction / total) for pattern, fraction in zip(ACCESS_PATTERNS,
+                                                                                              fractions))
+        self.box_size = tuple(box_size)
+
+    def __repr__(self):
+        return 'Workload(%s, box_size=%s)' % (', '.join('%s=%.2f' % item for item in self.fractions.items()),
+                                             self.box_size)
+
+
+class ChunkCandidate:
+    """
+    The benchmark results of a candidate chunk shape. All times are given in seconds.
+
+    :param chunk_sizes: The (time, lat, lon) chunk sizes.
+    """
+
+    def __init__(self, chunk_sizes):
+        self.chunk_sizes = tuple(chunk_sizes)
+        #: The size of an uncompressed chunk in bytes
+        self.chunk_bytes = int(numpy.prod(self.chunk_sizes)) * _ITEM_SIZE
+        #: The mapping of access patterns to the estimated time of a single read of the full grid
+        self.read_seconds = OrderedDict()
+        #: The estimated time to write a year of a variable
+        self.write_seconds = 0.0
+        #: The compression ratio of the synthetic slice
+        self.ratio = 0.0
+        #: The estimated time of a read weighted by the workload's fractions
+        self.latency = 0.0
+
+
+class ChunkTuning:
+    """
+    The result of :py:func:`tune_chunk_sizes`.
+
+    :param workload: The workload.
+    :param candidates: The benchmarked :py:class:`ChunkCandidate` instances.
+    :param best: The recommended candidate.
+    :param dask_chunks: The recommended (time, lat, lon) dask chunks.
+    :param max_latency: The latency target or ``None``.
+    """
+
+    def __init__(self, workload: Workload, candidates: list, best: ChunkCandidate, dask_chunks,
+                 max_latency: float = None):
+        self.workload = workload
+        self.candidates = candidates
+        self.best = best
+        self.dask_chunks = tuple(dask_chunks)
+        self.max_latency = max_latency
+
+    @property
+    def chunk_sizes(self) -> tuple:
+        """
+        The recommended (time, lat, lon) chunk sizes.
+        """
+        return self.best.chunk_sizes
+
+    @property
+    def target_met(self) -> bool:
+        """
+        Whether the recommended chunk sizes meet the latency target.
+        """
+        return self.max_latency is None or self.best.latency <= self.max_latency
+
+    def report(self) -> str:
+        """
+        Return a human-readable table of the candidates and the recommendation.
+        """
+        lines = ['workload: %s' % self.workload,
+                 '%-16s %10s %7s %10s %10s %10s %10s %10s' % ('chunk_sizes', 'chunk', 'ratio', 'maps(s)',
+                                                              'series(s)', 'boxes(s)', 'latency(s)', 'write(s)')]
+        for candidate in sorted(self.candidates, key=lambda c: c.latency):
+            lines.append('%-16s %10s %7.2f %10.4f %10.4f %10.4f %10.4f %10.3f%s' % (
+                ','.join(str(size) for size in candidate.chunk_sizes),
+                _format_bytes(candidate.chunk_bytes),
+                candidate.ratio,
+                candidate.read_seconds['maps'],
+                candidate.read_seconds['time_series'],
+                candidate.read_seconds['boxes'],
+                candidate.latency,
+                candidate.write_seconds,
+                ' *' if candidate is self.best else ''))
+        lines.append('recommended chunk_sizes: %s' % (self.chunk_sizes,))
+        lines.append('recommended dask_chunks: %s' % (self.dask_chunks,))
+        if not self.target_met:
+            lines.append('latency target of %s s not met by any candidate' % self.max_latency)
+        return '\n'.join(lines)
+
+
+def get_candidate_chunk_sizes(cube_config: CubeConfig, max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES) -> list:
+    """
+    Return the candidate (time, lat, lon) chunk sizes for the grid of *cube_config* whose uncompressed size does not
+    exceed *max_chunk_bytes*. Time sizes never exceed the periods of a year, because NetCDF cubes store one file
+    per year, and spatial sizes divide the grid into 1, 2, 4, ... parts.
+    """
+    num_periods = cube_config.num_periods_per_year
+    time_sizes = sorted(set(size for size in (1, 2, 4, 8, 16, num_periods // 2, num_periods)
+                            if 1 <= size <= num_periods))
+    spatial_sizes = []
+    for parts in (1, 2, 4, 8, 16, 32):
+        spatial_size = (int(math.ceil(cube_config.grid_height / parts)), int(math.ceil(cube_config.grid_width / parts)))
+        if spatial_size not in spatial_sizes:
+            spatial_sizes.append(spatial_size)
+    return [(time_size,) + spatial_size for time_size in time_sizes for spatial_size in spatial_sizes
+            if time_size * spatial_size[0] * spatial_size[1] * _ITEM_SIZE <= max_chunk_bytes]
+
+
+def get_dask_chunks(cube_config: CubeConfig, chunk_sizes, workload: Workload,
+                    max_dask_bytes: int = DEFAULT_MAX_DASK_BYTES) -> tuple:
+    """
+    Return dask chunks which are multiples of *chunk_sizes* of at most *max_dask_bytes*. Chunks grow in time first
+    if the workload reads more time series than maps, otherwise in space first. Dask chunks of NetCDF cubes never
+    span more than a year, because each year is stored in its own file.
+    """
+    if cube_config.file_format == 'zarr':
+        time_limit = cube_config.time_axis.size
+    else:
+        time_limit = cube_config.num_periods_per_year
+    limits = [time_limit, cube_config.grid_height, cube_config.grid_width]
+    dask_chunks = [min(size, limit) for size, limit in zip(chunk_sizes, limits)]
+    if workload.fractions['time_series'] >= workload.fractions['maps']:
+        dims = (0, 1, 2)
+    else:
+        dims = (1, 2, 0)
+    for dim in dims:
+        while dask_chunks[dim] < limits[dim]:
+            grown = list(dask_chunks)
+            grown[dim] = min(2 * dask_chunks[dim], limits[dim])
+            if int(numpy.prod(grown)) * _ITEM_SIZE > max_dask_bytes:
+                break
+            dask_chunks = grown
+    return tuple(dask_chunks)
+
+
+def benchmark_chunk_sizes(cube_config: CubeConfig, chunk_sizes, workload: Workload, work_dir: str,
+                          num_reads: int = 3, seed: int = 0) -> ChunkCandidate:
+    """
+    Benchmark the (time, lat, lon) *chunk_sizes* for the cube given by *cube_config* by writing and reading a
+    synthetic slice in *work_dir*.
+
+    :return: A :py:class:`ChunkCandidate`.
+    """
+    candidate = ChunkCandidate(chunk_sizes)
+    time_size, lat_size, lon_size = candidate.chunk_sizes
+    num_periods = cube_config.num_periods_per_year
+    full_shape = (num_periods, cube_config.grid_height, cube_config.grid_width)
+    slice_shape = tuple(min(2 * size, full_size) for size, full_size in zip(candidate.chunk_sizes, full_shape))
+    data = _get_synthetic_data(slice_shape, seed)
+    random = numpy.random.RandomState(seed)
+
+    path = os.path.join(work_dir, 'chunks-%d-%d-%d' % candidate.chunk_sizes)
+    t1 = time.perf_counter()
+    array, close = _create_array(cube_config, path, slice_shape, candidate.chunk_sizes)
+    try:
+        for index in range(0, slice_shape[0], time_size):
+            array[index:index + time_size] = data[index:index + time_size]
+    finally:
+        close()
+    write_seconds = time.perf_counter() - t1
+    candidate.ratio = data.nbytes / _get_size(path)
+    candidate.write_seconds = write_seconds / _num_chunks(slice_shape, candidate.chunk_sizes) * \
+                              _num_chunks(full_shape, candidate.chunk_sizes)
+
+    if cube_config.file_format == 'zarr':
+        num_time_chunks = _ceil_div(cube_config.time_axis.size, time_size)
+    else:
+        num_years = cube_config.time_axis.end_year - cube_config.time_axis.start_year + 1 \
+            if cube_config.start_time and cube_config.end_time else 1
+        num_time_chunks = num_years * _ceil_div(num_periods, time_size)
+    box_size = [min(size, full_size) for size, full_size in zip(workload.box_size, full_shape)]
+    full_chunks = OrderedDict([('maps', _ceil_div(full_shape[1], lat_size) * _ceil_div(full_shape[2], lon_size)),
+                               ('time_series', num_time_chunks),
+                               ('boxes', numpy.prod([(size - 1) / chunk_size + 1
+                                                     for size, chunk_size in zip(box_size, candidate.chunk_sizes)]))])
+
+    array, close = _open_array(cube_config, path)
+    try:
+        for pattern in ACCESS_PATTERNS:
+            chunk_seconds = 0.0
+            for _ in range(num_reads):
+                if pattern == 'maps':
+                    offset = (random.randint(slice_shape[0]), 0, 0)
+                    shape = (1,) + slice_shape[1:]
+                elif pattern == 'time_series':
+                    offset = (0, random.randint(slice_shape[1]), random.randint(slice_shape[2]))
+                    shape = (slice_shape[0], 1, 1)
+                else:
+                    shape = tuple(min(size, slice_size) for size, slice_size in zip(box_size, slice_shape))
+                    offset = tuple(random.randint(slice_size - size + 1)
+                                   for size, slice_size in zip(shape, slice_shape))
+                key = tuple(slice(o, o + s) for o, s in zip(offset, shape))
+                t1 = time.perf_counter()
+                numpy.asarray(array[key])
+                chunk_seconds += (time.perf_counter() - t1) / _num_touched_chunks(offset, shape,
+                                                                                  candidate.chunk_sizes)
+            candidate.read_seconds[pattern] = chunk_seconds / num_reads * full_chunks[pattern]
+    finally:
+        close()
+    candidate.latency = sum(workload.fractions[pattern] * candidate.read_seconds[pattern]
+                            for pattern in ACCESS_PATTERNS)
+    return candidate
+
+
+def tune_chunk_sizes(cube_config: CubeConfig, workload: Workload, max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES,
+                     max_latency: float = None, max_dask_bytes: int = DEFAULT_MAX_DASK_BYTES, candidates=None,
+                     work_dir: str = None, num_reads: int = 3) -> ChunkTuning:
+    """
+    Benchmark candidate chunk sizes for the grid, time range, file format and codec of *cube_config* and recommend
+    the chunk sizes with the lowest estimated read time for *workload*. If *max_latency* is given, the recommendation
+    is the candidate with the smallest chunks among those whose estimated read time does not exceed it.
+
+    :param cube_config: The cube configuration, its *file_format* must be 'NETCDF4', 'NETCDF4_CLASSIC' or 'zarr'.
+    :param workload: The mix of read access patterns.
+    :param max_chunk_bytes: The maximum size of an uncompressed chunk, which bounds the memory of reading a chunk.
+    :param max_latency: The target of the estimated read time in seconds.
+    :param max_dask_bytes: The maximum size of a recommended dask chunk.
+    :param candidates: The (time, lat, lon) chunk sizes to benchmark, defaults to
+           :py:func:`get_candidate_chunk_sizes`.
+    :param work_dir: The directory in which the synthetic slices are written, defaults to a temporary directory.
+    :param num_reads: The number of reads per access pattern.
+    :return: A :py:class:`ChunkTuning`.
+    """
+    if cube_config.file_format not in ('NETCDF4', 'NETCDF4_CLASSIC', 'zarr'):
+        raise ValueError('chunk sizes can only be tuned for file formats NETCDF4, NETCDF4_CLASSIC and zarr')
+    if candidates is None:
+        candidates = get_candidate_chunk_sizes(cube_config, max_chunk_bytes)
+    if not candidates:
+        raise ValueError('no candidate chunk sizes, max_chunk_bytes is too small')
+    temp_dir = tempfile.mkdtemp(prefix='cube-chunks-', dir=work_dir)
+    try:
+        results = [benchmark_chunk_sizes(cube_config, chunk_sizes, workload, temp_dir, num_reads=num_reads)
+                   for chunk_sizes in candidates]
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    best = min(results, key=lambda c: c.latency)
+    if max_latency is not None:
+        fast_enough = [candidate for candidate in results if candidate.latency <= max_latency]
+        if fast_enough:
+            best = min(fast_enough, key=lambda c: (c.chunk_bytes, c.latency))
+    dask_chunks = get_dask_chunks(cube_config, best.chunk_sizes, workload, max_dask_bytes)
+    return ChunkTuning(workload, results, best, dask_chunks, max_latency=max_latency)
+
+
+def _get_synthetic_data(shape, seed):
+    # A smooth global field with a trend in time and some noise, which compresses like typical continuous variables
+    t, y, x = numpy.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    random = numpy.random.RandomState(seed)
+    data = numpy.sin(2 * numpy.pi * x / shape[2]) * numpy.cos(numpy.pi * y / shape[1]) + 0.1 * t / shape[0]
+    data = data + 0.01 * random.standard_normal(shape)
+    return data.astype(numpy.float32)
+
+
+def _create_array(cube_config, path, shape, chunk_sizes):
+    codec = cube_config.get_codec('data')
+    if cube_config.file_format == 'zarr':
+        import zarr
+        array = zarr.open_array(path, mode='w', shape=shape, chunks=chunk_sizes, dtype=numpy.float32,
+                                **codec.get_zarr_kwargs(numpy.float32))
+        return array, lambda: None
+    dataset = netCDF4.Dataset(path, 'w', format=cube_config.file_format)
+    for name, size in zip(('time', 'lat', 'lon'), shape):
+        dataset.createDimension(name, size)
+    variable = dataset.createVariable('data', 'f4', ('time', 'lat', 'lon'), chunksizes=chunk_sizes,
+                                      **codec.get_netcdf_kwargs(cube_config.file_format))
+    return variable, dataset.close
+
+
+def _open_array(cube_config, path):
+    if cube_config.file_format == 'zarr':
+        import zarr
+        return zarr.open_array(path, mode='r'), lambda: None
+    dataset = netCDF4.Dataset(path)
+    variable = dataset.variables['data']
+    # Chunks must be read from the file for every read, not from the HDF5 chunk cache
+    variable.set_var_chunk_cache(size=0)
+    return variable, dataset.close
+
+
+def _get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def _num_chunks(shape, chunk_sizes):
+    return int(numpy.prod([_ceil_div(size, chunk_size) for size, chunk_size in zip(shape, chunk_sizes)]))
+
+
+def _num_touched_chunks(offset, shape, chunk_sizes):
+    return int(numpy.prod([(o + s - 1) // c - o // c + 1 for o, s, c in zip(offset, shape, chunk_sizes)]))
+
+
+def _format_bytes(num_bytes) -> str:
+    if num_bytes < 1024:
+        return '%d B' % num_bytes
+    for unit in ('KiB', 'MiB', 'GiB', 'TiB'):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == 'TiB':
+            return '%.1f %s' % (num_bytes, unit)
+
+
+def _parse_sizes(text):
+    sizes = tuple(int(size) for size in text.split(','))
+    if len(sizes) != 3:
+        raise ValueError()
+    return sizes
+
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+
+    print('ESDL chunk size tuner, version %s' % __version__)
+
+    parser = argparse.ArgumentParser(description='Recommends the chunk sizes and dask chunks of an ESDL data cube '
+                                                 'for a mix of read access patterns.')
+    parser.add_argument('-c', '--cube-conf', metavar='CONFIG',
+                        help="data cube configuration file, defaults to the default configuration")
+    parser.add_argument('--maps', metavar='F', type=float, default=0.0,
+                        help="fraction of map reads, i.e. all pixels of a period")
+    parser.add_argument('--time-series', metavar='F', type=float, default=0.0,
+                        help="fraction of pixel time-series reads, i.e. all periods of a pixel")
+    parser.add_argument('--boxes', metavar='F', type=float, default=0.0,
+                        help="fraction of box reads of size --box-size")
+    parser.add_argument('--box-size', metavar='T,Y,X', default='46,100,100',
+                        help="size of a box read in time, lat and lon, defaults to 46,100,100")
+    parser.add_argument('--max-chunk-mb', metavar='MB', type=float, default=DEFAULT_MAX_CHUNK_BYTES / 1024 / 1024,
+                        help="maximum size of an uncompressed chunk in mebibytes, defaults to %d" %
+                             (DEFAULT_MAX_CHUNK_BYTES // 1024 // 1024))
+    parser.add_argument('--max-latency', metavar='S', type=float,
+                        help="target of the estimated read time in seconds, the smallest chunks meeting it are "
+                             "recommended")
+    parser.add_argument('--max-dask-mb', metavar='MB', type=float, default=DEFAULT_MAX_DASK_BYTES / 1024 / 1024,
+                        help="maximum size of a dask chunk in mebibytes, defaults to %d" %
+                             (DEFAULT_MAX_DASK_BYTES // 1024 // 1024))
+    parser.add_argument('--reads', metavar='N', type=int, default=3,
+                        help="number of reads per access pattern and candidate, defaults to 3")
+    parser.add_argument('--work-dir', metavar='DIR',
+                        help="directory in which the synthetic slices are written, defaults to a temporary directory")
+    parser.add_argument('-o', '--output', metavar='CONFIG',
+                        help="write the configuration with the recommended chunk_sizes and dask_chunks to CONFIG")
+    args_obj = parser.parse_args(args)
+
+    if args_obj.cube_conf and not os.path.isfile(args_obj.cube_conf):
+        parser.error('CONFIG file not found: %s' % args_obj.cube_conf)
+    if args_obj.reads < 1:
+        parser.error('N must be a positive integer')
+    if args_obj.max_chunk_mb <= 0 or args_obj.max_dask_mb <= 0:
+        parser.error('MB must be a positive number')
+    try:
+        box_size = _parse_sizes(args_obj.box_size)
+    except ValueError:
+        parser.error('T,Y,X must be three integers')
+    maps = args_obj.maps
+    if not (maps or args_obj.time_series or args_obj.boxes):
+        maps = 1.0
+    try:
+        workload = Workload(maps=maps, time_series=args_obj.time_series, boxes=args_obj.boxes, box_size=box_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cube_config = CubeConfig.load(args_obj.cube_conf) if args_obj.cube_conf else CubeConfig()
+    try:
+        tuning = tune_chunk_sizes(cube_config, workload,
+                                  max_chunk_bytes=int(args_obj.max_chunk_mb * 1024 * 1024),
+                                  max_latency=args_obj.max_latency,
+                                  max_dask_bytes=int(args_obj.max_dask_mb * 1024 * 1024),
+                                  work_dir=args_obj.work_dir,
+                                  num_reads=args_obj.reads)
+    except ValueError as e:
+        parser.error(str(e))
+    print(tuning.report())
+
+    if args_obj.output:
+        cube_config.chunk_sizes = tuning.chunk_sizes
+        cube_config.dask_chunks = tuning.dask_chunks
+        cube_config.store(args_obj.output)
+        print('configuration written to %s' % args_obj.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Compression codecs of cube variables, see :py:class:`Codec`.
+
+A codec is configured by a specification string ``<name>[:<level>[:<shuffle>]]``, e.g. ``'zlib:5'``,
+``'blosc-lz4:5:shuffle'`` or ``'none'``, using the cube configuration's **codec** and **var_codecs** parameters.
+:py:func:`select_codec` picks the codec with the best trade-off between compression ratio and speed for sample
+images of a variable.
+"""
+
+import os
+import time
+import zlib
+from collections import OrderedDict
+
+import netCDF4
+import numpy
+
+#: The names of the supported codecs. 'zlib' and 'zstd' are plain compressors, the 'blosc-*' codecs use
+#: the Blosc meta-compressor with the given internal compressor, which compresses blocks in several threads.
+CODEC_NAMES = ('none', 'zlib', 'zstd', 'blosc-lz4', 'blosc-lz4hc', 'blosc-zstd', 'blosc-zlib', 'blosc-blosclz')
+
+#: The supported shuffle filters. 'shuffle' reorders the bytes and 'bitshuffle' the bits of the values of
+#: a block before compression, which improves the compression ratio of most floating point data.
+SHUFFLES = ('noshuffle', 'shuffle', 'bitshuffle')
+
+#: The codecs tried by :py:func:`select_codec` by default.
+DEFAULT_CANDIDATES = ('zlib:1:shuffle', 'zlib:5:shuffle', 'zstd:3:shuffle', 'blosc-lz4:5:shuffle',
+                      'blosc-lz4hc:5:shuffle', 'blosc-zstd:3:shuffle', 'blosc-zstd:3:bitshuffle')
+
+#: The I/O throughput in bytes per second assumed by :py:func:`select_codec` to weigh compressed sizes
+#: against compression times.
+DEFAULT_IO_BYTES_PER_SECOND = 200 * 1024 * 1024
+
+_DEFAULT_LEVELS = {'none': 0, 'zlib': 5, 'zstd': 3}
+
+
+class Codec:
+    """
+    A compression codec of a cube variable.
+
+    :param name: The codec name, one of :py:data:`CODEC_NAMES`.
+    :param level: The compression level 1 to 9, defaults to 5 for zlib and Blosc codecs and 3 for zstd.
+    :param shuffle: The shuffle filter applied before compression, one of :py:data:`SHUFFLES`, defaults to
+           'shuffle'. 'bitshuffle' is only supported by Blosc codecs.
+    """
+
+    def __init__(self, name: str, level: int = None, shuffle: str = None):
+        if name not in CODEC_NAMES:
+            raise ValueError('codec must be one of %s' % ', '.join(CODEC_NAMES))
+        if level is None:
+            level = _DEFAULT_LEVELS.get(name, 5)
+        if name != 'none' and not 1 <= level <= 9:
+            raise ValueError('codec level must be an integer in the range 1 to 9')
+        if shuffle is None:
+            shuffle = 'noshuffle' if name == 'none' else 'shuffle'
+        if shuffle not in SHUFFLES:
+            raise ValueError('codec shuffle must be one of %s' % ', '.join(SHUFFLES))
+        if shuffle == 'bitshuffle' and not self._is_blosc(name):
+            raise ValueError("codec shuffle 'bitshuffle' requires a Blosc codec")
+        self.name = name
+        self.level = level
+        self.shuffle = shuffle
+
+    def __repr__(self):
+        return 'Codec(%s)' % repr(self.spec)
+
+    def __eq__(self, other):
+        return isinstance(other, Codec) and self.spec == other.spec
+
+    def __hash__(self):
+        return hash(self.spec)
+
+    @staticmethod
+    def parse(spec) -> 'Codec':
+        """
+        Parse a codec specification ``<name>[:<level>[:<shuffle>]]``. Codec instances are returned as they are.
+
+        :raise ValueError: if *spec* is invalid.
+        """
+        if isinstance(spec, Codec):
+            return spec
+        if not isinstance(spec, str) or not spec:
+            raise ValueError('codec must be given as "<name>[:<level>[:<shuffle>]]"')
+        parts = spec.split(':')
+        if len(parts) > 3:
+            raise ValueError('codec must be given as "<name>[:<level>[:<shuffle>]]"')
+        level = None
+        if len(parts) > 1 and parts[1]:
+            try:
+                level = int(parts[1])
+            except ValueError:
+                raise ValueError('codec level must be an integer in the range 1 to 9')
+        return Codec(parts[0], level=level, shuffle=parts[2] if len(parts) > 2 else None)
+
+    @property
+    def spec(self) -> str:
+        """
+        The codec's specification string.
+        """
+        if self.name == 'none':
+            return 'none'
+        return '%s:%d:%s' % (self.name, self.level, self.shuffle)
+
+    @property
+    def blosc(self) -> bool:
+        """
+        Whether the codec uses the multithreaded Blosc meta-compressor.
+        """
+        return self._is_blosc(self.name)
+
+    def get_netcdf_kwargs(self, file_format: str) -> dict:
+        """
+        Return the compression keyword arguments of ``netCDF4.Dataset.createVariable()`` for this codec.
+        Codecs other than 'zlib' require netCDF4 >= 1.6 built with the respective HDF5 filter plugins.
+
+        :raise ValueError: if the codec is not supported by the netCDF4 library or by *file_format*.
+        """
+        if self.name == 'none':
+            return dict(zlib=False)
+        if not file_format.startswith('NETCDF4'):
+            raise ValueError('codec %s requires file_format NETCDF4 or NETCDF4_CLASSIC' % self.spec)
+        if self.name == 'zlib':
+            return dict(zlib=True, complevel=self.level, shuffle=self.shuffle == 'shuffle')
+        if self.name == 'zstd':
+            if not getattr(netCDF4, '__has_zstd_support__', False):
+                raise ValueError('codec %s requires netCDF4 >= 1.6 with zstd support' % self.spec)
+            return dict(compression='zstd', complevel=self.level, shuffle=self.shuffle == 'shuffle')
+        if not getattr(netCDF4, '__has_blosc_support__', False):
+            raise ValueError('codec %s requires netCDF4 >= 1.6 with blosc support' % self.spec)
+        return dict(compression=self.name.replace('-', '_').replace('blosclz', 'lz'), complevel=self.level,
+                    blosc_shuffle=SHUFFLES.index(self.shuffle))
+
+    def get_zarr_kwargs(self, dtype) -> dict:
+        """
+        Return the ``compressor`` and ``filters`` keyword arguments of ``zarr.create()`` for this codec and
+        an array of the given *dtype*.
+
+        :raise ValueError: if the codec is not supported by the installed numcodecs package.
+        """
+        import numcodecs
+
+        if self.name == 'none':
+            return dict(compressor=None, filters=None)
+        filters = None
+        if self.shuffle == 'shuffle' and not self.blosc:
+            if not hasattr(numcodecs, 'Shuffle'):
+                raise ValueError('codec %s requires numcodecs >= 0.6.4' % self.spec)
+            filters = [numcodecs.Shuffle(elementsize=numpy.dtype(dtype).itemsize)]
+        return dict(compressor=self.get_numcodecs_codec(), filters=filters)
+
+    def get_numcodecs_codec(self):
+        """
+        Return the numcodecs compressor of this codec, ``None`` for 'none'. Shuffling is included only
+        for Blosc codecs.
+        """
+        import numcodecs
+
+        if self.name == 'none':
+            return None
+        if self.name == 'zlib':
+            return numcodecs.Zlib(level=self.level)
+        if self.name == 'zstd':
+            return numcodecs.Zstd(level=self.level)
+        shuffle = {'noshuffle': numcodecs.Blosc.NOSHUFFLE,
+                   'shuffle': numcodecs.Blosc.SHUFFLE,
+                   'bitshuffle': numcodecs.Blosc.BITSHUFFLE}[self.shuffle]
+        return numcodecs.Blosc(cname=self.name[len('blosc-'):], clevel=self.level, shuffle=shuffle)
+
+    def encode(self, array: numpy.ndarray) -> bytes:
+        """
+        Compress the contiguous data of *array* the way it is compressed in a chunk of a cube variable.
+        """
+        data = numpy.ascontiguousarray(array)
+        if self.shuffle == 'shuffle' and not self.blosc:
+            data = _shuffle(data)
+        if self.name == 'none':
+            return data.tobytes()
+        if self.name == 'zlib':
+            return zlib.compress(data.tobytes(), self.level)
+        return bytes(self.get_numcodecs_codec().encode(data))
+
+    def decode(self, buffer: bytes, dtype, shape) -> numpy.ndarray:
+        """
+        Decompress a *buffer* returned by :py:meth:`encode` into an array of the given *dtype* and *shape*.
+        """
+        dtype = numpy.dtype(dtype)
+        if self.name == 'none':
+            data = buffer
+        elif self.name == 'zlib':
+            data = zlib.decompress(buffer)
+        else:
+            data = self.get_numcodecs_codec().decode(buffer)
+        if self.shuffle == 'shuffle' and not self.blosc:
+            data = _unshuffle(numpy.frombuffer(data, dtype=numpy.uint8), dtype.itemsize)
+        return numpy.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def is_supported(self, file_format: str) -> bool:
+        """
+        Test whether the codec can be used for cubes of the given *file_format* in this environment.
+        """
+        try:
+            if file_format == 'zarr':
+                self.get_zarr_kwargs(numpy.float32)
+            else:
+                self.get_netcdf_kwargs(file_format)
+            if self.name not in ('none', 'zlib'):
+                # encode() uses numcodecs
+                self.get_numcodecs_codec()
+        except (ImportError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def _is_blosc(name):
+        return name.startswith('blosc-')
+
+
+def set_num_threads(num_threads: int):
+    """
+    Set the number of threads used by Blosc codecs to compress and decompress chunks, both by numcodecs
+    and by the Blosc filter plugin of HDF5, which reads the environment variable ``BLOSC_NTHREADS``.
+    """
+    os.environ['BLOSC_NTHREADS'] = str(num_threads)
+    try:
+        from numcodecs import blosc
+    except ImportError:
+        return
+    blosc.set_nthreads(num_threads)
+
+
+def evaluate_codec(codec: Codec, images) -> OrderedDict:
+    """
+    Compress and decompress *images* using *codec* and return the compression ratio and the times spent.
+
+    :param codec: The codec.
+    :param images: A sequence of numpy arrays, e.g. sample images of a cube variable.
+    :return: An ordered dictionary with the keys ``codec``, ``bytes``, ``compressed_bytes``, ``ratio``,
+             ``encode_seconds`` and ``decode_seconds``.
+    """
+    num_bytes = 0
+    compressed_bytes = 0
+    encode_seconds = 0.0
+    decode_seconds = 0.0
+    for image in images:
+        image = numpy.ma.getdata(image)
+        t1 = time.perf_counter()
+        buffer = codec.encode(image)
+        t2 = time.perf_counter()
+        codec.decode(buffer, image.dtype, image.shape)
+        t3 = time.perf_counter()
+        num_bytes += image.nbytes
+        compressed_bytes += len(buffer)
+        encode_seconds += t2 - t1
+        decode_seconds += t3 - t2
+    return OrderedDict([('codec', codec.spec),
+                        ('bytes', num_bytes),
+                        ('compressed_bytes', compressed_bytes),
+                        ('ratio', num_bytes / compressed_bytes if compressed_bytes else 0.0),
+                        ('encode_seconds', encode_seconds),
+                        ('decode_seconds', decode_seconds)])
+
+
+def select_codec(images, candidates=DEFAULT_CANDIDATES, file_format: str = None,
+                 io_bytes_per_second: float = DEFAULT_IO_BYTES_PER_SECOND):
+    """
+    Select the codec of *candidates* which minimizes the estimated time to write and read *images*, that is
+    the time spent compressing and decompressing plus the time to transfer the compressed bytes at
+    *io_bytes_per_second*. Well compressible variables such as masks favour high compression levels, while
+    noisy continuous fields favour fast codecs.
+
+    :param images: A sequence of numpy arrays, e.g. sample images of a cube variable.
+    :param candidates: The codecs or codec specifications to try.
+    :param file_format: If given, candidates which cannot be used for cubes of this file format are skipped.
+    :param io_bytes_per_second: The assumed I/O throughput.
+    :return: A pair (codec, results) where *results* is the list of results of :py:func:`evaluate_codec`
+             of all tried candidates, extended by the estimated time ``seconds``.
+    :raise ValueError: if none of the candidates is supported.
+    """
+    best_codec = None
+    best_seconds = None
+    results = []
+    for candidate in candidates:
+        codec = Codec.parse(candidate)
+        if file_format is not None and not codec.is_supported(file_format):
+            continue
+        result = evaluate_codec(codec, images)
+        seconds = result['encode_seconds'] + result['decode_seconds'] + \
+                  result['compressed_bytes'] / io_bytes_per_second
+        result['seconds'] = seconds
+        results.append(result)
+        if best_seconds is None or seconds < best_seconds:
+            best_codec = codec
+            best_seconds = seconds
+    if best_codec is None:
+        raise ValueError('none of the codecs %s is supported' % ', '.join(str(c) for c in candidates))
+    return best_codec, results
+
+
+def _shuffle(data):
+    # The byte shuffle filter of HDF5 and numcodecs: all first bytes of the values, then all second bytes, ...
+    return numpy.ascontiguousarray(data.view(numpy.uint8).reshape(-1, data.dtype.itemsize).T)
+
+
+def _unshuffle(data, item_size):
+    return numpy.ascontiguousarray(data.reshape(item_size, -1).T)
@@ -4,12 +4,26 @@ from typing import Tuple
 
 import netCDF4
 
+from .cube_codecs import Codec
+from .util import CubeTimeAxis
+
 #: The current version of the data cube's configuration and data model.
 #: The model version is incremented on every change of the cube's data model.
-CUBE_MODEL_VERSION = '1.0.2'
+CUBE_MODEL_VERSION = '1.1.0'
 
 CUBE_CHANGELOG = """
 
+version 1.1.0
+-------------
+* Introduced new configuration parameters codec, var_codecs and comp_threads selecting the compression codec
+  of all or of single variables
+* Introduced new file_format value 'zarr' for cubes that store one Zarr array per variable spanning all years,
+  file_format is now validated
+* Introduced new configuration parameter dask_chunks used when opening data cubes for analysis
+* Introduced new configuration parameter time_series_chunks for the time-series layout in TARGET/timeseries
+* Introduced new configuration parameter overview_levels for the overview levels in TARGET/overviews
+* The time axis of all target periods is derived from start_time, end_time, temporal_res, ref_time and calendar
+
 version 1.0.2
 -------------
 * Introduced new configuration parameter comp_level (0...9, default 5)
@@ -54,6 +68,9 @@ version 0.1
 * initial version
 """
 
+#: The valid values of the *file_format* configuration parameter.
+FILE_FORMATS = ('NETCDF4', 'NETCDF4_CLASSIC', 'NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'zarr')
+
 
 class CubeConfig:
     """
@@ -72,14 +89,35 @@ class CubeConfig:
     :param end_time: The exclusive end time of the last image of any variable in the cube given as datetime value.
                      ``None`` means unlimited.
     :param variables: A list of variable names to be included in the cube.
-    :param file_format: The file format used. Must be one of 'NETCDF4', 'NETCDF4_CLASSIC', 'NETCDF3_CLASSIC'
-                        or 'NETCDF3_64BIT'.
+    :param file_format: The file format used. Must be one of 'NETCDF4', 'NETCDF4_CLASSIC', 'NETCDF3_CLASSIC',
+                        'NETCDF3_64BIT' or 'zarr'. NetCDF cubes store one file per variable and year, while
+                        'zarr' cubes store one chunked Zarr array per variable that spans all years and
+                        requires *start_time* and *end_time* to be given.
     :param chunk_sizes: A mapping of dimension names to chunk size for encoding.
                         Default is None.
+    :param dask_chunks: The (time, lat, lon) sizes of the dask chunks used to read the cube's variables,
+                        usually multiples of *chunk_sizes*, see ``cube-chunks``. Defaults to *chunk_sizes*.
+    :param time_series_chunks: The (lat, lon) chunk sizes of the cube's time-series layout. If given, the cube keeps
+                               a second copy of each variable in ``TARGET/timeseries`` whose chunks span all
+                               periods of the cube, which serves long pixel time series, see
+                               :py:mod:`esdl.cube_timeseries`. Requires *start_time* and *end_time*.
+                               Default is None.
+    :param overview_levels: The number of overview levels of the cube. If given, the cube keeps downsampled copies
+                            of each variable in ``TARGET/overviews`` whose resolutions are 2, 4, 8, ... times
+                            coarser, which serve quick looks, see :py:mod:`esdl.cube_overviews`.
+                            Requires *start_time* and *end_time*. Default is None.
     :param compression: Whether gzip compression is used for encoding.
                         Default is False.
     :param comp_level: Integer between 1 and 9 describing the level of compression desired for encoding.
                        Default is 5. Ignored if *compression* is False.
+    :param codec: The compression codec of all variables given as specification string, e.g. 'blosc-lz4:5:shuffle',
+                  see :py:class:`esdl.cube_codecs.Codec`. Overrides *compression* and *comp_level* if given.
+                  Default is None.
+    :param var_codecs: A mapping of variable names to codec specification strings, which overrides *codec*
+                       for the given variables. Written by ``cube-gen --select-codecs``. Default is None.
+    :param comp_threads: The number of threads used by Blosc codecs to compress and decompress chunks.
+                         Default is None, which uses the Blosc default or the ``BLOSC_NTHREADS`` environment
+                         variable.
     """
 
     def __init__(self,
@@ -96,8 +134,14 @@ class CubeConfig:
                  variables=None,
                  file_format='NETCDF4_CLASSIC',
                  chunk_sizes=None,
+                 dask_chunks=None,
+                 time_series_chunks=None,
+                 overview_levels=None,
                  compression=False,
                  comp_level=5,
+                 codec=None,
+                 var_codecs=None,
+                 comp_threads=None,
                  static_data=False,
                  model_version=CUBE_MODEL_VERSION):
         self.model_version = model_version
@@ -115,8 +159,16 @@ class CubeConfig:
         self.file_format = file_format
         self.static_data = static_data
         self.chunk_sizes = chunk_sizes
+        self.dask_chunks = dask_chunks
+        self.time_series_chunks = time_series_chunks
+        self.overview_levels = overview_levels
         self.compression = compression
         self.comp_level = comp_level
+        self.codec = codec
+        self.var_codecs = var_codecs
+        self.comp_threads = comp_threads
+        self._time_axis = None
+        self._time_axis_key = None
         self._validate()
 
     def __repr__(self):
@@ -168,6 +220,41 @@ class CubeConfig:
         """
         return math.ceil(365.0 / self.temporal_res)
 
+    @property
+    def time_axis(self) -> CubeTimeAxis:
+        """
+        The target periods of all years of the cube from *start_time* to *end_time*. The axis is computed once
+        and recomputed only if the time configuration changes.
+
+        :raise ValueError: if *start_time* or *end_time* is ``None``.
+        """
+        if self.start_time is None or self.end_time is None:
+            raise ValueError('time axis requires start_time and end_time')
+        key = self.start_time, self.end_time, self.temporal_res, self.ref_time, self.calendar
+        if self._time_axis is None or self._time_axis_key != key:
+            end_year = self.end_time.year
+            if self.end_time == datetime(end_year, 1, 1):
+                end_year -= 1
+            self._time_axis = CubeTimeAxis(self.start_time.year, max(end_year, self.start_time.year),
+                                           self.temporal_res, ref_time=self.ref_time, calendar=self.calendar)
+            self._time_axis_key = key
+        return self._time_axis
+
+    def get_codec(self, var_name: str) -> Codec:
+        """
+        Return the compression codec of the variable *var_name*, which is given by *var_codecs*, *codec* or
+        *compression* and *comp_level*, in this order.
+        """
+        if self.var_codecs and var_name in self.var_codecs:
+            return Codec.parse(self.var_codecs[var_name])
+        if self.codec:
+            return Codec.parse(self.codec)
+        if self.compression:
+            # NetCDF variables have always been shuffled, Zarr variables not
+            shuffle = 'noshuffle' if self.file_format == 'zarr' else 'shuffle'
+            return Codec('zlib', level=self.comp_level, shuffle=shuffle)
+        return Codec('none')
+
     def date2num(self, date) -> float:
         """
         Return the number of days for the given *date* as a number in the time units
@@ -230,8 +317,39 @@ class CubeConfig:
         if lon1 >= lon2 or lon1 < -180 or lon1 > 180 or lon2 < -180 or lon2 > 180:
             raise ValueError('illegal combination of grid_x0, grid_width, spatial_res values')
 
+        if self.file_format not in FILE_FORMATS:
+            raise ValueError('file_format must be one of %s' % ', '.join(FILE_FORMATS))
+
+        if self.file_format == 'zarr' and (self.start_time is None or self.end_time is None):
+            raise ValueError('file_format \'zarr\' requires start_time and end_time')
+
         if self.chunk_sizes is not None and len(self.chunk_sizes) != 3:
             raise ValueError('chunk_sizes must be a sequence of three integers: <time-size>, <lat-size>, <lon-size>')
+
+        if self.dask_chunks is not None and len(self.dask_chunks) != 3:
+            raise ValueError('dask_chunks must be a sequence of three integers: <time-size>, <lat-size>, <lon-size>')
+
+        if self.time_series_chunks is not None:
+            if len(self.time_series_chunks) != 2:
+                raise ValueError('time_series_chunks must be a sequence of two integers: <lat-size>, <lon-size>')
+            if self.start_time is None or self.end_time is None:
+                raise ValueError('time_series_chunks requires start_time and end_time')
+
+        if self.overview_levels is not None:
+            if self.overview_levels < 1:
+                raise ValueError('overview_levels must be a positive integer')
+            if self.start_time is None or self.end_time is None:
+                raise ValueError('overview_levels requires start_time and end_time')
         
         if self.comp_level is not None and (self.comp_level < 1 or self.comp_level > 9):
             raise ValueError('comp_level must be an integer in the range 1 to 9')
+
+        if self.codec is not None:
+            Codec.parse(self.codec)
+
+        if self.var_codecs is not None:
+            for codec in self.var_codecs.values():
+                Codec.parse(codec)
+
+        if self.comp_threads is not None and self.comp_threads < 1:
+            raise ValueError('comp_threads must be a positive integer')
@@ -1,13 +1,25 @@
 import argparse
+import contextlib
+import multiprocessing
+import multiprocessing.connection
 import os
 import sys
+import threading
+import time
+import traceback
 
 from pkg_resources import iter_entry_points
 
 from .version import version as __version__
-from .cube import Cube
+from .cube import Cube, DEFAULT_MAX_OPEN_FILES
+from .cube_codecs import Codec, DEFAULT_CANDIDATES
 from .cube_config import CubeConfig
+from .cube_metrics import STAGES
 from .cube_provider import CubeSourceProvider
+from .cube_queue import DEFAULT_LOCK_TIMEOUT, WorkQueue
+from .cube_rechunk import DEFAULT_MEMORY_BUDGET, rechunk_cube
+from .cube_subset import parse_time_range, subset_cube
+from .cube_verify import verify_cube
 
 
 def _load_source_providers():
@@ -50,6 +62,162 @@ def _parse_source_arg(source: str):
     return name, args, kwargs, error_msg
 
 
+def _update_cube(cube, source_provider, update_kwargs, log_file):
+    """
+    Update *cube* with *source_provider* while redirecting stdout and stderr to *log_file*.
+    Target of the provider processes started by :py:func:`_update_cube_concurrently`.
+    """
+    with open(log_file, 'w') as log_stream:
+        with contextlib.redirect_stdout(log_stream), contextlib.redirect_stderr(log_stream):
+            cube.update(source_provider, **update_kwargs)
+
+
+def _update_cube_concurrently(cube, source_providers, max_sources, update_kwargs, log_dir):
+    """
+    Update *cube* with *source_providers*, running up to *max_sources* providers at a time in separate processes.
+    The output of each provider is written to its own log file in *log_dir*.
+    The keyword arguments *update_kwargs* are passed to :py:meth:`Cube.update`.
+
+    :return: the list of names of the providers that failed
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    waiting = list(source_providers)
+    running = dict()
+    failed = []
+    log_files = set()
+    while waiting or running:
+        while waiting and len(running) < max_sources:
+            source_provider = waiting.pop(0)
+            log_file = os.path.join(log_dir, '%s.log' % source_provider.name)
+            index = 1
+            while log_file in log_files:
+                index += 1
+                log_file = os.path.join(log_dir, '%s-%d.log' % (source_provider.name, index))
+            log_files.add(log_file)
+            process = multiprocessing.Process(target=_update_cube,
+                                              args=(cube, source_provider, update_kwargs, log_file),
+                                              name=source_provider.name)
+            process.start()
+            running[process.sentinel] = process, time.time()
+            print('%s: started, output is written to %s' % (source_provider.name, log_file))
+        for sentinel in multiprocessing.connection.wait(list(running.keys())):
+            process, start_time = running.pop(sentinel)
+            process.join()
+            if process.exitcode == 0:
+                print('%s: done, took %f seconds' % (process.name, time.time() - start_time))
+            else:
+                print('%s: failed with exit code %s, see log file' % (process.name, process.exitcode))
+                failed.append(process.name)
+    return failed
+
+
+def _create_or_open_cube(cube_dir, cube_config, timeout=60.0):
+    """
+    Create a new cube in *cube_dir*. If another worker has just created it, wait until its creation is complete
+    and open it.
+    """
+    try:
+        return Cube.create(cube_dir, cube_config)
+    except IOError:
+        pass
+    # Cube.create() writes the CHANGELOG file last
+    start_time = time.time()
+    while not os.path.exists(os.path.join(cube_dir, 'CHANGELOG')):
+        if time.time() - start_time > timeout:
+            raise IOError('data cube has not been created within %s seconds: %s' % (timeout, cube_dir))
+        time.sleep(0.1)
+    return Cube.open(cube_dir)
+
+
+def _get_work_unit(source_provider, year):
+    # The provider name is not unique, e.g. "test:var=a test:var=b", but the variables of SOURCEs are disjoint
+    return '%s.%s.%04d' % (source_provider.name, min(source_provider.variable_descriptors.keys()), year)
+
+
+def _run_worker(cube, source_providers, update_kwargs, queue_dir, lock_timeout=DEFAULT_LOCK_TIMEOUT, retries=1):
+    """
+    Update *cube* by claiming (SOURCE, year) work units from the :py:class:`WorkQueue` in *queue_dir* until all
+    units are claimed or done. Each claimed unit is processed by updating only the year files of its year.
+    The keyword arguments *update_kwargs* are passed to :py:meth:`Cube.update`.
+
+    The lock file of a unit is touched while it is processed, so that other workers reclaim it only after
+    *lock_timeout* seconds without a sign of life. Failed units are released and claimed again, by this or another
+    worker, until they have failed *retries* + 1 times in this worker. Units which are not done at the end are
+    reported.
+
+    :return: the list of work units that failed
+    """
+    work_queue = WorkQueue(queue_dir, lock_timeout=lock_timeout)
+    units = [(source_provider, year, _get_work_unit(source_provider, year))
+             for source_provider in source_providers for year in cube.get_update_years(source_provider)]
+    num_attempts = dict()
+    claimed = True
+    while claimed:
+        claimed = False
+        for source_provider, year, unit in units:
+            if num_attempts.get(unit, 0) > retries or not work_queue.claim(unit):
+                continue
+            claimed = True
+            num_attempts[unit] = num_attempts.get(unit, 0) + 1
+            print('%s: claimed work unit %s' % (source_provider.name, unit))
+            start_time = time.time()
+            try:
+                with _touching(work_queue, unit):
+                    cube.update(source_provider, years=[year], **update_kwargs)
+            except Exception:
+                traceback.print_exc()
+                # Let this or other workers retry
+                work_queue.release(unit)
+                print('%s: work unit %s failed' % (source_provider.name, unit))
+                continue
+            work_queue.complete(unit)
+            print('%s: work unit %s done, took %f seconds' % (source_provider.name, unit, time.time() - start_time))
+    for _, _, unit in units:
+        if not work_queue.is_done(unit):
+            owner = work_queue.get_owner(unit)
+            print('work unit %s is left over, %s' % (unit, 'claimed by ' + owner if owner else 'not claimed'))
+    return [unit for _, _, unit in units if num_attempts.get(unit, 0) > retries and not work_queue.is_done(unit)]
+
+
+@contextlib.contextmanager
+def _touching(work_queue, unit):
+    """
+    Touch the lock file of the claimed *unit* regularly while the block is executed.
+    """
+    if work_queue.lock_timeout is None:
+        yield
+        return
+    stop_event = threading.Event()
+
+    def touch():
+        while not stop_event.wait(work_queue.lock_timeout / 4):
+            work_queue.touch(unit)
+
+    thread = threading.Thread(target=touch, name='touch-' + unit)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join()
+
+
+def _select_codecs(cube, source_provider, candidates):
+    """
+    Select the codecs of the variables of *source_provider* which have no data in *cube* yet and print the results.
+    """
+    var_name_to_results = cube.select_codecs(source_provider, candidates=candidates)
+    for var_name, results in var_name_to_results.items():
+        print('%s: %s: %-24s %8s %10s %10s %13s' % (source_provider.name, var_name, 'codec', 'ratio', 'encode(s)',
+                                                     'decode(s)', 'estimated(s)'))
+        for result in results:
+            print('%s: %s: %-24s %8.2f %10.3f %10.3f %13.3f' % (source_provider.name, var_name, result['codec'],
+                                                                 result['ratio'], result['encode_seconds'],
+                                                                 result['decode_seconds'], result['seconds']))
+        print('%s: %s: selected codec %s' % (source_provider.name, var_name, cube.config.var_codecs[var_name]))
+
+
 def main(args=None):
     if not args:
         args = sys.argv[1:]
@@ -68,6 +236,18 @@ def main(args=None):
     cube-gen "esdc-31d-1deg-1x180x360-1.0.1_1" "burnt_area:dir=data-source/BurntArea"
     cube-gen "esdc-31d-1deg-1x180x360-1.0.1_1" "evaporative_stress:dir=data-source/evaporative_stress:var=S"
     cube-gen "esdc-31d-1deg-1x180x360-1.0.1_1" "soil_moisture:dir=data-source/ECV_sm:resampling_order=space_first"
+    cube-gen -j 8 "esdc-31d-1deg-1x180x360-1.0.1_1" "burnt_area:dir=data-source/BurntArea"
+    cube-gen -s 2 "esdc-31d-1deg-1x180x360-1.0.1_1" "burnt_area:dir=data-source/BurntArea" "ozone:dir=data-source/Ozone"
+    cube-gen --plan "esdc-31d-1deg-1x180x360-1.0.1_1" "soil_moisture:dir=data-source/ECV_sm"
+    cube-gen -w -c cube.config "esdc-31d-1deg-1x180x360-1.0.1_1" "burnt_area:dir=data-source/BurntArea" (on each node)
+    cube-gen --profile read,resample "esdc-31d-1deg-1x180x360-1.0.1_1" "burnt_area:dir=data-source/BurntArea"
+    cube-gen --memory-budget 4096 "esdc-8d-0.0083deg-1x21600x43200-1.0.1_1" "burnt_area:dir=data-source/BurntArea"
+    cube-gen --update-time-series "esdc-8d-0.25deg-1x720x1440-1.0.1_1"
+    cube-gen --update-overviews "esdc-8d-0.083deg-1x2160x4320-1.0.1_1"
+    cube-gen --select-codecs "esdc-8d-0.25deg-1x720x1440-1.0.1_1" "ozone:dir=data-source/Ozone" "water_mask:dir=..."
+    cube-gen --rechunk "esdc-8d-0.25deg-1x720x1440-1.0.1_1" -c ts.config -b 1024 -j 4 "esdc-8d-0.25deg-46x90x90-1.0.1_1"
+    cube-gen --subset "esdc-8d-0.25deg-1x720x1440-1.0.1_1" --bbox -25,35,45,72 --time 2005-01-01,2009-01-01 "europe"
+    cube-gen --verify -j 16 "esdc-8d-0.25deg-1x720x1440-1.0.1_1"
     """
     parser = argparse.ArgumentParser(description='Generates a new ESDL data cube or updates an existing one.')
     parser.add_argument('-l', '--list', action='store_true',
@@ -76,6 +256,86 @@ def main(args=None):
                         help="do not clear data cache before updating the cube (faster)")
     parser.add_argument('-c', '--cube-conf', metavar='CONFIG',
                         help="data cube configuration file")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help="number of worker processes used to compute the target periods of a SOURCE")
+    parser.add_argument('-p', '--pipelined', action='store_true',
+                        help="read, compute and write periods of a SOURCE concurrently and report stage statistics, "
+                             "cannot be combined with --jobs")
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help="skip periods which have already been written according to TARGET/cube.manifest, "
+                             "e.g. to continue an interrupted run")
+    parser.add_argument('-s', '--max-sources', metavar='M', type=int, default=1,
+                        help="maximum number of SOURCEs processed concurrently, each in its own process "
+                             "writing its output to a separate log file")
+    parser.add_argument('-b', '--memory-budget', metavar='MB', type=int,
+                        help="compute and write the images of a SOURCE in tiles of the target grid, such that "
+                             "computing a tile requires at most MB mebibytes, cannot be combined with --jobs or "
+                             "--pipelined")
+    parser.add_argument('-w', '--worker', action='store_true',
+                        help="run as one of several cooperating workers, possibly on different hosts sharing the "
+                             "TARGET file system: claim (SOURCE, year) work units from a lock-file based queue, "
+                             "process them and mark them done")
+    parser.add_argument('--queue-dir', metavar='DIR',
+                        help="work queue directory used by --worker, defaults to TARGET/queue")
+    parser.add_argument('--lock-timeout', metavar='S', type=float, default=DEFAULT_LOCK_TIMEOUT,
+                        help="seconds after which --worker reclaims a work unit whose lock file has not been "
+                             "touched by its owner, e.g. after a crash, defaults to %s" % DEFAULT_LOCK_TIMEOUT)
+    parser.add_argument('--retries', metavar='N', type=int, default=1,
+                        help="number of times a --worker claims a failed work unit again, defaults to 1")
+    parser.add_argument('--plan', action='store_true',
+                        help="only report the source images read per period, the total bytes to read, the "
+                             "estimated peak memory per period and the number of output files of each SOURCE, "
+                             "without reading pixel data or writing anything")
+    parser.add_argument('--max-open-files', metavar='F', type=int, default=DEFAULT_MAX_OPEN_FILES,
+                        help="maximum number of variable files of a SOURCE kept open, the least recently written "
+                             "file is closed if exceeded, preferring files whose periods have all been written, "
+                             "because closing others costs filling and reading back their remaining periods, "
+                             "defaults to %d" % DEFAULT_MAX_OPEN_FILES)
+    parser.add_argument('--profile', metavar='STAGES',
+                        help="profile the given comma-separated stages of cube generation using cProfile and dump "
+                             "the profiles to TARGET/reports, 'all' for all stages: %s" % ', '.join(STAGES))
+    parser.add_argument('--select-codecs', action='store_true',
+                        help="before updating, select the compression codec of each new variable of a SOURCE by "
+                             "trying the candidate codecs on sample images, the selected codecs are recorded in "
+                             "TARGET/cube.config")
+    parser.add_argument('--codecs', metavar='CODECS', default=','.join(DEFAULT_CANDIDATES),
+                        help="comma-separated candidate codecs used by --select-codecs, "
+                             "defaults to %s" % ','.join(DEFAULT_CANDIDATES))
+    parser.add_argument('--update-time-series', action='store_true',
+                        help="rewrite the time-series copies of all variables of TARGET after the SOURCEs have been "
+                             "processed, e.g. after all --worker processes have finished, requires "
+                             "time_series_chunks in the cube configuration")
+    parser.add_argument('--update-overviews', action='store_true',
+                        help="rewrite the overview levels of all variables of TARGET after the SOURCEs have been "
+                             "processed, e.g. after all --worker processes have finished, requires "
+                             "overview_levels in the cube configuration")
+    parser.add_argument('--rechunk', metavar='CUBE',
+                        help="create TARGET as a copy of the existing data cube CUBE with the chunk sizes, codecs and "
+                             "file format of CONFIG, using at most MB mebibytes per process, defaults to %d, and "
+                             "copying variables in N processes" % (DEFAULT_MEMORY_BUDGET // (1024 * 1024)))
+    parser.add_argument('--subset', metavar='CUBE',
+                        help="create TARGET as a subset of the existing data cube CUBE given by --bbox, --time and "
+                             "--vars, copying variables in N processes")
+    parser.add_argument('--bbox', metavar='BBOX',
+                        help="bounding box <lon1>,<lat1>,<lon2>,<lat2> in degrees used by --subset, defaults to the "
+                             "grid of CUBE")
+    parser.add_argument('--time', metavar='TIME',
+                        help="time range <start>,<end> of dates YYYY-MM-DD used by --subset, all periods of the years "
+                             "intersecting it are copied, defaults to the time range of CUBE")
+    parser.add_argument('--vars', metavar='VARS',
+                        help="comma-separated variable names used by --subset, defaults to all variables of CUBE")
+    parser.add_argument('--align-chunks', action='store_true',
+                        help="extend the bounding box of --subset to chunk boundaries, so that all chunks are copied "
+                             "without recompressing them")
+    parser.add_argument('--verify', action='store_true',
+                        help="check the dimensions, time bounds, chunks and fill values of all variable files of "
+                             "TARGET in N processes, defaults to one per CPU, and write a report to TARGET/reports, "
+                             "exits with status 1 if errors are found")
+    parser.add_argument('--quick', action='store_true',
+                        help="let --verify read only file headers and chunk indexes instead of decompressing chunks")
+    parser.add_argument('--log-dir', metavar='DIR',
+                        help="directory for the log files of concurrently processed SOURCEs, "
+                             "defaults to TARGET/log")
     parser.add_argument('cube_dir', metavar='TARGET', nargs='?',
                         help="data cube root directory")
     parser.add_argument('cube_sources', metavar='SOURCE', nargs='*',
@@ -91,13 +351,111 @@ def main(args=None):
     cube_sources = args_obj.cube_sources
     source_provider_infos = []
     list_mode = args_obj.list
+    if args_obj.jobs < 1:
+        parser.error('N must be a positive integer')
+    if args_obj.max_sources < 1:
+        parser.error('M must be a positive integer')
+    if args_obj.max_open_files < 1:
+        parser.error('F must be a positive integer')
+    if args_obj.pipelined and args_obj.jobs > 1:
+        parser.error('--pipelined cannot be combined with --jobs')
+    if args_obj.worker and (args_obj.max_sources > 1 or args_obj.plan):
+        parser.error('--worker cannot be combined with --max-sources or --plan')
+    if args_obj.lock_timeout <= 0:
+        parser.error('--lock-timeout must be a positive number of seconds')
+    if args_obj.retries < 0:
+        parser.error('--retries must not be negative')
+    if args_obj.memory_budget is not None:
+        if args_obj.memory_budget < 1:
+            parser.error('MB must be a positive integer')
+        if not args_obj.rechunk and not args_obj.subset and (args_obj.pipelined or args_obj.jobs > 1):
+            parser.error('--memory-budget cannot be combined with --jobs or --pipelined')
+    profile_stages = None
+    if args_obj.profile:
+        profile_stages = 'all' if args_obj.profile == 'all' else args_obj.profile.split(',')
+        if profile_stages != 'all' and not set(profile_stages).issubset(STAGES):
+            parser.error('STAGES must be \'all\' or a subset of %s' % ', '.join(STAGES))
+    codec_candidates = args_obj.codecs.split(',')
+    try:
+        for codec in codec_candidates:
+            Codec.parse(codec)
+    except ValueError as e:
+        parser.error('CODECS: %s' % e)
+    if args_obj.update_time_series and args_obj.worker:
+        parser.error('--update-time-series cannot be combined with --worker, run it after all workers have finished')
+    if args_obj.update_overviews and args_obj.worker:
+        parser.error('--update-overviews cannot be combined with --worker, run it after all workers have finished')
+    if args_obj.select_codecs and args_obj.worker:
+        parser.error('--select-codecs cannot be combined with --worker, select codecs before starting the workers')
     if cube_config_file and not os.path.isfile(cube_config_file):
         parser.error('CONFIG file not found: %s' % cube_config_file)
+    if args_obj.quick and not args_obj.verify:
+        parser.error('--quick requires --verify')
+    if args_obj.verify:
+        if not cube_dir or cube_sources:
+            parser.error('--verify requires a TARGET directory and no SOURCEs')
+        if args_obj.worker or args_obj.plan or args_obj.rechunk or args_obj.subset or cube_config_file:
+            parser.error('--verify cannot be combined with --worker, --plan, --rechunk, --subset or --cube-conf')
+        if not os.path.isfile(os.path.join(cube_dir, 'cube.config')):
+            parser.error('TARGET is not a data cube: %s' % cube_dir)
+        # All CPUs are used unless -j is given
+        report = verify_cube(cube_dir, quick=args_obj.quick, jobs=args_obj.jobs if args_obj.jobs > 1 else None)
+        if report['num_errors']:
+            sys.exit(1)
+        return
+    if args_obj.rechunk:
+        if not cube_dir or cube_sources:
+            parser.error('--rechunk requires a TARGET directory and no SOURCEs')
+        if args_obj.worker or args_obj.plan or args_obj.pipelined:
+            parser.error('--rechunk cannot be combined with --worker, --plan or --pipelined')
+        if not os.path.isfile(os.path.join(args_obj.rechunk, 'cube.config')):
+            parser.error('CUBE is not a data cube: %s' % args_obj.rechunk)
+        if os.path.exists(cube_dir):
+            parser.error('TARGET directory must not exist')
+        memory_budget = DEFAULT_MEMORY_BUDGET
+        if args_obj.memory_budget is not None:
+            memory_budget = args_obj.memory_budget * 1024 * 1024
+        try:
+            rechunk_cube(args_obj.rechunk, cube_dir,
+                         target_config=CubeConfig.load(cube_config_file) if cube_config_file else None,
+                         memory_budget=memory_budget, jobs=args_obj.jobs)
+        except ValueError as e:
+            parser.error('--rechunk: %s' % e)
+        return
+    if args_obj.subset:
+        if not cube_dir or cube_sources:
+            parser.error('--subset requires a TARGET directory and no SOURCEs')
+        if args_obj.worker or args_obj.plan or args_obj.pipelined or args_obj.rechunk or cube_config_file:
+            parser.error('--subset cannot be combined with --worker, --plan, --pipelined, --rechunk or --cube-conf')
+        if not os.path.isfile(os.path.join(args_obj.subset, 'cube.config')):
+            parser.error('CUBE is not a data cube: %s' % args_obj.subset)
+        if os.path.exists(cube_dir):
+            parser.error('TARGET directory must not exist')
+        lon_range = lat_range = time_range = None
+        if args_obj.bbox:
+            try:
+                lon_1, lat_1, lon_2, lat_2 = [float(value) for value in args_obj.bbox.split(',')]
+            except ValueError:
+                parser.error('BBOX must be given as <lon1>,<lat1>,<lon2>,<lat2>')
+            lon_range, lat_range = (lon_1, lon_2), (lat_1, lat_2)
+        if args_obj.time:
+            try:
+                time_range = parse_time_range(args_obj.time)
+            except ValueError as e:
+                parser.error('TIME: %s' % e)
+        try:
+            subset_cube(args_obj.subset, cube_dir, var_names=args_obj.vars.split(',') if args_obj.vars else None,
+                        lon_range=lon_range, lat_range=lat_range, time_range=time_range,
+                        align_chunks=args_obj.align_chunks, jobs=args_obj.jobs)
+        except ValueError as e:
+            parser.error('--subset: %s' % e)
+        return
     if not cube_dir and (cube_config_file or cube_sources):
         parser.error('TARGET directory must be provided')
     if cube_dir:
         is_new = not os.path.exists(cube_dir) or not os.listdir(cube_dir)
-        if not is_new and cube_config_file:
+        # Workers started together all pass the configuration, but only one of them creates the cube
+        if not is_new and cube_config_file and not args_obj.worker:
             parser.error('TARGET directory must be empty')
         for source in cube_sources:
             source_name, source_args, source_kwargs, source_error_msg = _parse_source_arg(source)
@@ -126,15 +484,67 @@ def main(args=None):
                 cube_config = CubeConfig.load(cube_config_file)
             else:
                 cube_config = CubeConfig()
-            cube = Cube.create(cube_dir, cube_config)
+            if args_obj.plan:
+                # Don't create anything when planning
+                cube = Cube(cube_dir, cube_config)
+            elif args_obj.worker:
+                cube = _create_or_open_cube(cube_dir, cube_config)
+            else:
+                cube = Cube.create(cube_dir, cube_config)
         else:
             cube = Cube.open(cube_dir)
 
         source_providers = [cls(cube.config, *args, name=name, **kwargs)
                             for name, cls, args, kwargs in source_provider_infos]
 
-        for source_provider in source_providers:
-            cube.update(source_provider)
+        if args_obj.plan:
+            for source_provider in source_providers:
+                print(cube.plan(source_provider, resume=args_obj.resume).report())
+            return
+
+        if args_obj.select_codecs:
+            for source_provider in source_providers:
+                _select_codecs(cube, source_provider, codec_candidates)
+
+        update_kwargs = dict(jobs=args_obj.jobs, pipelined=args_obj.pipelined, resume=args_obj.resume,
+                             profile_stages=profile_stages, max_open_files=args_obj.max_open_files, reports=True)
+        if args_obj.memory_budget is not None:
+            update_kwargs.update(memory_budget=args_obj.memory_budget * 1024 * 1024)
+        if (args_obj.max_sources > 1 or args_obj.worker) and len(source_providers) > 1:
+            var_name_to_provider_name = dict()
+            for source_provider in source_providers:
+                for var_name in source_provider.variable_descriptors:
+                    if var_name in var_name_to_provider_name:
+                        parser.error("SOURCEs '%s' and '%s' both provide variable '%s' and cannot be processed "
+                                     "concurrently" % (var_name_to_provider_name[var_name], source_provider.name,
+                                                       var_name))
+                    var_name_to_provider_name[var_name] = source_provider.name
+        if args_obj.worker:
+            if cube.config.file_format == 'zarr':
+                parser.error('--worker requires a NetCDF cube, because the years of a Zarr variable share chunks')
+            queue_dir = args_obj.queue_dir or os.path.join(cube_dir, 'queue')
+            failed = _run_worker(cube, source_providers, update_kwargs, queue_dir, lock_timeout=args_obj.lock_timeout,
+                                 retries=args_obj.retries)
+            if failed:
+                print('error: %d work unit(s) failed: %s' % (len(failed), ', '.join(failed)))
+                sys.exit(1)
+        elif args_obj.max_sources > 1 and len(source_providers) > 1:
+            log_dir = args_obj.log_dir or os.path.join(cube_dir, 'log')
+            failed = _update_cube_concurrently(cube, source_providers, args_obj.max_sources, update_kwargs, log_dir)
+            if failed:
+                print('error: %d SOURCE(s) failed: %s' % (len(failed), ', '.join(failed)))
+                sys.exit(1)
+        else:
+            for source_provider in source_providers:
+                cube.update(source_provider, **update_kwargs)
+        if args_obj.update_time_series:
+            if not cube.config.time_series_chunks:
+                parser.error('--update-time-series requires time_series_chunks in the cube configuration')
+            cube.update_time_series()
+        if args_obj.update_overviews:
+            if not cube.config.overview_levels:
+                parser.error('--update-overviews requires overview_levels in the cube configuration')
+            cube.update_overviews()
 
 
 if __name__ == "__main__":
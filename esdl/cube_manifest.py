@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class CubeManifest:
+    """
+    Records which periods have been completely written to the variable files of a data cube, so that an interrupted
+    cube update can be resumed, see the *resume* parameter of :py:meth:`Cube.update`.
+
+    The manifest is the text file ``cube.manifest`` in the cube's base directory. Each line has the form
+    ``<var_name> <year> <time_index>``. Written periods are first recorded as *pending* for the file they have been
+    written to and are only appended to the manifest by :py:meth:`commit` after that file has been closed.
+
+    The manifest may be shared by several processes, e.g. ``cube-gen --max-sources`` or ``cube-gen --worker``
+    processes on different hosts. Each append is therefore done while holding the lock file ``cube.manifest.lock``,
+    which is created exclusively (``O_CREAT | O_EXCL``) like the lock files of :py:class:`esdl.cube_queue.WorkQueue`.
+    Lock files older than :py:attr:`LOCK_TIMEOUT` seconds are considered left by a crashed process and are removed.
+
+    :param base_dir: The data cube's base directory.
+    """
+
+    FILE_NAME = 'cube.manifest'
+
+    #: Seconds after which a manifest lock file is considered stale. Appends take milliseconds.
+    LOCK_TIMEOUT = 60.0
+
+    def __init__(self, base_dir: str):
+        self._path = os.path.join(base_dir, CubeManifest.FILE_NAME)
+        self._completed = None
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        """
+        The manifest's file path.
+        """
+        return self._path
+
+    def is_completed(self, var_name: str, year: int, time_index: int) -> bool:
+        """
+        Test whether the period given by *year* and *time_index* has been completely written for variable *var_name*.
+        """
+        with self._lock:
+            return (var_name, year, time_index) in self._get_completed()
+
+    def add_pending(self, file_key: str, var_name: str, year: int, time_index: int):
+        """
+        Record that the period given by *year* and *time_index* has been written for variable *var_name*
+        to the file identified by *file_key*.
+        """
+        with self._lock:
+            self._pending.setdefault(file_key, []).append((var_name, year, time_index))
+
+    def commit(self, file_key: str):
+        """
+        Append the pending periods of the file identified by *file_key* to the manifest.
+        Must be called after the file has been closed.
+        """
+        with self._lock:
+            entries = self._pending.pop(file_key, None)
+            if not entries:
+                return
+            with self._file_lock():
+                # Start a new line if the last one is incomplete
+                text = '' if self._ends_with_new_line() else '\n'
+                text += ''.join('%s %d %d\n' % entry for entry in entries)
+                with open(self._path, 'a') as fp:
+                    fp.write(text)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            self._get_completed().update(entries)
+
+    @contextmanager
+    def _file_lock(self):
+        lock_file = self._path + '.lock'
+        while True:
+            try:
+                os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                break
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(lock_file) > CubeManifest.LOCK_TIMEOUT:
+                    print('Warning: removing stale manifest lock \'%s\'' % lock_file)
+                    os.remove(lock_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.remove(lock_file)
+
+    def _ends_with_new_line(self) -> bool:
+        if not os.path.exists(self._path) or os.path.getsize(self._path) == 0:
+            return True
+        with open(self._path, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b'\n'
+
+    def _get_completed(self) -> set:
+        if self._completed is None:
+            completed = set()
+            if os.path.exists(self._path):
+                with open(self._path) as fp:
+                    for line in fp:
+                        parts = line.split()
+                        # Ignore incomplete lines, e.g. left by a process killed while writing
+                        if len(parts) == 3 and line.endswith('\n'):
+                            completed.add((parts[0], int(parts[1]), int(parts[2])))
+            self._completed = completed
+        return self._completed
@@ -0,0 +1,292 @@
+"""
+Timers and counters of the stages of cube generation, see :py:class:`CubeMetrics`.
+
+Cube source providers record the stages they perform in their **metrics** object, :py:meth:`Cube.update`
+records the stages performed by the cube and writes a generation report to the cube's ``reports`` directory.
+"""
+
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+#: The stages recorded by the cube and by the providers of this package:
+#: *open* opens a source file, *read* reads a source image or window, *transform* calls a provider's
+#: **transform_source_image()**, *aggregate* aggregates source images in time, *resample* resamples an image
+#: in space, *compute* computes all variable images of a period, *write* puts an image or tile into a variable
+#: file and *close* flushes buffered images and closes a variable file.
+STAGES = ('open', 'read', 'transform', 'aggregate', 'resample', 'compute', 'write', 'close')
+
+
+class StageMetrics:
+    """
+    The accumulated timing and throughput of a single stage. All times are given in seconds.
+
+    :param name: The stage's name.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        #: Number of times the stage has been performed
+        self.count = 0
+        #: Total time spent in the stage
+        self.seconds = 0.0
+        #: Minimum time spent in the stage
+        self.min_seconds = None
+        #: Maximum time spent in the stage
+        self.max_seconds = None
+        #: Number of bytes read or written by the stage
+        self.bytes = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        """
+        The mean time spent in the stage.
+        """
+        return self.seconds / self.count if self.count else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        """
+        The stage's throughput in bytes per second.
+        """
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def add(self, seconds: float, num_bytes: int = 0, count: int = 1):
+        self.count += count
+        self.seconds += seconds
+        self.min_seconds = seconds if self.min_seconds is None else min(self.min_seconds, seconds)
+        self.max_seconds = seconds if self.max_seconds is None else max(self.max_seconds, seconds)
+        self.bytes += num_bytes
+
+    def merge(self, stage_dict: dict):
+        """
+        Add the values of *stage_dict* as returned by :py:meth:`to_dict`.
+        """
+        if not stage_dict['count']:
+            return
+        self.count += stage_dict['count']
+        self.seconds += stage_dict['seconds']
+        for name, select in (('min_seconds', min), ('max_seconds', max)):
+            value = getattr(self, name)
+            setattr(self, name, stage_dict[name] if value is None else select(value, stage_dict[name]))
+        self.bytes += stage_dict['bytes']
+
+    def to_dict(self) -> dict:
+        return OrderedDict([('count', self.count),
+                            ('seconds', self.seconds),
+                            ('mean_seconds', self.mean_seconds),
+                            ('min_seconds', self.min_seconds),
+                            ('max_seconds', self.max_seconds),
+                            ('bytes', self.bytes),
+                            ('bytes_per_second', self.bytes_per_second)])
+
+
+class CubeMetrics:
+    """
+    Collects timers and counters of the stages of cube generation. Safe to be shared by several threads.
+
+    Each time a stage is performed an event is emitted as a JSON object, which has the keys ``stage``,
+    ``time`` (the end time in seconds since the epoch), ``seconds``, ``bytes`` and the additional fields
+    passed to :py:meth:`timer`. Events are written to *events_file*, one per line, or kept in memory if
+    *buffer_events* is true, see :py:meth:`pop`.
+
+    If *profile_dir* is given, the stages in *profile_stages* are also profiled using :py:mod:`cProfile` and a
+    profile per stage is dumped to ``<profile_dir>/<profile_prefix><stage>.prof`` by :py:meth:`close`.
+    A thread profiles only one stage at a time, stages performed while an enclosing stage is profiled are
+    included in the profile of the enclosing stage.
+
+    :param events_file: A file to which events are appended as JSON lines.
+    :param buffer_events: Whether events are kept in memory if no *events_file* is given.
+    :param profile_dir: The directory to which profiles are dumped.
+    :param profile_stages: The stages to be profiled, defaults to all stages.
+    :param profile_prefix: A prefix for the names of the profile files.
+    """
+
+    def __init__(self, events_file: str = None, buffer_events: bool = False, profile_dir: str = None,
+                 profile_stages=None, profile_prefix: str = ''):
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()
+        self._counters = OrderedDict()
+        self._events_fp = open(events_file, 'a') if events_file else None
+        self._events = [] if buffer_events and not events_file else None
+        self._profile_dir = profile_dir
+        self._profile_stages = set(profile_stages) if profile_stages else None
+        self._profile_prefix = profile_prefix
+        self._profiles = dict()
+        self._profiling = threading.local()
+
+    def __getstate__(self):
+        # Locks, files and profiles cannot be pickled, copies only collect timers and counters.
+        state = self.__dict__.copy()
+        state.update(_lock=None, _events_fp=None, _events=None, _profile_dir=None, _profiles=dict(),
+                     _profiling=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._profiling = threading.local()
+
+    @property
+    def stages(self) -> OrderedDict:
+        """
+        The mapping of stage names to :py:class:`StageMetrics` in the order in which stages were first performed.
+        """
+        return self._stages
+
+    @property
+    def counters(self) -> OrderedDict:
+        """
+        The mapping of counter names to values.
+        """
+        return self._counters
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        """
+        Return a context manager that records the time spent in its block as one performance of *stage*.
+        The context manager yields a dictionary to which the block may add fields of the emitted event,
+        the number of bytes read or written by the stage is passed as ``bytes``.
+
+        :param stage: The stage name, usually one of :py:data:`STAGES`.
+        :param fields: Additional fields of the emitted event.
+        """
+        profile = self._start_profile(stage)
+        t1 = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            seconds = time.perf_counter() - t1
+            if profile is not None:
+                profile.disable()
+                self._profiling.active = False
+            self.add(stage, seconds, **fields)
+
+    def add(self, stage: str, seconds: float, bytes: int = 0, **fields):
+        """
+        Record one performance of *stage* which took *seconds* and read or wrote *bytes*.
+        """
+        with self._lock:
+            stage_metrics = self._stages.get(stage)
+            if stage_metrics is None:
+                stage_metrics = self._stages[stage] = StageMetrics(stage)
+            stage_metrics.add(seconds, bytes)
+            if self._events_fp is not None or self._events is not None:
+                event = OrderedDict([('stage', stage), ('time', time.time()), ('seconds', seconds),
+                                     ('bytes', bytes)])
+                event.update(fields)
+                self._emit(event)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increment the counter *name* by *value*.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def pop(self) -> dict:
+        """
+        Return the collected timers, counters and buffered events as dictionary and reset them.
+        The result can be passed to the :py:meth:`merge` method of another instance, e.g. to collect
+        the metrics of worker processes.
+        """
+        with self._lock:
+            metrics_dict = self._to_dict()
+            metrics_dict['events'] = self._events or []
+            self._stages = OrderedDict()
+            self._counters = OrderedDict()
+            if self._events is not None:
+                self._events = []
+            return metrics_dict
+
+    def merge(self, metrics_dict: dict):
+        """
+        Add the timers, counters and events of *metrics_dict* as returned by :py:meth:`pop`.
+        """
+        with self._lock:
+            for stage, stage_dict in metrics_dict['stages'].items():
+                stage_metrics = self._stages.get(stage)
+                if stage_metrics is None:
+                    stage_metrics = self._stages[stage] = StageMetrics(stage)
+                stage_metrics.merge(stage_dict)
+            for name, value in metrics_dict['counters'].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for event in metrics_dict.get('events', []):
+                self._emit(event)
+
+    def to_dict(self) -> dict:
+        """
+        Return the collected timers and counters as dictionary.
+        """
+        with self._lock:
+            return self._to_dict()
+
+    def report(self) -> str:
+        """
+        Return a human-readable table of the collected timers and counters.
+        """
+        lines = ['%-10s %8s %12s %12s %12s %12s' % ('stage', 'count', 'seconds', 'mean', 'MiB', 'MiB/s')]
+        for stage_metrics in list(self._stages.values()):
+            lines.append('%-10s %8d %12.3f %12.6f %12.1f %12.1f' % (stage_metrics.name,
+                                                                    stage_metrics.count,
+                                                                    stage_metrics.seconds,
+                                                                    stage_metrics.mean_seconds,
+                                                                    stage_metrics.bytes / (1024 * 1024),
+                                                                    stage_metrics.bytes_per_second / (1024 * 1024)))
+        for name, value in list(self._counters.items()):
+            lines.append('%s: %s' % (name, value))
+        return '\n'.join(lines)
+
+    def write_report(self, report_file: str, **info):
+        """
+        Write the collected timers and counters together with *info* to *report_file* as JSON object.
+        """
+        report = OrderedDict(info)
+        report.update(self.to_dict())
+        with open(report_file, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    def close(self):
+        """
+        Close the events file and dump the profiles. Events emitted afterwards are discarded.
+        """
+        with self._lock:
+            if self._events_fp is not None:
+                self._events_fp.close()
+                self._events_fp = None
+            profiles = self._profiles
+            self._profiles = dict()
+        for stage, profile in profiles.items():
+            profile.dump_stats(os.path.join(self._profile_dir, '%s%s.prof' % (self._profile_prefix, stage)))
+
+    def _to_dict(self):
+        return OrderedDict([('stages', OrderedDict((stage, stage_metrics.to_dict())
+                                                   for stage, stage_metrics in self._stages.items())),
+                            ('counters', OrderedDict(self._counters))])
+
+    def _emit(self, event):
+        if self._events_fp is not None:
+            self._events_fp.write(json.dumps(event) + '\n')
+        elif self._events is not None:
+            self._events.append(event)
+
+    def _start_profile(self, stage):
+        if self._profile_dir is None or (self._profile_stages is not None and stage not in self._profile_stages):
+            return None
+        if getattr(self._profiling, 'active', False):
+            return None
+        with self._lock:
+            profile = self._profiles.get(stage)
+            if profile is None:
+                profile = self._profiles[stage] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, e.g. in another thread on Python >= 3.12
+            return None
+        self._profiling.active = True
+        return profile
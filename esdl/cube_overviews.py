@@ -0,0 +1,244 @@
+"""
+The overview levels of a cube, downsampled copies of each variable for quick looks and dashboards, see the
+*overview_levels* parameter of :py:class:`CubeConfig`.
+
+Overview level *n* of a variable has a spatial resolution 2^n times coarser than the variable's data. Level 1 is
+downsampled from the data in ``TARGET/data``, every further level from the previous one, period by period, using the
+variable's ``ds_method`` attribute, 'MEAN' or 'MODE', the way source images are downsampled by cube providers.
+Each level is kept in ``TARGET/overviews/<var_name>``, chunked by whole maps of single periods, and is only valid as
+long as it is newer than all of the variable's files, see :py:func:`is_overview_current`.
+:py:class:`CubeDataAccess` reads from the level given by the *level* or *max_shape* arguments of its methods.
+"""
+
+import glob
+import math
+import os
+import shutil
+import time
+
+import netCDF4
+import numpy
+
+from .cube_config import CubeConfig
+from .cube_timeseries import get_newest_mtime
+from .cube_writer import INCOMPLETE_ATTR_NAME, ZarrVariableView
+
+#: The directory of the overview levels within the cube's base directory.
+OVERVIEWS_DIR = 'overviews'
+
+
+def get_overview_path(base_dir: str, var_name: str, level: int, file_format: str) -> str:
+    """
+    Return the path of overview *level* of variable *var_name*, a Zarr group for 'zarr' cubes and a NetCDF4 file
+    otherwise.
+    """
+    if file_format == 'zarr':
+        return os.path.join(base_dir, OVERVIEWS_DIR, var_name, '%d' % level)
+    return os.path.join(base_dir, OVERVIEWS_DIR, var_name, '%d.nc' % level)
+
+
+def get_overview_shape(height: int, width: int, level: int):
+    """
+    Return the (lat, lon) shape of overview *level* of a variable whose images have the given *height* and *width*.
+    """
+    factor = 2 ** level
+    return int(math.ceil(height / factor)), int(math.ceil(width / factor))
+
+
+def is_overview_current(base_dir: str, var_name: str, level: int, file_format: str) -> bool:
+    """
+    Test whether overview *level* of variable *var_name* exists and is newer than all of its files in
+    ``TARGET/data``.
+    """
+    path = get_overview_path(base_dir, var_name, level, file_format)
+    if not os.path.exists(path):
+        return False
+    return os.path.getmtime(path) >= get_newest_mtime(os.path.join(base_dir, 'data', var_name))
+
+
+def downsample_image(image, height: int, width: int, ds_method: str = 'MEAN'):
+    """
+    Downsample *image* to the given *height* and *width* using the gridtools downsampling method *ds_method*,
+    'MEAN' or 'MODE'. Masked and NaN values are ignored.
+
+    :return: A masked array.
+    """
+    import gridtools.resampling as gtr
+
+    image = numpy.ma.masked_invalid(numpy.ma.asarray(image, dtype=numpy.float64))
+    image = gtr.resample_2d(image, width, height, ds_method=gtr.__dict__['DS_' + ds_method], fill_value=numpy.nan)
+    return numpy.ma.masked_invalid(image)
+
+
+def write_overviews(base_dir: str, cube_config: CubeConfig, var_name: str) -> list:
+    """
+    Write the overview levels of variable *var_name* from its files in ``TARGET/data``, replacing existing levels.
+    The levels are written to temporary paths first and then renamed, so readers never see partial levels.
+
+    :param base_dir: The cube's base directory.
+    :param cube_config: The cube's configuration, its *overview_levels* must be given.
+    :param var_name: The variable name.
+    :return: The paths of the levels.
+    """
+    if not cube_config.overview_levels:
+        raise ValueError('cube configuration has no overview_levels')
+    levels = range(1, cube_config.overview_levels + 1)
+    paths = [get_overview_path(base_dir, var_name, level, cube_config.file_format) for level in levels]
+    os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+    temp_paths = [path + '.tmp' for path in paths]
+    for temp_path in temp_paths:
+        _remove(temp_path)
+    if cube_config.file_format == 'zarr':
+        _write_zarr_overviews(base_dir, cube_config, var_name, temp_paths)
+    else:
+        _write_netcdf_overviews(base_dir, cube_config, var_name, temp_paths)
+    # Levels must be newer than the files they have been downsampled from, also on file systems with coarse mtimes
+    now = max(time.time(), get_newest_mtime(os.path.join(base_dir, 'data', var_name)))
+    for path, temp_path in zip(paths, temp_paths):
+        _remove(path)
+        os.rename(temp_path, path)
+        os.utime(path, (now, now))
+    return paths
+
+
+def _write_netcdf_overviews(base_dir, cube_config, var_name, paths):
+    time_axis = cube_config.time_axis
+    year_files = []
+    for file in sorted(glob.glob(os.path.join(base_dir, 'data', var_name, '*_%s.nc' % var_name))):
+        year = int(os.path.basename(file)[:4])
+        if time_axis.start_year <= year <= time_axis.end_year:
+            year_files.append((time_axis.get_global_index(year, 0), file))
+    if not year_files:
+        raise ValueError('variable %s has no data' % var_name)
+
+    # Overviews require NetCDF4 chunks, also for NetCDF3 cubes
+    file_format = cube_config.file_format if cube_config.file_format.startswith('NETCDF4') else 'NETCDF4_CLASSIC'
+    datasets = []
+    try:
+        with netCDF4.Dataset(year_files[0][1]) as first_dataset:
+            source_variable = first_dataset.variables[var_name]
+            ds_method = getattr(source_variable, 'ds_method', 'MEAN')
+            for level, path in enumerate(paths, 1):
+                datasets.append(_create_netcdf_level(path, file_format, cube_config, first_dataset, var_name, level))
+        for time_offset, file in year_files:
+            with netCDF4.Dataset(file) as source_dataset:
+                source_variable = source_dataset.variables[var_name]
+                for time_index in range(source_variable.shape[0]):
+                    image = source_variable[time_index]
+                    if numpy.ma.getmaskarray(image).all():
+                        continue
+                    for dataset in datasets:
+                        variable = dataset.variables[var_name]
+                        image = downsample_image(image, variable.shape[1], variable.shape[2], ds_method)
+                        variable[time_offset + time_index] = image
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+
+def _create_netcdf_level(path, file_format, cube_config, source_dataset, var_name, level):
+    time_axis = cube_config.time_axis
+    source_variable = source_dataset.variables[var_name]
+    _, source_height, source_width = source_variable.shape
+    height, width = get_overview_shape(source_height, source_width, level)
+    lon_bnds, lat_bnds = _get_level_bounds(source_dataset.variables['lon_bnds'][0, 0],
+                                           source_dataset.variables['lat_bnds'][0, 1],
+                                           cube_config.spatial_res * 2 ** level, height, width)
+
+    dataset = netCDF4.Dataset(path, 'w', format=file_format)
+    dataset.setncatts({name: source_dataset.getncattr(name) for name in source_dataset.ncattrs()
+                       if name != INCOMPLETE_ATTR_NAME})
+    dataset.spatial_res = '%s degrees' % (cube_config.spatial_res * 2 ** level)
+    dataset.createDimension('bnds', 2)
+    dataset.createDimension('time', time_axis.size)
+    dataset.createDimension('lat', height)
+    dataset.createDimension('lon', width)
+
+    var_time_bnds = dataset.createVariable('time_bnds', 'f8', ('time', 'bnds'), fill_value=-9999.0)
+    var_time_bnds.setncatts(_get_attrs(source_dataset.variables['time_bnds']))
+    var_time_bnds[:, :] = numpy.stack([time_axis.lower_bounds, time_axis.upper_bounds], axis=1)
+    var_time = dataset.createVariable('time', 'f8', ('time',), fill_value=-9999.0)
+    var_time.setncatts(_get_attrs(source_dataset.variables['time']))
+    var_time[:] = time_axis.times
+    for name, bnds in (('lon', lon_bnds), ('lat', lat_bnds)):
+        var_coord = dataset.createVariable(name, 'f4', (name,))
+        var_coord.setncatts(_get_attrs(source_dataset.variables[name]))
+        var_coord[:] = bnds.mean(axis=1)
+        var_coord_bnds = dataset.createVariable(name + '_bnds', 'f4', (name, 'bnds'))
+        var_coord_bnds.setncatts(_get_attrs(source_dataset.variables[name + '_bnds']))
+        var_coord_bnds[:, :] = bnds
+
+    fill_value = getattr(source_variable, '_FillValue', None)
+    variable = dataset.createVariable(var_name, source_variable.dtype, ('time', 'lat', 'lon'),
+                                      fill_value=fill_value, chunksizes=(1, height, width),
+                                      **cube_config.get_codec(var_name).get_netcdf_kwargs(file_format))
+    variable.setncatts(_get_attrs(source_variable))
+    return dataset
+
+
+def _write_zarr_overviews(base_dir, cube_config, var_name, paths):
+    import zarr
+
+    source_group = zarr.open_group(os.path.join(base_dir, 'data', var_name), mode='r')
+    source_array = source_group[var_name]
+    time_size, source_height, source_width = source_array.shape
+    source_variable = ZarrVariableView(source_array, 0, time_size)
+    ds_method = source_array.attrs.get('ds_method', 'MEAN')
+
+    groups = []
+    variables = []
+    for level, path in enumerate(paths, 1):
+        height, width = get_overview_shape(source_height, source_width, level)
+        lon_bnds, lat_bnds = _get_level_bounds(source_group['lon_bnds'][0, 0], source_group['lat_bnds'][0, 1],
+                                               cube_config.spatial_res * 2 ** level, height, width)
+        group = zarr.open_group(path, mode='w')
+        group.attrs.update(source_group.attrs.asdict())
+        group.attrs['spatial_res'] = '%s degrees' % (cube_config.spatial_res * 2 ** level)
+        for name in ('time', 'time_bnds'):
+            source_coord_array = source_group[name]
+            coord_array = group.create_dataset(name, data=source_coord_array[...], chunks=source_coord_array.chunks,
+                                               fill_value=source_coord_array.fill_value)
+            coord_array.attrs.update(source_coord_array.attrs.asdict())
+        for name, bnds in (('lon', lon_bnds), ('lat', lat_bnds)):
+            coord_array = group.create_dataset(name, data=bnds.mean(axis=1).astype(numpy.float32))
+            coord_array.attrs.update(source_group[name].attrs.asdict())
+            coord_bnds_array = group.create_dataset(name + '_bnds', data=bnds.astype(numpy.float32))
+            coord_bnds_array.attrs.update(source_group[name + '_bnds'].attrs.asdict())
+        array = group.create_dataset(var_name, shape=(time_size, height, width), chunks=(1, height, width),
+                                     dtype=source_array.dtype, fill_value=source_array.fill_value,
+                                     compressor=source_array.compressor, filters=source_array.filters)
+        array.attrs.update(source_array.attrs.asdict())
+        groups.append(group)
+        variables.append(ZarrVariableView(array, 0, time_size))
+
+    for time_index in range(time_size):
+        image = source_variable[time_index]
+        if numpy.ma.getmaskarray(image).all():
+            # Unwritten periods are left unwritten
+            continue
+        for variable in variables:
+            image = downsample_image(image, variable.shape[1], variable.shape[2], ds_method)
+            variable[time_index] = image
+    if hasattr(zarr, 'consolidate_metadata'):
+        for group in groups:
+            zarr.consolidate_metadata(group.store)
+
+
+def _get_level_bounds(lon_0, lat_0, spatial_res, height, width):
+    """
+    Return the (lon, bnds) and (lat, bnds) bounds of a level grid whose upper left corner is (*lon_0*, *lat_0*).
+    """
+    lon = float(lon_0) + numpy.arange(width) * spatial_res
+    lat = float(lat_0) - numpy.arange(height) * spatial_res
+    return numpy.stack([lon, lon + spatial_res], axis=1), numpy.stack([lat - spatial_res, lat], axis=1)
+
+
+def _get_attrs(variable):
+    return {name: variable.getncattr(name) for name in variable.ncattrs() if name != '_FillValue'}
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,233 @@
+"""
+A three-stage pipeline used by pipelined cube updates, see the *pipelined* parameter of :py:meth:`Cube.update`.
+
+The stages run concurrently:
+
+* a *read* thread calls the provider's **read_period_sources()** for period k + 1,
+* a *compute* thread calls the provider's **compute_period_images()** for period k,
+* the consumer of the pipeline (the *write* stage) writes the images of period k - 1.
+
+Stages are connected by bounded queues. The read and write stages share a lock, so that source and target
+files are never accessed concurrently by the (not necessarily thread-safe) NetCDF/HDF5 libraries. Providers
+whose **has_read_stage** property is false read their sources while computing images, so for them the compute
+stage holds the lock too.
+"""
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+#: Marks the end of the items passed through a queue.
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class _Stopped(Exception):
+    pass
+
+
+class StageStats:
+    """
+    Timing and queue statistics of a single pipeline stage. All times are given in seconds.
+
+    :param name: The stage's name.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        #: Number of items processed
+        self.count = 0
+        #: Time spent processing items
+        self.busy_time = 0.0
+        #: Time spent waiting for an item from the previous stage
+        self.input_stall_time = 0.0
+        #: Time spent waiting for free space in the queue to the next stage
+        self.output_stall_time = 0.0
+        #: Time spent waiting for the I/O lock
+        self.io_wait_time = 0.0
+        #: Maximum number of items found in the stage's output queue after putting an item
+        self.max_queue_depth = 0
+        self._queue_depth_sum = 0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        """
+        The mean number of items found in the stage's output queue after putting an item.
+        """
+        return self._queue_depth_sum / self.count if self.count else 0.0
+
+    def add_queue_depth(self, depth: int):
+        self._queue_depth_sum += depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def to_dict(self) -> dict:
+        return OrderedDict([('count', self.count),
+                            ('busy_time', self.busy_time),
+                            ('input_stall_time', self.input_stall_time),
+                            ('output_stall_time', self.output_stall_time),
+                            ('io_wait_time', self.io_wait_time),
+                            ('max_queue_depth', self.max_queue_depth),
+                            ('mean_queue_depth', self.mean_queue_depth)])
+
+
+class PeriodPipeline:
+    """
+    Computes the images of the given target periods using a read, a compute and a write stage that run concurrently.
+    Iterating the pipeline yields (target_time, var_name_to_image) pairs in the order of *target_times*.
+    The loop body which consumes the pairs is the write stage and is executed while holding the I/O lock.
+
+    :param provider: A prepared cube source provider.
+    :param target_times: A sequence of target periods (time_index, period_start, period_end).
+    :param queue_size: The maximum number of items waiting in each of the queues between the stages.
+    """
+
+    def __init__(self, provider, target_times, queue_size: int = 2):
+        if queue_size < 1:
+            raise ValueError('queue_size must be a positive integer')
+        self._provider = provider
+        self._target_times = target_times
+        self._read_queue = queue.Queue(maxsize=queue_size)
+        self._image_queue = queue.Queue(maxsize=queue_size)
+        self._io_lock = threading.Lock()
+        self._compute_locked = not provider.has_read_stage
+        self._stop_event = threading.Event()
+        self._stats = OrderedDict([(name, StageStats(name)) for name in ('read', 'compute', 'write')])
+
+    @property
+    def stats(self) -> OrderedDict:
+        """
+        A mapping from stage names 'read', 'compute', 'write' to :py:class:`StageStats` instances.
+        """
+        return self._stats
+
+    def __iter__(self):
+        threads = [threading.Thread(target=self._run_read_stage, name='read'),
+                   threading.Thread(target=self._run_compute_stage, name='compute')]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        stats = self._stats['write']
+        try:
+            while True:
+                t0 = time.time()
+                item = self._image_queue.get()
+                t1 = time.time()
+                stats.input_stall_time += t1 - t0
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                with self._io_lock:
+                    t2 = time.time()
+                    stats.io_wait_time += t2 - t1
+                    yield item
+                    stats.busy_time += time.time() - t2
+                stats.count += 1
+        finally:
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self) -> str:
+        """
+        Return a human-readable table of the stage statistics.
+        The stage with the largest busy time is the pipeline's bottleneck.
+        """
+        lines = ['%-8s %6s %10s %12s %13s %10s %9s %10s' % ('stage', 'items', 'busy[s]', 'in-stall[s]',
+                                                            'out-stall[s]', 'io-wait[s]', 'max-queue',
+                                                            'mean-queue')]
+        for stats in self._stats.values():
+            lines.append('%-8s %6d %10.3f %12.3f %13.3f %10.3f %9d %10.2f' % (stats.name, stats.count,
+                                                                             stats.busy_time,
+                                                                             stats.input_stall_time,
+                                                                             stats.output_stall_time,
+                                                                             stats.io_wait_time,
+                                                                             stats.max_queue_depth,
+                                                                             stats.mean_queue_depth))
+        bottleneck = max(self._stats.values(), key=lambda s: s.busy_time)
+        lines.append('bottleneck: %s' % bottleneck.name)
+        return '\n'.join(lines)
+
+    def _run_read_stage(self):
+        stats = self._stats['read']
+        try:
+            for target_time in self._target_times:
+                if self._stop_event.is_set():
+                    return
+                _, period_start, period_end = target_time
+                t0 = time.time()
+                with self._io_lock:
+                    t1 = time.time()
+                    period_sources = self._provider.read_period_sources(period_start, period_end)
+                t2 = time.time()
+                stats.io_wait_time += t1 - t0
+                stats.busy_time += t2 - t1
+                stats.count += 1
+                self._put(self._read_queue, (target_time, period_sources), stats)
+            self._put(self._read_queue, _END, None)
+        except _Stopped:
+            pass
+        except BaseException as error:
+            self._put_failure(self._read_queue, error)
+
+    def _run_compute_stage(self):
+        stats = self._stats['compute']
+        try:
+            while True:
+                t0 = time.time()
+                item = self._get(self._read_queue)
+                t1 = time.time()
+                stats.input_stall_time += t1 - t0
+                if item is _END or isinstance(item, _Failure):
+                    self._put(self._image_queue, item, None)
+                    return
+                target_time, period_sources = item
+                if self._compute_locked:
+                    with self._io_lock:
+                        t2 = time.time()
+                        stats.io_wait_time += t2 - t1
+                        var_name_to_image = self._provider.compute_period_images(period_sources)
+                else:
+                    t2 = t1
+                    var_name_to_image = self._provider.compute_period_images(period_sources)
+                stats.busy_time += time.time() - t2
+                stats.count += 1
+                self._put(self._image_queue, (target_time, var_name_to_image), stats)
+        except _Stopped:
+            pass
+        except BaseException as error:
+            self._put_failure(self._image_queue, error)
+
+    def _get(self, q):
+        while True:
+            if self._stop_event.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _put(self, q, item, stats):
+        t0 = time.time()
+        while True:
+            if self._stop_event.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if stats is not None:
+            stats.output_stall_time += time.time() - t0
+            stats.add_queue_depth(q.qsize())
+
+    def _put_failure(self, q, error):
+        try:
+            self._put(q, _Failure(error), None)
+        except _Stopped:
+            pass
@@ -0,0 +1,193 @@
+"""
+Dry-run planning of cube updates, see :py:meth:`Cube.plan`.
+
+Memory estimates assume that source images are read as masked arrays (one mask byte per pixel) and that
+aggregated and resampled images are masked float64 arrays. They follow the processing order of
+:py:class:`NetCDFCubeSourceProvider`: the variables are computed one after the other, the source images of a
+variable are read one at a time while they are aggregated by an :py:class:`esdl.util.ImageAggregator` keeping
+two float64 arrays, and the computed images of all variables are kept until the period has been written.
+"""
+
+from collections import OrderedDict
+
+import numpy
+
+#: The supported resampling orders.
+RESAMPLING_ORDERS = ('time_first', 'space_first')
+
+#: Bytes per pixel of a masked float64 image.
+_RESULT_PIXEL_SIZE = numpy.dtype(numpy.float64).itemsize + 1
+
+#: Bytes per pixel of the sum and weight arrays of an image aggregator.
+_AGGREGATOR_PIXEL_SIZE = 2 * numpy.dtype(numpy.float64).itemsize
+
+
+def _get_work_memory(resampling_order, num_images, source_pixels, item_size, target_pixels):
+    """
+    Return the memory required to compute a variable from *num_images* source images besides its result, which is
+    one source image and, if there are multiple source images, the aggregator and the aggregated image.
+    """
+    work_memory = source_pixels * (item_size + 1)
+    if num_images > 1:
+        if resampling_order == 'space_first':
+            # The resampled source image, the aggregator and the aggregated image have the target size
+            work_memory += target_pixels * (_RESULT_PIXEL_SIZE + _AGGREGATOR_PIXEL_SIZE)
+        else:
+            work_memory += source_pixels * (_AGGREGATOR_PIXEL_SIZE + _RESULT_PIXEL_SIZE)
+    return work_memory
+
+
+class PeriodPlan:
+    """
+    The estimated costs of computing a single target period.
+
+    :param target_time: The target period (time_index, period_start, period_end).
+    :param planned_sources: The provider's planned source images, see
+           :py:meth:`CubeSourceProvider.plan_period_sources`, or ``None`` if unknown.
+    :param target_pixels: The number of pixels of a target image.
+    """
+
+    def __init__(self, target_time, planned_sources, target_pixels: int):
+        self.time_index, self.period_start, self.period_end = target_time
+        #: Whether the provider described its source images
+        self.known = planned_sources is not None
+        planned_sources = planned_sources or []
+        #: Number of distinct source time ranges used
+        self.num_sources = len(set(source[1] for source in planned_sources))
+        #: Number of source images read, i.e. over all variables
+        self.num_images = len(planned_sources)
+        #: Number of bytes read, 0 if image shapes are unknown
+        self.read_bytes = 0
+        #: Estimated peak memory for each resampling order in bytes
+        self.peak_memory = OrderedDict()
+        var_name_to_sources = OrderedDict()
+        for var_name, _, image_shape, dtype in planned_sources:
+            var_name_to_sources.setdefault(var_name, []).append((image_shape, dtype))
+        #: Names of the variables for which images are computed
+        self.var_names = list(var_name_to_sources.keys())
+
+        work_memory = {order: 0 for order in RESAMPLING_ORDERS}
+        for var_sources in var_name_to_sources.values():
+            num_images = len(var_sources)
+            max_source_pixels = 0
+            max_source_item_size = 0
+            for image_shape, dtype in var_sources:
+                if image_shape is None or dtype is None:
+                    continue
+                pixels = int(numpy.prod(image_shape))
+                item_size = numpy.dtype(dtype).itemsize
+                self.read_bytes += pixels * item_size
+                max_source_pixels = max(max_source_pixels, pixels)
+                max_source_item_size = max(max_source_item_size, item_size)
+            for order in RESAMPLING_ORDERS:
+                work_memory[order] = max(work_memory[order],
+                                         _get_work_memory(order, num_images, max_source_pixels,
+                                                          max_source_item_size, target_pixels))
+        result_memory = len(var_name_to_sources) * target_pixels * _RESULT_PIXEL_SIZE
+        for order in RESAMPLING_ORDERS:
+            self.peak_memory[order] = work_memory[order] + result_memory
+
+
+class UpdatePlan:
+    """
+    The estimated I/O and memory costs of updating a cube with a source provider, computed without reading
+    any pixel data. Use :py:meth:`Cube.plan` to create instances.
+
+    :param provider: A prepared cube source provider.
+    :param target_times: The target periods (time_index, period_start, period_end) to be updated.
+    :param cube_config: The cube's configuration.
+    """
+
+    def __init__(self, provider, target_times, cube_config):
+        self._provider_name = provider.name
+        self._resampling_order = getattr(provider, 'resampling_order', None)
+        _, _, image_width, image_height = provider.spatial_coverage
+        target_pixels = image_width * image_height
+        var_names = list(provider.variable_descriptors.keys())
+        self._periods = []
+        self._output_files = set()
+        for target_time in target_times:
+            period_plan = PeriodPlan(target_time, provider.plan_period_sources(target_time[1], target_time[2]),
+                                     target_pixels)
+            self._periods.append(period_plan)
+            written_var_names = period_plan.var_names if period_plan.known else var_names
+            if period_plan.known and not period_plan.num_sources:
+                # No images are computed, so nothing is written
+                continue
+            for var_name in written_var_names:
+                if cube_config.file_format == 'zarr':
+                    self._output_files.add(var_name)
+                else:
+                    self._output_files.add('%04d_%s.nc' % (target_time[1].year, var_name))
+
+    @property
+    def periods(self) -> list:
+        """
+        The list of :py:class:`PeriodPlan` instances, one for each target period.
+        """
+        return self._periods
+
+    @property
+    def known(self) -> bool:
+        """
+        Whether the provider described the source images of all periods.
+        """
+        return all(period.known for period in self._periods)
+
+    @property
+    def total_read_bytes(self) -> int:
+        """
+        The total number of bytes read from source images.
+        """
+        return sum(period.read_bytes for period in self._periods)
+
+    @property
+    def num_output_files(self) -> int:
+        """
+        The number of output files touched, for Zarr cubes the number of variable arrays.
+        """
+        return len(self._output_files)
+
+    def get_peak_memory(self, resampling_order: str) -> int:
+        """
+        Return the estimated peak memory of computing a single period using the given *resampling_order*.
+        """
+        return max([period.peak_memory.get(resampling_order, 0) for period in self._periods] or [0])
+
+    def report(self) -> str:
+        """
+        Return a human-readable summary and a table of the planned periods.
+        """
+        lines = ['%s: %d period(s)' % (self._provider_name, len(self._periods))]
+        if not self.known:
+            lines.append('source images unknown for %d period(s), estimates are incomplete' %
+                         sum(1 for period in self._periods if not period.known))
+        lines.append('source images read: %d' % sum(period.num_images for period in self._periods))
+        lines.append('total bytes to read: %s' % _format_bytes(self.total_read_bytes))
+        for order in RESAMPLING_ORDERS:
+            lines.append('peak memory per period (%s): %s%s' % (order, _format_bytes(self.get_peak_memory(order)),
+                                                                ' (current)' if order == self._resampling_order
+                                                                else ''))
+        lines.append('output files touched: %d' % self.num_output_files)
+        lines.append('%-6s %-19s %-19s %7s %7s %10s %12s %12s' % ('index', 'period start', 'period end', 'sources',
+                                                                  'images', 'read', 'time_first', 'space_first'))
+        for period in self._periods:
+            lines.append('%-6d %-19s %-19s %7s %7s %10s %12s %12s' % (
+                period.time_index,
+                period.period_start.strftime('%Y-%m-%d %H:%M:%S'),
+                period.period_end.strftime('%Y-%m-%d %H:%M:%S'),
+                period.num_sources if period.known else '?',
+                period.num_images if period.known else '?',
+                _format_bytes(period.read_bytes) if period.known else '?',
+                _format_bytes(period.peak_memory['time_first']) if period.known else '?',
+                _format_bytes(period.peak_memory['space_first']) if period.known else '?'))
+        return '\n'.join(lines)
+
+
+def _format_bytes(num_bytes) -> str:
+    if num_bytes < 1024:
+        return '%d B' % num_bytes
+    for unit in ('KiB', 'MiB', 'GiB', 'TiB'):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == 'TiB':
+            return '%.1f %s' % (num_bytes, unit)
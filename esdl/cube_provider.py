@@ -1,16 +1,98 @@
+import concurrent.futures
 import glob
 import os.path
+import re
+import threading
 import time
 from abc import ABCMeta, abstractmethod, abstractproperty
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import gridtools.resampling as gtr
 import netCDF4
 import numpy as np
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List, Iterable
 
 from .cube_config import CubeConfig
-from .util import Config, NetCDFDatasetCache, aggregate_images, temporal_weight
+from .cube_metrics import CubeMetrics
+from .util import Config, ImageAggregator, NetCDFDatasetCache, SourceTimeRangeIndex, SourceTimeRanges, \
+    get_aligned_tiles
+
+#: The default maximum number of threads scanning source directories and files, see :py:func:`list_source_files`
+#: and :py:meth:`NetCDFCubeSourceProvider.scan_source_time_ranges`.
+DEFAULT_SCAN_THREADS = 8
+
+#: Serializes the source file reads of concurrent scans, because the NetCDF/HDF5 libraries are not thread-safe.
+_SCAN_READ_LOCK = threading.Lock()
+
+
+def list_source_files(dir_paths, file_filter=None, max_threads: int = DEFAULT_SCAN_THREADS) -> List[str]:
+    """
+    List the files of the directories *dir_paths* using up to *max_threads* threads, so that the latencies of
+    listing directories on networked file systems add up in parallel rather than one after the other.
+
+    :param dir_paths: The directory paths.
+    :param file_filter: An optional function which returns whether a file name is accepted.
+    :param max_threads: The maximum number of threads.
+    :return: The sorted list of the paths of the accepted files.
+    """
+
+    def list_dir(dir_path):
+        return [os.path.join(dir_path, file_name) for file_name in os.listdir(dir_path)
+                if file_filter is None or file_filter(file_name)]
+
+    return sorted(file for files in _map_concurrently(list_dir, dir_paths, max_threads) for file in files)
+
+
+class SourceFileTemplate:
+    """
+    A declarative description of source files whose names give their time ranges, see
+    :py:meth:`NetCDFCubeSourceProvider.compute_template_time_ranges`.
+
+    :param pattern: A regular expression which must match whole file names, files not matching are ignored.
+           Its group named 'time' gives the start time of the file's period.
+    :param time_format: The ``strptime`` format of the 'time' group, e.g. '%Y%m%d' or '%Y%j'.
+    :param period: The length of the period covered by each file as ``timedelta``.
+    :param year_dirs: If true, files are kept in sub-directories named by their years and only those of the cube's
+           time range are listed.
+    :param sub_dirs: The names of further sub-directories of the source directory or of each year directory
+           holding the files, e.g. ``('005',)``.
+    :param validate: If true, new or changed files are opened once to validate them, see
+           :py:meth:`NetCDFCubeSourceProvider.validate_source_file`. The results are kept in the provider's
+           source time range index.
+    """
+
+    def __init__(self, pattern: str, time_format: str, period: timedelta = timedelta(days=1), year_dirs: bool = False,
+                 sub_dirs=(), validate: bool = False):
+        self.pattern = re.compile(pattern)
+        if 'time' not in self.pattern.groupindex:
+            raise ValueError("pattern must have a group named 'time'")
+        self.time_format = time_format
+        self.period = period
+        self.year_dirs = year_dirs
+        self.sub_dirs = tuple(sub_dirs)
+        self.validate = validate
+
+    def get_time_range(self, file_name: str):
+        """
+        Return the (time_start, time_stop) range of the file with the given *file_name*, ``None`` if the name does
+        not match the pattern.
+        """
+        match = self.pattern.fullmatch(file_name)
+        if match is None:
+            return None
+        time_start = datetime.strptime(match.group('time'), self.time_format)
+        return time_start, time_start + self.period
+
+
+def _map_concurrently(function, items, max_threads):
+    """
+    Return the results of *function* called for each of *items* in their order, using up to *max_threads* threads.
+    """
+    items = list(items)
+    if max_threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_threads, len(items))) as executor:
+        return list(executor.map(function, items))
 
 
 def _get_us_method(var_attributes):
@@ -21,6 +103,30 @@ def _get_ds_method(var_attributes):
     return gtr.__dict__['DS_' + var_attributes.get('ds_method', 'MEAN')]
 
 
+#: The temporal aggregation reducers whose result for a single source image is the source image itself.
+_IDENTITY_REDUCERS = ('mean', 'min', 'max', 'last')
+
+
+def _new_image_aggregator(var_attributes, num_sources):
+    """
+    Return a new :py:class:`ImageAggregator` for the variable's temporal aggregation, or ``None`` if the source image
+    can be used as it is, because there is a single source and the reducer passes it through.
+    """
+    reducer = var_attributes.get('temporal_aggregation', 'mean')
+    if num_sources <= 1 and reducer in _IDENTITY_REDUCERS:
+        return None
+    return ImageAggregator(reducer=reducer)
+
+
+def _get_num_bytes(image):
+    # Masked arrays are read with a mask byte per pixel
+    num_bytes = getattr(image, 'nbytes', 0)
+    mask = np.ma.getmask(image)
+    if mask is not np.ma.nomask:
+        num_bytes += mask.nbytes
+    return num_bytes
+
+
 class CubeSourceProvider(metaclass=ABCMeta):
     """
     An abstract interface for objects representing data source providers for the data cube.
@@ -37,12 +143,25 @@ class CubeSourceProvider(metaclass=ABCMeta):
             raise ValueError('name expected')
         self._name = name
         self._cube_config = cube_config
+        self._metrics = CubeMetrics()
 
     @property
     def name(self) -> str:
         """ The provider's registration name. """
         return self._name
 
+    @property
+    def metrics(self) -> CubeMetrics:
+        """
+        The timers and counters of the stages performed by the provider, see :py:data:`esdl.cube_metrics.STAGES`.
+        Replaced by :py:meth:`Cube.update` with the metrics of the update.
+        """
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics: CubeMetrics):
+        self._metrics = metrics
+
     @property
     def cube_config(self) -> CubeConfig:
         """ The data cube's configuration. """
@@ -90,11 +209,24 @@ class CubeSourceProvider(metaclass=ABCMeta):
         * ``units``: See CF conventions. Optional.
         * ``standard_name``: See CF conventions. Optional.
         * ``long_name``: See CF conventions. Optional.
+        * ``temporal_aggregation``: The reducer used to aggregate the source images of a target period, one of
+            'mean', 'min', 'max', 'count' or 'last', see :py:class:`esdl.util.ImageAggregator`.
+            Optional, defaults to 'mean'. Not written to the target variable.
 
         :return: dictionary of variable names to attribute dictionaries
         """
         return None
 
+    @property
+    def parallel_periods(self) -> bool:
+        """
+        Whether the images returned by :py:meth:`compute_variable_images` depend on the requested period only.
+        If so, copies of the prepared provider may compute different periods concurrently in separate processes,
+        see the *jobs* parameter of :py:meth:`Cube.update`. Such providers must be picklable after
+        :py:meth:`prepare` has been called. Defaults to ``False``.
+        """
+        return False
+
     @abstractmethod
     def compute_variable_images(self, period_start: datetime, period_end: datetime) -> Dict[str, np.ndarray]:
         """
@@ -119,6 +251,79 @@ class CubeSourceProvider(metaclass=ABCMeta):
         """
         return None
 
+    def read_period_sources(self, period_start: datetime, period_end: datetime) -> Any:
+        """
+        First stage of :py:meth:`compute_variable_images` as used by pipelined cube updates, see the *pipelined*
+        parameter of :py:meth:`Cube.update`. Read the source data required to compute the images of the given period.
+        The return value is passed to :py:meth:`compute_period_images` and is otherwise opaque.
+
+        The default implementation reads nothing and returns the period, so that all work is done by
+        :py:meth:`compute_period_images`.
+
+        :param period_start: The period start time as a datetime.datetime instance
+        :param period_end: The period end time as a datetime.datetime instance
+        :return: The period's source data.
+        """
+        return period_start, period_end
+
+    def compute_period_images(self, period_sources: Any) -> Dict[str, np.ndarray]:
+        """
+        Second stage of :py:meth:`compute_variable_images` as used by pipelined cube updates.
+        Compute the variable images from the source data returned by :py:meth:`read_period_sources`.
+
+        The default implementation calls :py:meth:`compute_variable_images`.
+
+        :param period_sources: The value returned by :py:meth:`read_period_sources`.
+        :return: Same as :py:meth:`compute_variable_images`.
+        """
+        period_start, period_end = period_sources
+        return self.compute_variable_images(period_start, period_end)
+
+    @property
+    def has_read_stage(self) -> bool:
+        """
+        Whether :py:meth:`read_period_sources` reads all source data, so that :py:meth:`compute_period_images` does
+        not access any source files. Otherwise pipelined cube updates compute the images while holding the lock
+        shared with the write stage, because the NetCDF/HDF5 libraries are not thread-safe. Defaults to ``False``.
+        """
+        return False
+
+    def compute_variable_tiles(self, period_start: datetime, period_end: datetime,
+                               memory_budget: int) -> Iterable[Tuple[str, Tuple[int, int, int, int], np.ndarray]]:
+        """
+        Compute the variable images of the given period in tiles, so that computing a tile requires at most
+        *memory_budget* bytes. Used by tiled cube updates, see the *memory_budget* parameter of :py:meth:`Cube.update`.
+
+        The default implementation yields the whole images computed by :py:meth:`compute_variable_images`
+        and therefore does not bound the memory used.
+
+        :param period_start: The period start time as a datetime.datetime instance
+        :param period_end: The period end time as a datetime.datetime instance
+        :param memory_budget: The maximum number of bytes used to compute a single tile.
+        :return: An iterable of (var_name, tile_rect, tile_image) tuples, where *tile_rect* is given as
+                 (x, y, width, height) in the provider's image coordinates, see :py:meth:`spatial_coverage`.
+                 All tiles of a variable must be yielded before the tiles of the next variable.
+        """
+        var_name_to_image = self.compute_variable_images(period_start, period_end)
+        if not var_name_to_image:
+            return []
+        return [(var_name, (0, 0, image.shape[1], image.shape[0]), image)
+                for var_name, image in var_name_to_image.items() if image is not None]
+
+    def plan_period_sources(self, period_start: datetime, period_end: datetime) -> List[Tuple[str, int, Any, Any]]:
+        """
+        Describe the source images that :py:meth:`compute_variable_images` would read for the given period without
+        reading any pixel data. Used by :py:meth:`Cube.plan` to estimate the costs of a cube update.
+
+        The default implementation returns ``None``.
+
+        :param period_start: The period start time as a datetime.datetime instance
+        :param period_end: The period end time as a datetime.datetime instance
+        :return: A list of (var_name, source_index, image_shape, dtype) tuples, where *image_shape* and *dtype* are
+                 ``None`` if unknown, or ``None`` if the provider cannot describe its source images.
+        """
+        return None
+
     @abstractmethod
     def close(self):
         """
@@ -144,14 +349,23 @@ class BaseCubeSourceProvider(CubeSourceProvider, metaclass=ABCMeta):
 
     def prepare(self):
         """
-        Calls **compute_source_time_ranges** and assigns the return value to the field **source_time_ranges**.
+        Calls **compute_source_time_ranges** and assigns the return value as :py:class:`SourceTimeRanges` to the
+        field **source_time_ranges**.
         """
-        self._source_time_ranges = self.compute_source_time_ranges()
+        source_time_ranges = self.compute_source_time_ranges()
+        self._source_time_ranges = SourceTimeRanges(source_time_ranges) if source_time_ranges is not None else None
 
     @property
-    def source_time_ranges(self):
+    def source_time_ranges(self) -> SourceTimeRanges:
         return self._source_time_ranges
 
+    @property
+    def parallel_periods(self) -> bool:
+        """
+        Return ``True``, because images are computed from the source time ranges overlapping the requested period.
+        """
+        return True
+
     @property
     def spatial_coverage(self):
         """
@@ -193,25 +407,107 @@ class BaseCubeSourceProvider(CubeSourceProvider, metaclass=ABCMeta):
                  (grid_height, grid_width) as given by the **CubeConfig**.
                  Return ``None`` if no such variables exists for the given target time range.
         """
-
-        source_time_ranges = self._source_time_ranges
-        if len(source_time_ranges) == 0:
+        index_to_weight = self.compute_index_to_weight(period_start, period_end)
+        if not index_to_weight:
             return None
+        return self._compute_images_from_sources(period_start, period_end, index_to_weight, None)
+
+    def read_period_sources(self, period_start: datetime, period_end: datetime):
+        """
+        Compute the source index to weight mapping for the given period and pass it to **read_sources()**.
 
-        index_to_weight = dict()
-        for i in range(len(source_time_ranges)):
-            source_start_time, source_end_time = source_time_ranges[i][0:2]
-            weight = temporal_weight(source_start_time, source_end_time,
-                                     period_start, period_end)
-            if weight > 0.0:
-                index_to_weight[i] = weight
+        :return: A tuple (period_start, period_end, index_to_weight, sources) or ``None`` if no source overlaps
+                 with the given period.
+        """
+        index_to_weight = self.compute_index_to_weight(period_start, period_end)
         if not index_to_weight:
             return None
+        return period_start, period_end, index_to_weight, self.read_sources(index_to_weight)
+
+    def compute_period_images(self, period_sources):
+        """
+        Compute the images from the value returned by **read_period_sources()**.
+        """
+        if period_sources is None:
+            return None
+        return self._compute_images_from_sources(*period_sources)
+
+    @property
+    def has_read_stage(self) -> bool:
+        """
+        Return ``True`` if **read_sources()** is overridden to read the source data.
+        """
+        return type(self).read_sources is not BaseCubeSourceProvider.read_sources
+
+    def compute_index_to_weight(self, period_start: datetime, period_end: datetime) -> Dict[int, float]:
+        """
+        Compute the weights of all source time ranges that overlap with the given target time range.
+
+        :return: A dictionary mapping indexes into the source time ranges list --> weight values.
+        """
+        return self._source_time_ranges.get_index_to_weight(period_start, period_end)
+
+    def plan_period_sources(self, period_start: datetime, period_end: datetime):
+        """
+        Describe the source images of all variables for the source time ranges that overlap with the given period,
+        see **compute_index_to_weight()** and **get_source_image_info()**.
+        """
+        index_to_weight = self.compute_index_to_weight(period_start, period_end)
+        planned_sources = []
+        for var_name in self.variable_descriptors:
+            for i in sorted(index_to_weight.keys()):
+                image_shape, dtype = self.get_source_image_info(i, var_name)
+                planned_sources.append((var_name, i, image_shape, dtype))
+        return planned_sources
+
+    def get_source_image_info(self, index: int, var_name: str) -> Tuple[Any, Any]:
+        """
+        Return the shape and data type of the source image of variable *var_name* at the given index into the source
+        time ranges list. Must not read any pixel data.
+
+        The default implementation returns ``(None, None)`` which means unknown.
+
+        :param index: An index into the source time ranges list.
+        :param var_name: The target variable name.
+        :return: A tuple (image_shape, dtype).
+        """
+        return None, None
+
+    def read_sources(self, index_to_weight: Dict[int, float]) -> Any:
+        """
+        Read the source data for the given source indices, so that it can be passed to
+        **compute_variable_images_from_read_sources()**. Used by pipelined cube updates only.
 
+        The default implementation returns ``None`` which means that sources are read by
+        **compute_variable_images_from_sources()**. Override together with
+        **compute_variable_images_from_read_sources()** to separate reading from computation.
+
+        :param index_to_weight: A dictionary mapping time indexes --> weight values.
+        :return: The source data or ``None``.
+        """
+        return None
+
+    def compute_variable_images_from_read_sources(self, index_to_weight: Dict[int, float], sources: Any):
+        """
+        Compute the target images for all variables from the *sources* returned by **read_sources()**.
+
+        The default implementation calls **compute_variable_images_from_sources()**.
+
+        :param index_to_weight: A dictionary mapping time indexes --> weight values.
+        :param sources: The value returned by **read_sources()**.
+        :return: Same as **compute_variable_images_from_sources()**.
+        """
+        return self.compute_variable_images_from_sources(index_to_weight)
+
+    def _compute_images_from_sources(self, period_start, period_end, index_to_weight, sources):
         self.log('computing images for time range %s to %s from %d source(s)...' % (period_start, period_end,
                                                                                     len(index_to_weight)))
         t1 = time.time()
-        result = self.compute_variable_images_from_sources(index_to_weight)
+        with self.metrics.timer('compute', period_start=str(period_start), num_sources=len(index_to_weight)):
+            if sources is None:
+                result = self.compute_variable_images_from_sources(index_to_weight)
+            else:
+                result = self.compute_variable_images_from_read_sources(index_to_weight, sources)
         t2 = time.time()
         self.log('images computed for %s, took %f seconds' % (str(list(result.keys())), t2 - t1))
 
@@ -289,20 +585,25 @@ class BaseStaticCubeSourceProvider(CubeSourceProvider, metaclass=ABCMeta):
         if self._variable_images_computed:
             return None
 
-        dataset = self.open_dataset()
+        with self.metrics.timer('open'):
+            dataset = self.open_dataset()
         try:
             var_descriptors = self.variable_descriptors
             target_var_images = dict()
             for var_name, var_attributes in var_descriptors.items():
                 source_name = var_attributes.get('source_name', var_name)
-                var_image = self.get_dataset_image(dataset, source_name)
-                var_image = self.transform_source_image(var_image)
-                var_image = gtr.resample_2d(var_image,
-                                            self.cube_config.grid_width,
-                                            self.cube_config.grid_height,
-                                            ds_method=_get_ds_method(var_attributes),
-                                            us_method=_get_us_method(var_attributes),
-                                            fill_value=var_attributes.get('fill_value', np.nan))
+                with self.metrics.timer('read', var=var_name) as event:
+                    var_image = self.get_dataset_image(dataset, source_name)
+                    event['bytes'] = _get_num_bytes(var_image)
+                with self.metrics.timer('transform', var=var_name):
+                    var_image = self.transform_source_image(var_image)
+                with self.metrics.timer('resample', var=var_name):
+                    var_image = gtr.resample_2d(var_image,
+                                                self.cube_config.grid_width,
+                                                self.cube_config.grid_height,
+                                                ds_method=_get_ds_method(var_attributes),
+                                                us_method=_get_us_method(var_attributes),
+                                                fill_value=var_attributes.get('fill_value', np.nan))
                 if var_image.shape[1] / var_image.shape[0] != 2.0:
                     print("Warning: wrong size ratio of image in '%s'. Expected 2, got %f" % (
                         self.get_dataset_file_path(dataset),
@@ -442,64 +743,247 @@ class NetCDFCubeSourceProvider(BaseCubeSourceProvider, metaclass=ABCMeta):
             self._dir_path = dir_path
         self._resampling_order = resampling_order
         self._dataset_cache = NetCDFDatasetCache(name)
+        self._time_range_index = SourceTimeRangeIndex(name, self._dir_path, version=self.time_range_version)
         self._old_indices = None
+        self._source_image_infos = dict()
 
     @property
     def dir_path(self):
         return self._dir_path
 
+    @property
+    def resampling_order(self) -> str:
+        """
+        The order in which resampling is performed, 'time_first' or 'space_first'.
+        """
+        return self._resampling_order
+
     @property
     def dataset_cache(self):
         return self._dataset_cache
 
+    @property
+    def time_range_version(self) -> int:
+        """
+        The version of the way this provider computes the time ranges of a source file. Time ranges recorded in the
+        **time_range_index** by other versions are not used. Providers must increase it whenever they change the
+        time ranges computed for a given file. The default is 1.
+        """
+        return 1
+
+    @property
+    def time_range_index(self) -> SourceTimeRangeIndex:
+        """
+        The persistent index of the time ranges of the source files. Implementations of
+        **compute_source_time_ranges()** should get the time ranges of each source file from it, so that only new or
+        changed files are opened, see :py:meth:`SourceTimeRangeIndex.get_time_ranges`.
+        """
+        return self._time_range_index
+
+    def compute_template_time_ranges(self, template: SourceFileTemplate) -> list:
+        """
+        Return the time ranges of the source files described by *template* which overlap with the cube's time range,
+        derived from their names. Files are only opened if the template asks for validation. Providers whose file
+        names give the time ranges may return this from **compute_source_time_ranges()**.
+
+        :param template: The :py:class:`SourceFileTemplate` of the source files.
+        :return: The list of (time_start, time_stop, file, time_index) tuples sorted by time_start.
+        """
+        if template.year_dirs:
+            dir_paths = self.get_year_dir_paths(*template.sub_dirs)
+        else:
+            dir_paths = [os.path.join(self.dir_path, *template.sub_dirs)]
+        start_time, end_time = self.cube_config.start_time, self.cube_config.end_time
+        file_to_time_range = dict()
+
+        def is_source_file(file_name):
+            time_range = template.get_time_range(file_name)
+            # A cube time range bound of None is open-ended
+            if time_range is None \
+                    or (start_time is not None and time_range[1] <= start_time) \
+                    or (end_time is not None and time_range[0] >= end_time):
+                return False
+            file_to_time_range[file_name] = time_range
+            return True
+
+        files = list_source_files(dir_paths, is_source_file)
+        if not template.validate:
+            return sorted([file_to_time_range[os.path.basename(file)] + (file, 0) for file in files],
+                          key=lambda item: item[0])
+
+        def read_time_ranges(file):
+            if not self.validate_source_file(file):
+                return []
+            return [file_to_time_range[os.path.basename(file)] + (0,)]
+
+        return self.scan_source_time_ranges(files, read_time_ranges)
+
+    def validate_source_file(self, file: str) -> bool:
+        """
+        Test whether the source *file* can be used, called for new or changed files if the template passed to
+        **compute_template_time_ranges()** asks for validation. The default implementation tests whether the file
+        can be opened.
+        """
+        self._dataset_cache.get_dataset(file)
+        self._dataset_cache.close_dataset(file)
+        return True
+
+    def get_year_dir_paths(self, *paths) -> List[str]:
+        """
+        Return the sorted paths of the sub-directories of **dir_path** which are named by the years of the cube's
+        time range, each joined with *paths*, e.g. ``get_year_dir_paths('005')`` for ``<dir_path>/<year>/005``.
+        A cube time range bound of ``None`` is open-ended.
+        """
+        start_time, end_time = self.cube_config.start_time, self.cube_config.end_time
+        start_year = start_time.year if start_time is not None else datetime.min.year
+        end_year = end_time.year if end_time is not None else datetime.max.year
+        return [os.path.join(self.dir_path, sub_dir, *paths) for sub_dir in sorted(os.listdir(self.dir_path))
+                if sub_dir.isdigit() and start_year <= int(sub_dir) <= end_year
+                and os.path.isdir(os.path.join(self.dir_path, sub_dir))]
+
+    def scan_source_time_ranges(self, files, read_time_ranges, max_threads: int = DEFAULT_SCAN_THREADS) -> list:
+        """
+        Get the time ranges of the source *files* from the **time_range_index**. The index lookups, which stat each
+        file, run in up to *max_threads* threads, so that the latencies of networked file systems add up in parallel
+        rather than one after the other. The time ranges of new or changed files are read by calling
+        *read_time_ranges(file)* one file at a time, because the NetCDF/HDF5 libraries are not thread-safe.
+
+        :param files: The source file paths.
+        :param read_time_ranges: A function which opens a source file and returns the list of its
+               (time_start, time_stop, time_index) tuples.
+        :param max_threads: The maximum number of threads.
+        :return: The list of (time_start, time_stop, file, time_index) tuples sorted by time_start as returned by
+                 **compute_source_time_ranges()**, equal times are sorted by file path.
+        """
+        files = sorted(files)
+
+        def read_time_ranges_locked(file):
+            with _SCAN_READ_LOCK:
+                return read_time_ranges(file)
+
+        def get_time_ranges(file):
+            return self._time_range_index.get_time_ranges(file, read_time_ranges_locked)
+
+        source_time_ranges = []
+        for file, time_ranges in zip(files, _map_concurrently(get_time_ranges, files, max_threads)):
+            source_time_ranges += [(t1, t2, file, i) for t1, t2, i in time_ranges]
+        return sorted(source_time_ranges, key=lambda item: item[0])
+
+    def prepare(self):
+        """
+        Calls **compute_source_time_ranges** and saves the source time range index.
+        """
+        super(NetCDFCubeSourceProvider, self).prepare()
+        index = self._time_range_index
+        try:
+            index.save()
+        except OSError as e:
+            print('Warning: source time range index \'%s\' not saved: %s' % (index.index_file, e))
+        if index.num_hits or index.num_misses:
+            self.log('time ranges of %d source file(s) read from index, %d file(s) opened'
+                     % (index.num_hits, index.num_misses))
+
+    def get_source_image_info(self, index, var_name):
+        """
+        Return the shape and data type of the source image from the header of its NetCDF file.
+        """
+        file, _ = self._get_file_and_time_index(index)
+        source_name = self.variable_descriptors[var_name].get('source_name', var_name)
+        key = file, source_name
+        info = self._source_image_infos.get(key)
+        if info is None:
+            dataset = netCDF4.Dataset(file)
+            try:
+                variable = dataset.variables[source_name]
+                info = tuple(variable.shape[-2:]), variable.dtype
+            finally:
+                dataset.close()
+            self._source_image_infos[key] = info
+        return info
+
     def compute_variable_images_from_sources(self, index_to_weight):
+        """
+        Read, transform, aggregate and resample the source images. Unlike **read_sources()**, the source images of
+        a variable are read one at a time while they are aggregated, so that they are not all kept in memory.
+        """
+        indices = sorted(self.close_unused_open_files(index_to_weight))
+        sources = {var_name: self._read_var_sources(var_name, var_attributes, indices, index_to_weight)
+                   for var_name, var_attributes in self.variable_descriptors.items()}
+        return self._compute_variable_images(sources, len(indices))
 
-        new_indices = self.close_unused_open_files(index_to_weight)
+    def read_sources(self, index_to_weight):
+        """
+        Read the source images of all variables for the given source indices.
 
-        var_descriptors = self.variable_descriptors
-        target_var_images = dict()
-        for var_name, var_attributes in var_descriptors.items():
-            source_var_images = [None] * len(new_indices)
-            source_weights = [None] * len(new_indices)
-            var_image_index = 0
-            for i in new_indices:
-                file, time_index = self._get_file_and_time_index(i)
-                source_name = var_attributes.get('source_name', var_name)
-                variable = self._dataset_cache.get_dataset(file).variables[source_name]
+        :param index_to_weight: A dictionary mapping time indexes --> weight values.
+        :return: A dictionary variable name --> list of (source image, weight, file) tuples.
+        """
+        indices = sorted(self.close_unused_open_files(index_to_weight))
+        return {var_name: list(self._read_var_sources(var_name, var_attributes, indices, index_to_weight))
+                for var_name, var_attributes in self.variable_descriptors.items()}
+
+    def _read_var_sources(self, var_name, var_attributes, indices, index_to_weight):
+        """
+        Generate the (source image, weight, file) tuples of variable *var_name* for the given source *indices*.
+        """
+        source_name = var_attributes.get('source_name', var_name)
+        for i in indices:
+            file, time_index = self._get_file_and_time_index(i)
+            variable = self._get_dataset(file).variables[source_name]
+            with self.metrics.timer('read', var=var_name, file=file) as event:
                 if len(variable.shape) == 3:
                     var_image = variable[time_index, :, :]
                 elif len(variable.shape) == 2:
                     var_image = variable[:, :]
                 else:
                     raise ValueError("unexpected shape for variable '%s'" % var_name)
-                var_image = self.transform_source_image(var_image)
+                event['bytes'] = _get_num_bytes(var_image)
+            yield var_image, index_to_weight[i], file
+
+    def compute_variable_images_from_read_sources(self, index_to_weight, sources):
+        """
+        Transform, aggregate and resample the source images returned by **read_sources()**.
+        """
+        return self._compute_variable_images(sources, len(index_to_weight))
+
+    def _compute_variable_images(self, sources, num_sources):
+        """
+        Transform, aggregate and resample the source images given by the iterables of (source image, weight, file)
+        tuples in *sources* of *num_sources* items for each variable.
+        """
+        var_descriptors = self.variable_descriptors
+        target_var_images = dict()
+        for var_name, var_attributes in var_descriptors.items():
+            # Temporal aggregation is done while iterating the sources, a single source may be used as it is
+            aggregator = _new_image_aggregator(var_attributes, num_sources)
+            for var_image, weight, file in sources[var_name]:
+                with self.metrics.timer('transform', var=var_name):
+                    var_image = self.transform_source_image(var_image)
                 if self._resampling_order == 'space_first':
+                    with self.metrics.timer('resample', var=var_name):
+                        var_image = gtr.resample_2d(var_image,
+                                                    self.cube_config.grid_width,
+                                                    self.cube_config.grid_height,
+                                                    ds_method=_get_ds_method(var_attributes),
+                                                    us_method=_get_us_method(var_attributes),
+                                                    fill_value=var_attributes.get('fill_value', np.nan))
+                if var_image.shape[1] / var_image.shape[0] != 2.0:
+                    print("Warning: wrong size ratio of image in '%s'. Expected 2, got %f" % (
+                        file, var_image.shape[1] / var_image.shape[0]))
+                if aggregator is not None:
+                    with self.metrics.timer('aggregate', var=var_name):
+                        aggregator.add(var_image, weight)
+            if aggregator is not None:
+                var_image = aggregator.get_result()
+            # Spatial resampling
+            if self._resampling_order == 'time_first':
+                with self.metrics.timer('resample', var=var_name):
                     var_image = gtr.resample_2d(var_image,
                                                 self.cube_config.grid_width,
                                                 self.cube_config.grid_height,
                                                 ds_method=_get_ds_method(var_attributes),
                                                 us_method=_get_us_method(var_attributes),
                                                 fill_value=var_attributes.get('fill_value', np.nan))
-                if var_image.shape[1] / var_image.shape[0] != 2.0:
-                    print("Warning: wrong size ratio of image in '%s'. Expected 2, got %f" % (
-                        file, var_image.shape[1] / var_image.shape[0]))
-                source_var_images[var_image_index] = var_image
-                source_weights[var_image_index] = index_to_weight[i]
-                var_image_index += 1
-            if len(new_indices) > 1:
-                # Temporal aggregation
-                var_image = aggregate_images(source_var_images, weights=source_weights)
-            else:
-                # Temporal aggregation not required
-                var_image = source_var_images[0]
-            # Spatial resampling
-            if self._resampling_order == 'time_first':
-                var_image = gtr.resample_2d(var_image,
-                                            self.cube_config.grid_width,
-                                            self.cube_config.grid_height,
-                                            ds_method=_get_ds_method(var_attributes),
-                                            us_method=_get_us_method(var_attributes),
-                                            fill_value=var_attributes.get('fill_value', np.nan))
             target_var_images[var_name] = var_image
 
         return target_var_images
@@ -507,11 +991,114 @@ class NetCDFCubeSourceProvider(BaseCubeSourceProvider, metaclass=ABCMeta):
     def transform_source_image(self, source_image):
         """
         Returns the source image. Override to implement transformations if needed.
+        Providers that override this method cannot compute tiles, see **compute_variable_tiles()**.
         :param source_image: 2D image
         :return: source_image
         """
         return source_image
 
+    def compute_variable_tiles(self, period_start, period_end, memory_budget):
+        """
+        Compute the target images tile by tile. For each tile only the window of the source images which covers it
+        is read, then aggregated and resampled in the provider's resampling order. The tile layout is aligned with
+        the source pixels and sized according to *memory_budget*, see :py:func:`esdl.util.get_aligned_tiles`.
+
+        Providers that override **transform_source_image()** or the methods that read and compute whole source
+        images cannot compute tiles, because these methods operate on whole images.
+        """
+        self._ensure_tiles_supported()
+        index_to_weight = self.compute_index_to_weight(period_start, period_end)
+        if not index_to_weight:
+            return
+        indices = sorted(self.close_unused_open_files(index_to_weight))
+        grid_width = self.cube_config.grid_width
+        grid_height = self.cube_config.grid_height
+        for var_name, var_attributes in self.variable_descriptors.items():
+            source_name = var_attributes.get('source_name', var_name)
+            sources = []
+            for i in indices:
+                file, time_index = self._get_file_and_time_index(i)
+                variable = self._get_dataset(file).variables[source_name]
+                if len(variable.shape) not in (2, 3):
+                    raise ValueError("unexpected shape for variable '%s'" % var_name)
+                sources.append((variable, time_index, index_to_weight[i]))
+            source_shape = sources[0][0].shape[-2:]
+            if any(variable.shape[-2:] != source_shape for variable, _, _ in sources):
+                raise ValueError("source images of variable '%s' differ in size" % var_name)
+            item_size = max(variable.dtype.itemsize for variable, _, _ in sources)
+            target_pixel_size, source_pixel_size = self._get_tile_pixel_sizes(var_attributes, len(sources),
+                                                                              item_size)
+            tiles = get_aligned_tiles((grid_width, grid_height), (source_shape[1], source_shape[0]),
+                                      target_pixel_size, source_pixel_size, memory_budget)
+            for target_rect, source_rect in tiles:
+                yield var_name, target_rect, self._compute_tile(var_attributes, sources, target_rect, source_rect)
+
+    def _ensure_tiles_supported(self):
+        for method_name in ('transform_source_image', 'read_sources', 'compute_variable_images_from_sources',
+                            'compute_variable_images_from_read_sources'):
+            if getattr(type(self), method_name) is not getattr(NetCDFCubeSourceProvider, method_name):
+                raise ValueError("provider '%s' overrides %s() and cannot compute tiles" % (self.name, method_name))
+
+    def _get_tile_pixel_sizes(self, var_attributes, num_sources, item_size):
+        """
+        Return the number of bytes required per target pixel and per source pixel to compute a tile.
+        Source windows are read one at a time as masked arrays, resampled images are masked float64 arrays.
+        Sources are aggregated by an :py:class:`ImageAggregator` keeping two float64 arrays, unless a single source
+        is used as it is.
+        """
+        source_pixel_size = item_size + 1
+        result_pixel_size = np.dtype(np.float64).itemsize + 1
+        if _new_image_aggregator(var_attributes, num_sources) is not None:
+            aggregator_pixel_size = 2 * np.dtype(np.float64).itemsize + result_pixel_size
+        else:
+            aggregator_pixel_size = 0
+        if self._resampling_order == 'space_first':
+            target_pixel_size = result_pixel_size + aggregator_pixel_size
+        else:
+            target_pixel_size = result_pixel_size
+            source_pixel_size += aggregator_pixel_size
+        return target_pixel_size, source_pixel_size
+
+    def _compute_tile(self, var_attributes, sources, target_rect, source_rect):
+        _, _, tile_width, tile_height = target_rect
+        x, y, width, height = source_rect
+        aggregator = _new_image_aggregator(var_attributes, len(sources))
+        tile_image = None
+        for variable, time_index, weight in sources:
+            with self.metrics.timer('read', rect=list(source_rect)) as event:
+                if len(variable.shape) == 3:
+                    tile_image = variable[time_index, y:y + height, x:x + width]
+                else:
+                    tile_image = variable[y:y + height, x:x + width]
+                event['bytes'] = _get_num_bytes(tile_image)
+            if self._resampling_order == 'space_first':
+                tile_image = self._resample_tile(tile_image, tile_width, tile_height, var_attributes)
+            if aggregator is not None:
+                with self.metrics.timer('aggregate'):
+                    aggregator.add(tile_image, weight)
+        if aggregator is not None:
+            tile_image = aggregator.get_result()
+        if self._resampling_order == 'time_first':
+            tile_image = self._resample_tile(tile_image, tile_width, tile_height, var_attributes)
+        return tile_image
+
+    def _resample_tile(self, image, width, height, var_attributes):
+        with self.metrics.timer('resample'):
+            return gtr.resample_2d(image, width, height,
+                                   ds_method=_get_ds_method(var_attributes),
+                                   us_method=_get_us_method(var_attributes),
+                                   fill_value=var_attributes.get('fill_value', np.nan))
+
+    def _get_dataset(self, file):
+        """
+        Return the cached dataset of the source *file*, open it if required.
+        """
+        dataset = self._dataset_cache.get_cached_dataset(file)
+        if dataset is None:
+            with self.metrics.timer('open', file=file):
+                dataset = self._dataset_cache.get_dataset(file)
+        return dataset
+
     def close_unused_open_files(self, index_to_weight):
         """
         Close all datasets that wont be used anymore w.r.t. the given **index_to_weight** dictionary passed to the
@@ -0,0 +1,159 @@
+import os
+import socket
+import time
+
+#: The default number of seconds after which the lock file of a claimed unit which has not been touched is stale.
+DEFAULT_LOCK_TIMEOUT = 600.0
+
+
+class WorkQueue:
+    """
+    A queue of work units shared by cooperating cube-gen worker processes, which may run on several hosts
+    that mount the same file system, see ``cube-gen --worker``.
+
+    The queue is a directory that holds a ``<unit>.lock`` file for each claimed unit and a ``<unit>.done`` file for
+    each completed unit. Units are claimed by creating their lock file exclusively (``O_CREAT | O_EXCL``), which is
+    atomic on local file systems and on NFS version 3 or later. The lock file records the owner's host name and
+    process ID.
+
+    Lock files of crashed workers are stale and are reclaimed by :py:meth:`claim`: on the owner's host if the
+    owner's process no longer exists, on any host if the lock file has not been touched for *lock_timeout*
+    seconds. Owners must therefore call :py:meth:`touch` more often than that while processing a unit.
+
+    :param queue_dir: The queue directory. Created if it does not exist.
+    :param lock_timeout: Seconds after which an untouched lock file is stale, ``None`` to reclaim lock files
+           of dead processes on the same host only.
+    """
+
+    def __init__(self, queue_dir: str, lock_timeout: float = None):
+        if lock_timeout is not None and lock_timeout <= 0:
+            raise ValueError('lock_timeout must be a positive number of seconds')
+        os.makedirs(queue_dir, exist_ok=True)
+        self._queue_dir = queue_dir
+        self._lock_timeout = lock_timeout
+
+    @property
+    def lock_timeout(self) -> float:
+        """
+        Seconds after which an untouched lock file is stale, or ``None``.
+        """
+        return self._lock_timeout
+
+    @property
+    def queue_dir(self) -> str:
+        """
+        The queue directory.
+        """
+        return self._queue_dir
+
+    def claim(self, unit: str) -> bool:
+        """
+        Try to claim the work unit *unit*. A stale lock file of the unit is reclaimed, see :py:meth:`is_stale`.
+
+        :return: ``True`` if the unit has been claimed by the calling process, ``False`` if it is owned by another
+                 process or has already been completed.
+        """
+        if self.is_done(unit):
+            return False
+        lock_file = self._get_path(unit, 'lock')
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            owner = self.get_owner(unit)
+            if owner is None or not self.is_stale(unit):
+                return False
+            print('reclaiming work unit %s from stale owner %s' % (unit, owner))
+            self._reclaim(unit, owner)
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('%s %d %s\n' % (socket.gethostname(), os.getpid(), time.strftime('%Y-%m-%dT%H:%M:%S')))
+        # The unit may have been completed by another process after we tested it above
+        if self.is_done(unit):
+            os.remove(lock_file)
+            return False
+        return True
+
+    def complete(self, unit: str):
+        """
+        Mark the claimed work unit *unit* as done and release it.
+        """
+        with open(self._get_path(unit, 'done'), 'w') as fp:
+            fp.write('%s %d %s\n' % (socket.gethostname(), os.getpid(), time.strftime('%Y-%m-%dT%H:%M:%S')))
+        self.release(unit)
+
+    def release(self, unit: str):
+        """
+        Release the claimed work unit *unit* without marking it as done, so that it can be claimed again.
+        """
+        lock_file = self._get_path(unit, 'lock')
+        if os.path.exists(lock_file):
+            os.remove(lock_file)
+
+    def touch(self, unit: str):
+        """
+        Update the modification time of the lock file of the claimed work unit *unit*, so that it does not become
+        stale while it is being processed.
+        """
+        os.utime(self._get_path(unit, 'lock'))
+
+    def is_stale(self, unit: str) -> bool:
+        """
+        Test whether the lock file of the work unit *unit* has been left by a crashed worker: its owner runs on this
+        host and its process does not exist anymore, or it has not been touched for **lock_timeout** seconds.
+        """
+        lock_file = self._get_path(unit, 'lock')
+        try:
+            mtime = os.path.getmtime(lock_file)
+            with open(lock_file) as fp:
+                parts = fp.read().split()
+        except FileNotFoundError:
+            return False
+        if os.name == 'posix' and len(parts) >= 2 and parts[0] == socket.gethostname() and parts[1].isdigit():
+            try:
+                os.kill(int(parts[1]), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return self._lock_timeout is not None and time.time() - mtime > self._lock_timeout
+
+    def is_done(self, unit: str) -> bool:
+        """
+        Test whether the work unit *unit* has been completed.
+        """
+        return os.path.exists(self._get_path(unit, 'done'))
+
+    def get_owner(self, unit: str) -> str:
+        """
+        Return the "<host> <pid> <time>" record of the process that has claimed the work unit *unit*,
+        or ``None`` if the unit is not claimed.
+        """
+        try:
+            with open(self._get_path(unit, 'lock')) as fp:
+                return fp.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _reclaim(self, unit, owner):
+        # Move the stale lock file aside atomically, so that only one worker reclaims it
+        lock_file = self._get_path(unit, 'lock')
+        stale_file = '%s.%s-%d' % (lock_file, socket.gethostname(), os.getpid())
+        try:
+            os.rename(lock_file, stale_file)
+        except FileNotFoundError:
+            return
+        with open(stale_file) as fp:
+            moved_owner = fp.read().strip()
+        if moved_owner != owner:
+            # Another worker has reclaimed the unit in the meantime, give its lock file back
+            try:
+                os.link(stale_file, lock_file)
+            except FileExistsError:
+                pass
+        os.remove(stale_file)
+
+    def _get_path(self, unit, ext):
+        return os.path.join(self._queue_dir, '%s.%s' % (unit, ext))
@@ -0,0 +1,348 @@
+"""
+Rechunking of an existing cube into a new cube with different chunk sizes, compression codecs or file format,
+see :py:func:`rechunk_cube`.
+
+The variables of the source cube are read through :py:class:`CubeDataAccess` and copied block by block, such that
+no more than a given memory budget is used, however large the variables are. Blocks are made of whole target chunks,
+so each target chunk is written once. If a block covering a source chunk does not fit into the memory budget, e.g.
+when map chunks are rechunked into pixel time-series chunks, the copy is planned in two stages, see
+:py:func:`plan_rechunk`: the first stage writes an uncompressed intermediate file whose chunks are small in every
+dimension, from which the second stage reads the target chunks.
+
+Usage::
+
+    cube-gen --rechunk OLD_TARGET -c new-cube.config -b 1024 -j 4 NEW_TARGET
+"""
+
+import math
+import multiprocessing
+import os
+import shutil
+import time
+from collections import OrderedDict
+
+import netCDF4
+import numpy
+
+from .cube import Cube
+from .cube_codecs import set_num_threads
+from .cube_config import CubeConfig
+from .cube_manifest import CubeManifest
+
+#: The default memory budget in bytes of :py:func:`rechunk_cube`.
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+#: The configuration parameters which must be equal for the source and the target cube of :py:func:`rechunk_cube`.
+GRID_PARAMS = ('spatial_res', 'grid_x0', 'grid_y0', 'grid_width', 'grid_height', 'temporal_res', 'calendar',
+               'ref_time', 'start_time', 'end_time')
+
+# A block is held once as read and about twice more while it is masked and packed for writing
+_BLOCK_COPIES = 3
+
+
+class RechunkStage:
+    """
+    A stage of a :py:class:`RechunkPlan` which copies a variable from chunks *read_chunks* to chunks *write_chunks*
+    in blocks of *block_shape*. Blocks are multiples of *write_chunks* covering at least one of *read_chunks*.
+    """
+
+    def __init__(self, read_chunks, write_chunks, block_shape):
+        self.read_chunks = tuple(read_chunks)
+        self.write_chunks = tuple(write_chunks)
+        self.block_shape = tuple(block_shape)
+
+    def get_blocks(self, shape):
+        """
+        Return the (time, lat, lon) slices of the blocks of a variable of the given *shape*.
+        """
+        return [(slice(t, min(t + self.block_shape[0], shape[0])),
+                 slice(y, min(y + self.block_shape[1], shape[1])),
+                 slice(x, min(x + self.block_shape[2], shape[2])))
+                for t in range(0, shape[0], self.block_shape[0])
+                for y in range(0, shape[1], self.block_shape[1])
+                for x in range(0, shape[2], self.block_shape[2])]
+
+
+class RechunkPlan:
+    """
+    The stages of copying the periods of one year of a variable with chunks *source_chunks* into chunks
+    *target_chunks*, see :py:func:`plan_rechunk`.
+    """
+
+    def __init__(self, shape, dtype, source_chunks, target_chunks, memory_budget, stages):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.source_chunks = tuple(source_chunks)
+        self.target_chunks = tuple(target_chunks)
+        self.memory_budget = memory_budget
+        self.stages = stages
+
+    @property
+    def intermediate_chunks(self):
+        """
+        The chunks of the intermediate file, ``None`` if the plan has a single stage.
+        """
+        return self.stages[0].write_chunks if len(self.stages) > 1 else None
+
+    def report(self) -> str:
+        """
+        Return a human-readable report of the plan.
+        """
+        lines = ['shape %s of %s, chunks %s -> %s, memory budget %.1f MiB' % (self.shape, self.dtype.name,
+                                                                           self.source_chunks, self.target_chunks,
+                                                                           self.memory_budget / (1024 * 1024))]
+        for index, stage in enumerate(self.stages):
+            block_bytes = _get_num_bytes(stage.block_shape, self.dtype.itemsize)
+            lines.append('stage %d: chunks %s -> %s in %d block(s) of %s, %.1f MiB each'
+                         % (index + 1, stage.read_chunks, stage.write_chunks, len(stage.get_blocks(self.shape)),
+                            stage.block_shape, block_bytes / (1024 * 1024)))
+        return '\n'.join(lines)
+
+
+def plan_rechunk(shape, dtype, source_chunks, target_chunks, memory_budget: int = DEFAULT_MEMORY_BUDGET) \
+        -> RechunkPlan:
+    """
+    Plan the copy of a (time, lat, lon) variable of the given *shape* and *dtype* from *source_chunks* into
+    *target_chunks* using at most *memory_budget* bytes.
+
+    The copy is done in a single stage if a block of whole target chunks covering a source chunk fits into the
+    memory budget, blocks are then grown by whole target chunks, longitude first, as long as they fit. Otherwise
+    the copy is done in two stages through intermediate chunks which are the smaller of the source and target
+    chunk sizes in each dimension, so that the first stage reads the source and the second stage writes the target
+    chunk by chunk.
+
+    :raise ValueError: if not even a source or a target chunk fits into the memory budget.
+    """
+    item_size = numpy.dtype(dtype).itemsize
+    block_budget = memory_budget // _BLOCK_COPIES
+    source_chunks = tuple(min(size, chunk_size) for size, chunk_size in zip(shape, source_chunks))
+    target_chunks = tuple(min(size, chunk_size) for size, chunk_size in zip(shape, target_chunks))
+    block_shape = _get_block_shape(shape, source_chunks, target_chunks, item_size, block_budget)
+    if block_shape is not None:
+        stages = [RechunkStage(source_chunks, target_chunks, block_shape)]
+    else:
+        intermediate_chunks = tuple(min(source_size, target_size)
+                                    for source_size, target_size in zip(source_chunks, target_chunks))
+        block_shape_1 = _get_block_shape(shape, source_chunks, intermediate_chunks, item_size, block_budget)
+        block_shape_2 = _get_block_shape(shape, intermediate_chunks, target_chunks, item_size, block_budget)
+        if block_shape_1 is None or block_shape_2 is None:
+            raise ValueError('memory budget of %d bytes is too small to rechunk %s into %s'
+                             % (memory_budget, source_chunks, target_chunks))
+        stages = [RechunkStage(source_chunks, intermediate_chunks, block_shape_1),
+                  RechunkStage(intermediate_chunks, target_chunks, block_shape_2)]
+    return RechunkPlan(shape, dtype, source_chunks, target_chunks, memory_budget, stages)
+
+
+def rechunk_cube(source_dir: str, target_dir: str, target_config: CubeConfig = None,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET, jobs: int = 1, var_names=None,
+                 work_dir: str = None) -> OrderedDict:
+    """
+    Create a new cube in *target_dir* holding the variables of the cube in *source_dir* with the chunk sizes,
+    codecs and file format of *target_config*. Only periods written to the source cube according to its
+    :py:class:`CubeManifest` are recorded in the manifest of the target cube.
+
+    :param source_dir: The source cube's base directory.
+    :param target_dir: The target cube's base directory, must not exist.
+    :param target_config: The target cube's configuration, defaults to the source cube's configuration.
+           Its grid and time parameters, see :py:data:`GRID_PARAMS`, must equal those of the source cube.
+    :param memory_budget: The maximum number of bytes of the blocks held in memory by each process.
+    :param jobs: The number of processes copying variables, NetCDF year files are copied in parallel as well.
+    :param var_names: The names of the variables to copy, defaults to all variables of the source cube.
+    :param work_dir: The directory of intermediate files, defaults to ``TARGET/rechunk``. Removed when done.
+    :return: An ordered dictionary mapping the variable names to their :py:class:`RechunkPlan`.
+    """
+    source_cube = Cube.open(source_dir)
+    target_config = target_config or source_cube.config
+    for name in GRID_PARAMS:
+        if getattr(source_cube.config, name) != getattr(target_config, name):
+            raise ValueError('target configuration must not change %s' % name)
+    if jobs < 1:
+        raise ValueError('jobs must be a positive integer')
+
+    units = []
+    var_name_to_plan = OrderedDict()
+    try:
+        data = source_cube.data
+        for var_name in (var_names if var_names is not None else data.variable_names):
+            variable = data.variable(var_name)
+            years = sorted(set(int(year) for year in variable['time.year'].values))
+            plan = plan_rechunk((target_config.num_periods_per_year,) + tuple(variable.shape[1:]), variable.dtype,
+                                _get_chunk_sizes(source_cube.config, variable.shape),
+                                _get_chunk_sizes(target_config, variable.shape),
+                                memory_budget=memory_budget)
+            var_name_to_plan[var_name] = plan
+            for line in plan.report().split('\n'):
+                print('%s: %s' % (var_name, line))
+            if target_config.file_format == 'zarr':
+                # The years of a Zarr variable share chunks and must be written by the same process
+                units.append((var_name, years))
+            else:
+                units.extend((var_name, [year]) for year in years)
+    finally:
+        source_cube.close()
+
+    target_cube = Cube.create(target_dir, target_config)
+    target_cube.close()
+    work_dir = work_dir or os.path.join(target_dir, 'rechunk')
+    os.makedirs(work_dir, exist_ok=True)
+    unit_args = [(source_dir, target_dir, var_name, years, memory_budget, work_dir) for var_name, years in units]
+    try:
+        if jobs > 1 and len(units) > 1:
+            with multiprocessing.Pool(min(jobs, len(units))) as pool:
+                for message in pool.imap_unordered(_rechunk_unit, unit_args):
+                    print(message)
+        else:
+            for args in unit_args:
+                print(_rechunk_unit(args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if target_config.time_series_chunks or target_config.overview_levels:
+        target_cube = Cube.open(target_dir)
+        if target_config.time_series_chunks:
+            target_cube.update_time_series(list(var_name_to_plan.keys()))
+        if target_config.overview_levels:
+            target_cube.update_overviews(list(var_name_to_plan.keys()))
+        target_cube.close()
+    return var_name_to_plan
+
+
+class _VariableSource:
+    """
+    Provides the spatial coverage and the variable descriptor of a source cube variable to
+    :py:meth:`Cube._open_variable_dataset` the way a :py:class:`CubeSourceProvider` does.
+    """
+
+    def __init__(self, config, dataset, var_name):
+        spatial_res = config.spatial_res
+        lon = dataset['lon'].values
+        lat = dataset['lat'].values
+        x0 = int(round((float(lon[0]) - 0.5 * spatial_res - config.easting) / spatial_res))
+        y0 = int(round((config.northing - float(lat[0]) - 0.5 * spatial_res) / spatial_res))
+        self.spatial_coverage = x0, y0, len(lon), len(lat)
+        variable = dataset[var_name]
+        encoding = variable.encoding
+        descriptor = dict(variable.attrs)
+        descriptor.update(data_type=encoding.get('dtype', variable.dtype),
+                          fill_value=encoding.get('_FillValue'),
+                          scale_factor=encoding.get('scale_factor', 1.0),
+                          add_offset=encoding.get('add_offset', 0.0))
+        self.variable_descriptors = {var_name: descriptor}
+
+
+def _rechunk_unit(args):
+    """
+    Copy the given years of a variable. Target of the worker processes of :py:func:`rechunk_cube`.
+    """
+    source_dir, target_dir, var_name, years, memory_budget, work_dir = args
+    start_time = time.time()
+    source_cube = Cube.open(source_dir)
+    target_cube = Cube.open(target_dir)
+    target_config = target_cube.config
+    if target_config.comp_threads:
+        set_num_threads(target_config.comp_threads)
+    source_manifest = CubeManifest(source_dir)
+    target_manifest = CubeManifest(target_dir)
+    num_stages = 0
+    try:
+        dataset = source_cube.data.dataset(var_name)
+        variable = dataset[var_name]
+        source = _VariableSource(source_cube.config, dataset, var_name)
+        time_years = variable['time.year'].values
+        for year in years:
+            time_offset = int(numpy.flatnonzero(time_years == year)[0])
+            plan = plan_rechunk((target_config.num_periods_per_year,) + tuple(variable.shape[1:]), variable.dtype,
+                                _get_chunk_sizes(source_cube.config, variable.shape),
+                                _get_chunk_sizes(target_config, variable.shape),
+                                memory_budget=memory_budget)
+            num_stages = len(plan.stages)
+            filename = target_cube._get_variable_filename(var_name, year)
+            target_dataset = target_cube._open_variable_dataset(source, filename, var_name, year, True)
+            try:
+                _copy_year(variable, time_offset, target_dataset.variables[var_name], plan,
+                           os.path.join(work_dir, '%04d_%s.nc' % (year, var_name)))
+            finally:
+                target_dataset.close()
+            for time_index in range(target_config.num_periods_per_year):
+                if source_manifest.is_completed(var_name, year, time_index):
+                    target_manifest.add_pending(filename, var_name, year, time_index)
+            target_manifest.commit(filename)
+    finally:
+        source_cube.close()
+        target_cube.close()
+    return '%s: rechunked %s in %d stage(s), took %f seconds' % (var_name, ', '.join(str(year) for year in years),
+                                                                  num_stages, time.time() - start_time)
+
+
+def _copy_year(variable, time_offset, target_variable, plan, intermediate_file):
+    """
+    Copy the periods of one year from the source *variable*, a ``xarray.DataArray``, starting at *time_offset*
+    to the *target_variable* according to *plan*.
+    """
+    shape = plan.shape
+
+    def read_source(t, y, x):
+        return variable[time_offset + t.start:time_offset + t.stop, y, x].values
+
+    def write_target(t, y, x, block):
+        if block.dtype.kind == 'f':
+            block = numpy.ma.masked_invalid(block, copy=False)
+        target_variable[t, y, x] = block
+
+    if len(plan.stages) == 1:
+        _copy_blocks(plan.stages[0], shape, read_source, write_target)
+        return
+
+    dataset = netCDF4.Dataset(intermediate_file, 'w', format='NETCDF4')
+    try:
+        dataset.set_fill_off()
+        dataset.createDimension('time', shape[0])
+        dataset.createDimension('lat', shape[1])
+        dataset.createDimension('lon', shape[2])
+        intermediate_variable = dataset.createVariable('value', plan.dtype, ('time', 'lat', 'lon'),
+                                                       chunksizes=plan.intermediate_chunks)
+        intermediate_variable.set_auto_maskandscale(False)
+
+        def write_intermediate(t, y, x, block):
+            intermediate_variable[t, y, x] = block
+
+        def read_intermediate(t, y, x):
+            return intermediate_variable[t, y, x]
+
+        _copy_blocks(plan.stages[0], shape, read_source, write_intermediate)
+        _copy_blocks(plan.stages[1], shape, read_intermediate, write_target)
+    finally:
+        dataset.close()
+        os.remove(intermediate_file)
+
+
+def _copy_blocks(stage, shape, read, write):
+    for t, y, x in stage.get_blocks(shape):
+        write(t, y, x, read(t, y, x))
+
+
+def _get_chunk_sizes(config, shape):
+    return tuple(config.chunk_sizes) if config.chunk_sizes else (1,) + tuple(shape[1:])
+
+
+def _get_block_shape(shape, read_chunks, write_chunks, item_size, block_budget):
+    """
+    Return the shape of the blocks of whole *write_chunks* which cover at least one of *read_chunks*, grown by
+    whole *write_chunks* within *block_budget*, or ``None`` if they do not fit.
+    """
+    block_shape = [min(size, write_size * int(math.ceil(read_size / write_size)))
+                   for size, read_size, write_size in zip(shape, read_chunks, write_chunks)]
+    if _get_num_bytes(block_shape, item_size) > block_budget:
+        return None
+    for dim in (2, 1, 0):
+        other_bytes = _get_num_bytes(block_shape[:dim] + block_shape[dim + 1:], item_size)
+        max_size = block_budget // other_bytes
+        block_shape[dim] = min(shape[dim], max(block_shape[dim], max_size // write_chunks[dim] * write_chunks[dim]))
+    return tuple(block_shape)
+
+
+def _get_num_bytes(shape, item_size):
+    num_bytes = item_size
+    for size in shape:
+        num_bytes *= size
+    return num_bytes
@@ -0,0 +1,368 @@
+"""
+Regional and temporal subsets of a cube, written as new self-contained cubes, see :py:func:`subset_cube`.
+
+A subset covers a bounding box of the source cube's grid, the years of a time range and a selection of variables.
+Its ``cube.config`` has the grid offsets and sizes of the bounding box. Variables are copied chunk by chunk:
+if the bounding box starts at chunk boundaries of a variable, its compressed chunks are copied as they are,
+without decompressing and recompressing them, otherwise the packed values of each target chunk are copied.
+Variables, and the year files of NetCDF cubes, are copied in parallel.
+
+Usage::
+
+    cube-gen --subset CUBE --bbox -25,35,45,72 --time 2005-01-01,2009-01-01 --vars LAI,FAPAR -j 4 TARGET
+"""
+
+import math
+import multiprocessing
+import os
+import time
+from datetime import datetime
+
+import netCDF4
+
+from .cube import Cube
+from .cube_config import CubeConfig
+from .cube_manifest import CubeManifest
+
+
+def get_subset_grid_ranges(cube_config: CubeConfig, lon_range=None, lat_range=None, align_chunks: bool = False):
+    """
+    Return the grid index ranges ((x1, x2), (y1, y2)) of the cells of the cube's grid which intersect the given
+    longitude and latitude ranges, *x2* and *y2* being exclusive.
+
+    :param cube_config: The cube's configuration.
+    :param lon_range: The (lon_1, lon_2) range in degrees, the whole grid width if ``None``.
+    :param lat_range: The (lat_1, lat_2) range in degrees, the whole grid height if ``None``.
+    :param align_chunks: If true, the ranges are extended to the chunk boundaries of the cube's *chunk_sizes*,
+           so that all chunks can be copied without recompressing them.
+    :raise ValueError: if the ranges do not intersect the grid.
+    """
+    spatial_res = cube_config.spatial_res
+    x1, x2 = 0, cube_config.grid_width
+    y1, y2 = 0, cube_config.grid_height
+    if lon_range is not None:
+        lon_1, lon_2 = lon_range
+        x1 = max(x1, int(math.floor(round((lon_1 - cube_config.easting) / spatial_res, 6))))
+        x2 = min(x2, int(math.ceil(round((lon_2 - cube_config.easting) / spatial_res, 6))))
+    if lat_range is not None:
+        lat_1, lat_2 = lat_range
+        y1 = max(y1, int(math.floor(round((cube_config.northing - lat_2) / spatial_res, 6))))
+        y2 = min(y2, int(math.ceil(round((cube_config.northing - lat_1) / spatial_res, 6))))
+    if x1 >= x2 or y1 >= y2:
+        raise ValueError('bounding box does not intersect the cube\'s grid')
+    if align_chunks and cube_config.chunk_sizes:
+        _, lat_size, lon_size = cube_config.chunk_sizes
+        x1 = x1 // lon_size * lon_size
+        x2 = min(cube_config.grid_width, int(math.ceil(x2 / lon_size)) * lon_size)
+        y1 = y1 // lat_size * lat_size
+        y2 = min(cube_config.grid_height, int(math.ceil(y2 / lat_size)) * lat_size)
+    return (x1, x2), (y1, y2)
+
+
+def get_subset_config(cube_config: CubeConfig, lon_range=None, lat_range=None, time_range=None, var_names=None,
+                      align_chunks: bool = False) -> CubeConfig:
+    """
+    Return the configuration of a subset of the cube with configuration *cube_config*, see :py:func:`subset_cube`.
+    Chunk sizes exceeding the subset's grid are clipped.
+    """
+    (x1, x2), (y1, y2) = get_subset_grid_ranges(cube_config, lon_range, lat_range, align_chunks=align_chunks)
+    start_time, end_time = cube_config.start_time, cube_config.end_time
+    if time_range is not None:
+        start_time = max(start_time, time_range[0]) if start_time else time_range[0]
+        end_time = min(end_time, time_range[1]) if end_time else time_range[1]
+    if start_time is None or end_time is None or start_time >= end_time:
+        raise ValueError('time range does not intersect the cube\'s time range')
+    kwargs = {name: value for name, value in cube_config.__dict__.items() if not name.startswith('_')}
+    kwargs.update(grid_x0=cube_config.grid_x0 + x1,
+                  grid_y0=cube_config.grid_y0 + y1,
+                  grid_width=x2 - x1,
+                  grid_height=y2 - y1,
+                  start_time=start_time,
+                  end_time=end_time)
+    if var_names is not None:
+        kwargs.update(variables=list(var_names))
+    if cube_config.chunk_sizes:
+        time_size, lat_size, lon_size = cube_config.chunk_sizes
+        kwargs.update(chunk_sizes=(time_size, min(lat_size, y2 - y1), min(lon_size, x2 - x1)))
+    return CubeConfig(**kwargs)
+
+
+def parse_time_range(text: str):
+    """
+    Parse a time range ``<start>,<end>`` of dates ``YYYY-MM-DD`` into a pair of datetime values.
+
+    :raise ValueError: if *text* is invalid.
+    """
+    parts = text.split(',')
+    if len(parts) != 2:
+        raise ValueError('time range must be given as "<start>,<end>"')
+    return tuple(datetime.strptime(part.strip(), '%Y-%m-%d') for part in parts)
+
+
+def subset_cube(source_dir: str, target_dir: str, var_names=None, lon_range=None, lat_range=None, time_range=None,
+                align_chunks: bool = False, jobs: int = 1) -> CubeConfig:
+    """
+    Create a new cube in *target_dir* holding a regional and temporal subset of the cube in *source_dir*.
+    Only periods written to the source cube according to its :py:class:`CubeManifest` are recorded in the manifest
+    of the subset. The subset's time-series layout and overview levels are written if configured.
+
+    :param source_dir: The source cube's base directory.
+    :param target_dir: The subset's base directory, must not exist.
+    :param var_names: The names of the variables to copy, defaults to all variables of the source cube.
+    :param lon_range: The (lon_1, lon_2) range in degrees, the whole grid width if ``None``.
+    :param lat_range: The (lat_1, lat_2) range in degrees, the whole grid height if ``None``.
+    :param time_range: The (start_time, end_time) range given as datetime values. All periods of the years
+           intersecting the time range are copied.
+    :param align_chunks: If true, the bounding box is extended to chunk boundaries, so that all chunks are
+           copied without recompressing them.
+    :param jobs: The number of processes copying variables, NetCDF year files are copied in parallel as well.
+    :return: The subset's configuration.
+    """
+    if jobs < 1:
+        raise ValueError('jobs must be a positive integer')
+    source_cube = Cube.open(source_dir)
+    source_config = source_cube.config
+    source_cube.close()
+    data_dir = os.path.join(source_dir, 'data')
+    all_var_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+    if var_names is None:
+        var_names = all_var_names
+    for var_name in var_names:
+        if var_name not in all_var_names:
+            raise ValueError('variable %s not found in %s' % (var_name, source_dir))
+    target_config = get_subset_config(source_config, lon_range=lon_range, lat_range=lat_range,
+                                      time_range=time_range, var_names=var_names, align_chunks=align_chunks)
+    Cube.create(target_dir, target_config).close()
+
+    time_axis = target_config.time_axis
+    years = list(range(time_axis.start_year, time_axis.end_year + 1))
+    if target_config.file_format == 'zarr':
+        # The years of a Zarr variable share chunks and must be written by the same process
+        units = [(source_dir, target_dir, var_name, years) for var_name in var_names]
+    else:
+        units = [(source_dir, target_dir, var_name, [year]) for var_name in var_names for year in years]
+    if jobs > 1 and len(units) > 1:
+        with multiprocessing.Pool(min(jobs, len(units))) as pool:
+            for message in pool.imap_unordered(_subset_unit, units):
+                print(message)
+    else:
+        for unit in units:
+            print(_subset_unit(unit))
+
+    if target_config.time_series_chunks or target_config.overview_levels:
+        target_cube = Cube.open(target_dir)
+        target_var_names = [var_name for var_name in var_names
+                            if os.path.isdir(os.path.join(target_dir, 'data', var_name))]
+        if target_config.time_series_chunks:
+            target_cube.update_time_series(target_var_names)
+        if target_config.overview_levels:
+            target_cube.update_overviews(target_var_names)
+        target_cube.close()
+    return target_config
+
+
+class _SubsetSource:
+    """
+    Provides the spatial coverage and the variable descriptor of a subset variable to
+    :py:meth:`Cube._open_variable_dataset` the way a :py:class:`CubeSourceProvider` does, together with the
+    (lat, lon) offset of the subset in the source variable.
+    """
+
+    def __init__(self, spatial_coverage, variable_descriptors, source_offset):
+        self.spatial_coverage = spatial_coverage
+        self.variable_descriptors = variable_descriptors
+        self.source_offset = source_offset
+
+
+def _get_subset_source(source_config, target_config, var_name, lon_0, lat_0, width, height, attrs, dtype,
+                       fill_value):
+    """
+    Return the :py:class:`_SubsetSource` of a source variable of *width* x *height* cells whose upper left corner
+    is (*lon_0*, *lat_0*), or ``None`` if it does not intersect the subset.
+    """
+    spatial_res = source_config.spatial_res
+    source_x0 = int(round((float(lon_0) - source_config.easting) / spatial_res))
+    source_y0 = int(round((source_config.northing - float(lat_0)) / spatial_res))
+    x0 = target_config.grid_x0 - source_config.grid_x0
+    y0 = target_config.grid_y0 - source_config.grid_y0
+    x1, x2 = max(x0, source_x0), min(x0 + target_config.grid_width, source_x0 + width)
+    y1, y2 = max(y0, source_y0), min(y0 + target_config.grid_height, source_y0 + height)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    descriptor = {name: value for name, value in attrs.items()
+                  if name not in {'_FillValue', '_ARRAY_DIMENSIONS', 'scale_factor', 'add_offset'}}
+    descriptor.update(data_type=dtype,
+                      fill_value=fill_value,
+                      scale_factor=attrs.get('scale_factor', 1.0),
+                      add_offset=attrs.get('add_offset', 0.0))
+    return _SubsetSource((x1 - x0, y1 - y0, x2 - x1, y2 - y1), {var_name: descriptor}, (y1 - source_y0, x1 - source_x0))
+
+
+def _subset_unit(args):
+    """
+    Copy the given years of a variable. Target of the worker processes of :py:func:`subset_cube`.
+    """
+    source_dir, target_dir, var_name, years = args
+    start_time = time.time()
+    source_cube = Cube.open(source_dir)
+    target_cube = Cube.open(target_dir)
+    source_manifest = CubeManifest(source_dir)
+    target_manifest = CubeManifest(target_dir)
+    num_copied = 0
+    num_rewritten = 0
+    try:
+        if target_cube.config.file_format == 'zarr':
+            filenames = [(target_cube._get_variable_filename(var_name, year), year) for year in years]
+            result = _subset_zarr_variable(source_cube, target_cube, var_name, years)
+        else:
+            filenames = [(target_cube._get_variable_filename(var_name, years[0]), years[0])]
+            result = _subset_netcdf_file(source_cube, target_cube, var_name, years[0])
+        if result is None:
+            return '%s: no data in the subset for %s' % (var_name, ', '.join(str(year) for year in years))
+        num_copied, num_rewritten = result
+        for filename, year in filenames:
+            for time_index in range(target_cube.config.num_periods_per_year):
+                if source_manifest.is_completed(var_name, year, time_index):
+                    target_manifest.add_pending(filename, var_name, year, time_index)
+            target_manifest.commit(filename)
+    finally:
+        source_cube.close()
+        target_cube.close()
+    return '%s: subset of %s written, %d chunk(s) copied, %d chunk(s) rewritten, took %f seconds' \
+           % (var_name, ', '.join(str(year) for year in years), num_copied, num_rewritten, time.time() - start_time)
+
+
+def _subset_netcdf_file(source_cube, target_cube, var_name, year):
+    source_file = os.path.join(source_cube.base_dir, 'data', var_name, '%04d_%s.nc' % (year, var_name))
+    if not os.path.exists(source_file):
+        return None
+    filename = target_cube._get_variable_filename(var_name, year)
+    target_file = os.path.join(target_cube.base_dir, 'data', var_name, filename)
+    with netCDF4.Dataset(source_file) as source_dataset:
+        source_variable = source_dataset.variables[var_name]
+        _, height, width = source_variable.shape
+        attrs = {name: source_variable.getncattr(name) for name in source_variable.ncattrs()}
+        source = _get_subset_source(source_cube.config, target_cube.config, var_name,
+                                    source_dataset.variables['lon_bnds'][0, 0],
+                                    source_dataset.variables['lat_bnds'][0, 1], width, height, attrs,
+                                    source_variable.dtype, attrs.get('_FillValue'))
+        if source is None:
+            return None
+        target_dataset = target_cube._open_variable_dataset(source, filename, var_name, year, True)
+        try:
+            target_variable = target_dataset.variables[var_name]
+            source_chunks = source_variable.chunking()
+            target_chunks = target_variable.chunking()
+            copy_chunks = source_chunks != 'contiguous' and source_chunks == target_chunks \
+                and source_variable.filters() == target_variable.filters() \
+                and _is_aligned(source.source_offset, target_chunks[1:]) and _has_direct_chunk_io()
+            if not copy_chunks:
+                # Packed values are copied as they are
+                source_variable.set_auto_maskandscale(False)
+                target_variable.set_auto_maskandscale(False)
+                chunks = target_chunks if target_chunks != 'contiguous' else (1,) + target_variable.shape[1:]
+                return 0, _copy_blocks(source_variable, target_variable, (0,) + source.source_offset, chunks)
+        finally:
+            target_dataset.close()
+    return _copy_netcdf_chunks(source_file, target_file, var_name, source.source_offset), 0
+
+
+def _copy_netcdf_chunks(source_file, target_file, var_name, source_offset):
+    """
+    Copy the compressed chunks of variable *var_name* from *source_file* to *target_file* using HDF5's direct
+    chunk I/O, unallocated chunks are skipped.
+    """
+    import h5py
+
+    num_copied = 0
+    with h5py.File(source_file, 'r') as source_file, h5py.File(target_file, 'r+') as target_file:
+        source_variable = source_file[var_name]
+        target_variable = target_file[var_name]
+        y_offset, x_offset = source_offset
+        for t, y, x in _get_chunk_offsets(target_variable.shape, target_variable.chunks):
+            offset = (t, y + y_offset, x + x_offset)
+            if source_variable.id.get_chunk_info_by_coord(offset).byte_offset is None:
+                continue
+            filter_mask, chunk = source_variable.id.read_direct_chunk(offset)
+            target_variable.id.write_direct_chunk((t, y, x), chunk, filter_mask)
+            num_copied += 1
+    return num_copied
+
+
+def _subset_zarr_variable(source_cube, target_cube, var_name, years):
+    import zarr
+
+    source_group = zarr.open_group(os.path.join(source_cube.base_dir, 'data', var_name), mode='r')
+    source_array = source_group[var_name]
+    _, height, width = source_array.shape
+    attrs = source_array.attrs.asdict()
+    source = _get_subset_source(source_cube.config, target_cube.config, var_name, source_group['lon_bnds'][0, 0],
+                                source_group['lat_bnds'][0, 1], width, height, attrs, source_array.dtype,
+                                source_array.fill_value)
+    if source is None:
+        return None
+    folder = os.path.join(target_cube.base_dir, 'data', var_name)
+    os.makedirs(folder, exist_ok=True)
+    target_cube._open_zarr_dataset(source, folder, var_name, years[0]).close()
+    target_group = zarr.open_group(folder, mode='a')
+    target_array = target_group[var_name]
+    time_offset = source_cube.config.time_axis.get_global_index(years[0], 0)
+    source_offset = (time_offset,) + source.source_offset
+    copy_chunks = source_array.chunks == target_array.chunks and source_array.dtype == target_array.dtype \
+        and source_array.compressor == target_array.compressor and source_array.filters == target_array.filters \
+        and _is_aligned(source_offset, target_array.chunks)
+    num_copied = 0
+    num_rewritten = 0
+    if copy_chunks:
+        chunk_offset = tuple(offset // size for offset, size in zip(source_offset, target_array.chunks))
+        for offset in _get_chunk_offsets(target_array.shape, target_array.chunks):
+            index = tuple(o // size for o, size in zip(offset, target_array.chunks))
+            source_key = _get_zarr_chunk_key(source_array, tuple(i + o for i, o in zip(index, chunk_offset)))
+            if source_key in source_array.store:
+                target_array.store[_get_zarr_chunk_key(target_array, index)] = source_array.store[source_key]
+                num_copied += 1
+    else:
+        num_rewritten = _copy_blocks(source_array, target_array, source_offset, target_array.chunks)
+    if hasattr(zarr, 'consolidate_metadata'):
+        zarr.consolidate_metadata(target_group.store)
+    return num_copied, num_rewritten
+
+
+def _copy_blocks(source_variable, target_variable, source_offset, chunks):
+    """
+    Copy *target_variable* chunk by chunk from *source_variable* starting at the (time, lat, lon) *source_offset*.
+    """
+    num_blocks = 0
+    t_offset, y_offset, x_offset = source_offset
+    shape = target_variable.shape
+    for t, y, x in _get_chunk_offsets(shape, chunks):
+        t2, y2, x2 = min(t + chunks[0], shape[0]), min(y + chunks[1], shape[1]), min(x + chunks[2], shape[2])
+        target_variable[t:t2, y:y2, x:x2] = source_variable[t_offset + t:t_offset + t2,
+                                                            y_offset + y:y_offset + y2,
+                                                            x_offset + x:x_offset + x2]
+        num_blocks += 1
+    return num_blocks
+
+
+def _get_chunk_offsets(shape, chunks):
+    return [(t, y, x)
+            for t in range(0, shape[0], chunks[0])
+            for y in range(0, shape[1], chunks[1])
+            for x in range(0, shape[2], chunks[2])]
+
+
+def _get_zarr_chunk_key(array, index):
+    return (array.path + '/' if array.path else '') + '.'.join(str(i) for i in index)
+
+
+def _is_aligned(offsets, chunks):
+    return all(offset % size == 0 for offset, size in zip(offsets, chunks))
+
+
+def _has_direct_chunk_io():
+    try:
+        import h5py
+    except ImportError:
+        return False
+    # Testing whether a chunk is allocated requires h5py >= 3.0
+    return hasattr(h5py.h5d.DatasetID, 'get_chunk_info_by_coord')
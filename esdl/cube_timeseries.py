@@ -0,0 +1,232 @@
+"""
+The time-series layout of a cube, a second copy of each variable whose chunks span all periods of the cube for
+small (lat, lon) blocks, see the *time_series_chunks* parameter of :py:class:`CubeConfig`.
+
+The year files in ``TARGET/data`` are chunked for map reads, while the copies in ``TARGET/timeseries`` serve long
+pixel time series by reading a single chunk per block. The copy of a variable is written by
+:py:func:`write_time_series` from the variable's data, so it is only valid as long as it is newer than all of the
+variable's files, see :py:func:`is_time_series_current`. :py:class:`CubeDataAccess` reads from the layout whose
+chunks are touched less by a request, see :py:func:`count_touched_chunks`.
+"""
+
+import glob
+import os
+import shutil
+import time
+
+import netCDF4
+import numpy
+
+from .cube_config import CubeConfig
+from .cube_writer import INCOMPLETE_ATTR_NAME
+
+#: The directory of the time-series layout within the cube's base directory.
+TIME_SERIES_DIR = 'timeseries'
+
+#: The default maximum number of bytes of a block copied by :py:func:`write_time_series`.
+DEFAULT_COPY_BYTES = 256 * 1024 * 1024
+
+_COORD_VAR_NAMES = ('lat', 'lat_bnds', 'lon', 'lon_bnds')
+
+
+def get_time_series_path(base_dir: str, var_name: str, file_format: str) -> str:
+    """
+    Return the path of the time-series copy of variable *var_name*, a Zarr group for 'zarr' cubes and a NetCDF4
+    file otherwise.
+    """
+    if file_format == 'zarr':
+        return os.path.join(base_dir, TIME_SERIES_DIR, var_name)
+    return os.path.join(base_dir, TIME_SERIES_DIR, var_name + '.nc')
+
+
+def is_time_series_current(base_dir: str, var_name: str, file_format: str) -> bool:
+    """
+    Test whether the time-series copy of variable *var_name* exists and is newer than all of its files
+    in ``TARGET/data``.
+    """
+    path = get_time_series_path(base_dir, var_name, file_format)
+    if not os.path.exists(path):
+        return False
+    return os.path.getmtime(path) >= get_newest_mtime(os.path.join(base_dir, 'data', var_name))
+
+
+def count_touched_chunks(index_ranges, chunk_sizes, time_block_size: int = None) -> int:
+    """
+    Return the number of chunks touched by reading the (time, lat, lon) index ranges *index_ranges*, given as
+    pairs of inclusive start and end indices, from a variable with the given *chunk_sizes*.
+    If *time_block_size* is given, the time dimension is split into blocks of this size, e.g. into year files,
+    and time chunks do not span blocks.
+    """
+    (time_1, time_2), lat_range, lon_range = index_ranges
+    if time_block_size:
+        num_time_chunks = 0
+        for block_start in range(time_1 - time_1 % time_block_size, time_2 + 1, time_block_size):
+            num_time_chunks += _count_range_chunks(max(time_1, block_start) - block_start,
+                                                   min(time_2, block_start + time_block_size - 1) - block_start,
+                                                   chunk_sizes[0])
+    else:
+        num_time_chunks = _count_range_chunks(time_1, time_2, chunk_sizes[0])
+    return num_time_chunks * _count_range_chunks(lat_range[0], lat_range[1], chunk_sizes[1]) * \
+           _count_range_chunks(lon_range[0], lon_range[1], chunk_sizes[2])
+
+
+def get_newest_mtime(path) -> float:
+    """
+    Return the newest modification time of the files in directory *path* and its subdirectories, 0 if there are none.
+    """
+    mtime = 0.0
+    for root, _, files in os.walk(path):
+        for file in files:
+            mtime = max(mtime, os.path.getmtime(os.path.join(root, file)))
+    return mtime
+
+
+def write_time_series(base_dir: str, cube_config: CubeConfig, var_name: str,
+                      max_copy_bytes: int = DEFAULT_COPY_BYTES) -> str:
+    """
+    Write the time-series copy of variable *var_name* from its files in ``TARGET/data``, replacing an existing
+    copy. The copy is written to a temporary path first and then renamed, so readers never see a partial copy.
+
+    :param base_dir: The cube's base directory.
+    :param cube_config: The cube's configuration, its *time_series_chunks* must be given.
+    :param var_name: The variable name.
+    :param max_copy_bytes: The maximum number of bytes of a (time, lat, lon) block read at once.
+    :return: The path of the copy.
+    """
+    if not cube_config.time_series_chunks:
+        raise ValueError('cube configuration has no time_series_chunks')
+    path = get_time_series_path(base_dir, var_name, cube_config.file_format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    _remove(temp_path)
+    if cube_config.file_format == 'zarr':
+        _write_zarr_time_series(base_dir, cube_config, var_name, temp_path, max_copy_bytes)
+    else:
+        _write_netcdf_time_series(base_dir, cube_config, var_name, temp_path, max_copy_bytes)
+    _remove(path)
+    os.rename(temp_path, path)
+    # The copy must be newer than the files it has been copied from, also on file systems with coarse mtimes
+    now = max(time.time(), get_newest_mtime(os.path.join(base_dir, 'data', var_name)))
+    os.utime(path, (now, now))
+    return path
+
+
+def _write_netcdf_time_series(base_dir, cube_config, var_name, path, max_copy_bytes):
+    time_axis = cube_config.time_axis
+    year_files = []
+    for file in sorted(glob.glob(os.path.join(base_dir, 'data', var_name, '*_%s.nc' % var_name))):
+        year = int(os.path.basename(file)[:4])
+        if time_axis.start_year <= year <= time_axis.end_year:
+            year_files.append((time_axis.get_global_index(year, 0), file))
+    if not year_files:
+        raise ValueError('variable %s has no data' % var_name)
+
+    source_datasets = [(time_offset, netCDF4.Dataset(file)) for time_offset, file in year_files]
+    try:
+        first_dataset = source_datasets[0][1]
+        source_variable = first_dataset.variables[var_name]
+        _, height, width = source_variable.shape
+        lat_size, lon_size = cube_config.time_series_chunks
+        chunk_sizes = (time_axis.size, min(lat_size, height), min(lon_size, width))
+
+        # Chunks require NetCDF4, also for NetCDF3 cubes
+        file_format = cube_config.file_format if cube_config.file_format.startswith('NETCDF4') else 'NETCDF4_CLASSIC'
+        dataset = netCDF4.Dataset(path, 'w', format=file_format)
+        try:
+            dataset.setncatts({name: first_dataset.getncattr(name) for name in first_dataset.ncattrs()
+                               if name != INCOMPLETE_ATTR_NAME})
+            dataset.createDimension('bnds', 2)
+            dataset.createDimension('time', time_axis.size)
+            dataset.createDimension('lat', height)
+            dataset.createDimension('lon', width)
+
+            var_time_bnds = dataset.createVariable('time_bnds', 'f8', ('time', 'bnds'), fill_value=-9999.0)
+            var_time_bnds.setncatts(_get_attrs(first_dataset.variables['time_bnds']))
+            var_time_bnds[:, :] = numpy.stack([time_axis.lower_bounds, time_axis.upper_bounds], axis=1)
+            var_time = dataset.createVariable('time', 'f8', ('time',), fill_value=-9999.0)
+            var_time.setncatts(_get_attrs(first_dataset.variables['time']))
+            var_time[:] = time_axis.times
+            for name in _COORD_VAR_NAMES:
+                source_coord_var = first_dataset.variables[name]
+                coord_var = dataset.createVariable(name, source_coord_var.dtype, source_coord_var.dimensions)
+                coord_var.setncatts(_get_attrs(source_coord_var))
+                coord_var[:] = source_coord_var[:]
+
+            fill_value = getattr(source_variable, '_FillValue', None)
+            variable = dataset.createVariable(var_name, source_variable.dtype, ('time', 'lat', 'lon'),
+                                              fill_value=fill_value, chunksizes=chunk_sizes,
+                                              **cube_config.get_codec(var_name).get_netcdf_kwargs(file_format))
+            variable.setncatts(_get_attrs(source_variable))
+            # Packed values are copied as they are
+            variable.set_auto_maskandscale(False)
+            for _, source_dataset in source_datasets:
+                source_dataset.variables[var_name].set_auto_maskandscale(False)
+
+            for y, x, block_height, block_width in _get_copy_blocks(chunk_sizes, height, width,
+                                                                    source_variable.dtype, max_copy_bytes):
+                block = numpy.empty((time_axis.size, block_height, block_width), dtype=source_variable.dtype)
+                block[...] = fill_value if fill_value is not None else 0
+                for time_offset, source_dataset in source_datasets:
+                    source_block = source_dataset.variables[var_name][:, y:y + block_height, x:x + block_width]
+                    block[time_offset:time_offset + source_block.shape[0]] = source_block
+                variable[:, y:y + block_height, x:x + block_width] = block
+        finally:
+            dataset.close()
+    finally:
+        for _, source_dataset in source_datasets:
+            source_dataset.close()
+
+
+def _write_zarr_time_series(base_dir, cube_config, var_name, path, max_copy_bytes):
+    import zarr
+
+    source_group = zarr.open_group(os.path.join(base_dir, 'data', var_name), mode='r')
+    source_array = source_group[var_name]
+    time_size, height, width = source_array.shape
+    lat_size, lon_size = cube_config.time_series_chunks
+    chunk_sizes = (time_size, min(lat_size, height), min(lon_size, width))
+
+    group = zarr.open_group(path, mode='w')
+    group.attrs.update(source_group.attrs.asdict())
+    for name in ('time', 'time_bnds') + _COORD_VAR_NAMES:
+        source_coord_array = source_group[name]
+        coord_array = group.create_dataset(name, data=source_coord_array[...], chunks=source_coord_array.chunks,
+                                           fill_value=source_coord_array.fill_value)
+        coord_array.attrs.update(source_coord_array.attrs.asdict())
+    array = group.create_dataset(var_name, shape=source_array.shape, chunks=chunk_sizes, dtype=source_array.dtype,
+                                 fill_value=source_array.fill_value, compressor=source_array.compressor,
+                                 filters=source_array.filters)
+    array.attrs.update(source_array.attrs.asdict())
+    for y, x, block_height, block_width in _get_copy_blocks(chunk_sizes, height, width, source_array.dtype,
+                                                            max_copy_bytes):
+        array[:, y:y + block_height, x:x + block_width] = source_array[:, y:y + block_height, x:x + block_width]
+    if hasattr(zarr, 'consolidate_metadata'):
+        zarr.consolidate_metadata(group.store)
+
+
+def _get_copy_blocks(chunk_sizes, height, width, dtype, max_copy_bytes):
+    """
+    Return the blocks (y, x, height, width) of whole chunks of at most *max_copy_bytes*, but at least one chunk.
+    """
+    time_size, lat_size, lon_size = chunk_sizes
+    chunk_bytes = time_size * lat_size * lon_size * numpy.dtype(dtype).itemsize
+    num_chunks = max(1, max_copy_bytes // chunk_bytes)
+    block_width = min(width, lon_size * num_chunks)
+    block_height = min(height, lat_size * max(1, num_chunks // _count_range_chunks(0, width - 1, lon_size)))
+    return [(y, x, min(block_height, height - y), min(block_width, width - x))
+            for y in range(0, height, block_height) for x in range(0, width, block_width)]
+
+
+def _count_range_chunks(index_1, index_2, chunk_size):
+    return index_2 // chunk_size - index_1 // chunk_size + 1
+
+
+def _get_attrs(variable):
+    return {name: variable.getncattr(name) for name in variable.ncattrs() if name != '_FillValue'}
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
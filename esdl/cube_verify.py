@@ -0,0 +1,346 @@
+"""
+Integrity and consistency checks of the variable files of a cube, see :py:func:`verify_cube`.
+
+Every year file ``TARGET/data/<var_name>/<year>_<var_name>.nc``, or every year of the variable groups of 'zarr'
+cubes, is checked in a process of its own for
+
+* dimensions and coordinates which fit the cube's grid and the number of periods per year,
+* time bounds equal to the cube's periods of the year,
+* being left incomplete by an interrupted update,
+* the readability of every chunk and
+* the fraction of cells of each period holding the fill value.
+
+Quick scans read only the file headers and the chunk indexes. Instead of decompressing every chunk, they check
+that all allocated chunks lie within their file, and the fill fractions are those of the unallocated chunks,
+which hold nothing but fill values.
+
+Usage::
+
+    cube-gen --verify -j 16 TARGET
+    cube-gen --verify --quick TARGET
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+
+import netCDF4
+import numpy
+
+from .cube_config import CubeConfig
+from .cube_writer import INCOMPLETE_ATTR_NAME
+
+
+def verify_cube(base_dir: str, var_names=None, quick: bool = False, jobs: int = None,
+                report_file: str = None) -> OrderedDict:
+    """
+    Check the variable files of the cube in *base_dir* and write a report of all errors, warnings and fill
+    fractions found to *report_file* as JSON object.
+
+    :param base_dir: The cube's base directory.
+    :param var_names: The names of the variables to check, defaults to all variables of the cube.
+    :param quick: If true, only headers and chunk indexes are read, chunks are not decompressed.
+    :param jobs: The number of processes checking files, defaults to the number of CPUs.
+    :param report_file: The report file, defaults to ``TARGET/reports/verify-<time>.json``.
+    :return: The report as ordered dictionary, its 'files' entry holds the results of each year file.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs < 1:
+        raise ValueError('jobs must be a positive integer')
+    start_time = time.time()
+    config = CubeConfig.load(os.path.join(base_dir, 'cube.config'))
+    data_dir = os.path.join(base_dir, 'data')
+    all_var_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+    if var_names is None:
+        var_names = all_var_names
+    for var_name in var_names:
+        if var_name not in all_var_names:
+            raise ValueError('variable %s not found in %s' % (var_name, base_dir))
+
+    units = []
+    for var_name in var_names:
+        if config.file_format == 'zarr':
+            time_axis = config.time_axis
+            units.extend((base_dir, var_name, year, quick)
+                         for year in range(time_axis.start_year, time_axis.end_year + 1))
+        else:
+            for file in sorted(glob.glob(os.path.join(data_dir, var_name, '*_%s.nc' % var_name))):
+                units.append((base_dir, var_name, int(os.path.basename(file)[:4]), quick))
+
+    results = []
+    if jobs > 1 and len(units) > 1:
+        with multiprocessing.Pool(min(jobs, len(units))) as pool:
+            for result in pool.imap(_verify_unit, units):
+                _print_result(result)
+                results.append(result)
+    else:
+        for unit in units:
+            result = _verify_unit(unit)
+            _print_result(result)
+            results.append(result)
+
+    report = OrderedDict()
+    report['base_dir'] = os.path.abspath(base_dir)
+    report['time'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_time))
+    report['quick'] = quick
+    report['num_files'] = len(results)
+    report['num_errors'] = sum(len(result['errors']) for result in results)
+    report['num_warnings'] = sum(len(result['warnings']) for result in results)
+    report['seconds'] = time.time() - start_time
+    report['files'] = results
+    if report_file is None:
+        reports_dir = os.path.join(base_dir, 'reports')
+        os.makedirs(reports_dir, exist_ok=True)
+        report_file = os.path.join(reports_dir, 'verify-%s.json' % time.strftime('%Y%m%dT%H%M%S',
+                                                                                 time.localtime(start_time)))
+    with open(report_file, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print('%d file(s) checked, %d error(s), %d warning(s), took %f seconds, report written to %s'
+          % (report['num_files'], report['num_errors'], report['num_warnings'], report['seconds'], report_file))
+    return report
+
+
+def _print_result(result):
+    for error in result['errors']:
+        print('%s: error: %s' % (result['path'], error))
+    for warning in result['warnings']:
+        print('%s: warning: %s' % (result['path'], warning))
+
+
+def _verify_unit(args):
+    """
+    Check one year of a variable. Target of the worker processes of :py:func:`verify_cube`.
+    """
+    base_dir, var_name, year, quick = args
+    start_time = time.time()
+    config = CubeConfig.load(os.path.join(base_dir, 'cube.config'))
+    if config.file_format == 'zarr':
+        path = os.path.join('data', var_name)
+    else:
+        path = os.path.join('data', var_name, '%04d_%s.nc' % (year, var_name))
+    result = OrderedDict()
+    result['path'] = path
+    result['var_name'] = var_name
+    result['year'] = year
+    result['errors'] = []
+    result['warnings'] = []
+    result['fill_fractions'] = None
+    if config.file_format == 'zarr':
+        _verify_zarr_year(config, os.path.join(base_dir, path), var_name, year, quick, result)
+    else:
+        _verify_netcdf_file(config, os.path.join(base_dir, path), var_name, year, quick, result)
+    result['seconds'] = time.time() - start_time
+    return result
+
+
+def _verify_netcdf_file(config, file, var_name, year, quick, result):
+    errors = result['errors']
+    try:
+        dataset = netCDF4.Dataset(file)
+    except (OSError, IOError, RuntimeError) as e:
+        errors.append('file cannot be opened: %s' % e)
+        return
+    try:
+        if INCOMPLETE_ATTR_NAME in dataset.ncattrs():
+            errors.append('file has been left incomplete by an interrupted update')
+        missing_names = [name for name in (var_name, 'time_bnds', 'lon', 'lat') if name not in dataset.variables]
+        if missing_names:
+            errors.append('variable(s) %s missing' % ', '.join(missing_names))
+            return
+        variable = dataset.variables[var_name]
+        num_errors = len(errors)
+        _check_grid(config, variable.dimensions, variable.shape, config.num_periods_per_year,
+                    dataset.variables['lon'][:], dataset.variables['lat'][:], errors)
+        _check_time_bounds(config, year, dataset.variables['time_bnds'][:], errors)
+        if len(errors) > num_errors:
+            return
+        chunks = variable.chunking()
+        if chunks == 'contiguous' or chunks is None:
+            chunks = (1,) + tuple(variable.shape[1:])
+        elif config.chunk_sizes and tuple(chunks) != _clip_chunks(config.chunk_sizes, variable.shape):
+            result['warnings'].append('chunks %s differ from the configured chunk_sizes %s'
+                                      % (tuple(chunks), tuple(config.chunk_sizes)))
+        if quick:
+            if dataset.data_model.startswith('NETCDF4') and variable.chunking() != 'contiguous':
+                dataset.close()
+                dataset = None
+                _scan_hdf5_chunk_index(file, var_name, tuple(chunks), result)
+            return
+        variable.set_auto_maskandscale(False)
+        blocks = _get_chunk_blocks(0, variable.shape[0], variable.shape[1], variable.shape[2], chunks)
+        result['fill_fractions'] = _read_blocks(variable, blocks, 0, variable.shape,
+                                                _get_netcdf_fill_value(variable), errors)
+    finally:
+        if dataset is not None:
+            dataset.close()
+
+
+def _scan_hdf5_chunk_index(file, var_name, chunks, result):
+    """
+    Check that the allocated chunks of variable *var_name* lie within *file* and set the fill fractions of the
+    unallocated chunks.
+    """
+    try:
+        import h5py
+    except ImportError:
+        h5py = None
+    # Iterating the chunk index requires h5py >= 2.10
+    if h5py is None or not hasattr(h5py.h5d.DatasetID, 'get_chunk_info'):
+        result['warnings'].append('chunk index not checked, requires h5py >= 2.10')
+        return
+    file_size = os.path.getsize(file)
+    with h5py.File(file, 'r') as h5_file:
+        dataset_id = h5_file[var_name].id
+        num_periods, height, width = dataset_id.shape
+        num_allocated = numpy.zeros(num_periods, dtype=numpy.int64)
+        for index in range(dataset_id.get_num_chunks()):
+            info = dataset_id.get_chunk_info(index)
+            t, y, x = info.chunk_offset
+            if info.byte_offset is None or info.byte_offset + info.size > file_size:
+                result['errors'].append('chunk at %s lies beyond the end of the file' % ((t, y, x),))
+                continue
+            num_allocated[t:t + chunks[0]] += min(chunks[1], height - y) * min(chunks[2], width - x)
+    result['fill_fractions'] = (1.0 - num_allocated / float(height * width)).tolist()
+
+
+def _verify_zarr_year(config, folder, var_name, year, quick, result):
+    import zarr
+
+    errors = result['errors']
+    time_axis = config.time_axis
+    try:
+        group = zarr.open_group(folder, mode='r')
+    except (ValueError, KeyError, OSError, IOError) as e:
+        errors.append('group cannot be opened: %s' % e)
+        return
+    missing_names = [name for name in (var_name, 'time_bnds', 'lon', 'lat') if name not in group]
+    if missing_names:
+        errors.append('array(s) %s missing' % ', '.join(missing_names))
+        return
+    array = group[var_name]
+    _check_grid(config, tuple(array.attrs.get('_ARRAY_DIMENSIONS', ())), array.shape, time_axis.size,
+                group['lon'][:], group['lat'][:], errors)
+    year_slice = time_axis.get_year_slice(year)
+    _check_time_bounds(config, year, group['time_bnds'][year_slice], errors)
+    if errors:
+        return
+    _, height, width = array.shape
+    blocks = _get_chunk_blocks(year_slice.start, year_slice.stop, height, width, array.chunks)
+    if quick:
+        num_allocated = numpy.zeros(config.num_periods_per_year, dtype=numpy.int64)
+        for t, y, x in blocks:
+            index = (t.start // array.chunks[0], y.start // array.chunks[1], x.start // array.chunks[2])
+            if _get_zarr_chunk_key(array, index) in array.store:
+                num_allocated[t.start - year_slice.start:t.stop - year_slice.start] += \
+                    (y.stop - y.start) * (x.stop - x.start)
+        result['fill_fractions'] = (1.0 - num_allocated / float(height * width)).tolist()
+        return
+    result['fill_fractions'] = _read_blocks(array, blocks, year_slice.start,
+                                            (config.num_periods_per_year, height, width), array.fill_value, errors)
+
+
+def _check_grid(config, dimensions, shape, num_periods, lon, lat, errors):
+    """
+    Check the dimensions, the shape and the coordinates of a variable against the cube's grid.
+    """
+    if tuple(dimensions) != ('time', 'lat', 'lon'):
+        errors.append('dimensions %s differ from (time, lat, lon)' % (tuple(dimensions),))
+        return
+    if shape[0] != num_periods:
+        errors.append('%d period(s) found, expected %d' % (shape[0], num_periods))
+    if (len(lat), len(lon)) != tuple(shape[1:]):
+        errors.append('coordinate sizes (%d, %d) differ from the variable\'s shape %s'
+                      % (len(lat), len(lon), tuple(shape)))
+        return
+    spatial_res = config.spatial_res
+    lon = numpy.ma.getdata(lon).astype(numpy.float64)
+    lat = numpy.ma.getdata(lat).astype(numpy.float64)
+    if not numpy.allclose(numpy.diff(lon), spatial_res, atol=1e-4) or \
+            not numpy.allclose(numpy.diff(lat), -spatial_res, atol=1e-4):
+        errors.append('coordinates are not spaced by the spatial resolution %s' % spatial_res)
+        return
+    x0 = (lon[0] - 0.5 * spatial_res - config.easting) / spatial_res
+    y0 = (config.northing - lat[0] - 0.5 * spatial_res) / spatial_res
+    if abs(x0 - round(x0)) > 1e-3 or abs(y0 - round(y0)) > 1e-3:
+        errors.append('coordinates are not aligned with the grid cells')
+        return
+    x0, y0 = int(round(x0)), int(round(y0))
+    if x0 < 0 or y0 < 0 or x0 + len(lon) > config.grid_width or y0 + len(lat) > config.grid_height:
+        errors.append('coverage (x0=%d, y0=%d, width=%d, height=%d) exceeds the grid of %d x %d cells'
+                      % (x0, y0, len(lon), len(lat), config.grid_width, config.grid_height))
+
+
+def _check_time_bounds(config, year, time_bnds, errors):
+    """
+    Check the time bounds of a year against the cube's periods of the *year*.
+    """
+    time_axis = config.time_axis
+    if not time_axis.start_year <= year <= time_axis.end_year:
+        errors.append('year %d is outside of the cube\'s time range' % year)
+        return
+    year_slice = time_axis.get_year_slice(year)
+    expected = numpy.stack([time_axis.lower_bounds[year_slice], time_axis.upper_bounds[year_slice]], axis=1)
+    time_bnds = numpy.ma.getdata(time_bnds)
+    if time_bnds.shape != expected.shape:
+        errors.append('%d time bounds found, expected %d' % (time_bnds.shape[0], expected.shape[0]))
+    elif not numpy.allclose(time_bnds, expected):
+        errors.append('time bounds differ from the cube\'s periods of %d' % year)
+
+
+def _read_blocks(variable, blocks, time_offset, shape, fill_value, errors):
+    """
+    Read the *blocks* of *variable*, record the chunks which cannot be read in *errors* and return the fraction
+    of cells holding the fill value for each of the *shape[0]* periods from *time_offset*. The cells of unreadable
+    chunks are counted as fill values.
+    """
+    num_periods, height, width = shape
+    num_filled = numpy.zeros(num_periods, dtype=numpy.int64)
+    for t, y, x in blocks:
+        periods = slice(t.start - time_offset, t.stop - time_offset)
+        try:
+            block = numpy.ma.getdata(variable[t, y, x])
+        except (RuntimeError, OSError, IOError, ValueError) as e:
+            errors.append('chunk at %s cannot be read: %s' % ((t.start, y.start, x.start), e))
+            num_filled[periods] += (y.stop - y.start) * (x.stop - x.start)
+            continue
+        if fill_value is not None and not (block.dtype.kind == 'f' and numpy.isnan(fill_value)):
+            mask = block == fill_value
+            if block.dtype.kind == 'f':
+                mask |= numpy.isnan(block)
+        elif block.dtype.kind == 'f':
+            mask = numpy.isnan(block)
+        else:
+            continue
+        num_filled[periods] += mask.sum(axis=(1, 2))
+    return (num_filled / float(height * width)).tolist()
+
+
+def _get_chunk_blocks(t1, t2, height, width, chunks):
+    """
+    Return the (time, lat, lon) slices of the chunks which intersect the periods *t1* to *t2*, clipped to them.
+    """
+    t_size, y_size, x_size = chunks
+    return [(slice(max(t, t1), min(t + t_size, t2)),
+             slice(y, min(y + y_size, height)),
+             slice(x, min(x + x_size, width)))
+            for t in range(t1 // t_size * t_size, t2, t_size)
+            for y in range(0, height, y_size)
+            for x in range(0, width, x_size)]
+
+
+def _get_netcdf_fill_value(variable):
+    if '_FillValue' in variable.ncattrs():
+        return variable.getncattr('_FillValue')
+    return netCDF4.default_fillvals.get(variable.dtype.str[1:])
+
+
+def _get_zarr_chunk_key(array, index):
+    return (array.path + '/' if array.path else '') + '.'.join(str(i) for i in index)
+
+
+def _clip_chunks(chunk_sizes, shape):
+    return tuple(min(size, chunk_size) for size, chunk_size in zip(shape, chunk_sizes))
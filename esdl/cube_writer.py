@@ -0,0 +1,359 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy
+
+#: Name of the global attribute that marks a variable file whose unwritten periods have not yet been filled.
+#: Variable files are created with HDF5 fill-on-create disabled, see :py:class:`SlabWriter`.
+INCOMPLETE_ATTR_NAME = 'esdl_incomplete'
+
+
+class SlabWriter:
+    """
+    Writes the period images of a (time, lat, lon) variable in slabs of whole time chunks.
+
+    Images passed to :py:meth:`put` are buffered until all periods of their time chunk have been put, or until
+    an image of another time chunk is put, and are then written with a single assignment. This avoids that
+    HDF5 decompresses, modifies and recompresses the same chunk for every period.
+
+    If *fill* is true, the variable's file has been created with fill-on-create disabled. Then gaps in a time
+    chunk are written as fill values and all time chunks which have not been written at all are filled by
+    :py:meth:`close`, so that no unwritten storage is left. Otherwise gaps are read back from the variable,
+    so that existing data is preserved.
+
+    :param variable: A netCDF4 variable with dimensions (time, lat, lon).
+    :param time_chunk_size: The variable's chunk size in the time dimension.
+    :param fill: Whether unwritten periods shall be filled.
+    :param time_offset: The index of the variable's first period within the time dimension of the underlying
+           storage, which is used to align slabs with the storage's time chunks. Non-zero for the yearly views
+           of a :py:class:`ZarrYearDataset`.
+    """
+
+    def __init__(self, variable, time_chunk_size: int, fill: bool, time_offset: int = 0):
+        self._variable = variable
+        self._time_size = variable.shape[0]
+        self._time_chunk_size = max(1, time_chunk_size or 1)
+        if not time_offset:
+            self._time_chunk_size = min(self._time_chunk_size, self._time_size)
+        self._time_offset = time_offset
+        self._fill = fill
+        self._chunk_index = None
+        self._images = dict()
+        self._written_chunk_indices = set()
+        self._put_time_indices = set()
+
+    @property
+    def num_unfilled_periods(self) -> int:
+        """
+        The number of periods which have not been put and would be filled by :py:meth:`close`, zero if *fill*
+        is false. Closing a variable file before all its periods have been put makes HDF5 write fill values for
+        these periods, and the chunks written later must be read back, see :py:class:`DatasetPool`.
+        """
+        return self._time_size - len(self._put_time_indices) if self._fill else 0
+
+    def put(self, time_index: int, image):
+        """
+        Buffer the *image* for the period given by *time_index*. Writes the buffered images if their time chunk
+        is complete.
+        """
+        chunk_index = (time_index + self._time_offset) // self._time_chunk_size
+        if self._chunk_index is not None and chunk_index != self._chunk_index:
+            self.flush()
+        self._chunk_index = chunk_index
+        self._images[time_index] = image
+        self._put_time_indices.add(time_index)
+        time_1, time_2 = self._get_chunk_range(chunk_index)
+        if len(self._images) == time_2 - time_1:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered images.
+        """
+        if not self._images:
+            return
+        time_1, time_2 = self._get_chunk_range(self._chunk_index)
+        if len(self._images) == time_2 - time_1 or self._fill:
+            slab = self._new_slab(time_2 - time_1, self._images.values())
+        else:
+            slab = self._variable[time_1:time_2, :, :]
+            if not numpy.ma.isMaskedArray(slab):
+                slab = numpy.ma.masked_array(slab)
+        for time_index, image in self._images.items():
+            slab[time_index - time_1] = image
+        self._variable[time_1:time_2, :, :] = slab
+        self._written_chunk_indices.add(self._chunk_index)
+        self._images = dict()
+        self._chunk_index = None
+
+    def close(self):
+        """
+        Write the buffered images and, if *fill* is true, fill all time chunks that have not been written.
+        """
+        self.flush()
+        if self._fill:
+            first_chunk_index = self._time_offset // self._time_chunk_size
+            last_chunk_index = (self._time_offset + self._time_size - 1) // self._time_chunk_size
+            for chunk_index in range(first_chunk_index, last_chunk_index + 1):
+                if chunk_index not in self._written_chunk_indices:
+                    time_1, time_2 = self._get_chunk_range(chunk_index)
+                    self._variable[time_1:time_2, :, :] = self._new_slab(time_2 - time_1, [])
+                    self._written_chunk_indices.add(chunk_index)
+
+    def _get_chunk_range(self, chunk_index):
+        time_1 = chunk_index * self._time_chunk_size - self._time_offset
+        return max(time_1, 0), min(time_1 + self._time_chunk_size, self._time_size)
+
+    def _new_slab(self, size, images):
+        dtype = numpy.result_type(*[image.dtype for image in images]) if images else self._variable.dtype
+        return numpy.ma.masked_all((size,) + self._variable.shape[1:], dtype=dtype)
+
+
+class ZarrYearDataset:
+    """
+    Provides the periods of one year of a variable stored in a Zarr group through the subset of the
+    ``netCDF4.Dataset`` interface used by :py:meth:`Cube.update`.
+
+    A Zarr variable group holds a single array per variable that spans all years of the cube. Its
+    **variables** mapping contains views on the variable array and the ``time_bnds`` array which are
+    restricted to the periods of the given year.
+
+    :param group: The variable's ``zarr.hierarchy.Group``.
+    :param var_name: The variable name.
+    :param time_offset: The index of the year's first period in the cube's time dimension.
+    :param num_periods_per_year: The number of periods per year.
+    """
+
+    def __init__(self, group, var_name: str, time_offset: int, num_periods_per_year: int):
+        self._group = group
+        self._open = True
+        self.time_offset = time_offset
+        self.variables = {name: ZarrVariableView(group[name], time_offset, num_periods_per_year)
+                          for name in (var_name, 'time_bnds')}
+
+    def ncattrs(self):
+        # Unwritten Zarr chunks are not stored and read as fill values, so no dataset is ever incomplete
+        return []
+
+    def isopen(self) -> bool:
+        return self._open
+
+    def close(self):
+        """
+        Update the group's consolidated metadata. Requires zarr >= 2.3, ignored otherwise.
+        """
+        import zarr
+        if hasattr(zarr, 'consolidate_metadata'):
+            zarr.consolidate_metadata(self._group.store)
+        self._open = False
+
+
+class ZarrVariableView:
+    """
+    A view on the periods *time_offset* to *time_offset* + *time_size* of a (time, ...) Zarr array which behaves
+    like a netCDF4 variable with automatic masking and scaling: masked values are written as the array's fill value
+    and values are packed using the array's ``scale_factor`` and ``add_offset`` attributes.
+
+    :param array: The ``zarr.core.Array``.
+    :param time_offset: The index of the view's first period in the array.
+    :param time_size: The number of periods of the view.
+    """
+
+    def __init__(self, array, time_offset: int, time_size: int):
+        self._array = array
+        self._time_offset = time_offset
+        self.shape = (time_size,) + tuple(array.shape[1:])
+        self.dtype = array.dtype
+        self.chunks = array.chunks
+        self._scale_factor = array.attrs.get('scale_factor', 1.0)
+        self._add_offset = array.attrs.get('add_offset', 0.0)
+
+    def __getitem__(self, key):
+        data = numpy.asarray(self._array[self._shift(key)])
+        fill_value = self._array.fill_value
+        if fill_value is None:
+            data = numpy.ma.masked_array(data)
+        elif isinstance(fill_value, float) and numpy.isnan(fill_value):
+            data = numpy.ma.masked_invalid(data)
+        else:
+            data = numpy.ma.masked_equal(data, fill_value)
+        if self._scale_factor != 1.0 or self._add_offset != 0.0:
+            data = data * self._scale_factor + self._add_offset
+        return data
+
+    def __setitem__(self, key, value):
+        value = numpy.ma.asarray(value)
+        if self._scale_factor != 1.0 or self._add_offset != 0.0:
+            value = (value - self._add_offset) / self._scale_factor
+        if numpy.issubdtype(self.dtype, numpy.integer):
+            value = numpy.ma.round(value)
+        value = value.astype(self.dtype)
+        fill_value = self._array.fill_value
+        self._array[self._shift(key)] = value.filled(fill_value) if fill_value is not None else value.filled()
+
+    def _shift(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        time_key = key[0]
+        if isinstance(time_key, slice):
+            start, stop, step = time_key.indices(self.shape[0])
+            time_key = slice(start + self._time_offset, stop + self._time_offset, step)
+        else:
+            time_key = int(time_key)
+            if time_key < 0:
+                time_key += self.shape[0]
+            if not 0 <= time_key < self.shape[0]:
+                raise IndexError('time index out of range: %d' % key[0])
+            time_key += self._time_offset
+        return (time_key,) + key[1:]
+
+
+class DatasetPool:
+    """
+    A bounded pool of open output datasets, e.g. the variable files written by :py:meth:`Cube.update`.
+
+    Datasets are opened on demand by calling *open_dataset(key)*. If *max_open* datasets are open, the least
+    recently used dataset that is not in use is evicted before another one is opened, i.e. it is flushed and
+    closed by calling *close_dataset(key, dataset)*, so that it can be reopened later. The pool counts hits,
+    misses and evictions.
+
+    Evicting a dataset may cost more than reopening it: a variable file written by a :py:class:`SlabWriter` with
+    *fill* true gets fill values for all periods not yet written when it is closed, and these chunks must be read
+    back when the remaining periods are written after reopening it. If *get_eviction_cost(key)* is given, datasets
+    with the lowest cost, e.g. :py:attr:`SlabWriter.num_unfilled_periods`, are evicted first, least recently used
+    first among equal costs. Too small pools may still evict incomplete datasets.
+
+    The pool is safe to be shared by several threads. Use :py:meth:`use` (or :py:meth:`acquire` and
+    :py:meth:`release`) to access a dataset, datasets in use are never evicted. Datasets are opened and closed
+    while holding the pool's lock.
+
+    :param open_dataset: A function that opens the dataset for a key.
+    :param close_dataset: A function that flushes and closes a dataset, called with key and dataset.
+    :param max_open: The maximum number of open datasets, unbounded if ``None``. The limit is exceeded
+           temporarily if all open datasets are in use.
+    :param get_eviction_cost: An optional function that returns the cost of evicting the dataset for a key.
+    """
+
+    def __init__(self, open_dataset, close_dataset, max_open: int = None, get_eviction_cost=None):
+        if max_open is not None and max_open < 1:
+            raise ValueError('max_open must be a positive integer')
+        self._open_dataset = open_dataset
+        self._close_dataset = close_dataset
+        self._max_open = max_open
+        self._get_eviction_cost = get_eviction_cost
+        self._lock = threading.RLock()
+        self._datasets = OrderedDict()
+        self._use_counts = dict()
+        #: Number of requests for datasets that were open
+        self.hits = 0
+        #: Number of requests for datasets that had to be opened
+        self.misses = 0
+        #: Number of datasets closed to make room for others
+        self.evictions = 0
+
+    @property
+    def max_open(self) -> int:
+        """
+        The maximum number of open datasets, or ``None``.
+        """
+        return self._max_open
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datasets)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._datasets
+
+    def keys(self) -> list:
+        """
+        Return the keys of the open datasets from least to most recently used.
+        """
+        with self._lock:
+            return list(self._datasets.keys())
+
+    @contextmanager
+    def use(self, key):
+        """
+        Return a context manager that yields the open dataset for *key* and protects it from eviction
+        while the block is executed.
+        """
+        dataset = self.acquire(key)
+        try:
+            yield dataset
+        finally:
+            self.release(key)
+
+    def acquire(self, key):
+        """
+        Return the open dataset for *key*, open it if required. The dataset is not evicted until
+        :py:meth:`release` has been called as often as this method.
+        """
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is not None:
+                self.hits += 1
+                self._datasets.move_to_end(key)
+            else:
+                self.misses += 1
+                if self._max_open is not None:
+                    self._evict(self._max_open - 1)
+                dataset = self._open_dataset(key)
+                self._datasets[key] = dataset
+            self._use_counts[key] = self._use_counts.get(key, 0) + 1
+            return dataset
+
+    def release(self, key):
+        """
+        Release the dataset for *key* acquired by :py:meth:`acquire`.
+        """
+        with self._lock:
+            use_count = self._use_counts.get(key, 0) - 1
+            if use_count > 0:
+                self._use_counts[key] = use_count
+            else:
+                self._use_counts.pop(key, None)
+
+    def close(self, key):
+        """
+        Close the dataset for *key* if it is open.
+        """
+        with self._lock:
+            dataset = self._datasets.pop(key, None)
+            self._use_counts.pop(key, None)
+            if dataset is not None:
+                self._close_dataset(key, dataset)
+
+    def close_all(self, predicate=None):
+        """
+        Close all open datasets, or those whose key satisfies *predicate* if given, in the order of their use.
+        """
+        with self._lock:
+            for key in self.keys():
+                if predicate is None or predicate(key):
+                    self.close(key)
+
+    def stats(self) -> OrderedDict:
+        """
+        Return the pool's hit, miss and eviction counts.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return OrderedDict([('max_open', self._max_open),
+                                ('hits', self.hits),
+                                ('misses', self.misses),
+                                ('evictions', self.evictions),
+                                ('hit_rate', self.hits / requests if requests else 0.0)])
+
+    def _evict(self, max_open):
+        keys = [key for key in self.keys() if key not in self._use_counts]
+        if self._get_eviction_cost is not None:
+            # Stable sort, so that equal costs are evicted in LRU order
+            keys.sort(key=self._get_eviction_cost)
+        for key in keys:
+            if len(self._datasets) <= max_open:
+                break
+            self.close(key)
+            self.evictions += 1
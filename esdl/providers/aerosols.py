@@ -1,10 +1,8 @@
 import datetime
-import os
-from datetime import timedelta
 
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, SourceFileTemplate
 
 
 class AerosolsProvider(NetCDFCubeSourceProvider):
@@ -78,22 +76,9 @@ class AerosolsProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        for root, sub_dirs, files in os.walk(self.dir_path):
-            for sub_dir in sub_dirs:
-                source_year = int(sub_dir)
-                if self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year:
-                    sub_dir_path = os.path.join(self.dir_path, sub_dir)
-                    file_names = os.listdir(sub_dir_path)
-                    for file_name in file_names:
-                        time_info = file_name.split('-', 1)[0]
-                        time = self.day2date(int(time_info))
-                        if self.cube_config.start_time <= time <= self.cube_config.end_time:
-                            file = os.path.join(sub_dir_path, file_name)
-                            self.dataset_cache.get_dataset(file)
-                            self.dataset_cache.close_dataset(file)
-                            source_time_ranges.append((time, time + timedelta(days=1), file, 0))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        # Daily files named YYYYMMDD-*.nc in year directories
+        template = SourceFileTemplate(r'(?P<time>\d{8})-.*', '%Y%m%d', year_dirs=True)
+        return self.compute_template_time_ranges(template)
 
     def transform_source_image(self, source_image):
         """
@@ -1,10 +1,9 @@
-import os
 from datetime import timedelta
 
 import netCDF4
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 
 class AirTemperatureProvider(NetCDFCubeSourceProvider):
@@ -29,20 +28,21 @@ class AirTemperatureProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            if '.nc' in file_name:
-                source_year = int(file_name.replace('.nc', '').split('_')[1])
-                if self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year:
-                    file = os.path.join(self.dir_path, file_name).replace("\\", "/")
-                    dataset = self.dataset_cache.get_dataset(file)
-                    times = dataset.variables['time']
-                    dates = netCDF4.num2date(times[:], 'hours since 1900-01-01 00:00:0.0', calendar='gregorian')
-                    self.dataset_cache.close_dataset(file)
-                    source_time_ranges += [(dates[i], dates[i] + timedelta(hours=12), file, i) for i in
-                                           range(len(dates))]
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        def is_source_file(file_name):
+            if '.nc' not in file_name:
+                return False
+            source_year = int(file_name.replace('.nc', '').split('_')[1])
+            return self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year
+
+        files = list_source_files([self.dir_path], is_source_file)
+        return self.scan_source_time_ranges(files, self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        dataset = self.dataset_cache.get_dataset(file)
+        times = dataset.variables['time']
+        dates = netCDF4.num2date(times[:], 'hours since 1900-01-01 00:00:0.0', calendar='gregorian')
+        self.dataset_cache.close_dataset(file)
+        return [(dates[i], dates[i] + timedelta(hours=12), i) for i in range(len(dates))]
 
     def transform_source_image(self, source_image):
         return numpy.roll(source_image, 720, axis=1)
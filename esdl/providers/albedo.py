@@ -1,10 +1,9 @@
 import datetime
-import os
 
 import numpy
 from netCDF4 import date2num, num2date
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, SourceFileTemplate
 
 
 class AlbedoProvider(NetCDFCubeSourceProvider):
@@ -46,19 +45,9 @@ class AlbedoProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            time_info = file_name.split('.', 5)[4]
-            t1, t2 = self.day2date(int(time_info))
-            if self.cube_config.start_time <= t1 <= self.cube_config.end_time:
-                file = os.path.join(self.dir_path, file_name)
-                self.dataset_cache.get_dataset(file)
-                self.dataset_cache.close_dataset(file)
-                source_time_ranges.append((t1, t2, file, 0))
-
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        # 8-day files named like GlobAlbedo.merge.albedo.05.YYYYDDD.nc
+        template = SourceFileTemplate(r'(?:[^.]*\.){4}(?P<time>\d{7})\..*', '%Y%j', period=datetime.timedelta(days=8))
+        return self.compute_template_time_ranges(template)
 
     @staticmethod
     def day2date(times):
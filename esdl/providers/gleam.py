@@ -1,10 +1,9 @@
 import datetime
-import os
 from datetime import timedelta
 
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 all_vars_descr = {'E': {
     'evaporation': {
@@ -191,29 +190,24 @@ class GleamProvider(NetCDFCubeSourceProvider):
         return all_vars_descr[self.var_name]
 
     def compute_source_time_ranges(self):
+        files = list_source_files(self.get_year_dir_paths(), lambda file_name: self.var_name + '_' in file_name)
         source_time_ranges = []
-        for root, sub_dirs, files in os.walk(self.dir_path):
-            for sub_dir in sub_dirs:
-                source_year = int(sub_dir)
-                if self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year:
-                    sub_dir_path = os.path.join(self.dir_path, sub_dir)
-                    file_names = os.listdir(sub_dir_path)
-                    for file_name in file_names:
-                        if self.var_name + '_' in file_name:
-                            file = os.path.join(self.dir_path, sub_dir, file_name).replace("\\", "/")
-                            dataset = self.dataset_cache.get_dataset(file)
-                            year = dataset.variables['DATE'][0, :].astype(int)
-                            month = dataset.variables['DATE'][1, :].astype(int)
-                            day = dataset.variables['DATE'][2, :].astype(int)
-                            self.dataset_cache.close_dataset(file)
-                            dates = [datetime.datetime(year[i], month[i], day[i]) for i in range(len(year))]
-                            cnt = 0
-                            for time in dates:
-                                if self.cube_config.start_time <= time <= self.cube_config.end_time:
-                                    source_time_ranges.append((time, time + timedelta(days=1), file, cnt))
-                                    cnt += 1
+        file_to_count = dict()
+        for time, _, file, _ in self.scan_source_time_ranges(files, self._read_source_time_ranges):
+            if self.cube_config.start_time <= time <= self.cube_config.end_time:
+                cnt = file_to_count.get(file, 0)
+                source_time_ranges.append((time, time + timedelta(days=1), file, cnt))
+                file_to_count[file] = cnt + 1
+        return source_time_ranges
 
-        return sorted(source_time_ranges, key=lambda item: item[0])
+    def _read_source_time_ranges(self, file):
+        dataset = self.dataset_cache.get_dataset(file)
+        year = dataset.variables['DATE'][0, :].astype(int)
+        month = dataset.variables['DATE'][1, :].astype(int)
+        day = dataset.variables['DATE'][2, :].astype(int)
+        self.dataset_cache.close_dataset(file)
+        dates = [datetime.datetime(year[i], month[i], day[i]) for i in range(len(year))]
+        return [(time, time + timedelta(days=1), i) for i, time in enumerate(dates)]
 
     def transform_source_image(self, source_image):
         """
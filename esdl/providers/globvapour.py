@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 import netCDF4
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 
 class GlobVapourProvider(NetCDFCubeSourceProvider):
@@ -31,23 +31,19 @@ class GlobVapourProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        dir_names = os.listdir(self.dir_path)
-
-        for dir_name in dir_names:
-            file_names = os.listdir(os.path.join(self.dir_path, dir_name))
-            for file_name in file_names:
-                file = os.path.join(self.dir_path, dir_name, file_name)
-                dataset = self.dataset_cache.get_dataset(file)
-                time = dataset.variables['time']
-                dates1 = netCDF4.num2date(time[:], 'days since 1970-01-01 00:00:00', calendar='gregorian')
-                self.dataset_cache.close_dataset(file)
-                t1 = datetime(dates1.year, dates1.month, dates1.day)
-                # use this one for weekly data
-                # t2 = t1 +  timedelta(days=7)
-                t2 = self._last_day_of_month(t1) + timedelta(days=1)
-                source_time_ranges.append((t1, t2, file, 0))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        dir_paths = [os.path.join(self.dir_path, dir_name) for dir_name in os.listdir(self.dir_path)]
+        return self.scan_source_time_ranges(list_source_files(dir_paths), self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        dataset = self.dataset_cache.get_dataset(file)
+        time = dataset.variables['time']
+        dates1 = netCDF4.num2date(time[:], 'days since 1970-01-01 00:00:00', calendar='gregorian')
+        self.dataset_cache.close_dataset(file)
+        t1 = datetime(dates1.year, dates1.month, dates1.day)
+        # use this one for weekly data
+        # t2 = t1 +  timedelta(days=7)
+        t2 = self._last_day_of_month(t1) + timedelta(days=1)
+        return [(t1, t2, 0)]
 
     @staticmethod
     def _last_day_of_month(any_day):
@@ -1,10 +1,9 @@
-import os
 from datetime import timedelta
 
 import netCDF4
 import numpy as np
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 
 class LaiFaparTipProvider(NetCDFCubeSourceProvider):
@@ -39,20 +38,13 @@ class LaiFaparTipProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        for root, sub_dirs, files in os.walk(self.dir_path):
-            for sub_dir in sub_dirs:
-                source_year = int(sub_dir)
-                if self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year:
-                    sub_dir_path = os.path.join(self.dir_path, sub_dir, "005")
-                    file_names = os.listdir(sub_dir_path)
-                    for file_name in file_names:
-                        if '.nc' in file_name:
-                            file = os.path.join(sub_dir_path, file_name)
-                            dataset = self.dataset_cache.get_dataset(file)
-                            time = netCDF4.num2date(dataset.variables['time'][0],
-                                                    dataset.variables['time'].units,
-                                                    calendar=dataset.variables['time'].calendar)
-                            self.dataset_cache.close_dataset(file)
-                            source_time_ranges.append((time, time + timedelta(days=1), file, 0))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        files = list_source_files(self.get_year_dir_paths('005'), lambda file_name: '.nc' in file_name)
+        return self.scan_source_time_ranges(files, self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        dataset = self.dataset_cache.get_dataset(file)
+        time = netCDF4.num2date(dataset.variables['time'][0],
+                                dataset.variables['time'].units,
+                                calendar=dataset.variables['time'].calendar)
+        self.dataset_cache.close_dataset(file)
+        return [(time, time + timedelta(days=1), 0)]
@@ -1,10 +1,6 @@
-import datetime
-import os
-from datetime import timedelta
-
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, SourceFileTemplate
 
 
 class LandSurfTemperatureProvider(NetCDFCubeSourceProvider):
@@ -30,21 +26,15 @@ class LandSurfTemperatureProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            if '.nc' in file_name:
-                # print (file_name)
-                source_date = datetime.datetime(int(file_name[22:26]), int(file_name[26:28]), int(file_name[28:30]), 12,
-                                                00)
-                if self.cube_config.start_time.year <= source_date.year <= self.cube_config.end_time.year:
-                    file = os.path.join(self.dir_path, file_name).replace("\\", "/")
-                    dataset = self.dataset_cache.get_dataset(file)
-                    if self.variable_descriptors[self._name]["source_name"] in dataset.variables:
-                        source_time_ranges.append(
-                            (source_date - timedelta(hours=12), source_date + timedelta(hours=12), file, 0))
-                    self.dataset_cache.close_dataset(file)
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        # Daily files named like GT_SSD-L3-AATSR_LST_3-YYYYMMDD_*.nc, not all of them contain the variable
+        template = SourceFileTemplate(r'.{22}(?P<time>\d{8}).*\.nc.*', '%Y%m%d', validate=True)
+        return self.compute_template_time_ranges(template)
+
+    def validate_source_file(self, file):
+        dataset = self.dataset_cache.get_dataset(file)
+        is_valid = self.variable_descriptors[self._name]['source_name'] in dataset.variables
+        self.dataset_cache.close_dataset(file)
+        return is_valid
 
     def transform_source_image(self, source_image):
         """
@@ -2,7 +2,7 @@ import os
 from datetime import timedelta
 
 import numpy
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 from dateutil.relativedelta import relativedelta
 from netCDF4 import num2date
 
@@ -91,21 +91,26 @@ class MPIBGCProvider(NetCDFCubeSourceProvider):
         return all_vars_descr[self.var_name]
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            if '.nc' in file_name:
-                source_year = int(file_name.replace('.nc', '').split('_')[1])
-                if self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year:
-                    file = os.path.join(self.dir_path, file_name).replace("\\", "/")
-                    dataset = self.dataset_cache.get_dataset(file)
-                    times = dataset.variables['time']
-                    dates = num2date(times[:], 'days since 1582-10-15 00:00:0.0', calendar='gregorian')
-                    self.dataset_cache.close_dataset(file)
-                    for i in range(len(dates)):
-                        # the following checks if the end period overlaps with the next year. If so, change the
-                        # timedelta so that the period stops at the last day of the year
-                        days_increment = 8 if (dates[i] + timedelta(days=8)).year == source_year else \
-                            (dates[i] + timedelta(days=8) - relativedelta(years=1)).day
-                        source_time_ranges.append((dates[i], dates[i] + timedelta(days=days_increment), file, i))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        def is_source_file(file_name):
+            if '.nc' not in file_name:
+                return False
+            source_year = int(file_name.replace('.nc', '').split('_')[1])
+            return self.cube_config.start_time.year <= source_year <= self.cube_config.end_time.year
+
+        files = list_source_files([self.dir_path], is_source_file)
+        return self.scan_source_time_ranges(files, self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        source_year = int(os.path.basename(file).replace('.nc', '').split('_')[1])
+        time_ranges = []
+        dataset = self.dataset_cache.get_dataset(file)
+        times = dataset.variables['time']
+        dates = num2date(times[:], 'days since 1582-10-15 00:00:0.0', calendar='gregorian')
+        self.dataset_cache.close_dataset(file)
+        for i in range(len(dates)):
+            # the following checks if the end period overlaps with the next year. If so, change the
+            # timedelta so that the period stops at the last day of the year
+            days_increment = 8 if (dates[i] + timedelta(days=8)).year == source_year else \
+                (dates[i] + timedelta(days=8) - relativedelta(years=1)).day
+            time_ranges.append((dates[i], dates[i] + timedelta(days=days_increment), i))
+        return time_ranges
@@ -1,10 +1,9 @@
-import os
 from datetime import datetime
 
 import netCDF4
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 
 class OzoneProvider(NetCDFCubeSourceProvider):
@@ -32,19 +31,16 @@ class OzoneProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        file_names = os.listdir(self.dir_path)
-        source_time_ranges = list()
-        for file_name in file_names:
-            file = os.path.join(self.dir_path, file_name)
-            dataset = netCDF4.Dataset(file)
-            t1 = dataset.time_coverage_start
-            t2 = dataset.time_coverage_end
-            dataset.close()
-            source_time_ranges.append((datetime(int(t1[0:4]), int(t1[4:6]), int(t1[6:8])),
-                                       datetime(int(t2[0:4]), int(t2[4:6]), int(t2[6:8])),
-                                       file,
-                                       None))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        return self.scan_source_time_ranges(list_source_files([self.dir_path]), self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        dataset = netCDF4.Dataset(file)
+        t1 = dataset.time_coverage_start
+        t2 = dataset.time_coverage_end
+        dataset.close()
+        return [(datetime(int(t1[0:4]), int(t1[4:6]), int(t1[6:8])),
+                 datetime(int(t2[0:4]), int(t2[4:6]), int(t2[6:8])),
+                 None)]
 
     def transform_source_image(self, source_image):
         """
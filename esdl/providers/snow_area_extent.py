@@ -1,10 +1,9 @@
-import os
 from datetime import timedelta
 
 import netCDF4
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 VAR_NAME = 'MFSC'
 FILL_VALUE = -9999
@@ -34,21 +33,21 @@ class SnowAreaExtentProvider(NetCDFCubeSourceProvider):
         }
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            file = os.path.join(self.dir_path, file_name)
-            dataset = self.dataset_cache.get_dataset(file)
-            time = dataset.variables['time']
-            # dates = netCDF4.num2date(time[:], time.units, calendar=time.calendar)
-            dates = netCDF4.num2date(time[:] - 14, 'days since 1582-10-15 00:00', calendar='gregorian')
-            self.dataset_cache.close_dataset(file)
-            n = len(dates)
-            for i in range(n):
-                t1 = dates[i]
-                if i < n - 1:
-                    t2 = dates[i + 1]
-                else:
-                    t2 = t1 + timedelta(days=31)  # assuming it's December
-                source_time_ranges.append((t1, t2, file, i))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        return self.scan_source_time_ranges(list_source_files([self.dir_path]), self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        time_ranges = []
+        dataset = self.dataset_cache.get_dataset(file)
+        time = dataset.variables['time']
+        # dates = netCDF4.num2date(time[:], time.units, calendar=time.calendar)
+        dates = netCDF4.num2date(time[:] - 14, 'days since 1582-10-15 00:00', calendar='gregorian')
+        self.dataset_cache.close_dataset(file)
+        n = len(dates)
+        for i in range(n):
+            t1 = dates[i]
+            if i < n - 1:
+                t2 = dates[i + 1]
+            else:
+                t2 = t1 + timedelta(days=31)  # assuming it's December
+            time_ranges.append((t1, t2, i))
+        return time_ranges
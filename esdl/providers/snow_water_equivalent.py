@@ -1,10 +1,9 @@
-import os
 from datetime import datetime, timedelta
 
 import netCDF4
 import numpy
 
-from esdl.cube_provider import NetCDFCubeSourceProvider
+from esdl.cube_provider import NetCDFCubeSourceProvider, list_source_files
 
 
 class SnowWaterEquivalentProvider(NetCDFCubeSourceProvider):
@@ -35,16 +34,16 @@ class SnowWaterEquivalentProvider(NetCDFCubeSourceProvider):
         self.dataset_cache.close_all_datasets()
 
     def compute_source_time_ranges(self):
-        source_time_ranges = []
-        file_names = os.listdir(self.dir_path)
-        for file_name in file_names:
-            file = os.path.join(self.dir_path, file_name)
-            dataset = self.dataset_cache.get_dataset(file)
-            time_bnds = dataset.variables['time']
-            time = netCDF4.num2date(time_bnds[:], 'days since 1582-10-15 00:00', calendar='gregorian')
-            self.dataset_cache.close_dataset(file)
-            for i in range(len(time)):
-                t1 = datetime(time[i].year, time[i].month, time[i].day)
-                t2 = t1 + timedelta(days=1)
-                source_time_ranges.append((t1, t2, file, i))
-        return sorted(source_time_ranges, key=lambda item: item[0])
+        return self.scan_source_time_ranges(list_source_files([self.dir_path]), self._read_source_time_ranges)
+
+    def _read_source_time_ranges(self, file):
+        time_ranges = []
+        dataset = self.dataset_cache.get_dataset(file)
+        time_bnds = dataset.variables['time']
+        time = netCDF4.num2date(time_bnds[:], 'days since 1582-10-15 00:00', calendar='gregorian')
+        self.dataset_cache.close_dataset(file)
+        for i in range(len(time)):
+            t1 = datetime(time[i].year, time[i].month, time[i].day)
+            t2 = t1 + timedelta(days=1)
+            time_ranges.append((t1, t2, i))
+        return time_ranges
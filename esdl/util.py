@@ -2,9 +2,13 @@
 Various utility constants, functions and classes.
 Developer note: make sure this module does not import any other esdl module!
 """
+import bisect
 import gzip
+import hashlib
+import json
 import math
 import os
+import threading
 from abc import abstractmethod, ABCMeta
 from datetime import datetime, timedelta
 
@@ -42,6 +46,107 @@ def temporal_weight(a1, a2, b1, b2):
     return 0.0
 
 
+class SourceTimeRanges:
+    """
+    The time ranges of source files held in compact arrays: datetime64 start and stop times, file paths and time
+    indexes. Behaves like the list of (time_start, time_stop, file, time_index) tuples it is created from, and
+    finds the time ranges overlapping a given period by a binary search on the start times.
+
+    :param time_ranges: A sequence of (time_start, time_stop, file, time_index) tuples, usually sorted by time_start.
+                        The time_index may be ``None``.
+    """
+
+    #: The value of :py:attr:`time_indexes` for time ranges whose time index is ``None``.
+    NO_TIME_INDEX = -1
+
+    def __init__(self, time_ranges):
+        time_ranges = list(time_ranges)
+        self._starts = numpy.array([_to_datetime(item[0]) for item in time_ranges], dtype='datetime64[us]')
+        self._stops = numpy.array([_to_datetime(item[1]) for item in time_ranges], dtype='datetime64[us]')
+        self._files = numpy.array([item[2] for item in time_ranges], dtype=object)
+        # Time ranges without a time index, e.g. of files holding a single image, are given by NO_TIME_INDEX
+        self._time_indexes = numpy.array([SourceTimeRanges.NO_TIME_INDEX if item[3] is None else item[3]
+                                          for item in time_ranges], dtype=numpy.int64)
+        # Positions into the time ranges in the order of their start times, None if already sorted
+        self._order = None
+        if len(time_ranges) > 1 and numpy.any(self._starts[1:] < self._starts[:-1]):
+            self._order = numpy.argsort(self._starts, kind='mergesort')
+        self._sorted_starts = self._starts if self._order is None else self._starts[self._order]
+        self._max_duration = (self._stops - self._starts).max() if time_ranges else numpy.timedelta64(0, 'us')
+
+    @property
+    def starts(self) -> numpy.ndarray:
+        """The start times as datetime64 array."""
+        return self._starts
+
+    @property
+    def stops(self) -> numpy.ndarray:
+        """The stop times as datetime64 array."""
+        return self._stops
+
+    @property
+    def files(self) -> numpy.ndarray:
+        """The file paths as object array."""
+        return self._files
+
+    @property
+    def time_indexes(self) -> numpy.ndarray:
+        """The time indexes within the files as int64 array, :py:data:`NO_TIME_INDEX` where it is ``None``."""
+        return self._time_indexes
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        time_index = int(self._time_indexes[index])
+        return (self._starts[index].item(), self._stops[index].item(), self._files[index],
+                None if time_index == SourceTimeRanges.NO_TIME_INDEX else time_index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, (SourceTimeRanges, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return 'SourceTimeRanges(%r)' % list(self)
+
+    def get_index_to_weight(self, period_start, period_end):
+        """
+        Compute the weights of all time ranges that overlap with the period *period_start* ... *period_end*,
+        equal to :py:func:`temporal_weight` for each time range, but only the candidates found by a binary search
+        on the start times are looked at.
+
+        :return: A dictionary mapping indexes into the time ranges --> weight values greater than zero.
+        """
+        b1 = numpy.datetime64(_to_datetime(period_start), 'us')
+        b2 = numpy.datetime64(_to_datetime(period_end), 'us')
+        # Time ranges overlapping with the period start no earlier than the longest time range before it
+        lo = numpy.searchsorted(self._sorted_starts, b1 - self._max_duration, side='left')
+        hi = numpy.searchsorted(self._sorted_starts, b2, side='right')
+        if lo >= hi:
+            return dict()
+        indexes = numpy.arange(lo, hi) if self._order is None else numpy.sort(self._order[lo:hi])
+        a1 = self._starts[indexes]
+        a2 = self._stops[indexes]
+        a1_in_b_range = (b1 <= a1) & (a1 <= b2)
+        a2_in_b_range = (b1 <= a2) & (a2 <= b2)
+        b_in_a_range = (a1 <= b1) & (b2 <= a2)
+        period = b2 - b1
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            weights = numpy.where(a1_in_b_range & a2_in_b_range, 1.0,
+                                  numpy.where(a1_in_b_range, (b2 - a1) / period,
+                                              numpy.where(a2_in_b_range, (a2 - b1) / period,
+                                                          numpy.where(b_in_a_range, 1.0, 0.0))))
+        mask = weights > 0.0
+        return {int(i): float(w) for i, w in zip(indexes[mask], weights[mask])}
+
+
 def aggregate_images(images, weights=None):
     """
     Aggregates the list of optionally masked *images* by averaging them using the optional *weights*.
@@ -50,22 +155,137 @@ def aggregate_images(images, weights=None):
     :param weights: a weight 0..1 for each image
     :return: A combined, masked image.
     """
-    reshaped_images = []
+    aggregator = ImageAggregator()
     for i in range(len(images)):
-        image = images[i]
-        reshaped_image = image.reshape((1,) + image.shape)
-        reshaped_images.append(reshaped_image)
-        image_stack = numpy.ma.concatenate(reshaped_images)
-    return numpy.ma.average(image_stack, axis=0, weights=weights)
-
-    # aggregated_images = numpy.ma.zeros(images[0].shape,dtype = numpy.float32)
-    # for i in range(len(images)):
-    #     image = images[i].astype(numpy.float32)
-    #     if weights:
-    #         numpy.multiply(image,weights[i],out = image, casting = 'same_kind')
-    #     aggregated_images += image * 1./(len(images))
-    #     numpy.add(aggregated_images, image * 1./(len(images)),out = aggregated_images)
-    # return aggregated_images
+        aggregator.add(images[i], 1.0 if weights is None else weights[i])
+    return aggregator.get_result()
+
+
+class ImageAggregator:
+    """
+    Temporally aggregates optionally masked images of equal shape which are added one after the other, so that only
+    two arrays of the image shape are kept rather than all images. Masked pixels of an image are ignored, pixels
+    without any valid value are masked in the result.
+
+    Reducers are
+
+    * 'mean': the weighted average, keeps the weighted sum and the sum of weights;
+    * 'min', 'max': the minimum or maximum value, keeps the value and the number of valid values;
+    * 'count': the number of valid values, returned as unmasked int32 array;
+    * 'last': the last valid value in the order the images were added.
+
+    :param reducer: The reducer, one of :py:data:`ImageAggregator.REDUCERS`.
+    :param dtype: The data type of the kept values, e.g. ``numpy.float32`` to save memory.
+    """
+
+    #: The names of the supported reducers.
+    REDUCERS = ('mean', 'min', 'max', 'count', 'last')
+
+    def __init__(self, reducer: str = 'mean', dtype=numpy.float64):
+        if reducer not in ImageAggregator.REDUCERS:
+            raise ValueError("reducer must be one of %s, got '%s'" % (', '.join(ImageAggregator.REDUCERS), reducer))
+        self._reducer = reducer
+        self._dtype = numpy.dtype(dtype)
+        self._values = None
+        self._weights = None
+        self._num_images = 0
+
+    @property
+    def reducer(self) -> str:
+        return self._reducer
+
+    @property
+    def num_images(self) -> int:
+        """The number of images added so far."""
+        return self._num_images
+
+    def add(self, image, weight: float = 1.0):
+        """
+        Add an optionally masked *image*. The *weight* is used by the 'mean' reducer only.
+        """
+        data = numpy.ma.getdata(image)
+        valid = ~numpy.ma.getmaskarray(image)
+        if self._weights is None:
+            weights_dtype = numpy.int32 if self._reducer != 'mean' else self._dtype
+            self._weights = numpy.zeros(data.shape, dtype=weights_dtype)
+            if self._reducer != 'count':
+                self._values = numpy.zeros(data.shape, dtype=self._dtype)
+        elif data.shape != self._weights.shape:
+            raise ValueError('image shape %s differs from %s' % (data.shape, self._weights.shape))
+        if self._reducer == 'mean':
+            self._values += numpy.where(valid, data, 0) * weight
+            self._weights += numpy.where(valid, weight, 0)
+        else:
+            if self._reducer == 'min':
+                update = valid & ((self._weights == 0) | (data < self._values))
+            elif self._reducer == 'max':
+                update = valid & ((self._weights == 0) | (data > self._values))
+            else:
+                update = valid
+            if self._values is not None:
+                numpy.copyto(self._values, data, casting='unsafe', where=update)
+            self._weights += valid
+        self._num_images += 1
+
+    def get_result(self):
+        """
+        Return the aggregated image as masked array, or an unmasked int32 array for the 'count' reducer.
+
+        :raise ValueError: if no image has been added.
+        """
+        if self._weights is None:
+            raise ValueError('no images added')
+        if self._reducer == 'count':
+            return self._weights
+        mask = self._weights == 0
+        if self._reducer == 'mean':
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                return numpy.ma.masked_array(self._values / self._weights, mask=mask)
+        return numpy.ma.masked_array(self._values, mask=mask)
+
+
+def get_aligned_tiles(target_size, source_size, target_pixel_size, source_pixel_size, memory_budget):
+    """
+    Split a target image into tiles whose boundaries coincide with source pixel boundaries, so that each tile can
+    be resampled from its own source window with the same result as resampling the whole source image.
+    Tiles span the full target width if possible and are chosen as large as the *memory_budget* allows.
+
+    :param target_size: The target image size (width, height).
+    :param source_size: The source image size (width, height).
+    :param target_pixel_size: The number of bytes required per target pixel while computing a tile.
+    :param source_pixel_size: The number of bytes required per source pixel while computing a tile.
+    :param memory_budget: The maximum number of bytes required to compute a tile.
+    :return: A list of (target_rect, source_rect) pairs, each rectangle given as (x, y, width, height).
+    :raise ValueError: if the smallest possible tile exceeds the *memory_budget*.
+    """
+    target_width, target_height = target_size
+    source_width, source_height = source_size
+    gcd_x = math.gcd(target_width, source_width)
+    gcd_y = math.gcd(target_height, source_height)
+    # Size of the smallest aligned tile in target and source pixels
+    target_step_x, source_step_x = target_width // gcd_x, source_width // gcd_x
+    target_step_y, source_step_y = target_height // gcd_y, source_height // gcd_y
+    step_size = target_step_x * target_step_y * target_pixel_size + source_step_x * source_step_y * source_pixel_size
+    max_num_steps = int(memory_budget // step_size)
+    if max_num_steps < 1:
+        raise ValueError('memory budget of %d bytes too small, aligned tiles require at least %d bytes' %
+                         (memory_budget, step_size))
+    if max_num_steps >= gcd_x:
+        num_steps_x = gcd_x
+        num_steps_y = min(max_num_steps // gcd_x, gcd_y)
+    else:
+        num_steps_x = max_num_steps
+        num_steps_y = 1
+    tiles = []
+    for step_y in range(0, gcd_y, num_steps_y):
+        num_y = min(num_steps_y, gcd_y - step_y)
+        for step_x in range(0, gcd_x, num_steps_x):
+            num_x = min(num_steps_x, gcd_x - step_x)
+            tiles.append(((step_x * target_step_x, step_y * target_step_y,
+                           num_x * target_step_x, num_y * target_step_y),
+                          (step_x * source_step_x, step_y * source_step_y,
+                           num_x * source_step_x, num_y * source_step_y)))
+    return tiles
 
 
 def resolve_temporal_range_index(target_start_year: int,
@@ -85,35 +305,146 @@ def resolve_temporal_range_index(target_start_year: int,
     :param source_end_time: the datetime to find the end time index
     :return: a tuple of start time index and end time index
     """
-    time_steps = _get_time_steps(target_end_year, target_start_year, temporal_res)
-    start_time_index = 0
-    end_time_index = len(time_steps) - 1
-    for time_index in range(len(time_steps)):
-        time_1, time_2 = time_steps[time_index]
-        if time_1 <= source_start_time <= time_2:
-            start_time_index = time_index
-        if time_1 <= source_end_time <= time_2:
-            end_time_index = time_index
-        if start_time_index != 0 and end_time_index != len(time_steps) - 1:
-            break
-    return start_time_index, end_time_index
-
-
-def _get_time_steps(target_end_year, target_start_year, temporal_res):
-    time_steps = []
-    for target_year in range(target_start_year, target_end_year + 1):
-        time_min = datetime(target_year, 1, 1)
-        time_max = datetime(target_year + 1, 1, 1)
-        time_1 = time_min
-        num_periods_per_year = math.ceil(365.0 / temporal_res)
-        for time_index in range(num_periods_per_year):
-            d_time = timedelta(days=temporal_res)
-            time_2 = time_1 + d_time
-            if time_2 > time_max:
-                time_2 = time_max
-            time_steps.append((time_1, time_2))
-            time_1 = time_2
-    return time_steps
+    time_axis = CubeTimeAxis(target_start_year, target_end_year, temporal_res)
+    return time_axis.get_index(source_start_time, clip=True), time_axis.get_index(source_end_time, clip=True)
+
+
+class CubeTimeAxis:
+    """
+    The target periods of a data cube for the years *start_year* to *end_year* (inclusive).
+
+    Each year is divided into ``ceil(365 / temporal_res)`` periods of *temporal_res* days starting on January 1st,
+    the last period of a year ends on January 1st of the next year. Periods are addressed either by their global
+    index into the axis or by (year, time_index), where time_index is the index within the year as used by the
+    cube's yearly variable files.
+
+    Times are given as numbers in the units 'days since *ref_time*' by the arrays **lower_bounds**,
+    **upper_bounds** and **times**. The **times** are the lower bounds plus half the temporal resolution,
+    so that they are not centered for the shorter last period of a year.
+
+    Use :py:attr:`CubeConfig.time_axis` to get the cached axis of a cube.
+
+    :param start_year: The first year.
+    :param end_year: The last year.
+    :param temporal_res: The temporal resolution in days.
+    :param ref_time: The reference time of the time units.
+    :param calendar: The calendar of the time units.
+    """
+
+    def __init__(self, start_year: int, end_year: int, temporal_res: int, ref_time: datetime = datetime(2001, 1, 1),
+                 calendar: str = 'gregorian'):
+        if end_year < start_year:
+            raise ValueError('end_year must not be less than start_year')
+        self._start_year = start_year
+        self._end_year = end_year
+        self._temporal_res = temporal_res
+        self._num_periods_per_year = math.ceil(365.0 / temporal_res)
+        d_time = timedelta(days=temporal_res)
+        start_times = []
+        end_times = []
+        for year in range(start_year, end_year + 1):
+            time_1 = datetime(year, 1, 1)
+            time_max = datetime(year + 1, 1, 1)
+            for _ in range(self._num_periods_per_year):
+                time_2 = min(time_1 + d_time, time_max)
+                start_times.append(time_1)
+                end_times.append(time_2)
+                time_1 = time_2
+            # In leap years the last period also covers December 31st if 365 is a multiple of temporal_res
+            end_times[-1] = time_max
+        self._start_times = start_times
+        self._end_times = end_times
+        if calendar in ('gregorian', 'standard', 'proleptic_gregorian'):
+            ref_time_64 = numpy.datetime64(ref_time, 'us')
+            one_day = numpy.timedelta64(1, 'D')
+            lower_bounds = (numpy.array(start_times, dtype='datetime64[us]') - ref_time_64) / one_day
+            upper_bounds = (numpy.array(end_times, dtype='datetime64[us]') - ref_time_64) / one_day
+        else:
+            time_units = 'days since %4d-%02d-%02d %02d:%02d' % (ref_time.year, ref_time.month, ref_time.day,
+                                                                 ref_time.hour, ref_time.minute)
+            lower_bounds = numpy.asarray(netCDF4.date2num(start_times, time_units, calendar=calendar),
+                                         dtype=numpy.float64)
+            upper_bounds = numpy.asarray(netCDF4.date2num(end_times, time_units, calendar=calendar),
+                                         dtype=numpy.float64)
+        #: The lower period bounds in days since *ref_time*
+        self.lower_bounds = lower_bounds
+        #: The upper period bounds in days since *ref_time*
+        self.upper_bounds = upper_bounds
+        #: The period times in days since *ref_time*
+        self.times = lower_bounds + 0.5 * temporal_res
+
+    @property
+    def start_year(self) -> int:
+        return self._start_year
+
+    @property
+    def end_year(self) -> int:
+        return self._end_year
+
+    @property
+    def num_periods_per_year(self) -> int:
+        return self._num_periods_per_year
+
+    @property
+    def size(self) -> int:
+        """
+        The number of periods.
+        """
+        return len(self._start_times)
+
+    def __len__(self):
+        return len(self._start_times)
+
+    def get_period(self, index: int):
+        """
+        Return the period (start_time, end_time) with the given global *index* as datetime values.
+        """
+        return self._start_times[index], self._end_times[index]
+
+    def get_global_index(self, year: int, time_index: int) -> int:
+        """
+        Return the global index of the period *time_index* of the given *year*.
+        """
+        if not self._start_year <= year <= self._end_year:
+            raise IndexError('year %d is outside of the time axis' % year)
+        return (year - self._start_year) * self._num_periods_per_year + time_index
+
+    def get_year_and_time_index(self, index: int):
+        """
+        Return (year, time_index) of the period with the given global *index*.
+        """
+        year_offset, time_index = divmod(index, self._num_periods_per_year)
+        return self._start_year + year_offset, time_index
+
+    def get_year_slice(self, year: int) -> slice:
+        """
+        Return the slice of global indices of the periods of the given *year*, e.g. to select their bounds.
+        """
+        index = self.get_global_index(year, 0)
+        return slice(index, index + self._num_periods_per_year)
+
+    def get_index(self, time: datetime, clip: bool = False) -> int:
+        """
+        Return the global index of the period which contains *time*, i.e. start_time <= time < end_time.
+
+        :param time: A datetime value.
+        :param clip: If true, times before the first or after the last period return the first or last index,
+               otherwise an ``IndexError`` is raised.
+        """
+        index = bisect.bisect_right(self._start_times, time) - 1
+        if index < 0 or time >= self._end_times[-1]:
+            if not clip:
+                raise IndexError('time %s is outside of the time axis' % time)
+            return 0 if index < 0 else len(self._start_times) - 1
+        return index
+
+    def get_overlapping_indices(self, start_time: datetime, end_time: datetime) -> range:
+        """
+        Return the range of global indices of the periods which overlap with *start_time* to *end_time*.
+        """
+        index_1 = bisect.bisect_right(self._end_times, start_time)
+        index_2 = bisect.bisect_left(self._start_times, end_time)
+        return range(index_1, max(index_1, index_2))
 
 
 class DatasetCache(metaclass=ABCMeta):
@@ -134,6 +465,12 @@ class DatasetCache(metaclass=ABCMeta):
         self._cache_dir = os.path.join(cache_base_dir, name)
         self._file_to_dataset = dict()
 
+    def __getstate__(self):
+        # Open datasets cannot be pickled, copies of a cache start without any.
+        state = self.__dict__.copy()
+        state['_file_to_dataset'] = dict()
+        return state
+
     @abstractmethod
     def open_dataset(self, file):
         """
@@ -208,6 +545,139 @@ class NetCDFDatasetCache(DatasetCache):
                   real_file)
 
 
+class SourceTimeRangeIndex:
+    """
+    A persistent index of the time ranges of the source files a provider named *name* reads from *dir_path*.
+
+    For each source file the index records the file's size and modification time together with the
+    (time_start, time_stop, time_index) ranges computed from it, so that only new or changed files have to be opened
+    again when a provider is prepared. The index is kept as JSON file **index_dir**/*name*-*hash*.json, where
+    *hash* identifies *dir_path*. Times are returned as ``datetime`` values. The index may be used by several
+    threads, see :py:meth:`NetCDFCubeSourceProvider.scan_source_time_ranges`.
+
+    The index file records :py:data:`SourceTimeRangeIndex.FORMAT_VERSION` and the *version* of the provider's
+    time range computation. An index file whose versions differ is ignored and replaced on the next **save()**.
+
+    :param name: The provider's registration name.
+    :param dir_path: The provider's source directory.
+    :param index_dir: The index directory. Defaults to ~/.esdl/index.
+    :param version: The version of the way the provider computes the time ranges of a source file.
+    """
+
+    #: The version of the index file format.
+    FORMAT_VERSION = 1
+
+    def __init__(self, name, dir_path, index_dir=None, version: int = 0):
+        if index_dir is None:
+            index_dir = os.path.join(os.path.join(os.path.expanduser("~"), '.esdl'), 'index')
+        dir_hash = hashlib.md5(os.path.abspath(dir_path).encode('utf-8')).hexdigest()[:16]
+        self._index_file = os.path.join(index_dir, '%s-%s.json' % (name, dir_hash))
+        self._version = version
+        self._file_to_entry = None
+        self._modified = False
+        self._lock = threading.Lock()
+        #: The number of files whose time ranges have been read from the index
+        self.num_hits = 0
+        #: The number of files whose time ranges have been computed
+        self.num_misses = 0
+
+    def __getstate__(self):
+        # Copies, e.g. in the worker processes of a provider, reload the index when needed
+        state = self.__dict__.copy()
+        state['_file_to_entry'] = None
+        state['_modified'] = False
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def index_file(self) -> str:
+        return self._index_file
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get_time_ranges(self, file, compute) -> list:
+        """
+        Get the list of (time_start, time_stop, time_index) tuples of the source *file*. They are taken from the
+        index if the file's size and modification time are unchanged, otherwise they are computed by calling
+        *compute(file)* and recorded in the index. Calls for different files may run concurrently, *compute* is
+        called outside of the index's lock.
+
+        :param file: The source file path.
+        :param compute: A function which opens *file* and returns its time ranges.
+        :return: The list of time ranges.
+        """
+        stat = os.stat(file)
+        key = os.path.abspath(file)
+        with self._lock:
+            entry = self._get_file_to_entry().get(key)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                self.num_hits += 1
+                return [(datetime(*t1), datetime(*t2), time_index) for t1, t2, time_index in entry['time_ranges']]
+        time_ranges = [(_to_datetime(t1), _to_datetime(t2), None if time_index is None else int(time_index))
+                       for t1, t2, time_index in compute(file)]
+        entry = dict(size=stat.st_size, mtime=stat.st_mtime,
+                     time_ranges=[(_to_time_tuple(t1), _to_time_tuple(t2), time_index)
+                                  for t1, t2, time_index in time_ranges])
+        with self._lock:
+            self.num_misses += 1
+            self._file_to_entry[key] = entry
+            self._modified = True
+        return time_ranges
+
+    def save(self):
+        """
+        Write the index if time ranges have been computed since it has been loaded. Entries of files which no longer
+        exist are dropped. The index is written to a temporary file first and then renamed, so that concurrent
+        readers never see a partial index.
+        """
+        with self._lock:
+            if not self._modified:
+                return
+            file_to_entry = {file: entry for file, entry in self._get_file_to_entry().items()
+                             if os.path.exists(file)}
+            self._modified = False
+        index_dir = os.path.dirname(self._index_file)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        temp_file = '%s.%d.tmp' % (self._index_file, os.getpid())
+        with open(temp_file, 'w') as fp:
+            json.dump(dict(format_version=SourceTimeRangeIndex.FORMAT_VERSION, version=self._version,
+                           files=file_to_entry), fp)
+        os.replace(temp_file, self._index_file)
+
+    def _get_file_to_entry(self):
+        if self._file_to_entry is None:
+            self._file_to_entry = dict()
+            if os.path.exists(self._index_file):
+                try:
+                    with open(self._index_file) as fp:
+                        index = json.load(fp)
+                except ValueError:
+                    print('Warning: ignoring corrupt source time range index \'%s\'' % self._index_file)
+                else:
+                    # Indexes of other versions may hold time ranges computed differently, they are dropped
+                    if isinstance(index, dict) \
+                            and index.get('format_version') == SourceTimeRangeIndex.FORMAT_VERSION \
+                            and index.get('version') == self._version:
+                        self._file_to_entry = index['files']
+        return self._file_to_entry
+
+
+def _to_datetime(time):
+    # Also converts the datetime objects returned by netCDF4.num2date() for non-standard calendars
+    return datetime(time.year, time.month, time.day, time.hour, time.minute, time.second, time.microsecond)
+
+
+def _to_time_tuple(time):
+    return time.year, time.month, time.day, time.hour, time.minute, time.second, time.microsecond
+
+
 class Config:
     """
     Global CAB-LAB configuration.
@@ -56,6 +56,8 @@ setup(
     entry_points={
         'console_scripts': [
             'cube-gen = esdl.cube_gen:main',
+            'cube-bench = esdl.cube_bench:main',
+            'cube-chunks = esdl.cube_chunks:main',
         ],
         'cate_plugins': [
             'cate_esdc = esdl.cate.esdc:cate_init',
@@ -1,11 +1,16 @@
+import json
 import os
 import shutil
+import threading
+import time
 from datetime import datetime
 from unittest import TestCase
 
+import netCDF4
 import numpy as np
 
 from esdl import CubeConfig, Cube
+from esdl.cube_manifest import CubeManifest
 from esdl.cube_provider import CubeSourceProvider
 
 CUBE_DIR = 'testcube'
@@ -138,6 +143,357 @@ class CubeTest(TestCase):
         finally:
             cube2.close()
 
+    def test_update_parallel_and_pipelined(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 3, 1))
+        serial_dir = CUBE_DIR + '/serial'
+        parallel_dir = CUBE_DIR + '/parallel'
+        pipelined_dir = CUBE_DIR + '/pipelined'
+        os.mkdir(CUBE_DIR)
+
+        cube = Cube.create(serial_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2002, 3, 1)))
+        cube.close()
+
+        cube = Cube.create(parallel_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2002, 3, 1)), jobs=3)
+        cube.close()
+
+        cube = Cube.create(pipelined_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2002, 3, 1)),
+                    pipelined=True)
+        cube.close()
+
+        for file in ['LAI/2001_LAI.nc', 'LAI/2002_LAI.nc']:
+            with netCDF4.Dataset(os.path.join(serial_dir, 'data', file)) as serial_ds:
+                serial_lai = serial_ds.variables['LAI'][:]
+            for other_dir in [parallel_dir, pipelined_dir]:
+                with netCDF4.Dataset(os.path.join(other_dir, 'data', file)) as other_ds:
+                    other_lai = other_ds.variables['LAI'][:]
+                self.assertEqual(serial_lai.tobytes(), other_lai.tobytes())
+                self.assertEqual(serial_lai.mask.tolist(), other_lai.mask.tolist())
+
+    def test_update_resume(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 3, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        cube.update(CubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20)))
+
+        manifest_file = os.path.join(CUBE_DIR, 'cube.manifest')
+        with open(manifest_file) as fp:
+            entries = sorted(tuple(line.split()) for line in fp)
+        self.assertEqual(16, len(entries))
+        self.assertIn(('FAPAR', '2001', '41'), entries)
+        self.assertIn(('LAI', '2002', '2'), entries)
+
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20))
+        cube.update(provider, resume=True)
+        self.assertEqual([], provider.trace)
+
+        # Forget about 2002
+        with open(manifest_file, 'w') as fp:
+            fp.write(''.join('%s %s %s\n' % entry for entry in entries if entry[1] == '2001'))
+            # Incomplete lines must be ignored
+            fp.write('LAI 2002')
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20))
+        cube.update(provider, resume=True)
+        self.assertEqual([(datetime(2002, 1, 1), datetime(2002, 1, 9)),
+                          (datetime(2002, 1, 9), datetime(2002, 1, 17)),
+                          (datetime(2002, 1, 17), datetime(2002, 1, 25))],
+                         provider.trace)
+        cube.close()
+
+    def test_manifest_commit_is_locked(self):
+        os.makedirs(CUBE_DIR)
+        lock_file = os.path.join(CUBE_DIR, 'cube.manifest.lock')
+
+        def commit_periods(var_name):
+            # Separate instances act like separate processes sharing the manifest file
+            manifest = CubeManifest(CUBE_DIR)
+            for time_index in range(50):
+                manifest.add_pending('file', var_name, 2001, time_index)
+                manifest.commit('file')
+
+        threads = [threading.Thread(target=commit_periods, args=(var_name,)) for var_name in ('LAI', 'FAPAR', 'NDVI')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(os.path.exists(lock_file))
+        with open(os.path.join(CUBE_DIR, 'cube.manifest')) as fp:
+            lines = fp.readlines()
+        self.assertEqual(150, len(lines))
+        self.assertEqual(150, len(set(lines)))
+
+        # A stale lock left by a crashed process is removed
+        with open(lock_file, 'w'):
+            pass
+        stale_time = time.time() - CubeManifest.LOCK_TIMEOUT - 10
+        os.utime(lock_file, (stale_time, stale_time))
+        manifest = CubeManifest(CUBE_DIR)
+        manifest.add_pending('file', 'LAI', 2002, 0)
+        manifest.commit('file')
+        self.assertTrue(CubeManifest(CUBE_DIR).is_completed('LAI', 2002, 0))
+        self.assertFalse(os.path.exists(lock_file))
+
+    def test_update_metrics(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2001, 2, 1))
+        cube.update(provider, profile_stages=['write'], reports=True)
+        cube.close()
+
+        self.assertEqual(4, provider.metrics.counters['periods'])
+        self.assertEqual(8, provider.metrics.stages['write'].count)
+        self.assertEqual(8 * 360 * 180 * 4, provider.metrics.stages['write'].bytes)
+        self.assertEqual(2, provider.metrics.stages['close'].count)
+
+        reports_dir = os.path.join(CUBE_DIR, 'reports')
+        report_files = os.listdir(reports_dir)
+        self.assertEqual(3, len(report_files))
+        prefix = [file for file in report_files if file.endswith('.json')][0][:-len('.json')]
+        self.assertTrue(prefix.startswith('test-'))
+        self.assertEqual(sorted([prefix + '.json', prefix + '.jsonl', prefix + '-write.prof']), sorted(report_files))
+        with open(os.path.join(reports_dir, prefix + '.json')) as fp:
+            report = json.load(fp)
+        self.assertEqual('test', report['provider'])
+        self.assertEqual(8, report['stages']['write']['count'])
+        with open(os.path.join(reports_dir, prefix + '.jsonl')) as fp:
+            events = [json.loads(line) for line in fp]
+        self.assertEqual(['write'] * 8 + ['close'] * 2, [event['stage'] for event in events])
+        self.assertEqual({'FAPAR', 'LAI'}, set(event['var'] for event in events[0:8]))
+        self.assertEqual(360 * 180 * 4, events[0]['bytes'])
+
+    def test_update_without_reports(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2001, 2, 1))
+        cube.update(provider)
+        cube.close()
+
+        self.assertEqual(4, provider.metrics.counters['periods'])
+        self.assertEqual(8, provider.metrics.stages['write'].count)
+        self.assertFalse(os.path.exists(os.path.join(CUBE_DIR, 'reports')))
+
+    def test_update_max_open_files(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(4, 180, 360),
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 3, 1))
+        serial_dir = CUBE_DIR + '/serial'
+        pooled_dir = CUBE_DIR + '/pooled'
+        os.mkdir(CUBE_DIR)
+
+        cube = Cube.create(serial_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20)))
+        cube.close()
+
+        # LAI and FAPAR files evict each other for every image
+        cube = Cube.create(pooled_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20)),
+                    max_open_files=1)
+        cube.close()
+
+        for file in ['LAI/2001_LAI.nc', 'LAI/2002_LAI.nc', 'FAPAR/2001_FAPAR.nc', 'FAPAR/2002_FAPAR.nc']:
+            var_name = file.split('/')[0]
+            with netCDF4.Dataset(os.path.join(serial_dir, 'data', file)) as serial_ds:
+                serial_var = serial_ds.variables[var_name][:]
+            with netCDF4.Dataset(os.path.join(pooled_dir, 'data', file)) as pooled_ds:
+                pooled_var = pooled_ds.variables[var_name][:]
+                self.assertNotIn('esdl_incomplete', pooled_ds.ncattrs())
+            self.assertEqual(serial_var.tobytes(), pooled_var.tobytes())
+            self.assertEqual(np.ma.getmaskarray(serial_var).tolist(), np.ma.getmaskarray(pooled_var).tolist())
+
+        with open(os.path.join(pooled_dir, 'cube.manifest')) as fp:
+            entries = fp.readlines()
+        self.assertEqual(2 * 8, len(entries))
+        self.assertEqual(len(entries), len(set(entries)))
+
+    def test_update_omits_temporal_aggregation(self):
+        cube = Cube.create(CUBE_DIR, CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180))
+        cube.update(AggregatingCubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2001, 1, 9)))
+        cube.close()
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, 'data', 'LAI', '2001_LAI.nc')) as dataset:
+            variable = dataset.variables['LAI']
+            self.assertEqual('m2 m-2', variable.units)
+            self.assertNotIn('temporal_aggregation', variable.ncattrs())
+
+    def test_update_tiled(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2002, 3, 1))
+        serial_dir = CUBE_DIR + '/serial'
+        tiled_dir = CUBE_DIR + '/tiled'
+        os.mkdir(CUBE_DIR)
+
+        cube = Cube.create(serial_dir, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20)))
+        cube.close()
+
+        cube = Cube.create(tiled_dir, config)
+        provider = TiledCubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20))
+        cube.update(provider, memory_budget=180 * 360)
+        # 8 periods with 4 tiles each
+        self.assertEqual(8 * 4, provider.num_tiles)
+        self.assertEqual(8, provider.metrics.counters['periods'])
+        with self.assertRaises(ValueError):
+            cube.update(provider, memory_budget=180 * 360, jobs=2)
+        cube.close()
+
+        for file in ['LAI/2001_LAI.nc', 'LAI/2002_LAI.nc']:
+            with netCDF4.Dataset(os.path.join(serial_dir, 'data', file)) as serial_ds:
+                serial_lai = serial_ds.variables['LAI'][:]
+            with netCDF4.Dataset(os.path.join(tiled_dir, 'data', file)) as tiled_ds:
+                tiled_lai = tiled_ds.variables['LAI'][:]
+            self.assertEqual(serial_lai.tobytes(), tiled_lai.tobytes())
+            self.assertEqual(serial_lai.mask.tolist(), tiled_lai.mask.tolist())
+
+        with open(os.path.join(tiled_dir, 'cube.manifest')) as fp:
+            self.assertEqual(8, len(fp.readlines()))
+
+        # Periods without sources yield no tiles and are not counted
+        cube = Cube.create(CUBE_DIR + '/tiled-gap', config)
+        provider = TiledCubeSourceProviderMock(cube.config, datetime(2001, 12, 1), datetime(2002, 1, 20))
+        provider.empty_period_starts = {datetime(2001, 12, 11), datetime(2002, 1, 1)}
+        cube.update(provider, memory_budget=180 * 360)
+        cube.close()
+        self.assertEqual(6 * 4, provider.num_tiles)
+        self.assertEqual(6, provider.metrics.counters['periods'])
+
+    def test_update_zarr(self):
+        netcdf_dir = CUBE_DIR + '/netcdf'
+        zarr_dir = CUBE_DIR + '/zarr'
+        os.mkdir(CUBE_DIR)
+
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(4, 90, 90),
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        cube = Cube.create(netcdf_dir, config)
+        cube.update(CubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+        cube.close()
+
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(4, 90, 90),
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1), file_format='zarr')
+        cube = Cube.create(zarr_dir, config)
+        cube.update(CubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+        cube.close()
+
+        self.assertTrue(os.path.exists(zarr_dir + '/data/LAI/.zgroup'))
+        self.assertFalse(os.path.exists(zarr_dir + '/data/LAI/2001_LAI.nc'))
+
+        cube = Cube.open(zarr_dir)
+        self.assertEqual('zarr', cube.config.file_format)
+        netcdf_cube = Cube.open(netcdf_dir)
+        try:
+            self.assertEqual(['FAPAR', 'LAI'], cube.data.variable_names)
+            for var_name in ['FAPAR', 'LAI']:
+                zarr_var = cube.data.variable(var_name)
+                netcdf_var = netcdf_cube.data.variable(var_name)
+                self.assertEqual((92, 180, 360), zarr_var.shape)
+                self.assertEqual(netcdf_var.shape, zarr_var.shape)
+                np.testing.assert_array_equal(netcdf_var.values, zarr_var.values)
+            ds = cube.data.dataset('LAI')
+            self.assertIn('time_bnds', ds.coords)
+            self.assertEqual(netcdf_cube.data.dataset('LAI').time.values.tolist(), ds.time.values.tolist())
+        finally:
+            cube.close()
+            netcdf_cube.close()
+
+        with self.assertRaises(ValueError):
+            CubeConfig(file_format='zarr', start_time=None)
+
+    def test_update_time_series(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 180, 360),
+                            time_series_chunks=(10, 20), start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        cube.update(CubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+
+        time_series_file = os.path.join(CUBE_DIR, 'timeseries', 'LAI.nc')
+        self.assertTrue(os.path.exists(time_series_file))
+        with netCDF4.Dataset(time_series_file) as dataset:
+            variable = dataset.variables['LAI']
+            self.assertEqual((92, 180, 360), variable.shape)
+            self.assertEqual([92, 10, 20], variable.chunking())
+            time_series = variable[:, 30, 40]
+            self.assertEqual(2 * 46, len(dataset.variables['time']))
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, 'data', 'LAI', '2001_LAI.nc')) as dataset:
+            np.testing.assert_array_equal(dataset.variables['LAI'][:, 30, 40], time_series[:46])
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, 'data', 'LAI', '2002_LAI.nc')) as dataset:
+            np.testing.assert_array_equal(dataset.variables['LAI'][:, 30, 40], time_series[46:])
+
+        data = cube.data
+        cube_var = data._cube_var_dict['LAI']
+        # A map touches fewer chunks of the year files
+        lai_map = data.get('LAI', time=datetime(2001, 11, 10))[0]
+        self.assertEqual((180, 360), lai_map.shape)
+        self.assertIsNone(cube_var.time_series_dataset)
+        # A pixel time series touches a single chunk of the time-series copy
+        lai_series = data.get('LAI', time=(datetime(2001, 1, 1), datetime(2002, 12, 31)), latitude=59.6,
+                              longitude=-139.6)[0]
+        self.assertIsNotNone(cube_var.time_series_dataset)
+        np.testing.assert_array_equal(np.ma.filled(time_series.astype(np.float64), np.nan), lai_series.values)
+        dataset = data.dataset('LAI', latitude=59.6, longitude=-139.6)
+        self.assertEqual(92, dataset.dims['time'])
+        cube.close()
+
+        # Copies older than the data are not used
+        newer = os.path.getmtime(time_series_file) + 10
+        os.utime(os.path.join(CUBE_DIR, 'data', 'LAI', '2002_LAI.nc'), (newer, newer))
+        cube = Cube.open(CUBE_DIR)
+        data = cube.data
+        data.get('LAI', time=(datetime(2001, 1, 1), datetime(2002, 12, 31)), latitude=59.6, longitude=-139.6)
+        self.assertIsNone(data._cube_var_dict['LAI'].time_series_dataset)
+        cube.update_time_series(['LAI'])
+        cube.close()
+        self.assertGreaterEqual(os.path.getmtime(time_series_file), newer)
+
+    def test_update_overviews(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 180, 360),
+                            overview_levels=2, start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        cube.update(CubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+
+        for level, shape in ((1, (92, 90, 180)), (2, (92, 45, 90))):
+            with netCDF4.Dataset(os.path.join(CUBE_DIR, 'overviews', 'LAI', '%d.nc' % level)) as dataset:
+                self.assertEqual(shape, dataset.variables['LAI'].shape)
+                self.assertAlmostEqual(2 ** level, float(dataset.variables['lon_bnds'][0, 1] -
+                                                         dataset.variables['lon_bnds'][0, 0]))
+
+        data = cube.data
+        lai_map = data.get('LAI', time=datetime(2001, 11, 10))[0]
+        self.assertEqual((180, 360), lai_map.shape)
+        lai_overview = data.get('LAI', time=datetime(2001, 11, 10), max_shape=(50, 100))[0]
+        self.assertEqual((45, 90), lai_overview.shape)
+        np.testing.assert_allclose(lai_overview.values, float(lai_map.values[0, 0]), rtol=1e-6)
+        lai_overview = data.get('LAI', time=datetime(2001, 11, 10), max_shape=(10, 10))[0]
+        self.assertEqual((45, 90), lai_overview.shape)
+        self.assertEqual((92, 90, 180), data.variable('LAI', level=1).shape)
+        self.assertEqual((92, 180, 360), data.variable('LAI', max_shape=(720, 1440)).shape)
+        self.assertEqual(45, data.dataset('LAI', latitude=(0, 90), level=1).dims['lat'])
+        with self.assertRaises(ValueError):
+            data.variable('LAI', level=3)
+        cube.close()
+
+    def test_select_codecs(self):
+        cube = Cube.create(CUBE_DIR, CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                                                start_time=datetime(2001, 1, 1), end_time=datetime(2002, 1, 1)))
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2001, 3, 1))
+        results = cube.select_codecs(provider, candidates=['none', 'zlib:1', 'zlib:9'], num_samples=2,
+                                     io_bytes_per_second=1024 * 1024)
+        self.assertEqual(['FAPAR', 'LAI'], sorted(results.keys()))
+        self.assertEqual(['none', 'zlib:1:shuffle', 'zlib:9:shuffle'], [result['codec'] for result in results['LAI']])
+        self.assertEqual(2 * 180 * 360 * 4, results['LAI'][0]['bytes'])
+        self.assertIn(cube.config.var_codecs['LAI'], ['zlib:1:shuffle', 'zlib:9:shuffle'])
+        self.assertEqual(cube.config.var_codecs, Cube.open(CUBE_DIR).config.var_codecs)
+
+        cube.update(provider)
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, 'data', 'LAI', '2001_LAI.nc')) as dataset:
+            filters = dataset.variables['LAI'].filters()
+        self.assertTrue(filters['zlib'])
+        self.assertTrue(filters['shuffle'])
+
+        # Variables with data keep their codec
+        self.assertEqual(0, len(cube.select_codecs(provider, candidates=['none'])))
+        cube.close()
+
     def assert_cf_conformant_time_info(self, data, var_name):
         P = 8.  # period = 8d
         L = 138  # num periods
@@ -264,3 +620,68 @@ class CubeSourceProviderMock(CubeSourceProvider):
 
     def close(self):
         pass
+
+
+class PeriodCubeSourceProviderMock(CubeSourceProviderMock):
+    """
+    A provider whose images only depend on the requested period, so it can be used with ``Cube.update(jobs=N)``.
+    """
+
+    @property
+    def parallel_periods(self):
+        return True
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'LAI': {
+                'data_type': np.float32,
+                'fill_value': 0.0,
+            }
+        }
+
+    def compute_variable_images(self, period_start, period_end):
+        image_shape = (self.cube_config.grid_height, self.cube_config.grid_width)
+        image = np.full(image_shape, period_start.timetuple().tm_yday / 365., dtype=np.float32)
+        image[:, 0:period_start.month] = np.nan
+        return {'LAI': image}
+
+
+class AggregatingCubeSourceProviderMock(PeriodCubeSourceProviderMock):
+    """
+    A provider whose variable descriptor chooses a temporal aggregation reducer.
+    """
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'LAI': {
+                'data_type': np.float32,
+                'fill_value': 0.0,
+                'units': 'm2 m-2',
+                'temporal_aggregation': 'max',
+            }
+        }
+
+
+class TiledCubeSourceProviderMock(PeriodCubeSourceProviderMock):
+    """
+    Yields the images of the PeriodCubeSourceProviderMock in 4 row bands.
+    """
+
+    def __init__(self, *args):
+        super(TiledCubeSourceProviderMock, self).__init__(*args)
+        self.num_tiles = 0
+        self.empty_period_starts = set()
+
+    def compute_variable_tiles(self, period_start, period_end, memory_budget):
+        if period_start in self.empty_period_starts:
+            return
+        var_name_to_image = self.compute_variable_images(period_start, period_end)
+        if not var_name_to_image:
+            return
+        for var_name, image in var_name_to_image.items():
+            height = image.shape[0] // 4
+            for y in range(0, image.shape[0], height):
+                self.num_tiles += 1
+                yield var_name, (0, y, image.shape[1], height), image[y:y + height, :]
@@ -0,0 +1,50 @@
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+from esdl import CubeConfig
+from esdl.cube_bench import append_history, find_baseline, is_regression, load_history, run_benchmark
+
+CUBE_DIR = 'testcube'
+HISTORY_FILE = 'test-cube-bench-history.jsonl'
+
+
+class CubeBenchTest(TestCase):
+    def setUp(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, True)
+        if os.path.exists(HISTORY_FILE):
+            os.remove(HISTORY_FILE)
+
+    def tearDown(self):
+        self.setUp()
+
+    def test_run_benchmark(self):
+        cube_config = CubeConfig(spatial_res=10.0, grid_width=36, grid_height=18, temporal_res=8,
+                                 start_time=datetime(2001, 1, 1), end_time=datetime(2002, 1, 1),
+                                 chunk_sizes=(4, 18, 36))
+        result = run_benchmark(CUBE_DIR, cube_config, num_vars=2)
+
+        self.assertEqual(2 * 46, result['num_periods'])
+        self.assertEqual([4, 18, 36], result['chunk_sizes'])
+        self.assertAlmostEqual(2 * 46 * 36 * 18 * 4 / (1024. * 1024.), result['data_mb'])
+        self.assertGreater(result['file_mb'], 0.0)
+        self.assertGreater(result['periods_per_second'], 0.0)
+        self.assertGreater(result['compute_time'], 0.0)
+        self.assertGreater(result['write_time'], 0.0)
+        self.assertLessEqual(result['compute_time'] + result['write_time'], result['total_time'])
+
+        self.assertEqual([], load_history(HISTORY_FILE))
+        self.assertIsNone(find_baseline([], result))
+        append_history(HISTORY_FILE, result)
+        history = load_history(HISTORY_FILE)
+        self.assertEqual([result], history)
+        self.assertEqual(result, find_baseline(history, result))
+
+        other_result = dict(result, grid_width=72)
+        self.assertIsNone(find_baseline(history, other_result))
+
+        slower_result = dict(result, periods_per_second=0.85 * result['periods_per_second'])
+        self.assertTrue(is_regression(slower_result, result, 10.0))
+        self.assertFalse(is_regression(slower_result, result, 20.0))
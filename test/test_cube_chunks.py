@@ -0,0 +1,95 @@
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+from esdl import CubeConfig
+from esdl.cube_chunks import Workload, get_candidate_chunk_sizes, get_dask_chunks, tune_chunk_sizes, main
+from esdl.cube_chunks import _num_touched_chunks
+
+WORK_DIR = 'testchunks'
+
+
+def _create_config(**kwargs):
+    return CubeConfig(spatial_res=10.0, grid_width=36, grid_height=18,
+                      start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1), **kwargs)
+
+
+class ChunksTest(TestCase):
+    def setUp(self):
+        while os.path.exists(WORK_DIR):
+            shutil.rmtree(WORK_DIR, False)
+        os.mkdir(WORK_DIR)
+
+    def tearDown(self):
+        while os.path.exists(WORK_DIR):
+            shutil.rmtree(WORK_DIR, False)
+
+    def test_workload(self):
+        workload = Workload(maps=1, time_series=3)
+        self.assertEqual([0.25, 0.75, 0.0], list(workload.fractions.values()))
+        with self.assertRaises(ValueError):
+            Workload(maps=0)
+        with self.assertRaises(ValueError):
+            Workload(maps=-1, time_series=2)
+        with self.assertRaises(ValueError):
+            Workload(boxes=1, box_size=(10, 10))
+
+    def test_get_candidate_chunk_sizes(self):
+        candidates = get_candidate_chunk_sizes(_create_config())
+        self.assertIn((1, 18, 36), candidates)
+        self.assertIn((46, 9, 18), candidates)
+        self.assertIn((23, 1, 2), candidates)
+        self.assertEqual(len(candidates), len(set(candidates)))
+        candidates = get_candidate_chunk_sizes(_create_config(), 18 * 36 * 4)
+        self.assertIn((1, 18, 36), candidates)
+        self.assertNotIn((2, 18, 36), candidates)
+        self.assertTrue(all(t * y * x * 4 <= 18 * 36 * 4 for t, y, x in candidates))
+
+    def test_get_dask_chunks(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        # Time first for time series, never more than a year of a NetCDF cube
+        self.assertEqual((46, 180, 360), get_dask_chunks(config, (1, 90, 90), Workload(time_series=1)))
+        self.assertEqual((46, 45, 90), get_dask_chunks(config, (1, 45, 90), Workload(time_series=1),
+                                                       max_dask_bytes=46 * 45 * 90 * 4))
+        # Space first for maps
+        self.assertEqual((2, 180, 360), get_dask_chunks(config, (1, 90, 90), Workload(maps=1),
+                                                        max_dask_bytes=2 * 180 * 360 * 4))
+
+    def test_num_touched_chunks(self):
+        self.assertEqual(1, _num_touched_chunks((0, 0, 0), (1, 10, 10), (1, 10, 10)))
+        self.assertEqual(8, _num_touched_chunks((5, 5, 5), (10, 10, 10), (10, 10, 10)))
+        self.assertEqual(46, _num_touched_chunks((0, 3, 3), (46, 1, 1), (1, 18, 36)))
+
+    def test_tune_chunk_sizes(self):
+        candidates = [(1, 18, 36), (46, 3, 6)]
+        tuning = tune_chunk_sizes(_create_config(), Workload(time_series=1), candidates=candidates,
+                                  work_dir=WORK_DIR)
+        self.assertEqual(candidates, [candidate.chunk_sizes for candidate in tuning.candidates])
+        self.assertIn(tuning.chunk_sizes, candidates)
+        self.assertTrue(tuning.target_met)
+        for candidate in tuning.candidates:
+            self.assertEqual(['maps', 'time_series', 'boxes'], list(candidate.read_seconds.keys()))
+            self.assertEqual(candidate.read_seconds['time_series'], candidate.latency)
+            self.assertGreater(candidate.ratio, 0.0)
+        self.assertIn('recommended chunk_sizes', tuning.report())
+        # Synthetic slices are removed
+        self.assertEqual([], os.listdir(WORK_DIR))
+
+        # The smallest chunks meeting the latency target are recommended
+        tuning = tune_chunk_sizes(_create_config(), Workload(time_series=1), candidates=candidates,
+                                  work_dir=WORK_DIR, max_latency=1000.0)
+        self.assertEqual((1, 18, 36), tuning.chunk_sizes)
+
+        with self.assertRaises(ValueError):
+            tune_chunk_sizes(_create_config(file_format='NETCDF3_CLASSIC'), Workload())
+
+    def test_main(self):
+        config_file = os.path.join(WORK_DIR, 'cube.config')
+        output_file = os.path.join(WORK_DIR, 'tuned.config')
+        _create_config().store(config_file)
+        main(['-c', config_file, '--time-series', '1', '--max-chunk-mb', '0.01', '--reads', '1',
+              '--work-dir', WORK_DIR, '-o', output_file])
+        config = CubeConfig.load(output_file)
+        self.assertEqual(3, len(config.chunk_sizes))
+        self.assertEqual(3, len(config.dask_chunks))
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+import numpy as np
+
+from esdl.cube_codecs import Codec, evaluate_codec, select_codec
+
+
+class CodecTest(TestCase):
+    def test_parse(self):
+        self.assertEqual('zlib:5:shuffle', Codec.parse('zlib').spec)
+        self.assertEqual('zlib:1:noshuffle', Codec.parse('zlib:1:noshuffle').spec)
+        self.assertEqual('zstd:3:shuffle', Codec.parse('zstd').spec)
+        self.assertEqual('blosc-lz4:5:bitshuffle', Codec.parse('blosc-lz4::bitshuffle').spec)
+        self.assertEqual('none', Codec.parse('none').spec)
+        self.assertEqual(Codec('zlib', level=5), Codec.parse('zlib:5'))
+        with self.assertRaises(ValueError):
+            Codec.parse('gzip')
+        with self.assertRaises(ValueError):
+            Codec.parse('zlib:0')
+        with self.assertRaises(ValueError):
+            Codec.parse('zlib:x')
+        with self.assertRaises(ValueError):
+            Codec.parse('zlib:5:bitshuffle')
+        with self.assertRaises(ValueError):
+            Codec.parse('zlib:5:shuffle:1')
+
+    def test_get_netcdf_kwargs(self):
+        self.assertEqual(dict(zlib=False), Codec('none').get_netcdf_kwargs('NETCDF3_CLASSIC'))
+        self.assertEqual(dict(zlib=True, complevel=5, shuffle=True),
+                         Codec('zlib').get_netcdf_kwargs('NETCDF4_CLASSIC'))
+        with self.assertRaises(ValueError):
+            Codec('zlib').get_netcdf_kwargs('NETCDF3_CLASSIC')
+
+    def test_encode_decode(self):
+        image = np.linspace(0.0, 1.0, 180 * 360, dtype=np.float32).reshape((180, 360))
+        for spec in ['none', 'zlib:1:noshuffle', 'zlib:9:shuffle']:
+            codec = Codec.parse(spec)
+            buffer = codec.encode(image)
+            np.testing.assert_array_equal(image, codec.decode(buffer, image.dtype, image.shape))
+        self.assertLess(len(Codec.parse('zlib:5:shuffle').encode(image)),
+                        len(Codec.parse('zlib:5:noshuffle').encode(image)))
+
+    def test_select_codec(self):
+        images = [np.zeros((180, 360), dtype=np.float32), np.ones((180, 360), dtype=np.float32)]
+        result = evaluate_codec(Codec('zlib'), images)
+        self.assertEqual(2 * 180 * 360 * 4, result['bytes'])
+        self.assertGreater(result['ratio'], 100.0)
+
+        # Constant images on slow storage: the smaller size outweighs the time spent compressing
+        codec, results = select_codec(images, candidates=['none', 'zlib:1'], file_format='NETCDF4_CLASSIC',
+                                      io_bytes_per_second=1024 * 1024)
+        self.assertEqual('zlib:1:shuffle', codec.spec)
+        self.assertEqual(['none', 'zlib:1:shuffle'], [result['codec'] for result in results])
+
+        # Only 'none' is supported by NetCDF 3
+        codec, results = select_codec(images, candidates=['none', 'zlib:1'], file_format='NETCDF3_CLASSIC')
+        self.assertEqual('none', codec.spec)
+        self.assertEqual(1, len(results))
+
+        with self.assertRaises(ValueError):
+            select_codec(images, candidates=['zlib:1'], file_format='NETCDF3_CLASSIC')
@@ -1,3 +1,4 @@
+from datetime import datetime
 from unittest import TestCase
 
 from esdl import CubeConfig, CUBE_MODEL_VERSION
@@ -23,6 +24,40 @@ class CubeConfigTest(TestCase):
             CubeConfig(comp_level=0)
         with self.assertRaises(ValueError):
             CubeConfig(comp_level=10)
+        with self.assertRaises(ValueError):
+            CubeConfig(codec='gzip')
+        with self.assertRaises(ValueError):
+            CubeConfig(var_codecs={'LAI': 'zlib:10'})
+        with self.assertRaises(ValueError):
+            CubeConfig(comp_threads=0)
+        with self.assertRaises(ValueError):
+            CubeConfig(overview_levels=0)
+        with self.assertRaises(ValueError):
+            CubeConfig(overview_levels=2, end_time=None)
+
+    def test_get_codec(self):
+        self.assertEqual('none', CubeConfig().get_codec('LAI').spec)
+        self.assertEqual('zlib:3:shuffle', CubeConfig(compression=True, comp_level=3).get_codec('LAI').spec)
+        self.assertEqual('zlib:3:noshuffle', CubeConfig(compression=True, comp_level=3,
+                                                        file_format='zarr').get_codec('LAI').spec)
+        config = CubeConfig(compression=True, codec='zlib:1', var_codecs={'water_mask': 'zlib:9'})
+        self.assertEqual('zlib:1:shuffle', config.get_codec('LAI').spec)
+        self.assertEqual('zlib:9:shuffle', config.get_codec('water_mask').spec)
+
+    def test_time_axis(self):
+        config = CubeConfig(start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        time_axis = config.time_axis
+        self.assertEqual(2001, time_axis.start_year)
+        self.assertEqual(2002, time_axis.end_year)
+        self.assertIs(time_axis, config.time_axis)
+
+        config.end_time = datetime(2003, 3, 1)
+        self.assertIsNot(time_axis, config.time_axis)
+        self.assertEqual(3 * 46, config.time_axis.size)
+
+        config.start_time = None
+        with self.assertRaises(ValueError):
+            config.time_axis
 
     def test_model_version_is_current(self):
         config = CubeConfig()
@@ -1,9 +1,21 @@
+import multiprocessing
 import os
+import shutil
+import sys
 from collections import OrderedDict
+from datetime import datetime
 from unittest import TestCase
 
+from esdl import Cube, CubeConfig
 from esdl.cube_gen import _parse_source_arg
+from esdl.cube_gen import _create_or_open_cube
+from esdl.cube_gen import _run_worker
+from esdl.cube_gen import _update_cube_concurrently
 from esdl.cube_gen import main
+from esdl.cube_queue import WorkQueue
+from esdl.providers import TestCubeSourceProvider
+
+CUBE_DIR = 'testcube'
 
 
 class MainTest(TestCase):
@@ -22,3 +34,105 @@ class MainTest(TestCase):
         self.assertEquals(('a', [['c'], ['e']], OrderedDict([('b', '1'), ('d', '2')]), None),
                           _parse_source_arg(
                               'a' + os.pathsep + 'b=1' + os.pathsep + 'c' + os.pathsep + 'd=2' + os.pathsep + 'e'))
+
+
+class UpdateCubeConcurrentlyTest(TestCase):
+    def setUp(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, False)
+
+    def tearDown(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, False)
+
+    def test_update_cube_concurrently(self):
+        cube = Cube.create(CUBE_DIR, CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                                                start_time=datetime(2005, 1, 1), end_time=datetime(2005, 3, 1)))
+        source_providers = [TestCubeSourceProvider(cube.config, var='a_var'),
+                            TestCubeSourceProvider(cube.config, var='b_var'),
+                            TestCubeSourceProvider(cube.config, var='c_var')]
+        log_dir = os.path.join(CUBE_DIR, 'log')
+        failed = _update_cube_concurrently(cube, source_providers, 2, dict(), log_dir)
+        cube.close()
+
+        self.assertEqual([], failed)
+        for var_name in ['a_var', 'b_var', 'c_var']:
+            self.assertTrue(os.path.exists(os.path.join(CUBE_DIR, 'data', var_name, '2005_%s.nc' % var_name)))
+        self.assertEqual(['test-2.log', 'test-3.log', 'test.log'], sorted(os.listdir(log_dir)))
+
+
+class WorkerTest(TestCase):
+    def setUp(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, False)
+
+    def tearDown(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, False)
+
+    def test_workers(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180,
+                            start_time=datetime(2005, 1, 1), end_time=datetime(2008, 1, 1))
+        workers = [multiprocessing.Process(target=_run_test_worker, args=(config,)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([0, 0, 0], [worker.exitcode for worker in workers])
+
+        queue_dir = os.path.join(CUBE_DIR, 'queue')
+        self.assertEqual(sorted('test.%s.%d.done' % (var_name, year)
+                                for var_name in ['a_var', 'b_var'] for year in [2005, 2006, 2007]),
+                         sorted(os.listdir(queue_dir)))
+        for var_name in ['a_var', 'b_var']:
+            for year in [2005, 2006, 2007]:
+                self.assertTrue(os.path.exists(os.path.join(CUBE_DIR, 'data', var_name, '%d_%s.nc' % (year, var_name))))
+
+        # Every period has been written exactly once
+        with open(os.path.join(CUBE_DIR, 'cube.manifest')) as fp:
+            entries = fp.readlines()
+        self.assertEqual(2 * 3 * 46, len(entries))
+        self.assertEqual(len(entries), len(set(entries)))
+
+    def test_worker_retries_failed_units(self):
+        queue_dir = os.path.join(CUBE_DIR, 'queue')
+        cube = FailingCubeMock(num_failures=1)
+        self.assertEqual([], _run_worker(cube, [SourceProviderMock()], dict(), queue_dir, retries=1))
+        self.assertEqual([2005, 2006, 2005], cube.updated_years)
+
+        cube = FailingCubeMock(num_failures=3)
+        self.assertEqual(['mock.x.2007'], _run_worker(cube, [SourceProviderMock(2007)], dict(), queue_dir, retries=1))
+        self.assertEqual([2007, 2007], cube.updated_years)
+        self.assertIsNone(WorkQueue(queue_dir).get_owner('mock.x.2007'))
+
+
+class FailingCubeMock:
+    def __init__(self, num_failures):
+        self.num_failures = num_failures
+        self.updated_years = []
+
+    def get_update_years(self, source_provider):
+        return source_provider.years
+
+    def update(self, source_provider, years=None):
+        self.updated_years.extend(years)
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise ValueError('update failed')
+
+
+class SourceProviderMock:
+    name = 'mock'
+    variable_descriptors = {'x': {}}
+
+    def __init__(self, *years):
+        self.years = list(years) or [2005, 2006]
+
+
+def _run_test_worker(config):
+    cube = _create_or_open_cube(CUBE_DIR, config)
+    source_providers = [TestCubeSourceProvider(cube.config, var='a_var'),
+                        TestCubeSourceProvider(cube.config, var='b_var')]
+    failed = _run_worker(cube, source_providers, dict(), os.path.join(CUBE_DIR, 'queue'))
+    cube.close()
+    sys.exit(1 if failed else 0)
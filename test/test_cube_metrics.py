@@ -0,0 +1,96 @@
+import os
+import pickle
+import pstats
+import shutil
+import threading
+from unittest import TestCase
+
+from esdl.cube_metrics import CubeMetrics
+
+REPORTS_DIR = 'testreports'
+
+
+class CubeMetricsTest(TestCase):
+    def setUp(self):
+        while os.path.exists(REPORTS_DIR):
+            shutil.rmtree(REPORTS_DIR, False)
+        os.mkdir(REPORTS_DIR)
+
+    def tearDown(self):
+        while os.path.exists(REPORTS_DIR):
+            shutil.rmtree(REPORTS_DIR, False)
+
+    def test_timer_and_counters(self):
+        metrics = CubeMetrics(buffer_events=True)
+        with metrics.timer('read', file='a.nc') as event:
+            event['bytes'] = 100
+        with metrics.timer('read', file='b.nc') as event:
+            event['bytes'] = 300
+        with self.assertRaises(ValueError):
+            with metrics.timer('resample'):
+                raise ValueError()
+        metrics.count('periods')
+        metrics.count('periods', 2)
+
+        self.assertEqual(['read', 'resample'], list(metrics.stages.keys()))
+        self.assertEqual(2, metrics.stages['read'].count)
+        self.assertEqual(400, metrics.stages['read'].bytes)
+        self.assertEqual(1, metrics.stages['resample'].count)
+        self.assertLessEqual(metrics.stages['read'].min_seconds, metrics.stages['read'].max_seconds)
+        self.assertEqual(3, metrics.counters['periods'])
+        self.assertIn('periods: 3', metrics.report())
+
+        metrics_dict = metrics.pop()
+        self.assertEqual([], list(metrics.stages.keys()))
+        self.assertEqual(['read', 'read', 'resample'], [event['stage'] for event in metrics_dict['events']])
+        self.assertEqual('b.nc', metrics_dict['events'][1]['file'])
+
+        other_metrics = CubeMetrics(events_file=os.path.join(REPORTS_DIR, 'events.jsonl'))
+        other_metrics.add('read', 1.0, bytes=10)
+        other_metrics.merge(metrics_dict)
+        other_metrics.merge(pickle.loads(pickle.dumps(metrics_dict)))
+        other_metrics.close()
+        self.assertEqual(5, other_metrics.stages['read'].count)
+        self.assertEqual(810, other_metrics.stages['read'].bytes)
+        self.assertEqual(1.0, other_metrics.stages['read'].max_seconds)
+        self.assertEqual(6, other_metrics.counters['periods'])
+        with open(os.path.join(REPORTS_DIR, 'events.jsonl')) as fp:
+            self.assertEqual(7, len(fp.readlines()))
+
+    def test_threads(self):
+        metrics = CubeMetrics()
+
+        def run():
+            for _ in range(1000):
+                with metrics.timer('compute'):
+                    pass
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, metrics.stages['compute'].count)
+
+    def test_profile(self):
+        metrics = CubeMetrics(profile_dir=REPORTS_DIR, profile_stages=['compute'], profile_prefix='x-')
+        with metrics.timer('compute'):
+            # Nested stages are included in the profile of the enclosing stage
+            with metrics.timer('resample'):
+                sorted(range(1000))
+        with metrics.timer('write'):
+            pass
+        metrics.close()
+        self.assertEqual(['x-compute.prof'], os.listdir(REPORTS_DIR))
+        pstats.Stats(os.path.join(REPORTS_DIR, 'x-compute.prof'))
+
+    def test_pickle(self):
+        metrics = CubeMetrics(events_file=os.path.join(REPORTS_DIR, 'events.jsonl'), profile_dir=REPORTS_DIR)
+        metrics.add('read', 0.5)
+        copy = pickle.loads(pickle.dumps(metrics))
+        metrics.close()
+        with copy.timer('read'):
+            pass
+        self.assertEqual(2, copy.stages['read'].count)
+        copy.close()
+        self.assertEqual(['events.jsonl'], os.listdir(REPORTS_DIR))
@@ -0,0 +1,26 @@
+import os
+from unittest import TestCase
+
+import numpy as np
+
+from esdl.cube_overviews import downsample_image, get_overview_path, get_overview_shape
+
+
+class OverviewsTest(TestCase):
+    def test_get_overview_path(self):
+        self.assertEqual(os.path.join('cube', 'overviews', 'LAI', '2.nc'),
+                         get_overview_path('cube', 'LAI', 2, 'NETCDF4_CLASSIC'))
+        self.assertEqual(os.path.join('cube', 'overviews', 'LAI', '2'), get_overview_path('cube', 'LAI', 2, 'zarr'))
+
+    def test_get_overview_shape(self):
+        self.assertEqual((2160, 4320), get_overview_shape(2160, 4320, 0))
+        self.assertEqual((1080, 2160), get_overview_shape(2160, 4320, 1))
+        self.assertEqual((23, 45), get_overview_shape(180, 360, 3))
+
+    def test_downsample_image(self):
+        image = np.ma.masked_invalid(np.array([[1.0, 3.0, 2.0, 2.0],
+                                               [1.0, 3.0, np.nan, np.nan]], dtype=np.float32))
+        mean = downsample_image(image, 1, 2)
+        np.testing.assert_allclose([[2.0, 2.0]], mean)
+        mode = downsample_image(np.array([[1, 1, 2, 4], [1, 3, 4, 4]]), 1, 2, ds_method='MODE')
+        np.testing.assert_array_equal([[1, 4]], mode)
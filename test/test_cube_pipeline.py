@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import numpy
+
+from esdl import CubeConfig
+from esdl.cube_pipeline import PeriodPipeline
+from esdl.cube_provider import BaseStaticCubeSourceProvider
+
+
+class PeriodPipelineTest(TestCase):
+    def test_order_and_stats(self):
+        provider = PipelineProviderMock()
+        target_times = [(i, datetime(2001, 1, 1) + timedelta(days=8 * i), datetime(2001, 1, 9) + timedelta(days=8 * i))
+                        for i in range(10)]
+        pipeline = PeriodPipeline(provider, target_times, queue_size=2)
+        results = list(pipeline)
+
+        self.assertEqual(target_times, [target_time for target_time, _ in results])
+        self.assertEqual([{'x': i} for i in range(10)], [images for _, images in results])
+        self.assertEqual(['read', 'compute', 'write'], list(pipeline.stats.keys()))
+        for stats in pipeline.stats.values():
+            self.assertEqual(10, stats.count)
+        self.assertLessEqual(pipeline.stats['read'].max_queue_depth, 2)
+        self.assertIn('bottleneck:', pipeline.report())
+
+    def test_failure_is_propagated(self):
+        provider = PipelineProviderMock(fail_at=3)
+        target_times = [(i, datetime(2001, 1, 1), datetime(2001, 1, 9)) for i in range(10)]
+        with self.assertRaises(ValueError):
+            list(PeriodPipeline(provider, target_times))
+
+    def test_early_exit(self):
+        provider = PipelineProviderMock()
+        target_times = [(i, datetime(2001, 1, 1), datetime(2001, 1, 9)) for i in range(100)]
+        period_images = iter(PeriodPipeline(provider, target_times, queue_size=1))
+        next(period_images)
+        period_images.close()
+        self.assertLess(provider.num_reads, 100)
+
+    def test_static_provider_computes_under_io_lock(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        provider = StaticProviderMock(config)
+        self.assertFalse(provider.has_read_stage)
+        provider.prepare()
+        target_times = [(i, datetime(2001, 1, 1) + timedelta(days=8 * i), datetime(2001, 1, 9) + timedelta(days=8 * i))
+                        for i in range(3)]
+        pipeline = PeriodPipeline(provider, target_times)
+        provider.io_lock = pipeline._io_lock
+        results = list(pipeline)
+        self.assertEqual(3, len(results))
+        self.assertEqual((180, 360), results[0][1]['mask'].shape)
+        self.assertEqual([True], provider.locked_on_open)
+
+
+class PipelineProviderMock:
+    has_read_stage = True
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.num_reads = 0
+
+    def read_period_sources(self, period_start, period_end):
+        if self.num_reads == self.fail_at:
+            raise ValueError('read failed')
+        self.num_reads += 1
+        return self.num_reads - 1
+
+    def compute_period_images(self, period_sources):
+        return {'x': period_sources}
+
+
+class StaticProviderMock(BaseStaticCubeSourceProvider):
+    def __init__(self, cube_config):
+        super(StaticProviderMock, self).__init__(cube_config, 'static')
+        self.io_lock = None
+        self.locked_on_open = []
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'mask': {
+                'data_type': numpy.float32,
+                'fill_value': numpy.nan,
+            }
+        }
+
+    def open_dataset(self):
+        self.locked_on_open.append(self.io_lock.locked())
+        return {'mask': numpy.ones((180, 360), dtype=numpy.float32)}
+
+    def close_dataset(self, dataset):
+        pass
+
+    def get_dataset_file_path(self, dataset):
+        return 'mask.nc'
+
+    def get_dataset_image(self, dataset, name):
+        return dataset[name]
@@ -0,0 +1,92 @@
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+import numpy as np
+
+from esdl import CubeConfig, Cube
+from esdl.cube_plan import UpdatePlan
+from test.test_cube import CubeSourceProviderMock
+
+CUBE_DIR = 'testcube'
+
+
+class UpdatePlanTest(TestCase):
+    def test_estimates(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        provider = PlanCubeSourceProviderMock(config)
+        target_times = [(0, datetime(2001, 1, 1), datetime(2001, 1, 9)),
+                        (1, datetime(2001, 1, 9), datetime(2001, 1, 17)),
+                        (45, datetime(2001, 12, 27), datetime(2002, 1, 1)),
+                        (0, datetime(2002, 1, 1), datetime(2002, 1, 9))]
+        plan = UpdatePlan(provider, target_times, config)
+
+        self.assertTrue(plan.known)
+        self.assertEqual([2, 1, 0, 1], [period.num_sources for period in plan.periods])
+        self.assertEqual([4, 2, 0, 2], [period.num_images for period in plan.periods])
+        # One 720x1440 float32 image per source and variable
+        self.assertEqual(8 * 720 * 1440 * 4, plan.total_read_bytes)
+        # 2001_LAI.nc, 2001_FAPAR.nc, 2002_LAI.nc, 2002_FAPAR.nc
+        self.assertEqual(4, plan.num_output_files)
+
+        # One masked float32 source image, the aggregator's sum and weight arrays and the aggregated image,
+        # plus the masked float64 results of both variables
+        source_memory = 720 * 1440 * 5
+        aggregator_memory = 2 * 8 + 9
+        result_memory = 2 * 180 * 360 * 9
+        self.assertEqual(source_memory + 720 * 1440 * aggregator_memory + result_memory,
+                         plan.get_peak_memory('time_first'))
+        self.assertEqual(source_memory + 180 * 360 * (9 + aggregator_memory) + result_memory,
+                         plan.get_peak_memory('space_first'))
+
+        report = plan.report()
+        self.assertIn('total bytes to read: 31.6 MiB', report)
+        self.assertIn('output files touched: 4', report)
+        self.assertIn('peak memory per period (time_first)', report)
+
+    def test_unknown_sources(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        provider = CubeSourceProviderMock(config)
+        plan = UpdatePlan(provider, [(0, datetime(2013, 1, 1), datetime(2013, 1, 9))], config)
+        self.assertFalse(plan.known)
+        self.assertEqual(0, plan.total_read_bytes)
+        self.assertEqual(2, plan.num_output_files)
+        self.assertIn('source images unknown for 1 period(s)', plan.report())
+
+
+class CubePlanTest(TestCase):
+    def setUp(self):
+        while os.path.isdir(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, True)
+
+    def tearDown(self):
+        while os.path.isdir(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, True)
+
+    def test_plan_writes_nothing(self):
+        cube = Cube.create(CUBE_DIR, CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180))
+        provider = CubeSourceProviderMock(cube.config, datetime(2001, 1, 1), datetime(2001, 2, 1))
+        plan = cube.plan(provider)
+        self.assertEqual(4, len(plan.periods))
+        self.assertEqual([], provider.trace)
+        self.assertFalse(os.path.exists(os.path.join(CUBE_DIR, 'data')))
+        cube.close()
+
+
+class PlanCubeSourceProviderMock(CubeSourceProviderMock):
+    """
+    Describes source images of 720x1440 pixels for the source time ranges given by SOURCE_TIME_RANGES.
+    """
+
+    SOURCE_TIME_RANGES = [(datetime(2001, 1, 1), datetime(2001, 1, 5)),
+                          (datetime(2001, 1, 5), datetime(2001, 1, 13)),
+                          (datetime(2002, 1, 1), datetime(2002, 1, 9))]
+
+    def plan_period_sources(self, period_start, period_end):
+        planned_sources = []
+        for var_name in sorted(self.variable_descriptors.keys()):
+            for i, (source_start, source_end) in enumerate(self.SOURCE_TIME_RANGES):
+                if period_start < source_end and source_start < period_end:
+                    planned_sources.append((var_name, i, (720, 1440), np.float32))
+        return planned_sources
@@ -1,10 +1,15 @@
-from datetime import datetime
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 import numpy
 
 from esdl import CubeConfig
-from esdl.cube_provider import BaseCubeSourceProvider, BaseStaticCubeSourceProvider
+from esdl.cube_provider import BaseCubeSourceProvider, BaseStaticCubeSourceProvider, NetCDFCubeSourceProvider, \
+    SourceFileTemplate, list_source_files
+from esdl.util import SourceTimeRangeIndex
 
 
 class BaseCubeSourceProviderTest(TestCase):
@@ -59,6 +64,36 @@ class BaseCubeSourceProviderTest(TestCase):
         provider.compute_variable_images(datetime(2012, 1, 2), datetime(2012, 1, 10))
         self.assertEqual([], provider.trace)
 
+    def test_read_period_sources(self):
+        provider = MyCubeSourceProvider(CubeConfig(),
+                                        [(datetime(2010, 1, 1), datetime(2010, 1, 5)),
+                                         (datetime(2010, 1, 5), datetime(2010, 1, 9)),
+                                         (datetime(2010, 1, 9), datetime(2010, 1, 13))])
+        provider.prepare()
+
+        period_sources = provider.read_period_sources(datetime(2010, 1, 2), datetime(2010, 1, 10))
+        self.assertEqual([], provider.trace)
+        images = provider.compute_period_images(period_sources)
+        self.assertEqual([{0: 0.375, 1: 1.0, 2: 0.125}], provider.trace)
+        self.assertEqual({'LAI', 'FAPAR'}, set(images.keys()))
+
+        period_sources = provider.read_period_sources(datetime(2012, 1, 2), datetime(2012, 1, 10))
+        self.assertIsNone(period_sources)
+        self.assertIsNone(provider.compute_period_images(period_sources))
+
+    def test_plan_period_sources(self):
+        provider = MyCubeSourceProvider(CubeConfig(),
+                                        [(datetime(2010, 1, 1), datetime(2010, 1, 5)),
+                                         (datetime(2010, 1, 5), datetime(2010, 1, 9)),
+                                         (datetime(2010, 1, 9), datetime(2010, 1, 13))])
+        provider.prepare()
+
+        planned_sources = provider.plan_period_sources(datetime(2010, 1, 6), datetime(2010, 1, 10))
+        self.assertEqual([], provider.trace)
+        self.assertEqual([('FAPAR', 1, None, None), ('FAPAR', 2, None, None),
+                          ('LAI', 1, None, None), ('LAI', 2, None, None)], sorted(planned_sources))
+        self.assertEqual([], provider.plan_period_sources(datetime(2012, 1, 2), datetime(2012, 1, 10)))
+
 
 class MyCubeSourceProvider(BaseCubeSourceProvider):
     def __init__(self, cube_config, source_time_ranges):
@@ -153,3 +188,177 @@ class MyStaticCubeSourceProvider(BaseStaticCubeSourceProvider):
                 'ds_method': 'MODE'
             },
         }
+
+
+class NetCDFCubeSourceProviderTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.temp_dir, 'source')
+        for year in (2000, 2001, 2002):
+            os.makedirs(os.path.join(self.source_dir, str(year)))
+            for month in (3, 1, 2):
+                with open(os.path.join(self.source_dir, str(year), 'test-%d-%02d.txt' % (year, month)), 'w') as fp:
+                    fp.write('%d-%02d' % (year, month))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _new_provider(self, max_threads):
+        cube_config = CubeConfig(start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        provider = MyNetCDFCubeSourceProvider(cube_config, self.source_dir, max_threads)
+        provider._time_range_index = SourceTimeRangeIndex('test', self.source_dir,
+                                                          index_dir=os.path.join(self.temp_dir, 'index'))
+        return provider
+
+    def test_list_source_files(self):
+        dir_paths = [os.path.join(self.source_dir, '2001'), os.path.join(self.source_dir, '2000')]
+        files = list_source_files(dir_paths, lambda file_name: not file_name.endswith('-03.txt'), max_threads=2)
+        self.assertEqual([os.path.join(self.source_dir, '2000', 'test-2000-01.txt'),
+                          os.path.join(self.source_dir, '2000', 'test-2000-02.txt'),
+                          os.path.join(self.source_dir, '2001', 'test-2001-01.txt'),
+                          os.path.join(self.source_dir, '2001', 'test-2001-02.txt')], files)
+
+    def test_scan_source_time_ranges(self):
+        provider = self._new_provider(4)
+        self.assertEqual([os.path.join(self.source_dir, '2001'), os.path.join(self.source_dir, '2002')],
+                         provider.get_year_dir_paths())
+        provider.prepare()
+        source_time_ranges = provider.source_time_ranges
+        self.assertEqual(6, len(source_time_ranges))
+        self.assertEqual((datetime(2001, 1, 1), datetime(2001, 1, 2),
+                          os.path.join(self.source_dir, '2001', 'test-2001-01.txt'), 0), source_time_ranges[0])
+        self.assertEqual(datetime(2002, 3, 1), source_time_ranges[5][0])
+        self.assertEqual(source_time_ranges, self._new_provider(1).compute_source_time_ranges())
+
+        # The second scan reads all time ranges from the index
+        provider = self._new_provider(4)
+        provider.prepare()
+        self.assertEqual(source_time_ranges, provider.source_time_ranges)
+        self.assertEqual((6, 0), (provider.time_range_index.num_hits, provider.time_range_index.num_misses))
+
+    def test_source_file_template(self):
+        template = SourceFileTemplate(r'test-(?P<time>\d{4}-\d{2})\.txt', '%Y-%m', period=timedelta(days=2))
+        self.assertEqual((datetime(2001, 2, 1), datetime(2001, 2, 3)), template.get_time_range('test-2001-02.txt'))
+        self.assertIsNone(template.get_time_range('test-2001-02.txt.bak'))
+        with self.assertRaises(ValueError):
+            SourceFileTemplate(r'test-(\d{4}-\d{2})\.txt', '%Y-%m')
+
+    def test_compute_source_time_ranges_from_template(self):
+        provider = MyTemplateCubeSourceProvider(self._new_provider(1).cube_config, self.source_dir, validate=False)
+        source_time_ranges = provider.compute_source_time_ranges()
+        self.assertEqual(6, len(source_time_ranges))
+        self.assertEqual((datetime(2001, 1, 1), datetime(2001, 1, 2),
+                          os.path.join(self.source_dir, '2001', 'test-2001-01.txt'), 0), source_time_ranges[0])
+        self.assertEqual(datetime(2002, 3, 1), source_time_ranges[5][0])
+        self.assertEqual([], provider.validated_files)
+
+    def test_compute_source_time_ranges_from_template_open_ended(self):
+        cube_config = CubeConfig(start_time=None, end_time=datetime(2001, 6, 1))
+        provider = MyTemplateCubeSourceProvider(cube_config, self.source_dir, validate=False)
+        self.assertEqual([os.path.join(self.source_dir, '2000'), os.path.join(self.source_dir, '2001')],
+                         provider.get_year_dir_paths())
+        source_time_ranges = provider.compute_source_time_ranges()
+        self.assertEqual(6, len(source_time_ranges))
+        self.assertEqual(datetime(2000, 1, 1), source_time_ranges[0][0])
+        self.assertEqual(datetime(2001, 3, 1), source_time_ranges[5][0])
+
+    def test_compute_source_time_ranges_from_template_validated(self):
+        provider = MyTemplateCubeSourceProvider(self._new_provider(1).cube_config, self.source_dir, validate=True)
+        provider._time_range_index = self._new_provider(1).time_range_index
+        provider.prepare()
+        source_time_ranges = provider.source_time_ranges
+        self.assertEqual(4, len(source_time_ranges))
+        self.assertEqual([datetime(2001, 1, 1), datetime(2001, 3, 1), datetime(2002, 1, 1), datetime(2002, 3, 1)],
+                         [time_range[0] for time_range in source_time_ranges])
+        self.assertEqual(6, len(provider.validated_files))
+
+    def test_temporal_aggregation(self):
+        cube_config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        provider = MyAggregatingCubeSourceProvider(cube_config, self.source_dir)
+        images = [numpy.full((180, 360), value, dtype=numpy.float32) for value in (0.2, 0.6, 0.4)]
+        sources = {'LAI': [(image, 1.0, 'test-2001-01.nc') for image in images]}
+        var_images = provider.compute_variable_images_from_read_sources({0: 1.0, 1: 1.0, 2: 1.0}, sources)
+        self.assertEqual((180, 360), var_images['LAI'].shape)
+        numpy.testing.assert_almost_equal(var_images['LAI'], 0.6)
+
+    def test_temporal_aggregation_count_single_source(self):
+        cube_config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180)
+        provider = MyAggregatingCubeSourceProvider(cube_config, self.source_dir, temporal_aggregation='count')
+        image = numpy.ma.masked_array(numpy.full((180, 360), 0.2, dtype=numpy.float32),
+                                      mask=numpy.zeros((180, 360), dtype=bool))
+        image[:90] = numpy.ma.masked
+        sources = {'LAI': [(image, 1.0, 'test-2001-01.nc')]}
+        var_images = provider.compute_variable_images_from_read_sources({0: 1.0}, sources)
+        self.assertEqual((180, 360), var_images['LAI'].shape)
+        numpy.testing.assert_equal(numpy.ma.getdata(var_images['LAI'][:90]), 0)
+        numpy.testing.assert_equal(numpy.ma.getdata(var_images['LAI'][90:]), 1)
+
+
+class MyNetCDFCubeSourceProvider(NetCDFCubeSourceProvider):
+    def __init__(self, cube_config, dir_path, max_threads):
+        super(MyNetCDFCubeSourceProvider, self).__init__(cube_config, 'test', dir_path, None)
+        self.max_threads = max_threads
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'LAI': {
+                'data_type': numpy.float32,
+                'fill_value': 0.0,
+            }
+        }
+
+    def compute_source_time_ranges(self):
+        files = list_source_files(self.get_year_dir_paths(), lambda file_name: file_name.endswith('.txt'),
+                                  max_threads=self.max_threads)
+        return self.scan_source_time_ranges(files, self._read_source_time_ranges, max_threads=self.max_threads)
+
+    @staticmethod
+    def _read_source_time_ranges(file):
+        with open(file) as fp:
+            time = datetime.strptime(fp.read(), '%Y-%m')
+        return [(time, time + timedelta(days=1), 0)]
+
+
+class MyTemplateCubeSourceProvider(NetCDFCubeSourceProvider):
+    def __init__(self, cube_config, dir_path, validate):
+        super(MyTemplateCubeSourceProvider, self).__init__(cube_config, 'test', dir_path, None)
+        self.validate = validate
+        self.validated_files = []
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'LAI': {
+                'data_type': numpy.float32,
+                'fill_value': 0.0,
+            }
+        }
+
+    def compute_source_time_ranges(self):
+        template = SourceFileTemplate(r'test-(?P<time>\d{4}-\d{2})\.txt', '%Y-%m', year_dirs=True,
+                                      validate=self.validate)
+        return self.compute_template_time_ranges(template)
+
+    def validate_source_file(self, file):
+        self.validated_files.append(file)
+        return not file.endswith('-02.txt')
+
+
+class MyAggregatingCubeSourceProvider(NetCDFCubeSourceProvider):
+    def __init__(self, cube_config, dir_path, temporal_aggregation='max'):
+        super(MyAggregatingCubeSourceProvider, self).__init__(cube_config, 'test', dir_path, None)
+        self.temporal_aggregation = temporal_aggregation
+
+    @property
+    def variable_descriptors(self):
+        return {
+            'LAI': {
+                'data_type': numpy.float32,
+                'fill_value': 0.0,
+                'temporal_aggregation': self.temporal_aggregation,
+            }
+        }
+
+    def compute_source_time_ranges(self):
+        return []
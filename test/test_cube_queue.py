@@ -0,0 +1,69 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from unittest import TestCase
+
+from esdl.cube_queue import WorkQueue
+
+QUEUE_DIR = 'testqueue'
+
+
+class WorkQueueTest(TestCase):
+    def setUp(self):
+        while os.path.exists(QUEUE_DIR):
+            shutil.rmtree(QUEUE_DIR, False)
+
+    def tearDown(self):
+        while os.path.exists(QUEUE_DIR):
+            shutil.rmtree(QUEUE_DIR, False)
+
+    def test_claim_complete_release(self):
+        queue_1 = WorkQueue(QUEUE_DIR)
+        queue_2 = WorkQueue(QUEUE_DIR)
+
+        self.assertIsNone(queue_1.get_owner('a.2001'))
+        self.assertTrue(queue_1.claim('a.2001'))
+        self.assertIsNotNone(queue_1.get_owner('a.2001'))
+        self.assertFalse(queue_2.claim('a.2001'))
+        queue_1.complete('a.2001')
+        self.assertTrue(queue_2.is_done('a.2001'))
+        self.assertIsNone(queue_2.get_owner('a.2001'))
+        self.assertFalse(queue_2.claim('a.2001'))
+
+        self.assertTrue(queue_2.claim('a.2002'))
+        queue_2.release('a.2002')
+        self.assertFalse(queue_1.is_done('a.2002'))
+        self.assertTrue(queue_1.claim('a.2002'))
+
+        self.assertEqual(['a.2001.done', 'a.2002.lock'], sorted(os.listdir(QUEUE_DIR)))
+
+    def test_reclaim_stale(self):
+        queue_1 = WorkQueue(QUEUE_DIR, lock_timeout=60)
+        queue_2 = WorkQueue(QUEUE_DIR, lock_timeout=60)
+        self.assertTrue(queue_1.claim('a.2001'))
+        self.assertFalse(queue_2.is_stale('a.2001'))
+        self.assertFalse(queue_2.claim('a.2001'))
+
+        # Not touched for longer than the lock timeout
+        stale_time = time.time() - 120
+        os.utime(os.path.join(QUEUE_DIR, 'a.2001.lock'), (stale_time, stale_time))
+        self.assertTrue(queue_2.is_stale('a.2001'))
+        queue_1.touch('a.2001')
+        self.assertFalse(queue_2.is_stale('a.2001'))
+        os.utime(os.path.join(QUEUE_DIR, 'a.2001.lock'), (stale_time, stale_time))
+        self.assertTrue(queue_2.claim('a.2001'))
+        self.assertFalse(queue_1.claim('a.2001'))
+
+        # Owned by a process on this host that does not exist anymore
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        with open(os.path.join(QUEUE_DIR, 'a.2002.lock'), 'w') as fp:
+            fp.write('%s %d 2017-01-01T00:00:00\n' % (socket.gethostname(), process.pid))
+        queue_3 = WorkQueue(QUEUE_DIR)
+        self.assertTrue(queue_3.is_stale('a.2002'))
+        self.assertTrue(queue_3.claim('a.2002'))
+        self.assertIn(' %d ' % os.getpid(), queue_3.get_owner('a.2002'))
+        self.assertEqual(['a.2001.lock', 'a.2002.lock'], sorted(os.listdir(QUEUE_DIR)))
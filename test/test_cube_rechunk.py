@@ -0,0 +1,103 @@
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+import netCDF4
+import numpy as np
+
+from esdl import CubeConfig, Cube
+from esdl.cube_rechunk import plan_rechunk, rechunk_cube
+from test.test_cube import PeriodCubeSourceProviderMock
+
+CUBE_DIR = 'testcube'
+RECHUNKED_CUBE_DIR = 'testcube-rechunked'
+
+
+class PlanRechunkTest(TestCase):
+    def test_single_stage(self):
+        plan = plan_rechunk((46, 180, 360), np.float32, (1, 180, 360), (46, 30, 30), memory_budget=64 * 1024 * 1024)
+        self.assertEqual(1, len(plan.stages))
+        self.assertIsNone(plan.intermediate_chunks)
+        self.assertEqual((46, 180, 360), plan.stages[0].block_shape)
+        self.assertEqual(1, len(plan.stages[0].get_blocks(plan.shape)))
+
+    def test_two_stages(self):
+        plan = plan_rechunk((46, 180, 360), np.float32, (1, 180, 360), (46, 30, 30), memory_budget=3 * 1024 * 1024)
+        self.assertEqual(2, len(plan.stages))
+        self.assertEqual((1, 30, 30), plan.intermediate_chunks)
+        self.assertEqual((4, 180, 360), plan.stages[0].block_shape)
+        self.assertEqual(12, len(plan.stages[0].get_blocks(plan.shape)))
+        self.assertEqual((46, 30, 180), plan.stages[1].block_shape)
+        self.assertEqual(12, len(plan.stages[1].get_blocks(plan.shape)))
+        self.assertIn('stage 2: chunks (1, 30, 30) -> (46, 30, 30)', plan.report())
+
+    def test_chunks_are_clipped(self):
+        plan = plan_rechunk((46, 180, 360), np.float32, (1, 180, 360), (92, 180, 360))
+        self.assertEqual((46, 180, 360), plan.target_chunks)
+
+    def test_memory_budget_too_small(self):
+        with self.assertRaises(ValueError):
+            plan_rechunk((46, 180, 360), np.float32, (1, 180, 360), (46, 30, 30), memory_budget=300000)
+
+
+class RechunkCubeTest(TestCase):
+    def setUp(self):
+        for cube_dir in (CUBE_DIR, RECHUNKED_CUBE_DIR):
+            while os.path.exists(cube_dir):
+                shutil.rmtree(cube_dir, False)
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 180, 360),
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+        cube.close()
+
+    def test_rechunk_cube(self):
+        config = CubeConfig.load(os.path.join(CUBE_DIR, 'cube.config'))
+        config.chunk_sizes = (46, 30, 30)
+        config.codec = 'zlib:1'
+        plans = rechunk_cube(CUBE_DIR, RECHUNKED_CUBE_DIR, config, memory_budget=3 * 1024 * 1024)
+        self.assertEqual(['LAI'], list(plans.keys()))
+        self.assertEqual(2, len(plans['LAI'].stages))
+        self.assertFalse(os.path.exists(os.path.join(RECHUNKED_CUBE_DIR, 'rechunk')))
+
+        for year in (2001, 2002):
+            file = os.path.join('data', 'LAI', '%d_LAI.nc' % year)
+            with netCDF4.Dataset(os.path.join(CUBE_DIR, file)) as source_dataset, \
+                    netCDF4.Dataset(os.path.join(RECHUNKED_CUBE_DIR, file)) as target_dataset:
+                source_variable = source_dataset.variables['LAI']
+                target_variable = target_dataset.variables['LAI']
+                self.assertEqual([46, 30, 30], target_variable.chunking())
+                self.assertTrue(target_variable.filters()['zlib'])
+                np.testing.assert_array_equal(source_variable[:], target_variable[:])
+                np.testing.assert_array_equal(source_dataset.variables['lat'][:], target_dataset.variables['lat'][:])
+                np.testing.assert_array_equal(source_dataset.variables['time'][:],
+                                              target_dataset.variables['time'][:])
+
+        with open(os.path.join(CUBE_DIR, 'cube.manifest')) as fp:
+            source_manifest = sorted(fp.readlines())
+        with open(os.path.join(RECHUNKED_CUBE_DIR, 'cube.manifest')) as fp:
+            self.assertEqual(source_manifest, sorted(fp.readlines()))
+
+    def test_rechunk_cube_to_zarr(self):
+        try:
+            import zarr
+        except ImportError:
+            self.skipTest('zarr is not installed')
+        config = CubeConfig.load(os.path.join(CUBE_DIR, 'cube.config'))
+        config.file_format = 'zarr'
+        config.chunk_sizes = (23, 90, 90)
+        rechunk_cube(CUBE_DIR, RECHUNKED_CUBE_DIR, config, jobs=2)
+
+        array = zarr.open_group(os.path.join(RECHUNKED_CUBE_DIR, 'data', 'LAI'), mode='r')['LAI']
+        self.assertEqual((92, 180, 360), array.shape)
+        self.assertEqual((23, 90, 90), array.chunks)
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, 'data', 'LAI', '2002_LAI.nc')) as dataset:
+            np.testing.assert_array_equal(np.ma.filled(dataset.variables['LAI'][:], 0.0), array[46:])
+
+    def test_grid_must_not_change(self):
+        config = CubeConfig.load(os.path.join(CUBE_DIR, 'cube.config'))
+        config.end_time = datetime(2004, 1, 1)
+        with self.assertRaises(ValueError):
+            rechunk_cube(CUBE_DIR, RECHUNKED_CUBE_DIR, config)
+        self.assertFalse(os.path.exists(RECHUNKED_CUBE_DIR))
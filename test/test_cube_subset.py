@@ -0,0 +1,89 @@
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+import netCDF4
+import numpy as np
+
+from esdl import CubeConfig, Cube
+from esdl.cube_subset import get_subset_config, get_subset_grid_ranges, parse_time_range
+from test.test_cube import PeriodCubeSourceProviderMock
+
+CUBE_DIR = 'testcube'
+SUBSET_CUBE_DIR = 'testcube-subset'
+
+
+class SubsetConfigTest(TestCase):
+    def test_get_subset_grid_ranges(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 30, 30))
+        self.assertEqual(((155, 225), (18, 55)), get_subset_grid_ranges(config, (-25, 45), (35, 72)))
+        self.assertEqual(((150, 240), (0, 60)), get_subset_grid_ranges(config, (-25, 45), (35, 72),
+                                                                       align_chunks=True))
+        self.assertEqual(((0, 360), (0, 180)), get_subset_grid_ranges(config))
+        with self.assertRaises(ValueError):
+            get_subset_grid_ranges(config, (-25, -25), (35, 72))
+
+    def test_get_subset_config(self):
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 30, 30),
+                            start_time=datetime(2001, 1, 1), end_time=datetime(2011, 1, 1))
+        subset_config = get_subset_config(config, (-25, 45), (60, 72), parse_time_range('2005-01-01,2009-01-01'),
+                                          var_names=['LAI'])
+        self.assertEqual(155, subset_config.grid_x0)
+        self.assertEqual(18, subset_config.grid_y0)
+        self.assertEqual(70, subset_config.grid_width)
+        self.assertEqual(12, subset_config.grid_height)
+        self.assertEqual((1, 12, 30), subset_config.chunk_sizes)
+        self.assertEqual(['LAI'], subset_config.variables)
+        self.assertEqual(2005, subset_config.time_axis.start_year)
+        self.assertEqual(2008, subset_config.time_axis.end_year)
+        self.assertEqual(((-25.0, 60.0), (45.0, 72.0)), subset_config.geo_bounds)
+        with self.assertRaises(ValueError):
+            get_subset_config(config, time_range=(datetime(2012, 1, 1), datetime(2013, 1, 1)))
+
+
+class SubsetCubeTest(TestCase):
+    def setUp(self):
+        for cube_dir in (CUBE_DIR, SUBSET_CUBE_DIR):
+            while os.path.exists(cube_dir):
+                shutil.rmtree(cube_dir, False)
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 30, 30),
+                            compression=True, start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        self.cube = Cube.create(CUBE_DIR, config)
+        self.cube.update(PeriodCubeSourceProviderMock(self.cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+
+    def tearDown(self):
+        self.cube.close()
+
+    def _assert_subset_equal(self, year, x1, x2, y1, y2):
+        file = os.path.join('data', 'LAI', '%d_LAI.nc' % year)
+        with netCDF4.Dataset(os.path.join(CUBE_DIR, file)) as source_dataset, \
+                netCDF4.Dataset(os.path.join(SUBSET_CUBE_DIR, file)) as target_dataset:
+            np.testing.assert_array_equal(source_dataset.variables['LAI'][:, y1:y2, x1:x2],
+                                          target_dataset.variables['LAI'][:])
+            np.testing.assert_array_equal(source_dataset.variables['lon'][x1:x2], target_dataset.variables['lon'][:])
+            np.testing.assert_array_equal(source_dataset.variables['lat'][y1:y2], target_dataset.variables['lat'][:])
+
+    def test_subset_aligned(self):
+        subset = self.cube.subset(SUBSET_CUBE_DIR, lon_range=(-30, 30), lat_range=(0, 60),
+                                  time_range=(datetime(2002, 1, 1), datetime(2003, 1, 1)))
+        self.assertEqual((150, 30, 60, 60), (subset.config.grid_x0, subset.config.grid_y0,
+                                             subset.config.grid_width, subset.config.grid_height))
+        subset.close()
+        self.assertFalse(os.path.exists(os.path.join(SUBSET_CUBE_DIR, 'data', 'LAI', '2001_LAI.nc')))
+        self._assert_subset_equal(2002, 150, 210, 30, 90)
+        with open(os.path.join(SUBSET_CUBE_DIR, 'cube.manifest')) as fp:
+            lines = fp.readlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith('LAI 2002 ') for line in lines))
+
+    def test_subset_not_aligned(self):
+        subset = self.cube.subset(SUBSET_CUBE_DIR, lon_range=(-25.5, 45), lat_range=(35, 72), jobs=2)
+        subset.close()
+        self._assert_subset_equal(2001, 154, 225, 18, 55)
+        self._assert_subset_equal(2002, 154, 225, 18, 55)
+        data = Cube.open(SUBSET_CUBE_DIR).data
+        lai = data.get('LAI', time=datetime(2001, 11, 10), latitude=50.5, longitude=10.5)[0]
+        expected = self.cube.data.get('LAI', time=datetime(2001, 11, 10), latitude=50.5, longitude=10.5)[0]
+        self.assertEqual(float(expected), float(lai))
+        data.close()
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from esdl.cube_timeseries import count_touched_chunks
+
+
+class CountTouchedChunksTest(TestCase):
+    def test_map_layout(self):
+        # A map of one period
+        self.assertEqual(4, count_touched_chunks(((5, 5), (0, 179), (0, 359)), (1, 90, 180)))
+        # A pixel time series of 3 years split into year files of 46 periods
+        self.assertEqual(138, count_touched_chunks(((0, 137), (10, 10), (20, 20)), (1, 180, 360),
+                                                   time_block_size=46))
+        self.assertEqual(6, count_touched_chunks(((0, 137), (10, 10), (20, 20)), (23, 180, 360),
+                                                 time_block_size=46))
+        # Time chunks do not span year files
+        self.assertEqual(2, count_touched_chunks(((44, 47), (0, 0), (0, 0)), (8, 180, 360), time_block_size=46))
+        self.assertEqual(1, count_touched_chunks(((44, 47), (0, 0), (0, 0)), (8, 180, 360)))
+
+    def test_time_series_layout(self):
+        self.assertEqual(1, count_touched_chunks(((0, 137), (10, 10), (20, 20)), (138, 10, 10)))
+        self.assertEqual(18 * 36, count_touched_chunks(((5, 5), (0, 179), (0, 359)), (138, 10, 10)))
+        self.assertEqual(4, count_touched_chunks(((0, 0), (5, 14), (5, 14)), (138, 10, 10)))
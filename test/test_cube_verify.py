@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from unittest import TestCase
+
+import netCDF4
+
+from esdl import CubeConfig, Cube
+from esdl.cube_verify import verify_cube
+from test.test_cube import PeriodCubeSourceProviderMock
+
+CUBE_DIR = 'testcube'
+REPORT_FILE = 'testcube-verify.json'
+
+
+class VerifyCubeTest(TestCase):
+    def setUp(self):
+        while os.path.exists(CUBE_DIR):
+            shutil.rmtree(CUBE_DIR, False)
+        config = CubeConfig(spatial_res=1.0, grid_width=360, grid_height=180, chunk_sizes=(1, 90, 90),
+                            compression=True, start_time=datetime(2001, 1, 1), end_time=datetime(2003, 1, 1))
+        cube = Cube.create(CUBE_DIR, config)
+        cube.update(PeriodCubeSourceProviderMock(cube.config, datetime(2001, 11, 1), datetime(2002, 2, 1)))
+        cube.close()
+
+    def tearDown(self):
+        if os.path.exists(REPORT_FILE):
+            os.remove(REPORT_FILE)
+
+    def test_verify_cube(self):
+        report = verify_cube(CUBE_DIR, jobs=2, report_file=REPORT_FILE)
+        self.assertEqual(2, report['num_files'])
+        self.assertEqual(0, report['num_errors'])
+        self.assertEqual([os.path.join('data', 'LAI', '2001_LAI.nc'), os.path.join('data', 'LAI', '2002_LAI.nc')],
+                         [result['path'] for result in report['files']])
+        fill_fractions = report['files'][0]['fill_fractions']
+        self.assertEqual(46, len(fill_fractions))
+        self.assertEqual(1.0, fill_fractions[0])
+        self.assertAlmostEqual(12 / 360, fill_fractions[45])
+        with open(REPORT_FILE) as fp:
+            self.assertEqual(2, json.load(fp)['num_files'])
+
+    def test_verify_cube_quick(self):
+        report = verify_cube(CUBE_DIR, quick=True, jobs=1, report_file=REPORT_FILE)
+        self.assertEqual(0, report['num_errors'])
+        for result in report['files']:
+            if result['fill_fractions'] is not None:
+                self.assertEqual(46, len(result['fill_fractions']))
+
+    def test_verify_cube_finds_errors(self):
+        file = os.path.join(CUBE_DIR, 'data', 'LAI', '2002_LAI.nc')
+        with netCDF4.Dataset(file, 'a') as dataset:
+            dataset.variables['time_bnds'][0, 0] = -1.0
+            dataset.esdl_incomplete = 'true'
+        report = verify_cube(CUBE_DIR, jobs=1, report_file=REPORT_FILE)
+        self.assertEqual(2, report['num_errors'])
+        self.assertEqual([], report['files'][0]['errors'])
+        errors = report['files'][1]['errors']
+        self.assertIn('incomplete', errors[0])
+        self.assertIn('time bounds differ', errors[1])
+
+    def test_verify_cube_writes_report(self):
+        verify_cube(CUBE_DIR, var_names=['LAI'], jobs=1)
+        reports = os.listdir(os.path.join(CUBE_DIR, 'reports'))
+        self.assertTrue(any(name.startswith('verify-') and name.endswith('.json') for name in reports))
+        with self.assertRaises(ValueError):
+            verify_cube(CUBE_DIR, var_names=['FAPAR'], jobs=1)
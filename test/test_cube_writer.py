@@ -0,0 +1,195 @@
+from unittest import TestCase
+
+import numpy as np
+
+from esdl.cube_writer import DatasetPool, SlabWriter
+
+
+class DatasetPoolTest(TestCase):
+    def test_lru_eviction(self):
+        closed = []
+        pool = DatasetPool(lambda key: DatasetMock(key), lambda key, dataset: closed.append(key), max_open=2)
+        with pool.use('a') as dataset:
+            self.assertEqual('a', dataset.key)
+        with pool.use('b'):
+            pass
+        with pool.use('a'):
+            pass
+        # 'b' is least recently used
+        with pool.use('c'):
+            pass
+        self.assertEqual(['b'], closed)
+        self.assertEqual(['a', 'c'], pool.keys())
+        with pool.use('b'):
+            pass
+        self.assertEqual(['b', 'a'], closed)
+        self.assertEqual(1, pool.hits)
+        self.assertEqual(4, pool.misses)
+        self.assertEqual(2, pool.evictions)
+        self.assertEqual(0.2, pool.stats()['hit_rate'])
+
+        pool.close_all(lambda key: key != 'b')
+        self.assertEqual(['b', 'a', 'c'], closed)
+        self.assertEqual(['b'], pool.keys())
+        pool.close_all()
+        self.assertEqual(0, len(pool))
+
+    def test_datasets_in_use_are_not_evicted(self):
+        closed = []
+        pool = DatasetPool(lambda key: DatasetMock(key), lambda key, dataset: closed.append(key), max_open=1)
+        with pool.use('a'):
+            with pool.use('b'):
+                self.assertEqual(['a', 'b'], pool.keys())
+            self.assertEqual([], closed)
+        with pool.use('c'):
+            pass
+        self.assertEqual(['a', 'b'], closed)
+        self.assertEqual(['c'], pool.keys())
+
+    def test_cheapest_eviction_first(self):
+        closed = []
+        costs = {'a': 0, 'b': 5, 'c': 0, 'd': 3}
+        pool = DatasetPool(lambda key: DatasetMock(key), lambda key, dataset: closed.append(key), max_open=3,
+                           get_eviction_cost=costs.get)
+        for key in 'bad':
+            with pool.use(key):
+                pass
+        # 'b' is least recently used, but 'a' costs nothing
+        with pool.use('c'):
+            pass
+        self.assertEqual(['a'], closed)
+        costs['c'] = 1
+        with pool.use('a'):
+            pass
+        self.assertEqual(['a', 'c'], closed)
+        self.assertEqual(['b', 'd', 'a'], pool.keys())
+
+    def test_threads(self):
+        import threading
+
+        open_keys = []
+        lock = threading.Lock()
+
+        def open_dataset(key):
+            with lock:
+                self.assertNotIn(key, open_keys)
+                open_keys.append(key)
+            return DatasetMock(key)
+
+        def close_dataset(key, dataset):
+            with lock:
+                open_keys.remove(key)
+
+        pool = DatasetPool(open_dataset, close_dataset, max_open=3)
+
+        def run(offset):
+            for i in range(200):
+                key = (i + offset) % 5
+                with pool.use(key) as dataset:
+                    self.assertEqual(key, dataset.key)
+
+        threads = [threading.Thread(target=run, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(800, pool.hits + pool.misses)
+        self.assertLessEqual(len(pool), 3)
+        pool.close_all()
+        self.assertEqual([], open_keys)
+
+
+class DatasetMock:
+    def __init__(self, key):
+        self.key = key
+
+
+class SlabWriterTest(TestCase):
+    def test_writes_whole_time_chunks(self):
+        variable = VariableMock((10, 2, 3))
+        writer = SlabWriter(variable, 4, True)
+        for time_index in range(3):
+            writer.put(time_index, np.full((2, 3), time_index, dtype=np.float32))
+        self.assertEqual([], variable.writes)
+        writer.put(3, np.full((2, 3), 3, dtype=np.float32))
+        self.assertEqual([(0, 4)], variable.writes)
+
+        writer.put(4, np.full((2, 3), 4, dtype=np.float32))
+        writer.put(6, np.full((2, 3), 6, dtype=np.float32))
+        # Next chunk forces the incomplete one to be written
+        writer.put(9, np.full((2, 3), 9, dtype=np.float32))
+        self.assertEqual([(0, 4), (4, 8)], variable.writes)
+        writer.close()
+        self.assertEqual([(0, 4), (4, 8), (8, 10)], variable.writes)
+
+        self.assertEqual([0, 1, 2, 3, 4, -1, 6, -1, -1, 9], list(variable.data[:, 0, 0]))
+
+    def test_fills_unwritten_chunks(self):
+        variable = VariableMock((10, 2, 3))
+        writer = SlabWriter(variable, 4, True)
+        writer.put(5, np.full((2, 3), 5, dtype=np.float32))
+        writer.close()
+        self.assertEqual([(4, 8), (0, 4), (8, 10)], variable.writes)
+        self.assertEqual([-1, -1, -1, -1, -1, 5, -1, -1, -1, -1], list(variable.data[:, 0, 0]))
+
+    def test_num_unfilled_periods(self):
+        variable = VariableMock((10, 2, 3))
+        writer = SlabWriter(variable, 4, True)
+        self.assertEqual(10, writer.num_unfilled_periods)
+        writer.put(0, np.full((2, 3), 0, dtype=np.float32))
+        writer.put(1, np.full((2, 3), 1, dtype=np.float32))
+        self.assertEqual(8, writer.num_unfilled_periods)
+        self.assertEqual(0, SlabWriter(variable, 4, False).num_unfilled_periods)
+
+    def test_preserves_existing_data(self):
+        variable = VariableMock((10, 2, 3))
+        variable.data[:] = 7
+        writer = SlabWriter(variable, 4, False)
+        writer.put(5, np.full((2, 3), 5, dtype=np.float32))
+        writer.close()
+        self.assertEqual([(4, 8)], variable.writes)
+        self.assertEqual([7, 7, 7, 7, 7, 5, 7, 7, 7, 7], list(variable.data[:, 0, 0]))
+
+    def test_no_time_chunking(self):
+        variable = VariableMock((3, 2, 3))
+        writer = SlabWriter(variable, None, False)
+        writer.put(0, np.full((2, 3), 0, dtype=np.float32))
+        writer.put(1, np.full((2, 3), 1, dtype=np.float32))
+        self.assertEqual([(0, 1), (1, 2)], variable.writes)
+
+    def test_time_offset(self):
+        # The variable is a view on the periods 6 to 15 of some storage with time chunks of size 4
+        variable = VariableMock((10, 2, 3))
+        writer = SlabWriter(variable, 4, True, time_offset=6)
+        writer.put(0, np.full((2, 3), 0, dtype=np.float32))
+        writer.put(1, np.full((2, 3), 1, dtype=np.float32))
+        self.assertEqual([(0, 2)], variable.writes)
+        writer.put(9, np.full((2, 3), 9, dtype=np.float32))
+        writer.close()
+        self.assertEqual([(0, 2), (6, 10), (2, 6)], variable.writes)
+        self.assertEqual([0, 1, -1, -1, -1, -1, -1, -1, -1, 9], list(variable.data[:, 0, 0]))
+
+
+class VariableMock:
+    """
+    Emulates writing to a netCDF4 variable with fill value -1.
+    """
+
+    def __init__(self, shape):
+        self.data = np.full(shape, -1, dtype=np.float32)
+        self.writes = []
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __getitem__(self, key):
+        return np.ma.masked_equal(self.data[key], -1)
+
+    def __setitem__(self, key, value):
+        self.writes.append((key[0].start, key[0].stop))
+        self.data[key] = np.ma.filled(value, -1)
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 import numpy
@@ -5,8 +8,13 @@ import numpy
 from esdl.util import temporal_weight
 from esdl.util import resolve_temporal_range_index
 from esdl.util import aggregate_images
+from esdl.util import ImageAggregator
+from esdl.util import get_aligned_tiles
+from esdl.util import CubeTimeAxis
+from esdl.util import SourceTimeRangeIndex
+from esdl.util import SourceTimeRanges
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class UtilTest(unittest.TestCase):
@@ -58,6 +66,76 @@ class UtilTest(unittest.TestCase):
 
         self.assertEqual(im[0][0],0.75)
 
+    def test_get_aligned_tiles(self):
+        # Aligned tiles of 1x1 target pixels and 4x4 source pixels require 1 * 9 + 16 * 5 = 89 bytes
+        tiles = get_aligned_tiles((360, 180), (1440, 720), 9, 5, 89 * 360 * 45)
+        self.assertEqual([((0, 0, 360, 45), (0, 0, 1440, 180)),
+                          ((0, 45, 360, 45), (0, 180, 1440, 180)),
+                          ((0, 90, 360, 45), (0, 360, 1440, 180)),
+                          ((0, 135, 360, 45), (0, 540, 1440, 180))], tiles)
+
+        tiles = get_aligned_tiles((360, 180), (1440, 720), 9, 5, 89 * 100)
+        self.assertEqual(4 * 180, len(tiles))
+        self.assertEqual(((0, 0, 100, 1), (0, 0, 400, 4)), tiles[0])
+        self.assertEqual(((300, 0, 60, 1), (1200, 0, 240, 4)), tiles[3])
+
+        # The whole image fits into a single tile
+        tiles = get_aligned_tiles((360, 180), (720, 360), 9, 5, 10 ** 9)
+        self.assertEqual([((0, 0, 360, 180), (0, 0, 720, 360))], tiles)
+
+        # Non-integer ratios: gcd(360, 1000) = 40, so aligned tiles have 9 target and 25 source pixels in x
+        tiles = get_aligned_tiles((360, 180), (1000, 500), 1, 1, (9 * 9 + 25 * 25) * 40)
+        self.assertEqual(((0, 0, 360, 9), (0, 0, 1000, 25)), tiles[0])
+        self.assertEqual(20, len(tiles))
+
+        with self.assertRaises(ValueError):
+            get_aligned_tiles((360, 180), (1440, 720), 9, 5, 88)
+
+    def test_cube_time_axis(self):
+        time_axis = CubeTimeAxis(2001, 2004, 8)
+        self.assertEqual(4 * 46, time_axis.size)
+        self.assertEqual(46, time_axis.num_periods_per_year)
+        self.assertEqual((datetime(2001, 1, 1), datetime(2001, 1, 9)), time_axis.get_period(0))
+        self.assertEqual((datetime(2001, 12, 27), datetime(2002, 1, 1)), time_axis.get_period(45))
+        self.assertEqual((datetime(2004, 12, 26), datetime(2005, 1, 1)), time_axis.get_period(4 * 46 - 1))
+
+        self.assertEqual(0.0, time_axis.lower_bounds[0])
+        self.assertEqual(8.0, time_axis.upper_bounds[0])
+        self.assertEqual(4.0, time_axis.times[0])
+        self.assertEqual(365.0, time_axis.upper_bounds[45])
+        self.assertEqual(365.0, time_axis.lower_bounds[46])
+        self.assertEqual(list(time_axis.lower_bounds[1:]), list(time_axis.upper_bounds[:-1]))
+
+        self.assertEqual(47, time_axis.get_global_index(2002, 1))
+        self.assertEqual((2002, 1), time_axis.get_year_and_time_index(47))
+        self.assertEqual(slice(46, 92), time_axis.get_year_slice(2002))
+        with self.assertRaises(IndexError):
+            time_axis.get_global_index(2005, 0)
+
+        self.assertEqual(0, time_axis.get_index(datetime(2001, 1, 1)))
+        self.assertEqual(0, time_axis.get_index(datetime(2001, 1, 8, 23)))
+        self.assertEqual(1, time_axis.get_index(datetime(2001, 1, 9)))
+        self.assertEqual(46, time_axis.get_index(datetime(2002, 1, 1)))
+        with self.assertRaises(IndexError):
+            time_axis.get_index(datetime(2000, 12, 31))
+        with self.assertRaises(IndexError):
+            time_axis.get_index(datetime(2005, 1, 1))
+        self.assertEqual(0, time_axis.get_index(datetime(2000, 12, 31), clip=True))
+        self.assertEqual(4 * 46 - 1, time_axis.get_index(datetime(2005, 1, 1), clip=True))
+
+        self.assertEqual(range(45, 48),
+                         time_axis.get_overlapping_indices(datetime(2001, 12, 30), datetime(2002, 1, 10)))
+        self.assertEqual(range(1, 2), time_axis.get_overlapping_indices(datetime(2001, 1, 9), datetime(2001, 1, 17)))
+        self.assertEqual(range(0, 0), time_axis.get_overlapping_indices(datetime(1999, 1, 1), datetime(2001, 1, 1)))
+
+        # 365 is a multiple of 5, the last period of a leap year covers December 31st
+        time_axis = CubeTimeAxis(2004, 2004, 5)
+        self.assertEqual((datetime(2004, 12, 26), datetime(2005, 1, 1)), time_axis.get_period(72))
+        self.assertEqual(72, time_axis.get_index(datetime(2004, 12, 31, 12)))
+
+        time_axis = CubeTimeAxis(2001, 2001, 8, ref_time=datetime(2000, 1, 1), calendar='noleap')
+        self.assertEqual(365.0, time_axis.lower_bounds[0])
+
     def test_resolve_temporal_range_index(self):
         time1_index, time2_index = resolve_temporal_range_index(2001, 2011, 8,
                                                                 datetime(2001, 1, 1),
@@ -88,3 +166,169 @@ class UtilTest(unittest.TestCase):
                                                                 datetime(2020, 12, 31))
         self.assertEqual(time1_index, 0)
         self.assertEqual(time2_index, 505)
+
+
+class ImageAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.images = [numpy.ma.masked_array([[1.0, 2.0], [3.0, 4.0]], mask=[[0, 0], [1, 0]]),
+                       numpy.ma.masked_array([[5.0, 1.0], [2.0, 6.0]], mask=[[0, 1], [1, 0]]),
+                       numpy.ma.masked_array([[3.0, 7.0], [8.0, 2.0]], mask=[[1, 0], [1, 0]])]
+
+    def _aggregate(self, reducer, dtype=numpy.float64):
+        aggregator = ImageAggregator(reducer, dtype=dtype)
+        for image, weight in zip(self.images, (1.0, 0.5, 0.25)):
+            aggregator.add(image, weight)
+        self.assertEqual(3, aggregator.num_images)
+        return aggregator.get_result()
+
+    def test_mean(self):
+        im = self._aggregate('mean', dtype=numpy.float32)
+        self.assertAlmostEqual(im[0, 0], (1.0 + 0.5 * 5.0) / 1.5, places=5)
+        self.assertAlmostEqual(im[0, 1], (2.0 + 0.25 * 7.0) / 1.25, places=5)
+        self.assertIs(im[1, 0], numpy.ma.masked)
+        self.assertAlmostEqual(im[1, 1], (4.0 + 0.5 * 6.0 + 0.25 * 2.0) / 1.75, places=5)
+
+    def test_min_max_last(self):
+        im = self._aggregate('min')
+        self.assertEqual([1.0, 2.0, 2.0], [im[0, 0], im[0, 1], im[1, 1]])
+        self.assertIs(im[1, 0], numpy.ma.masked)
+        im = self._aggregate('max')
+        self.assertEqual([5.0, 7.0, 6.0], [im[0, 0], im[0, 1], im[1, 1]])
+        self.assertIs(im[1, 0], numpy.ma.masked)
+        im = self._aggregate('last')
+        self.assertEqual([5.0, 7.0, 2.0], [im[0, 0], im[0, 1], im[1, 1]])
+        self.assertIs(im[1, 0], numpy.ma.masked)
+
+    def test_count(self):
+        numpy.testing.assert_array_equal([[2, 2], [0, 3]], self._aggregate('count'))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            ImageAggregator('median')
+        aggregator = ImageAggregator()
+        with self.assertRaises(ValueError):
+            aggregator.get_result()
+        aggregator.add(numpy.zeros((2, 2)))
+        with self.assertRaises(ValueError):
+            aggregator.add(numpy.zeros((2, 3)))
+
+
+class SourceTimeRangesTest(unittest.TestCase):
+    def setUp(self):
+        # Daily sources with a gap and a longer 10-day source in between
+        time_ranges = [(datetime(2001, 1, 1) + timedelta(days=i), datetime(2001, 1, 2) + timedelta(days=i),
+                        'daily.nc', i) for i in range(40) if not 20 <= i < 25]
+        time_ranges.append((datetime(2001, 1, 5), datetime(2001, 1, 15), 'ten-daily.nc', 0))
+        self.time_ranges = sorted(time_ranges, key=lambda item: item[0])
+
+    def test_sequence(self):
+        source_time_ranges = SourceTimeRanges(self.time_ranges)
+        self.assertEqual(36, len(source_time_ranges))
+        self.assertEqual((datetime(2001, 1, 5), datetime(2001, 1, 15), 'ten-daily.nc', 0), source_time_ranges[5])
+        self.assertEqual(('daily.nc', 39), source_time_ranges[-1][2:4])
+        self.assertEqual(self.time_ranges, source_time_ranges)
+        self.assertEqual(self.time_ranges[3:6], source_time_ranges[3:6])
+        self.assertEqual(numpy.datetime64('2001-01-05'), source_time_ranges.starts[5])
+
+    def test_get_index_to_weight(self):
+        for time_ranges in (self.time_ranges, list(reversed(self.time_ranges))):
+            source_time_ranges = SourceTimeRanges(time_ranges)
+            for day in range(-10, 50, 3):
+                for num_days in (1, 4, 8):
+                    period_start = datetime(2001, 1, 1) + timedelta(days=day, hours=6)
+                    period_end = period_start + timedelta(days=num_days)
+                    expected = dict()
+                    for i, (t1, t2, _, _) in enumerate(time_ranges):
+                        weight = temporal_weight(t1, t2, period_start, period_end)
+                        if weight > 0.0:
+                            expected[i] = weight
+                    index_to_weight = source_time_ranges.get_index_to_weight(period_start, period_end)
+                    self.assertEqual(sorted(expected.keys()), list(index_to_weight.keys()))
+                    for i, weight in expected.items():
+                        self.assertAlmostEqual(weight, index_to_weight[i])
+
+    def test_none_time_index(self):
+        time_ranges = [(datetime(2001, 1, 1), datetime(2001, 1, 9), 'single-2001-01-01.nc', None),
+                       (datetime(2001, 1, 9), datetime(2001, 1, 17), 'single-2001-01-09.nc', None)]
+        source_time_ranges = SourceTimeRanges(time_ranges)
+        self.assertEqual(time_ranges, source_time_ranges)
+        self.assertIsNone(source_time_ranges[1][3])
+        self.assertEqual([SourceTimeRanges.NO_TIME_INDEX] * 2, list(source_time_ranges.time_indexes))
+        self.assertEqual({0: 1.0}, source_time_ranges.get_index_to_weight(datetime(2001, 1, 1), datetime(2001, 1, 9)))
+
+    def test_empty(self):
+        source_time_ranges = SourceTimeRanges([])
+        self.assertEqual(0, len(source_time_ranges))
+        self.assertEqual({}, source_time_ranges.get_index_to_weight(datetime(2001, 1, 1), datetime(2001, 1, 9)))
+
+
+class SourceTimeRangeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_file = os.path.join(self.temp_dir, 'source.nc')
+        with open(self.source_file, 'w') as fp:
+            fp.write('2001')
+        self.num_computed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _compute(self, file):
+        self.num_computed += 1
+        with open(file) as fp:
+            year = int(fp.read())
+        return [(datetime(year, 1, 1), datetime(year, 1, 9), numpy.int64(0)),
+                (datetime(year, 1, 9), datetime(year, 1, 17), numpy.int64(1))]
+
+    def _new_index(self, version=0):
+        return SourceTimeRangeIndex('test', self.temp_dir, index_dir=os.path.join(self.temp_dir, 'index'),
+                                    version=version)
+
+    def test_get_time_ranges(self):
+        index = self._new_index()
+        expected = [(datetime(2001, 1, 1), datetime(2001, 1, 9), 0), (datetime(2001, 1, 9), datetime(2001, 1, 17), 1)]
+        self.assertEqual(expected, index.get_time_ranges(self.source_file, self._compute))
+        index.save()
+        self.assertTrue(os.path.exists(index.index_file))
+
+        index = self._new_index()
+        self.assertEqual(expected, index.get_time_ranges(self.source_file, self._compute))
+        self.assertEqual(1, self.num_computed)
+        self.assertEqual((1, 0), (index.num_hits, index.num_misses))
+
+    def test_changed_files_are_recomputed(self):
+        index = self._new_index()
+        index.get_time_ranges(self.source_file, self._compute)
+        index.save()
+        with open(self.source_file, 'w') as fp:
+            fp.write('02002')
+
+        index = self._new_index()
+        time_ranges = index.get_time_ranges(self.source_file, self._compute)
+        self.assertEqual(datetime(2002, 1, 1), time_ranges[0][0])
+        self.assertEqual(2, self.num_computed)
+        self.assertEqual((0, 1), (index.num_hits, index.num_misses))
+
+    def test_other_versions_are_recomputed(self):
+        index = self._new_index(version=1)
+        index.get_time_ranges(self.source_file, self._compute)
+        index.save()
+
+        index = self._new_index(version=2)
+        index.get_time_ranges(self.source_file, self._compute)
+        self.assertEqual((0, 1), (index.num_hits, index.num_misses))
+        index.save()
+
+        # Indexes written without format version are dropped too
+        with open(index.index_file, 'w') as fp:
+            fp.write('{}')
+        index = self._new_index(version=2)
+        index.get_time_ranges(self.source_file, self._compute)
+        self.assertEqual(3, self.num_computed)
+        self.assertEqual((0, 1), (index.num_hits, index.num_misses))
+
+    def test_index_per_directory(self):
+        index = self._new_index()
+        other_index = SourceTimeRangeIndex('test', os.path.join(self.temp_dir, 'other'),
+                                           index_dir=os.path.join(self.temp_dir, 'index'))
+        self.assertNotEqual(index.index_file, other_index.index_file)